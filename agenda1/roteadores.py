@@ -0,0 +1,61 @@
+import random
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from contatos import donos
+
+
+class RoteadorLeituraEscrita:
+    # Envia as consultas dos modelos da agenda para a partição do dono atual
+    # e as dos demais modelos para a partição 'default' (ver
+    # contatos/donos.py). Em cada partição, as escritas vão para a conexão
+    # de escrita e as leituras para uma das suas conexões de leitura (ver
+    # AGENDA_PARTICOES), abertas somente para leitura (PRAGMA query_only)
+    # sobre o mesmo arquivo. Com o banco em modo WAL, as leituras não esperam
+    # pelas escritas em andamento.
+    #
+    # Dentro de uma transação da conexão de escrita as leituras também vão
+    # para ela, para que enxerguem o que a própria transação já gravou. Um
+    # objeto já carregado continua na partição de onde veio, mesmo que o dono
+    # atual seja outro.
+
+    def __init__(self):
+        particoes = getattr(settings, 'AGENDA_PARTICOES', {DEFAULT_DB_ALIAS: []})
+        self.leitura = {escrita: [alias for alias in leituras if alias in settings.DATABASES]
+                        for escrita, leituras in particoes.items()}
+        # Alias de escrita da partição de cada conexão.
+        self.escrita = {alias: escrita for escrita, leituras in particoes.items() for alias in [escrita, *leituras]}
+
+    def _particao(self, model, hints):
+        if not donos.particionado(model):
+            return DEFAULT_DB_ALIAS
+        instancia = hints.get('instance')
+        if instancia is not None and instancia._state.db in self.escrita:
+            return self.escrita[instancia._state.db]
+        return donos.particao()
+
+    def db_for_read(self, model, **hints):
+        escrita = self._particao(model, hints)
+        leitura = self.leitura.get(escrita)
+        if not leitura or connections[escrita].in_atomic_block:
+            return escrita
+        return random.choice(leitura)
+
+    def db_for_write(self, model, **hints):
+        return self._particao(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # As conexões de uma mesma partição apontam para o mesmo banco.
+        particao1, particao2 = self.escrita.get(obj1._state.db), self.escrita.get(obj2._state.db)
+        if particao1 is None or particao2 is None:
+            return None
+        return particao1 == particao2
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in self.escrita and self.escrita[db] != db:
+            return False
+        if db == DEFAULT_DB_ALIAS or db not in self.escrita:
+            return None
+        # As demais partições só têm as tabelas dos modelos particionados.
+        return app_label == 'contatos' and model_name not in donos.MODELOS_GLOBAIS
@@ -43,11 +43,13 @@ INSTALLED_APPS = [
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
 MIDDLEWARE = [
+    'contatos.instrumentacao.InstrumentacaoMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'contatos.donos.DonoMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -76,13 +78,84 @@ WSGI_APPLICATION = 'agenda1.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# O backend agenda1.sqlite é o backend SQLite do Django com PRAGMAs
+# aplicados a cada conexão e transações iniciadas com BEGIN IMMEDIATE (ver
+# agenda1/sqlite/base.py). As conexões são mantidas entre requisições
+# (CONN_MAX_AGE), 'timeout' é quanto uma conexão espera pelo fim de outra
+# escrita antes de falhar com "database is locked", e as leituras vão para
+# uma conexão somente de leitura sobre o mesmo arquivo (ver
+# agenda1/roteadores.py). O comando 'manage.py vazao_banco' mede a vazão com
+# e sem esses ajustes.
+#
+# Os arquivos do banco não fazem parte do repositório (journal_mode=WAL
+# altera o cabeçalho do arquivo na primeira conexão); eles são criados por
+# 'manage.py migrate'.
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # em KiB
+    'temp_store': 'MEMORY',
+}
+
+
+def _banco_de_escrita(arquivo):
+    return {
+        'ENGINE': 'agenda1.sqlite',
+        'NAME': arquivo,
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            'timeout': 20,
+            'pragmas': SQLITE_PRAGMAS,
+            'inicio_transacao': 'BEGIN IMMEDIATE',
+        },
     }
+
+
+def _banco_de_leitura(arquivo, escrita):
+    return {
+        'ENGINE': 'agenda1.sqlite',
+        'NAME': arquivo,
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            'timeout': 20,
+            'pragmas': {**SQLITE_PRAGMAS, 'query_only': 'ON'},
+        },
+        'TEST': {'MIRROR': escrita},
+    }
+
+
+DATABASES = {
+    'default': _banco_de_escrita(BASE_DIR / 'db.sqlite3'),
+    'leitura': _banco_de_leitura(BASE_DIR / 'db.sqlite3', 'default'),
 }
 
+# Partições das agendas dos donos (ver contatos/donos.py), como
+# {alias de escrita: [aliases de leitura]}. A partição 'default' também
+# guarda as tabelas globais (usuários, sessões e a fila de tarefas); as
+# demais, 'particao1', 'particao2', ..., são os arquivos db-particaoN.sqlite3.
+# Cada dono fica em uma partição escolhida por hash. Para acrescentar
+# partições, aumente AGENDA_NUMERO_PARTICOES, crie as tabelas de cada nova
+# partição com 'manage.py migrate --database particaoN' e mova para elas os
+# donos que o hash passou a indicar com 'manage.py mover_dono --rebalancear'.
+# Durante a mudança de partição, as requisições do dono recebem 503 por
+# alguns segundos (AGENDA_VALIDADE_LOCALIZACAO).
+
+AGENDA_NUMERO_PARTICOES = 1
+AGENDA_PARTICOES = {'default': ['leitura']}
+for _numero in range(1, AGENDA_NUMERO_PARTICOES):
+    _arquivo = BASE_DIR / f'db-particao{_numero}.sqlite3'
+    DATABASES[f'particao{_numero}'] = _banco_de_escrita(_arquivo)
+    DATABASES[f'particao{_numero}_leitura'] = _banco_de_leitura(_arquivo, f'particao{_numero}')
+    AGENDA_PARTICOES[f'particao{_numero}'] = [f'particao{_numero}_leitura']
+
+# Dono das requisições sem usuário autenticado e dos comandos de manage.py.
+AGENDA_DONO_PADRAO = 1
+AGENDA_VALIDADE_LOCALIZACAO = 5
+
+DATABASE_ROUTERS = ['agenda1.roteadores.RoteadorLeituraEscrita']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -123,8 +196,129 @@ USE_TZ = True
 STATIC_URL = '/static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+SERVIR_MEDIA = DEBUG
+
+# Arquivos enviados para importação (ver contatos/importacao.py), fora de
+# MEDIA_ROOT: não são servidos e são apagados quando a importação termina.
+AGENDA_IMPORTACOES_DIR = BASE_DIR / 'importacoes'
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Paginação da lista de contatos (paginação por cursor sobre 'nome')
+
+CONTATOS_POR_PAGINA = 24
+CONTATOS_POR_PAGINA_MAXIMO = 120
+
+# DDD usado para normalizar telefones cadastrados sem DDD (ex.: '11').
+# Com None, esses números são armazenados apenas com os seus dígitos.
+
+TELEFONE_DDD_PADRAO = None
+
+# Miniaturas de avatares (ver contatos/avatares.py)
+
+AVATAR_TAMANHOS = (64, 200, 400)
+AVATAR_QUALIDADE = 82
+
+# Tempo, em segundos, durante o qual um avatar enviado (ou reenviado) não é
+# removido mesmo sem contatos que o usem (ver contatos/storage.py).
+
+AVATAR_CARENCIA = 3600
+
+# Instrumentação das requisições (ver contatos/instrumentacao.py). As
+# medições de uma fração das requisições são gravadas em
+# INSTRUMENTACAO_ARQUIVO e resumidas por 'manage.py relatorio_desempenho'.
+# O arquivo é rotacionado ao atingir INSTRUMENTACAO_TAMANHO_MAXIMO bytes,
+# mantendo INSTRUMENTACAO_ARQUIVOS_ANTIGOS cópias.
+
+INSTRUMENTACAO_ARQUIVO = BASE_DIR / 'logs' / 'desempenho.log'
+INSTRUMENTACAO_TAMANHO_MAXIMO = 10 * 1024 * 1024
+INSTRUMENTACAO_ARQUIVOS_ANTIGOS = 3
+INSTRUMENTACAO_AMOSTRAGEM = 1.0 if DEBUG else 0.1
+INSTRUMENTACAO_LIMITE_REPETICOES = 5
+
+# Contadores de contatos dos grupos (ver contatos/contadores.py). Com False,
+# a lista de grupos calcula os valores com consultas agregadas em vez de ler
+# os contadores mantidos a cada alteração.
+
+GRUPOS_USAR_CONTADORES = True
+
+# Cartões da lista de contatos (ver contatos/cartoes.py). Com
+# CONTATOS_USAR_CARTOES = False, a lista lê os contatos, grupos, telefones e
+# emails de cada página diretamente das tabelas.
+
+CONTATOS_USAR_CARTOES = True
+
+# Cache dos fragmentos de template (ver contatos/fragmentos.py), como os
+# cartões das listas de contatos e de grupos. O LocMemCache é exclusivo de
+# cada processo e, ao atingir MAX_ENTRIES, descarta os fragmentos usados há
+# mais tempo. Para que vários processos compartilhem os fragmentos, use um
+# cache em arquivos:
+#
+#     'fragmentos': {
+#         'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+#         'LOCATION': BASE_DIR / 'cache' / 'fragmentos',
+#         'OPTIONS': {'MAX_ENTRIES': 50000},
+#     },
+#
+# Incremente VERSION ao alterar o HTML dos cartões, para que os fragmentos
+# gravados com o HTML anterior deixem de ser usados. Com FRAGMENTOS_CACHE =
+# None, os fragmentos são renderizados a cada requisição.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'fragmentos': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fragmentos',
+        'TIMEOUT': 24 * 60 * 60,
+        'VERSION': 1,
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
+FRAGMENTOS_CACHE = 'fragmentos'
+
+# Registro de alterações da sincronização dos aplicativos (ver
+# contatos/alteracoes.py). 'manage.py compactar_alteracoes' apaga as
+# exclusões registradas há mais de ALTERACOES_RETENCAO_DIAS dias; um
+# aplicativo que fique mais tempo sem sincronizar baixa a agenda de novo.
+
+ALTERACOES_RETENCAO_DIAS = 30
+
+# Fila de tarefas (ver contatos/tarefas.py), executada por
+# 'manage.py executar_tarefas'. Cada tarefa fica reservada para um
+# trabalhador por TAREFAS_VISIBILIDADE segundos e, se não terminar nesse
+# prazo, volta para a fila. Uma tarefa que falha é tentada até
+# TAREFAS_MAX_TENTATIVAS vezes, e as concluídas são apagadas depois de
+# TAREFAS_RETENCAO_DIAS dias. Com TAREFAS_SINCRONAS = True, as tarefas são
+# executadas logo após a requisição que as criou, no mesmo processo, sem
+# precisar do comando.
+
+TAREFAS_VISIBILIDADE = 300
+TAREFAS_MAX_TENTATIVAS = 5
+TAREFAS_INTERVALO = 1.0
+TAREFAS_RETENCAO_DIAS = 7
+TAREFAS_SINCRONAS = False
+
+# Detecção de contatos duplicados (ver contatos/duplicados.py). Chaves
+# (telefone, email, nome) compartilhadas por mais de DUPLICADOS_LIMITE_BLOCO
+# contatos são ignoradas, e só pares com pontuação a partir de
+# DUPLICADOS_PONTUACAO_MINIMA (entre 0 e 1) são sugeridos para revisão.
+
+DUPLICADOS_LIMITE_BLOCO = 50
+DUPLICADOS_PONTUACAO_MINIMA = 0.6
+
+# Índice em memória das sugestões da busca (ver contatos/autocompletar.py).
+# Com AUTOCOMPLETAR_AQUECER ele é carregado ao iniciar o servidor (em
+# agenda1/wsgi.py e agenda1/asgi.py), e a cada AUTOCOMPLETAR_VERIFICAR_A_CADA
+# segundos é conferido se outro processo alterou a agenda. Cada processo
+# mantém os índices dos AUTOCOMPLETAR_MAXIMO_DONOS donos que buscaram mais
+# recentemente.
+
+AUTOCOMPLETAR_AQUECER = True
+AUTOCOMPLETAR_VERIFICAR_A_CADA = 1.0
+AUTOCOMPLETAR_MAXIMO_DONOS = 100
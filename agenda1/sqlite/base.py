@@ -0,0 +1,33 @@
+from django.db.backends.sqlite3 import base
+
+# Backend SQLite do Django com duas opções a mais em OPTIONS (ver DATABASES
+# em agenda1/settings.py):
+#
+# 'pragmas': PRAGMAs executados em cada nova conexão, como journal_mode=WAL
+#     (leitores não bloqueiam o escritor e vice-versa) e synchronous=NORMAL.
+#     Como as conexões são persistentes (CONN_MAX_AGE), o custo é pago uma
+#     vez por conexão e não a cada requisição.
+#
+# 'inicio_transacao': instrução que inicia as transações de atomic(). Com
+#     'BEGIN IMMEDIATE' a transação reserva a escrita logo no início. Com o
+#     'BEGIN' padrão, uma transação que lê e depois escreve pode falhar com
+#     "database is locked" sem esperar o 'timeout', quando outra conexão já
+#     está escrevendo, pois o SQLite não consegue promovê-la a escritora.
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.pragmas = params.pop('pragmas', {})
+        self.inicio_transacao = params.pop('inicio_transacao', 'BEGIN')
+        return params
+
+    def get_new_connection(self, conn_params):
+        conexao = super().get_new_connection(conn_params)
+        for nome, valor in self.pragmas.items():
+            conexao.execute(f'PRAGMA {nome} = {valor}')
+        return conexao
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(self.inicio_transacao)
@@ -14,12 +14,24 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
+import re
+
 from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
+
+from contatos.views import media_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('contatos.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
+
+# Os arquivos enviados (avatares) são servidos pelo Django apenas quando
+# SERVIR_MEDIA estiver ativo; em produção eles podem ser servidos diretamente
+# pelo servidor web. media_view responde requisições condicionais (304) e
+# marca arquivos armazenados pelo conteúdo como imutáveis.
+if settings.SERVIR_MEDIA:
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), media_view),
+    ]
@@ -14,3 +14,12 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'agenda1.settings')
 
 application = get_wsgi_application()
+
+# Carrega em segundo plano o índice em memória das sugestões da busca (ver
+# contatos/autocompletar.py), para que esteja pronto nas primeiras
+# requisições.
+from django.conf import settings  # noqa: E402
+
+if getattr(settings, 'AUTOCOMPLETAR_AQUECER', True):
+    from contatos import autocompletar  # noqa: E402
+    autocompletar.aquecer()
@@ -1,7 +1,240 @@
-from django.contrib import admin
-from . import models
+from django import forms
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.auth import get_permission_codename
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
 
-admin.site.register(models.Grupo)
-admin.site.register(models.Contato)
-admin.site.register(models.Telefone)
-admin.site.register(models.Email)
+from . import busca, operacoes
+from .donos import dono_atual, particao
+from .models import Contato, Email, Grupo, Telefone
+from .sincronizacao import sincronizacao_adiada
+from .telefones import normalizar_telefone
+
+# Admin da agenda, preparado para agendas com milhões de contatos e milhares
+# de grupos: cada página é montada com um número limitado de consultas.
+#
+#   - as listas não contam as linhas da tabela inteira (ver
+#     PaginadorEstimado) e carregam os objetos relacionados de cada página
+#     junto com ela;
+#   - os campos que apontam para contatos e grupos usam o autocomplete do
+#     admin, que busca pelo índice de busca (contatos) ou pelo índice de
+#     (dono, nome_busca, nome) (grupos), em vez de um <select> com a tabela inteira;
+#   - as exclusões e as ações em lote usam as operações de
+#     contatos/operacoes.py, e a confirmação da exclusão lista apenas os
+#     objetos selecionados, sem percorrer os telefones, emails e associações
+#     que serão excluídos junto.
+#
+# Como nas views, as consultas enxergam apenas a agenda do dono atual (o
+# usuário do admin, ver contatos/donos.py).
+
+# Quantidade máxima de linhas contadas por uma lista do admin. Acima disso a
+# lista informa esse valor, e as páginas seguintes são alcançadas refinando
+# a busca.
+LIMITE_CONTAGEM = getattr(settings, 'AGENDA_ADMIN_LIMITE_CONTAGEM', 10000)
+
+
+class PaginadorEstimado(Paginator):
+    # Conta no máximo LIMITE_CONTAGEM linhas, com um COUNT(*) sobre uma
+    # subconsulta com LIMIT, em vez de percorrer o índice da agenda inteira
+    # a cada página.
+    @cached_property
+    def count(self):
+        if not isinstance(self.object_list, QuerySet):
+            return len(self.object_list)
+        return self.object_list.order_by()[:LIMITE_CONTAGEM].count()
+
+
+class AcaoComGrupoForm(ActionForm):
+    grupo = forms.IntegerField(required=False, min_value=1, label='Id do grupo')
+
+
+class AdminDaAgenda(admin.ModelAdmin):
+    paginator = PaginadorEstimado
+    show_full_result_count = False
+    list_per_page = 50
+    # Modelos excluídos junto com os objetos deste admin, para a verificação
+    # das permissões na confirmação da exclusão.
+    excluidos_junto = ()
+
+    def changeform_view(self, request, *args, **kwargs):
+        # O objeto, os seus inlines e as suas associações são gravados em uma
+        # transação, e os signals de cada um são sincronizados uma única vez.
+        with transaction.atomic(using=particao()), sincronizacao_adiada():
+            return super().changeform_view(request, *args, **kwargs)
+
+    def get_deleted_objects(self, objs, request):
+        # A confirmação lista apenas os objetos selecionados (até
+        # list_per_page deles) e a quantidade total, sem percorrer os objetos
+        # relacionados como o admin faria.
+        if isinstance(objs, QuerySet):
+            quantidade = PaginadorEstimado(objs, self.list_per_page).count
+            objs = objs[:self.list_per_page]
+        else:
+            quantidade = len(objs)
+        nomes = [str(obj) for obj in objs]
+        if quantidade > len(nomes):
+            nomes.append(f'... e outros {quantidade - len(nomes)}')
+        sem_permissao = {modelo._meta.verbose_name for modelo in self.excluidos_junto
+                         if not request.user.has_perm(
+                             f'{modelo._meta.app_label}.{get_permission_codename("delete", modelo._meta)}')}
+        return nomes, {self.opts.verbose_name_plural: quantidade}, sem_permissao, []
+
+
+class TelefoneInline(admin.TabularInline):
+    model = Telefone
+    fields = ('numero', 'numero_normalizado')
+    readonly_fields = ('numero_normalizado',)
+    extra = 0
+
+
+class EmailInline(admin.TabularInline):
+    model = Email
+    fields = ('endereco',)
+    extra = 0
+
+
+class NomeUnicoForm(forms.ModelForm):
+    # O nome é único apenas na agenda do dono (uma UniqueConstraint que o
+    # ModelForm não verifica, já que 'dono' não é editável).
+    def clean_nome(self):
+        nome = self.cleaned_data.get('nome')
+        if self._meta.model.objects.filter(nome=nome).exclude(id=self.instance.id).exists():
+            raise forms.ValidationError("O nome escolhido já está sendo utilizado.")
+        return nome
+
+
+@admin.register(Grupo)
+class GrupoAdmin(AdminDaAgenda):
+    form = NomeUnicoForm
+    list_display = ('nome', 'total_contatos', 'contatos_com_telefone', 'contatos_com_email', 'atualizado_em')
+    readonly_fields = ('total_contatos', 'contatos_com_telefone', 'contatos_com_email', 'atualizado_em')
+    ordering = ('nome',)
+    search_fields = ('nome',)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Grupos cujo nome começa com o texto, sem diferenciar maiúsculas nem
+        # acentos, com os nomes lidos apenas do trecho correspondente do
+        # índice (dono, nome_busca, nome) (ver busca.filtrar_por_prefixo()).
+        if not search_term.strip():
+            return queryset, False
+        nomes = busca.filtrar_por_prefixo(Grupo.objects.all(), search_term).values('nome')
+        return queryset.filter(nome__in=nomes), False
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic(using=particao()), sincronizacao_adiada():
+            super().delete_queryset(request, queryset)
+
+
+@admin.register(Contato)
+class ContatoAdmin(AdminDaAgenda):
+    form = NomeUnicoForm
+    fields = ('nome', 'avatar', 'grupos')
+    list_display = ('nome', 'telefones', 'emails', 'atualizado_em')
+    autocomplete_fields = ('grupos',)
+    inlines = (TelefoneInline, EmailInline)
+    search_fields = ('nome',)
+    action_form = AcaoComGrupoForm
+    actions = ('adicionar_ao_grupo', 'remover_do_grupo', 'mover_para_grupo')
+    excluidos_junto = (Telefone, Email)
+
+    def get_queryset(self, request):
+        # Os telefones e emails exibidos na lista são carregados com uma
+        # consulta para cada tabela por página.
+        return super().get_queryset(request).prefetch_related('telefone_set', 'email_set')
+
+    def get_search_results(self, request, queryset, search_term):
+        # A mesma busca da lista de contatos, pelo índice FTS5 (ver
+        # contatos/busca.py), também usada pelo autocomplete dos telefones e
+        # emails.
+        termo = search_term.strip()
+        if not termo:
+            return queryset, False
+        return busca.filtrar_contatos(queryset, termo), False
+
+    @admin.display(description='Telefones')
+    def telefones(self, contato):
+        return ', '.join(telefone.numero for telefone in contato.telefone_set.all())
+
+    @admin.display(description='Emails')
+    def emails(self, contato):
+        return ', '.join(email.endereco for email in contato.email_set.all())
+
+    def delete_model(self, request, obj):
+        operacoes.excluir_contatos([obj.id])
+
+    def delete_queryset(self, request, queryset):
+        operacoes.excluir_contatos(list(queryset.values_list('id', flat=True)))
+
+    def _em_lote(self, request, queryset, acao, mensagem):
+        try:
+            grupo_id = int(request.POST['grupo']) if request.POST.get('grupo') else None
+            afetados = operacoes.executar(acao, list(queryset.values_list('id', flat=True)), grupo_id)
+        except (ValueError, Grupo.DoesNotExist) as erro:
+            self.message_user(request, str(erro), messages.ERROR)
+        else:
+            self.message_user(request, mensagem.format(afetados), messages.SUCCESS)
+
+    @admin.action(description='Incluir os contatos selecionados no grupo')
+    def adicionar_ao_grupo(self, request, queryset):
+        self._em_lote(request, queryset, 'adicionar', '{} contatos incluídos no grupo.')
+
+    @admin.action(description='Retirar os contatos selecionados do grupo (ou de todos os grupos)')
+    def remover_do_grupo(self, request, queryset):
+        self._em_lote(request, queryset, 'remover', '{} associações removidas.')
+
+    @admin.action(description='Mover os contatos selecionados para o grupo')
+    def mover_para_grupo(self, request, queryset):
+        self._em_lote(request, queryset, 'mover', '{} contatos movidos para o grupo.')
+
+
+class AdminPorContato(AdminDaAgenda):
+    # Telefones e emails não têm o campo 'dono' e são restritos à agenda do
+    # dono atual pelo contato.
+    list_select_related = ('contato',)
+    autocomplete_fields = ('contato',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).filter(contato__dono=dono_atual())
+
+
+@admin.register(Telefone)
+class TelefoneAdmin(AdminPorContato):
+    list_display = ('numero', 'numero_normalizado', 'contato')
+    search_fields = ('numero_normalizado',)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Busca pelo número normalizado, que é indexado.
+        normalizado = normalizar_telefone(search_term)
+        if not normalizado:
+            return (queryset.none() if search_term.strip() else queryset), False
+        return queryset.filter(numero_normalizado=normalizado), False
+
+    def delete_model(self, request, obj):
+        operacoes.excluir_telefones([obj.id])
+
+    def delete_queryset(self, request, queryset):
+        operacoes.excluir_telefones(list(queryset.values_list('id', flat=True)))
+
+
+@admin.register(Email)
+class EmailAdmin(AdminPorContato):
+    list_display = ('endereco', 'contato')
+    search_fields = ('endereco',)
+
+    def get_search_results(self, request, queryset, search_term):
+        # O índice de busca encontra os contatos com o email; dentre os
+        # emails deles, ficam os que contêm o texto.
+        termo = search_term.strip()
+        if not termo:
+            return queryset, False
+        return busca.filtrar_contatos(queryset, termo, campo='contato').filter(endereco__icontains=termo), False
+
+    def delete_model(self, request, obj):
+        operacoes.excluir_emails([obj.id])
+
+    def delete_queryset(self, request, queryset):
+        operacoes.excluir_emails(list(queryset.values_list('id', flat=True)))
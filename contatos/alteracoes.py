@@ -0,0 +1,207 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import situacao
+from .donos import dono_atual, particao
+from .models import Alteracao, CompactacaoAlteracoes, Contato, Grupo, Telefone, Email
+from .storage import armazenamento_avatares
+
+# Registro de alterações para a sincronização incremental dos aplicativos
+# (view 'sincronizar', em /sync/?since=<token>).
+#
+# contatos/sincronizacao.py registra em Alteracao cada contato e cada grupo
+# criado, alterado ou excluído, com uma sequência sempre crescente. Como as
+# escritas no SQLite são feitas uma transação de cada vez, as sequências
+# ficam visíveis na ordem em que foram geradas. O registro é compactado a
+# cada alteração: cada objeto guarda apenas a sua linha mais recente, então
+# o registro nunca tem mais linhas que objetos (mais os excluídos) e uma
+# sincronização a partir do zero (since=0) devolve a agenda inteira.
+#
+# O token entregue ao aplicativo é '<horizonte>.<sequencia>'. As exclusões
+# antigas são apagadas por 'manage.py compactar_alteracoes', que avança o
+# horizonte (ver CompactacaoAlteracoes). Um token anterior ao horizonte
+# atual pode ter perdido exclusões, e o aplicativo precisa recomeçar do
+# zero. Um aplicativo em dia recebe a resposta com uma única consulta, uma
+# varredura da chave primária a partir da sua sequência que não encontra
+# nenhuma linha.
+#
+# O registro, as sequências e o horizonte são de cada dono (ver
+# contatos/donos.py). As sequências são geradas pela partição, então não
+# são consecutivas dentro da agenda de um dono, apenas crescentes.
+
+LOTE_PADRAO = 500
+LOTE_MAXIMO = 2000
+
+# Dias durante os quais as exclusões são mantidas no registro.
+RETENCAO_DIAS = getattr(settings, 'ALTERACOES_RETENCAO_DIAS', 30)
+
+TAMANHO_PARTE = 500
+
+Associacao = Contato.grupos.through
+
+# Na reconstrução, os grupos são registrados antes dos contatos, para que o
+# aplicativo os conheça quando receber os contatos que fazem parte deles.
+MODELOS = {Alteracao.GRUPO: Grupo, Alteracao.CONTATO: Contato}
+
+
+class TokenInvalido(ValueError):
+    pass
+
+
+class TokenExpirado(Exception):
+    pass
+
+
+def _partes(ids):
+    for inicio in range(0, len(ids), TAMANHO_PARTE):
+        yield ids[inicio:inicio + TAMANHO_PARTE]
+
+
+def ler_token(token):
+    # Retorna (horizonte, sequencia). Sem token, a sincronização começa do
+    # zero.
+    if not token or token == '0':
+        return 0, 0
+    try:
+        horizonte, sequencia = (int(parte) for parte in token.split('.'))
+    except ValueError:
+        raise TokenInvalido(f'Token inválido: {token!r}')
+    if horizonte < 0 or sequencia < 0:
+        raise TokenInvalido(f'Token inválido: {token!r}')
+    return horizonte, sequencia
+
+
+def _token(horizonte, sequencia):
+    return f'{horizonte}.{sequencia}'
+
+
+def horizonte_atual():
+    return CompactacaoAlteracoes.objects.filter(id=dono_atual()).values_list('horizonte', flat=True).first() or 0
+
+
+def token_atual():
+    # Token de um aplicativo que já recebeu todas as alterações.
+    ultima = Alteracao.objects.aggregate(ultima=Max('sequencia'))['ultima'] or 0
+    return _token(horizonte_atual(), ultima)
+
+
+def _avancar_horizonte(sequencia):
+    dono = dono_atual()
+    if not CompactacaoAlteracoes.objects.filter(id=dono, horizonte__lt=sequencia).update(
+            horizonte=sequencia, compactada_em=timezone.now()):
+        CompactacaoAlteracoes.objects.get_or_create(id=dono, defaults={'horizonte': sequencia})
+
+
+def registrar(tipo, ids, existentes=None):
+    # Registra uma nova alteração de cada objeto em 'ids', substituindo a
+    # anterior. Os que não existem mais são registrados como excluídos.
+    # 'existentes' contém os ids que ainda existem, quando já são
+    # conhecidos; sem ele, os objetos são procurados no banco.
+    modelo = MODELOS[tipo]
+    agora = timezone.now()
+    for parte in situacao.partes(sorted(set(ids))):
+        if existentes is None:
+            existem = set(modelo.objects.filter(id__in=parte).values_list('id', flat=True))
+        else:
+            existem = existentes
+        Alteracao.objects.filter(tipo=tipo, objeto_id__in=parte).delete()
+        Alteracao.objects.bulk_create([
+            Alteracao(tipo=tipo, objeto_id=objeto_id, excluido=objeto_id not in existem, registrada_em=agora)
+            for objeto_id in parte])
+
+
+def _dados_dos_contatos(ids):
+    contatos = {}
+    for contato_id, nome, avatar in Contato.objects.filter(id__in=ids).order_by().values_list('id', 'nome', 'avatar'):
+        contatos[contato_id] = {
+            'nome': nome,
+            'avatar': armazenamento_avatares().url(avatar) if avatar else None,
+            'telefones': [],
+            'emails': [],
+            'grupos': [],
+        }
+    for telefone_id, contato_id, numero in (Telefone.objects.filter(contato_id__in=contatos).order_by('id')
+                                            .values_list('id', 'contato_id', 'numero')):
+        contatos[contato_id]['telefones'].append({'id': telefone_id, 'numero': numero})
+    for email_id, contato_id, endereco in (Email.objects.filter(contato_id__in=contatos).order_by('id')
+                                           .values_list('id', 'contato_id', 'endereco')):
+        contatos[contato_id]['emails'].append({'id': email_id, 'endereco': endereco})
+    for contato_id, grupo_id in (Associacao.objects.filter(contato_id__in=contatos).order_by('grupo_id')
+                                 .values_list('contato_id', 'grupo_id')):
+        contatos[contato_id]['grupos'].append(grupo_id)
+    return contatos
+
+
+def _dados_dos_grupos(ids):
+    return {grupo['id']: {'nome': grupo['nome'], 'descricao': grupo['descricao']}
+            for grupo in Grupo.objects.filter(id__in=ids).values('id', 'nome', 'descricao')}
+
+
+def desde(token, limite=LOTE_PADRAO):
+    # Alterações posteriores ao token, no máximo 'limite', com os dados
+    # atuais de cada objeto. Retorna {'token', 'mais', 'alteracoes'}, onde
+    # 'token' deve ser enviado na próxima chamada e 'mais' indica que há
+    # outras alterações além destas.
+    horizonte_cliente, sequencia = ler_token(token)
+    # O horizonte é conferido antes de tudo: uma compactação pode ter
+    # apagado todas as linhas posteriores ao token, e o aplicativo só
+    # ficaria sabendo das exclusões perdidas recomeçando do zero.
+    horizonte = horizonte_atual()
+    if sequencia and horizonte_cliente != horizonte and sequencia < horizonte:
+        raise TokenExpirado(f'O token {token!r} é anterior à última compactação.')
+
+    linhas = list(Alteracao.objects.filter(sequencia__gt=sequencia).order_by('sequencia')
+                  .values_list('sequencia', 'tipo', 'objeto_id', 'excluido')[:limite + 1])
+    if not linhas:
+        return {'token': _token(horizonte, sequencia), 'mais': False, 'alteracoes': []}
+
+    mais = len(linhas) > limite
+    linhas = linhas[:limite]
+    ids = {tipo: [] for tipo in MODELOS}
+    for _, tipo, objeto_id, excluido in linhas:
+        if not excluido:
+            ids[tipo].append(objeto_id)
+    dados = {Alteracao.CONTATO: {}, Alteracao.GRUPO: _dados_dos_grupos(ids[Alteracao.GRUPO])}
+    for parte in _partes(ids[Alteracao.CONTATO]):
+        dados[Alteracao.CONTATO].update(_dados_dos_contatos(parte))
+
+    alteracoes = []
+    for sequencia_linha, tipo, objeto_id, excluido in linhas:
+        # Um objeto excluído depois da leitura do registro também é enviado
+        # como excluído; a sua exclusão aparece de novo na próxima chamada.
+        atual = dados[tipo].get(objeto_id)
+        alteracao = {'seq': sequencia_linha, 'tipo': tipo, 'id': objeto_id, 'excluido': atual is None}
+        if atual is not None:
+            alteracao['dados'] = atual
+        alteracoes.append(alteracao)
+    return {'token': _token(horizonte, linhas[-1][0]), 'mais': mais, 'alteracoes': alteracoes}
+
+
+def compactar(dias=RETENCAO_DIAS):
+    # Apaga as exclusões registradas há mais de 'dias' dias e avança o
+    # horizonte até a última delas. Retorna o número de linhas apagadas.
+    with transaction.atomic(using=particao()):
+        exclusoes = Alteracao.objects.filter(excluido=True, registrada_em__lt=timezone.now() - timedelta(days=dias))
+        ultima = exclusoes.aggregate(ultima=Max('sequencia'))['ultima']
+        if ultima is None:
+            return 0
+        apagadas, _ = exclusoes.filter(sequencia__lte=ultima).delete()
+        _avancar_horizonte(ultima)
+    return apagadas
+
+
+def reconstruir():
+    # Registra do zero todos os grupos e contatos existentes. Todos os tokens
+    # emitidos até aqui expiram, já que as exclusões anteriores se perdem.
+    Alteracao.objects.all().delete()
+    agora = timezone.now()
+    for tipo, modelo in MODELOS.items():
+        ids = list(modelo.objects.order_by('id').values_list('id', flat=True))
+        for parte in _partes(ids):
+            Alteracao.objects.bulk_create([Alteracao(tipo=tipo, objeto_id=objeto_id, registrada_em=agora)
+                                           for objeto_id in parte])
+    _avancar_horizonte(Alteracao.objects.aggregate(ultima=Max('sequencia'))['ultima'] or 0)
@@ -1,6 +1,12 @@
+from importlib import import_module
+
 from django.apps import AppConfig
 
 
 class ContatosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'contatos'
+
+    def ready(self):
+        # Registra os receivers que mantêm o índice de busca sincronizado
+        import_module(f'{self.name}.signals')
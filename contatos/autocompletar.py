@@ -0,0 +1,331 @@
+import bisect
+import logging
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Max
+
+from . import alteracoes, situacao
+from .busca import filtrar_contatos, normalizar
+from .donos import como_dono, dono_atual, particao
+from .models import Alteracao, Contato, Telefone, Email, VersaoAgenda
+
+logger = logging.getLogger(__name__)
+
+# Índice em memória para as sugestões da caixa de busca (view
+# autocompletar_view), chamada a cada tecla digitada.
+#
+# O índice é um array ordenado de chaves (cada palavra do nome normalizado,
+# os dígitos de cada telefone e cada email), com um array paralelo com o id
+# do contato de cada chave. As chaves que começam com o texto digitado ficam
+# em posições consecutivas, encontradas com bisect em O(log n), sem nenhuma
+# consulta ao banco.
+#
+# Cada processo tem o seu próprio índice, carregado em segundo plano na
+# inicialização (ver agenda1/wsgi.py e agenda1/asgi.py). As alterações feitas
+# pelo próprio processo são aplicadas a ele quando confirmadas (ver
+# contatos/sincronizacao.py). Para perceber alterações feitas por outros
+# processos, o índice guarda a versão da agenda que ele representa, somando
+# 1 a cada incremento confirmado pelo próprio processo, e a última sequência
+# do registro de alterações (ver contatos/alteracoes.py) que ele já
+# conhece. Se a versão no banco for outra, outro processo alterou a agenda,
+# e os contatos registrados depois dessa sequência são relidos e aplicados
+# ao índice. Só quando o registro não basta (ele foi compactado depois da
+# sequência, ou são mais de MAXIMO_ATUALIZADOS contatos) o índice é
+# reconstruído, em segundo plano; enquanto isso, o índice anterior continua
+# sendo usado.
+#
+# Cada dono (ver contatos/donos.py) tem o seu índice, carregado na primeira
+# busca feita na sua agenda e conferido com a versão da sua agenda, sem
+# afetar os índices dos demais donos. Ficam em memória os índices dos
+# MAXIMO_DONOS donos buscados mais recentemente; o de um dono que deixa de
+# buscar é descartado e carregado de novo na sua próxima busca, que até lá
+# recorre ao índice de busca do banco.
+
+LIMITE_PADRAO = 10
+LIMITE_MAXIMO = 50
+
+# Intervalo mínimo, em segundos, entre duas verificações da versão da agenda.
+VERIFICAR_A_CADA = getattr(settings, 'AUTOCOMPLETAR_VERIFICAR_A_CADA', 1.0)
+
+# Quantidade máxima de donos com o índice em memória.
+MAXIMO_DONOS = getattr(settings, 'AUTOCOMPLETAR_MAXIMO_DONOS', 100)
+
+# Quantidade máxima de contatos alterados por outros processos que são
+# relidos e aplicados ao índice; acima disso, ele é reconstruído.
+MAXIMO_ATUALIZADOS = 2000
+
+# Quantidade máxima de chaves examinadas em uma busca com várias palavras,
+# em que parte das chaves encontradas pode ser descartada.
+MAXIMO_EXAMINADAS = 2000
+
+_TELEFONE = re.compile(r'[\d\s()+.-]+')
+
+
+def _versao_atual():
+    return VersaoAgenda.objects.filter(id=dono_atual()).values_list('versao', flat=True).first() or 0
+
+
+def _sequencia_atual():
+    return Alteracao.objects.aggregate(ultima=Max('sequencia'))['ultima'] or 0
+
+
+def _palavras(texto):
+    # Palavras do texto normalizado. Emails são mantidos inteiros.
+    for parte in normalizar(texto).split():
+        if '@' in parte:
+            yield parte
+        else:
+            yield from re.findall(r'\w+', parte)
+
+
+def _termos(texto):
+    if _TELEFONE.fullmatch(texto) and re.search(r'\d', texto):
+        return [re.sub(r'\D', '', texto)]
+    return list(dict.fromkeys(_palavras(texto)))
+
+
+def _chaves(nome, telefones, emails):
+    # Chaves de um contato, internadas, já que as mesmas palavras se repetem
+    # em muitos nomes. 'telefones' contém pares (numero, numero_normalizado).
+    chaves = set(_palavras(nome))
+    for numero, normalizado in telefones:
+        chaves.update(filter(None, (re.sub(r'\D', '', numero), normalizado.lstrip('+'))))
+    chaves.update(endereco.strip().lower() for endereco in emails)
+    return tuple(sys.intern(chave) for chave in chaves)
+
+
+def _dados_dos_contatos():
+    # {id: (nome, chaves)} de todos os contatos do dono atual.
+    contatos = {contato_id: (nome, [], []) for contato_id, nome in
+                Contato.objects.order_by().values_list('id', 'nome').iterator(chunk_size=5000)}
+    for contato_id, numero, normalizado in (Telefone.objects.filter(contato__dono=dono_atual()).order_by()
+                                            .values_list('contato_id', 'numero', 'numero_normalizado')
+                                            .iterator(chunk_size=5000)):
+        if contato_id in contatos:
+            contatos[contato_id][1].append((numero, normalizado))
+    for contato_id, endereco in (Email.objects.filter(contato__dono=dono_atual()).order_by()
+                                 .values_list('contato_id', 'endereco').iterator(chunk_size=5000)):
+        if contato_id in contatos:
+            contatos[contato_id][2].append(endereco)
+    return {contato_id: (nome, _chaves(nome, telefones, emails))
+            for contato_id, (nome, telefones, emails) in contatos.items()}
+
+
+def _dados_das_situacoes(situacoes):
+    # {id: (nome, chaves)} dos contatos em 'situacoes' (ver
+    # contatos/situacao.py).
+    return {contato_id: (atual.nome, _chaves(atual.nome, atual.telefones, atual.emails))
+            for contato_id, atual in situacoes.items()}
+
+
+def _campo(chave):
+    if '@' in chave:
+        return 'email'
+    return 'telefone' if chave.isdigit() else 'nome'
+
+
+class Indice:
+
+    def __init__(self, versao, sequencia, dados):
+        self.versao = versao
+        self.sequencia = sequencia
+        self.contatos = dados
+        entradas = sorted((chave, contato_id) for contato_id, (_, chaves) in dados.items() for chave in chaves)
+        self.chaves = [chave for chave, _ in entradas]
+        self.ids = [contato_id for _, contato_id in entradas]
+
+    @classmethod
+    def construir(cls):
+        # A versão e a sequência são lidas antes dos contatos: uma alteração
+        # feita durante a carga deixa o índice com uma versão menor que a do
+        # banco, e ela é aplicada de novo na próxima verificação.
+        versao = _versao_atual()
+        return cls(versao, _sequencia_atual(), _dados_dos_contatos())
+
+    def remover(self, contato_id):
+        _, chaves = self.contatos.pop(contato_id, (None, ()))
+        for chave in chaves:
+            inicio = bisect.bisect_left(self.chaves, chave)
+            fim = bisect.bisect_right(self.chaves, chave, inicio)
+            for posicao in range(inicio, fim):
+                if self.ids[posicao] == contato_id:
+                    del self.chaves[posicao]
+                    del self.ids[posicao]
+                    break
+
+    def adicionar(self, contato_id, nome, chaves):
+        self.contatos[contato_id] = (nome, chaves)
+        for chave in chaves:
+            posicao = bisect.bisect_left(self.chaves, chave)
+            self.chaves.insert(posicao, chave)
+            self.ids.insert(posicao, contato_id)
+
+    def _intervalo(self, prefixo):
+        # Posições das chaves que começam com 'prefixo'.
+        inicio = bisect.bisect_left(self.chaves, prefixo)
+        return inicio, bisect.bisect_left(self.chaves, prefixo + '\U0010ffff', inicio)
+
+    def buscar(self, termo, limite=LIMITE_PADRAO):
+        # Contatos em que cada palavra do termo é o início de alguma chave.
+        # As chaves percorridas são as da palavra com menos chaves, e os
+        # contatos encontrados são conferidos com as demais palavras.
+        termos = _termos(termo)
+        if not termos:
+            return []
+        intervalos = {t: self._intervalo(t) for t in termos}
+        principal = min(termos, key=lambda t: intervalos[t][1] - intervalos[t][0])
+        demais = [t for t in termos if t != principal]
+        inicio, fim = intervalos[principal]
+        vistos, resultados = set(), []
+        for posicao in range(inicio, min(fim, inicio + MAXIMO_EXAMINADAS)):
+            contato_id = self.ids[posicao]
+            if contato_id in vistos:
+                continue
+            vistos.add(contato_id)
+            nome, chaves = self.contatos[contato_id]
+            if all(any(c.startswith(t) for c in chaves) for t in demais):
+                resultados.append({'id': contato_id, 'nome': nome, 'campo': _campo(self.chaves[posicao]),
+                                   'valor': self.chaves[posicao]})
+                if len(resultados) >= limite:
+                    break
+        return resultados
+
+
+# {dono: Indice}, do dono buscado há mais tempo ao mais recente.
+_indices = OrderedDict()
+_trava = threading.Lock()
+_construindo = set()
+_verificado_em = {}
+
+
+def _construir(dono, em_segundo_plano):
+    try:
+        with como_dono(dono):
+            novo = Indice.construir()
+        with _trava:
+            _indices[dono] = novo
+            _indices.move_to_end(dono)
+            while len(_indices) > MAXIMO_DONOS:
+                antigo, _ = _indices.popitem(last=False)
+                _verificado_em.pop(antigo, None)
+    except Exception:
+        logger.exception('Não foi possível carregar o índice de sugestões do dono %s', dono)
+    finally:
+        _construindo.discard(dono)
+        if em_segundo_plano:
+            # A thread não é uma requisição, então fecha ela mesma as
+            # conexões que abriu.
+            connections.close_all()
+
+
+def aquecer(em_segundo_plano=True, dono=None):
+    # Carrega (ou recarrega) o índice do dono atual (ou de 'dono'), em uma
+    # thread separada por padrão.
+    dono = dono_atual() if dono is None else dono
+    with _trava:
+        if dono in _construindo:
+            return
+        _construindo.add(dono)
+    if em_segundo_plano:
+        threading.Thread(target=_construir, args=(dono, True), name='autocompletar', daemon=True).start()
+    else:
+        _construir(dono, False)
+
+
+def _atualizar(indice, versao):
+    # Aplica ao índice do dono atual os contatos registrados depois da sua
+    # sequência. Retorna False se o registro não basta e o índice precisa
+    # ser reconstruído.
+    if indice.sequencia < alteracoes.horizonte_atual():
+        return False
+    linhas = list(Alteracao.objects.filter(tipo=Alteracao.CONTATO, sequencia__gt=indice.sequencia)
+                  .order_by('sequencia').values_list('sequencia', 'objeto_id')[:MAXIMO_ATUALIZADOS + 1])
+    if len(linhas) > MAXIMO_ATUALIZADOS:
+        return False
+    ids = [objeto_id for _, objeto_id in linhas]
+    dados = {}
+    for parte in situacao.partes(ids):
+        dados.update(_dados_das_situacoes(situacao.carregar(parte)))
+    with _trava:
+        for contato_id in ids:
+            indice.remover(contato_id)
+            if contato_id in dados:
+                indice.adicionar(contato_id, *dados[contato_id])
+        indice.versao = versao
+        if linhas:
+            indice.sequencia = linhas[-1][0]
+    return True
+
+
+def _verificar(dono, indice):
+    agora = time.monotonic()
+    if agora - _verificado_em.get(dono, 0.0) < VERIFICAR_A_CADA:
+        return
+    _verificado_em[dono] = agora
+    # A versão é lida antes do registro, como em Indice.construir().
+    versao = _versao_atual()
+    if versao != indice.versao and dono not in _construindo and not _atualizar(indice, versao):
+        aquecer(dono=dono)
+
+
+def buscar(termo, limite=LIMITE_PADRAO):
+    # Sugestões para 'termo', como [{'id', 'nome', 'campo', 'valor'}].
+    # Enquanto o índice ainda não foi carregado, recorre ao índice de busca
+    # do banco (contatos/busca.py).
+    dono = dono_atual()
+    with _trava:
+        indice = _indices.get(dono)
+        if indice is not None:
+            _indices.move_to_end(dono)
+    if indice is None:
+        aquecer(dono=dono)
+        contatos = filtrar_contatos(Contato.objects.all(), termo).values('id', 'nome')[:limite]
+        return [{**contato, 'campo': 'nome', 'valor': ''} for contato in contatos]
+    _verificar(dono, indice)
+    with _trava:
+        return indice.buscar(termo, limite)
+
+
+def _aplicar(dono, ids, dados):
+    indice = _indices.get(dono)
+    if indice is None:
+        return
+    with _trava:
+        for contato_id in ids:
+            indice.remover(contato_id)
+            if contato_id in dados:
+                indice.adicionar(contato_id, *dados[contato_id])
+
+
+def contatos_alterados(ids, situacoes):
+    # Chamada por contatos/sincronizacao.py com a situação atual dos
+    # contatos em 'ids'. As alterações só são aplicadas ao índice quando a
+    # transação for confirmada.
+    ids, dono, dados = list(ids), dono_atual(), _dados_das_situacoes(situacoes)
+    transaction.on_commit(lambda: _aplicar(dono, ids, dados), using=particao())
+
+
+def _versao_incrementada(dono):
+    with _trava:
+        if dono in _indices:
+            _indices[dono].versao += 1
+
+
+def versao_incrementada():
+    # Chamada por contatos/sincronizacao.py a cada incremento da versão da
+    # agenda feito por este processo.
+    dono = dono_atual()
+    transaction.on_commit(lambda: _versao_incrementada(dono), using=particao())
+
+
+def invalidar():
+    # Para alterações gravadas diretamente nas tabelas, sem passar por
+    # contatos_alterados() (ver reconstruir_derivados()).
+    dono = dono_atual()
+    transaction.on_commit(lambda: aquecer(dono=dono), using=particao())
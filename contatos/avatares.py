@@ -0,0 +1,81 @@
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, features
+
+# Lados (em pixels) das miniaturas quadradas geradas para cada avatar. O
+# cartão da lista de contatos exibe o avatar com 200px de altura, então a
+# menor miniatura serve para listas compactas e a maior para telas de alta
+# densidade.
+TAMANHOS = tuple(getattr(settings, 'AVATAR_TAMANHOS', (64, 200, 400)))
+
+# Formatos gerados para cada tamanho: WebP, quando o Pillow tiver suporte, e
+# JPEG como alternativa para navegadores que não suportam WebP.
+FORMATOS = ('webp', 'jpg') if features.check('webp') else ('jpg',)
+
+QUALIDADE = getattr(settings, 'AVATAR_QUALIDADE', 82)
+
+_FORMATOS_PIL = {'webp': 'WEBP', 'jpg': 'JPEG'}
+
+
+def nome_miniatura(nome, tamanho, formato):
+    # As miniaturas ficam ao lado do arquivo original:
+    # 'avatares/ana.png' -> 'avatares/ana.200.webp'
+    base, _ = os.path.splitext(nome)
+    return f"{base}.{tamanho}.{formato}"
+
+
+def nomes_miniaturas(nome):
+    return [nome_miniatura(nome, tamanho, formato) for tamanho in TAMANHOS for formato in FORMATOS]
+
+
+def gerar_miniaturas(nome, storage=default_storage):
+    # Gera todas as miniaturas do avatar armazenado em 'nome', substituindo
+    # as que já existirem. A imagem é recortada no centro para ficar quadrada,
+    # respeitando a orientação indicada nos metadados EXIF da foto.
+    with storage.open(nome, 'rb') as arquivo:
+        imagem = Image.open(arquivo)
+        imagem = ImageOps.exif_transpose(imagem)
+        imagem = imagem.convert('RGB')
+    for tamanho in TAMANHOS:
+        miniatura = ImageOps.fit(imagem, (tamanho, tamanho), Image.LANCZOS)
+        for formato in FORMATOS:
+            conteudo = BytesIO()
+            miniatura.save(conteudo, _FORMATOS_PIL[formato], quality=QUALIDADE, optimize=True)
+            destino = nome_miniatura(nome, tamanho, formato)
+            if storage.exists(destino):
+                storage.delete(destino)
+            storage.save(destino, ContentFile(conteudo.getvalue()))
+
+
+def miniaturas_existem(nome, storage=default_storage):
+    return all(storage.exists(destino) for destino in nomes_miniaturas(nome))
+
+
+def excluir_miniaturas(nome, storage=default_storage):
+    for destino in nomes_miniaturas(nome):
+        if storage.exists(destino):
+            storage.delete(destino)
+
+
+def srcset(nome, formato):
+    # Monta o valor do atributo 'srcset' com todas as miniaturas de um formato,
+    # deixando o navegador escolher a menor que atenda à densidade da tela.
+    return ', '.join(
+        f"{default_storage.url(nome_miniatura(nome, tamanho, formato))} {tamanho}w"
+        for tamanho in TAMANHOS
+    )
+
+
+def atributos_img(nome, altura):
+    # Atributos 'src', 'srcset_jpg' e 'srcset_webp' do <picture> que exibe o
+    # avatar em 'nome' com 'altura' pixels (ver templates/contatos/avatar.html).
+    tamanho = next((t for t in TAMANHOS if t >= altura), TAMANHOS[-1])
+    return {
+        'src': default_storage.url(nome_miniatura(nome, tamanho, 'jpg')),
+        'srcset_jpg': srcset(nome, 'jpg'),
+        'srcset_webp': srcset(nome, 'webp') if 'webp' in FORMATOS else None,
+    }
@@ -0,0 +1,564 @@
+import asyncio
+import json
+import platform
+import random
+import re
+import threading
+import time
+import tracemalloc
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import accumulate, count
+
+import django
+from django import forms
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.http import urlencode
+from django.utils import timezone
+
+from . import alteracoes, autocompletar
+from .busca import normalizar
+from .donos import dono_atual, particao
+from .forms import EditarContatoForm
+from .importacao import inserir_em_lote
+from .models import (Contato, Grupo, Telefone, Email, Importacao, ParDuplicado, ResumoContato, CartaoContato,
+                     Tarefa)
+from .paginacao import POR_PAGINA_MAXIMO
+from .sincronizacao import reconstruir_derivados
+from .telefones import normalizar_telefone
+
+# Ferramentas para medir o desempenho das views em agendas de tamanhos
+# diferentes, sem depender de dados reais:
+#   gerar_agenda()   cria uma agenda sintética, sempre a mesma para a mesma
+#                    semente e quantidade de contatos;
+#   executar()       faz requisições para todas as rotas de contatos/urls.py
+#                    e mede latência, número de consultas e pico de memória;
+#   comparar()       aponta os cenários que passaram do número máximo de
+#                    consultas e as métricas que pioraram em relação a um
+#                    resultado anterior, guardado como referência;
+#   carga()          mede a vazão das views de leitura com muitos clientes
+#                    simultâneos, pelas views síncronas (como num servidor
+#                    WSGI com uma thread por cliente) ou assíncronas (ASGI).
+# Usados pelos comandos 'manage.py gerar_agenda', 'manage.py benchmark' e
+# 'manage.py carga'.
+
+PRIMEIROS_NOMES = (
+    'Ana', 'Bruno', 'Carla', 'Daniel', 'Eduarda', 'Felipe', 'Gabriela', 'Henrique', 'Isabela',
+    'João', 'Juliana', 'Lucas', 'Mariana', 'Nicolas', 'Otávio', 'Patrícia', 'Rafael', 'Sofia',
+    'Thiago', 'Vitória', 'Arthur', 'Beatriz', 'Caio', 'Débora', 'Enzo', 'Fernanda', 'Gustavo',
+    'Helena', 'Igor', 'Larissa', 'Matheus', 'Natália', 'Paulo', 'Renata', 'Samuel', 'Tânia',
+)
+SOBRENOMES = (
+    'Silva', 'Santos', 'Oliveira', 'Souza', 'Rodrigues', 'Ferreira', 'Alves', 'Pereira', 'Lima',
+    'Gomes', 'Costa', 'Ribeiro', 'Martins', 'Carvalho', 'Almeida', 'Lopes', 'Soares', 'Fernandes',
+    'Vieira', 'Barbosa', 'Rocha', 'Dias', 'Nascimento', 'Andrade', 'Moreira', 'Nunes', 'Marques',
+    'Machado', 'Mendes', 'Freitas', 'Cardoso', 'Ramos', 'Gonçalves', 'Santana', 'Teixeira', 'Araújo',
+)
+TEMAS_GRUPOS = (
+    'Família', 'Trabalho', 'Amigos', 'Faculdade', 'Clientes', 'Fornecedores', 'Vizinhos',
+    'Academia', 'Futebol', 'Escola', 'Condomínio', 'Viagem', 'Médicos', 'Igreja', 'Música',
+)
+DOMINIOS = ('gmail.com', 'hotmail.com', 'outlook.com', 'yahoo.com.br', 'uol.com.br', 'empresa.com.br')
+DDDS = ('11', '11', '11', '21', '21', '31', '41', '51', '61', '71', '81', '85', '19', '48')
+
+# Distribuição da quantidade de telefones, emails e grupos de cada contato,
+# como pares (quantidade, peso).
+TELEFONES_POR_CONTATO = ((0, 10), (1, 50), (2, 30), (3, 10))
+EMAILS_POR_CONTATO = ((0, 30), (1, 55), (2, 15))
+GRUPOS_POR_CONTATO = ((0, 35), (1, 40), (2, 18), (3, 7))
+
+TAMANHO_LOTE = 10000
+
+# Limites usados por comparar(): uma métrica regrediu quando o novo valor
+# passa do valor de referência multiplicado pelo fator correspondente.
+# Diferenças de latência menores que 'folga_ms' são ignoradas, para que
+# views muito rápidas não falhem por ruído de medição.
+LIMITES = getattr(settings, 'BENCHMARK_LIMITES', {
+    'p50_ms': 1.25,
+    'p95_ms': 1.5,
+    'consultas': 1.0,
+    'pico_kb': 1.5,
+    'folga_ms': 2.0,
+})
+
+
+# Número máximo de consultas dos cenários que alteram um único contato ou
+# grupo, verificado por comparar() mesmo sem referência (uma referência
+# gravada depois de uma regressão não a acusaria). Cada alteração sincroniza
+# as estruturas derivadas com um número fixo de consultas, independente do
+# tamanho da agenda (ver contatos/sincronizacao.py).
+CONSULTAS_MAXIMAS = getattr(settings, 'BENCHMARK_CONSULTAS_MAXIMAS', {
+    'editar_contato_salvar': 28,
+    'novo_grupo_salvar': 6,
+    'novo_tel_salvar': 16,
+    'novo_email_salvar': 16,
+    'excluir_contato': 18,
+    'excluir_telefone': 19,
+    'excluir_email': 19,
+    'excluir_telefones': 19,
+    'excluir_emails': 19,
+    'novo_contato_salvar': 16,
+    'par_duplicado_unir': 31,
+})
+
+
+def _sorteador(rng, distribuicao):
+    valores, pesos = zip(*distribuicao)
+    acumulados = list(accumulate(pesos))
+    return lambda: rng.choices(valores, cum_weights=acumulados)[0]
+
+
+def _ascii(texto):
+    return normalizar(texto).replace(' ', '')
+
+
+def limpar_agenda():
+    # Apaga todos os contatos e grupos do dono atual diretamente nas tabelas.
+    # Com QuerySet.delete() o Django carregaria cada contato para disparar os
+    # signals, o que é inviável com milhões de linhas.
+    contatos = Contato.objects.order_by().values('id')
+    for queryset in (Contato.grupos.through.objects.filter(contato_id__in=contatos),
+                     Telefone.objects.filter(contato_id__in=contatos), Email.objects.filter(contato_id__in=contatos),
+                     ParDuplicado.objects.all(), ResumoContato.objects.filter(contato_id__in=contatos),
+                     CartaoContato.objects.all(), Contato.objects.all(), Grupo.objects.all()):
+        queryset._raw_delete(particao())
+
+
+def gerar_agenda(total, semente=42, progresso=None):
+    # Cria 'total' contatos com telefones, emails e grupos sorteados de acordo
+    # com as distribuições acima. A mesma semente produz sempre a mesma
+    # agenda. Alguns grupos são muito maiores que outros (os pesos seguem uma
+    # distribuição de Zipf), como em agendas reais. Os dados são gravados em
+    # lotes, direto nas tabelas, e as estruturas derivadas são reconstruídas
+    # uma única vez no final.
+    rng = random.Random(semente)
+    agora = timezone.now()
+    dono = dono_atual()
+    agora_banco = connections[particao()].ops.adapt_datetimefield_value(agora)
+
+    quantidade_grupos = min(1000, max(len(TEMAS_GRUPOS), total // 200))
+    nomes_grupos = []
+    for i in range(quantidade_grupos):
+        rodada, tema = divmod(i, len(TEMAS_GRUPOS))
+        nomes_grupos.append(TEMAS_GRUPOS[tema] if rodada == 0 else f'{TEMAS_GRUPOS[tema]} {rodada + 1}')
+    Grupo.objects.bulk_create([Grupo(nome=nome, nome_busca=normalizar(nome), atualizado_em=agora)
+                               for nome in nomes_grupos], ignore_conflicts=True)
+    grupos = list(Grupo.objects.filter(nome__in=nomes_grupos).order_by('id').values_list('id', flat=True))
+    pesos_grupos = list(accumulate(1 / (i + 1) for i in range(len(grupos))))
+
+    sortear_telefones = _sorteador(rng, TELEFONES_POR_CONTATO)
+    sortear_emails = _sorteador(rng, EMAILS_POR_CONTATO)
+    sortear_grupos = _sorteador(rng, GRUPOS_POR_CONTATO)
+
+    # Os ids são sorteados pela partição inteira, com os contatos dos outros
+    # donos.
+    proximo_id = (Contato.todos.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+    usados = set(Contato.objects.values_list('nome', flat=True))
+    criados = 0
+    while criados < total:
+        contatos, telefones, emails, associacoes = [], [], [], []
+        for _ in range(min(TAMANHO_LOTE, total - criados)):
+            primeiro, sobrenome = rng.choice(PRIMEIROS_NOMES), rng.choice(SOBRENOMES)
+            nome = f'{primeiro} {rng.choice(SOBRENOMES)} {sobrenome}'
+            if nome in usados:
+                nome = f'{nome} {proximo_id}'
+            usados.add(nome)
+            contato_id = proximo_id
+            proximo_id += 1
+            contatos.append((contato_id, dono, nome, False, agora_banco))
+            for _ in range(sortear_telefones()):
+                numero = f'{rng.choice(DDDS)} 9{rng.randrange(10000):04d}-{rng.randrange(10000):04d}'
+                telefones.append((contato_id, numero, normalizar_telefone(numero)))
+            for i in range(sortear_emails()):
+                usuario = f'{_ascii(primeiro)}.{_ascii(sobrenome)}{contato_id if i == 0 else rng.randrange(1000)}'
+                emails.append((contato_id, f'{usuario}@{rng.choice(DOMINIOS)}'))
+            membro = set(rng.choices(grupos, cum_weights=pesos_grupos, k=sortear_grupos())) if grupos else ()
+            associacoes.extend((contato_id, grupo_id) for grupo_id in membro)
+        with transaction.atomic(using=particao()):
+            inserir_em_lote(Contato, ('id', 'dono', 'nome', 'avatar_miniaturas', 'atualizado_em'), contatos)
+            inserir_em_lote(Telefone, ('contato', 'numero', 'numero_normalizado'), telefones)
+            inserir_em_lote(Email, ('contato', 'endereco'), emails)
+            inserir_em_lote(Contato.grupos.through, ('contato', 'grupo'), associacoes)
+        criados += len(contatos)
+        if progresso:
+            progresso(criados)
+
+    with transaction.atomic(using=particao()):
+        reconstruir_derivados()
+    return criados
+
+
+Cenario = namedtuple('Cenario', 'nome rota requisicao repeticoes')
+
+
+def _dados_edicao(contato_id):
+    # Dados do formulário de edição exatamente como o navegador os enviaria,
+    # com o primeiro telefone alterado para que a gravação tenha trabalho.
+    form = EditarContatoForm(id=contato_id)
+    dados = {}
+    for nome, campo in form.fields.items():
+        valor = form.get_initial_for_field(campo, nome)
+        if isinstance(campo, forms.BooleanField):
+            if valor:
+                dados[nome] = 'on'
+        elif valor is not None:
+            dados[nome] = valor
+    telefone = next((nome for nome in dados if nome.startswith('tel_')), None)
+    if telefone:
+        dados[telefone] = '11 90000-0000'
+    return dados
+
+
+def _alvos():
+    # Objetos usados pelos cenários: o contato com mais telefones e emails
+    # (e o primeiro de cada), um segundo contato, o maior grupo (e o seu
+    # nome) e um número de telefone existente, além do token de
+    # sincronização de um aplicativo em dia.
+    contato = (Contato.objects.annotate(t=Count('telefone', distinct=True), e=Count('email', distinct=True))
+               .order_by('-t', '-e', 'id').values('id', 'nome').first())
+    grupo = (Contato.grupos.through.objects.filter(grupo__dono=dono_atual()).values('grupo_id').annotate(n=Count('id'))
+             .order_by('-n').values_list('grupo_id', flat=True).first())
+    if contato is None or grupo is None:
+        return None
+    nomes = list(Contato.objects.values_list('nome', flat=True)[:1000])
+    return {
+        'contato': contato['id'],
+        'outro': Contato.objects.exclude(id=contato['id']).order_by('id').values_list('id', flat=True).first(),
+        'busca': contato['nome'].split()[-1],
+        'meio_da_lista': nomes[len(nomes) // 2],
+        'grupo': grupo,
+        'nome_grupo': Grupo.objects.filter(id=grupo).values_list('nome', flat=True).first(),
+        'telefone': Telefone.objects.filter(contato_id=contato['id']).order_by('id').values_list('id', flat=True).first(),
+        'email': Email.objects.filter(contato_id=contato['id']).order_by('id').values_list('id', flat=True).first(),
+        'numero': Telefone.objects.filter(contato_id=contato['id']).values_list('numero', flat=True).first(),
+        'token': alteracoes.token_atual(),
+    }
+
+
+def cenarios(alvos):
+    # Um ou mais cenários para cada rota de contatos/urls.py. As requisições
+    # que alteram dados são desfeitas ao final de cada repetição (ver
+    # executar()). O envio de arquivos para 'importar_contatos' não é medido,
+    # porque grava o arquivo em AGENDA_IMPORTACOES_DIR, fora da transação.
+    c, g = alvos['contato'], alvos['grupo']
+
+    def get(rota, *args, **params):
+        return lambda cliente: cliente.get(reverse(rota, args=args), params)
+
+    def post(rota, *args, dados=None):
+        return lambda cliente: cliente.post(reverse(rota, args=args), dados or {})
+
+    return [
+        Cenario('lista', 'contatos_list_view', get('contatos_list_view'), None),
+        Cenario('lista_meio', 'contatos_list_view', get('contatos_list_view', depois=alvos['meio_da_lista']), None),
+        Cenario('lista_maxima', 'contatos_list_view', get('contatos_list_view', por_pagina=POR_PAGINA_MAXIMO), None),
+        Cenario('busca', 'contatos_list_view', get('contatos_list_view', busca=alvos['busca']), None),
+        Cenario('busca_uma_letra', 'contatos_list_view', get('contatos_list_view', busca=alvos['busca'][:1]), None),
+        Cenario('busca_duas_letras', 'contatos_list_view', get('contatos_list_view', busca=alvos['busca'][:2]), None),
+        Cenario('lista_grupo', 'contatos_list_por_grupo', get('contatos_list_por_grupo', g), None),
+        Cenario('editar_contato', 'editar_contato', get('editar_contato', c), None),
+        Cenario('editar_contato_salvar', 'editar_contato', post('editar_contato', c, dados=_dados_edicao(c)), None),
+        Cenario('novo_grupo', 'novo_grupo', get('novo_grupo'), None),
+        Cenario('novo_grupo_salvar', 'novo_grupo', post('novo_grupo', dados={'nome': 'Grupo do benchmark'}), None),
+        Cenario('novo_tel', 'novo_tel', get('novo_tel', c), None),
+        Cenario('novo_tel_salvar', 'novo_tel', post('novo_tel', c, dados={'numero': '11 98888-7777'}), None),
+        Cenario('novo_email', 'novo_email', get('novo_email', c), None),
+        Cenario('novo_email_salvar', 'novo_email', post('novo_email', c, dados={'endereco': 'bench@exemplo.com'}), None),
+        Cenario('excluir_contato', 'excluir_contato', get('excluir_contato', c), None),
+        Cenario('excluir_telefone', 'excluir_telefone', get('excluir_telefone', c, alvos['telefone']), None),
+        Cenario('excluir_email', 'excluir_email', get('excluir_email', c, alvos['email']), None),
+        Cenario('excluir_telefones', 'excluir_telefones',
+                post('excluir_telefones', c, dados={'ids': [alvos['telefone']]}), None),
+        Cenario('excluir_emails', 'excluir_emails', post('excluir_emails', c, dados={'ids': [alvos['email']]}), None),
+        Cenario('lote_excluir_grupo', 'contatos_em_lote',
+                post('contatos_em_lote', dados={'acao': 'excluir', 'de_grupo': g}), 3),
+        Cenario('lote_adicionar_busca', 'contatos_em_lote',
+                post('contatos_em_lote', dados={'acao': 'adicionar', 'busca': alvos['busca'], 'grupo': g}), 3),
+        Cenario('grupos', 'grupos_list', get('grupos_list'), None),
+        Cenario('grupos_por_tamanho', 'grupos_list', get('grupos_list', ordem='tamanho'), None),
+        Cenario('editar_grupo', 'editar_grupo', get('editar_grupo', g), None),
+        Cenario('editar_grupo_salvar', 'editar_grupo',
+                post('editar_grupo', g, dados={'nome': 'Grupo renomeado', 'descricao': 'benchmark'}), None),
+        Cenario('excluir_grupo', 'excluir_grupo', get('excluir_grupo', g), None),
+        Cenario('novo_contato', 'novo_contato', get('novo_contato'), None),
+        Cenario('novo_contato_salvar', 'novo_contato', post('novo_contato', dados={'nome': 'Contato do benchmark'}), None),
+        Cenario('exportar_vcard', 'exportar_contatos', get('exportar_contatos'), 3),
+        Cenario('exportar_csv_gzip', 'exportar_contatos', get('exportar_contatos', formato='csv', gzip='1'), 3),
+        Cenario('exportar_grupo', 'exportar_grupo', get('exportar_grupo', g), 3),
+        Cenario('importar_contatos', 'importar_contatos', get('importar_contatos'), None),
+        Cenario('importacao_detalhe', 'importacao_detalhe', get('importacao_detalhe', alvos['importacao']), None),
+        Cenario('retomar_importacao', 'retomar_importacao', post('retomar_importacao', alvos['importacao']), None),
+        Cenario('dono_do_telefone', 'dono_do_telefone', get('dono_do_telefone', numero=alvos['numero']), None),
+        Cenario('buscar_grupos', 'buscar_grupos', get('buscar_grupos', q=alvos['nome_grupo'][:3]), None),
+        Cenario('autocompletar', 'autocompletar', get('autocompletar', q=alvos['busca'][:3]), None),
+        Cenario('autocompletar_telefone', 'autocompletar',
+                get('autocompletar', q=re.sub(r'\D', '', alvos['numero'])[:4]), None),
+        Cenario('duplicados', 'duplicados', get('duplicados'), None),
+        Cenario('par_duplicado', 'par_duplicado', get('par_duplicado', alvos['par']), None),
+        Cenario('par_duplicado_unir', 'par_duplicado',
+                post('par_duplicado', alvos['par'], dados={'sobrevivente': c}), None),
+        Cenario('contato_dados', 'contato_dados', get('contato_dados', c), None),
+        Cenario('sincronizar_em_dia', 'sincronizar', get('sincronizar', since=alvos['token']), None),
+        Cenario('sincronizar_inicio', 'sincronizar', get('sincronizar', limite=alteracoes.LOTE_MAXIMO), None),
+        Cenario('tarefa', 'tarefa', get('tarefa', alvos['tarefa']), None),
+        Cenario('lista_async', 'contatos_list_async', get('contatos_list_async'), None),
+        Cenario('busca_async', 'contatos_list_async', get('contatos_list_async', busca=alvos['busca']), None),
+        Cenario('lista_grupo_async', 'contatos_list_por_grupo_async', get('contatos_list_por_grupo_async', g), None),
+        Cenario('grupos_async', 'grupos_list_async', get('grupos_list_async'), None),
+        Cenario('contato_dados_async', 'contato_dados_async', get('contato_dados_async', c), None),
+    ]
+
+
+def rotas_sem_cenario(lista):
+    from .urls import urlpatterns
+    return sorted({rota.name for rota in urlpatterns} - {cenario.rota for cenario in lista})
+
+
+@contextmanager
+def _desfeito_no_final():
+    # Transação na partição do dono atual e na partição 'default' (onde fica
+    # a fila de tarefas), desfeita nas duas no final.
+    banco = particao()
+    with transaction.atomic(), transaction.atomic(using=banco):
+        yield
+        transaction.set_rollback(True, using=banco)
+        transaction.set_rollback(True)
+
+
+def _requisitar(cliente, cenario):
+    # Faz a requisição dentro de uma transação desfeita no final, para que
+    # todas as repetições encontrem os mesmos dados. Respostas em partes
+    # (exportações) são consumidas por inteiro. O cliente de teste não fecha
+    # a conexão com o banco ao final da requisição, o que desfaria a
+    # transação externa de executar().
+    with _desfeito_no_final():
+        with CaptureQueriesContext(connections[particao()]) as consultas:
+            inicio = time.perf_counter()
+            resposta = cenario.requisicao(cliente)
+            if resposta.streaming:
+                for _ in resposta.streaming_content:
+                    pass
+            duracao = time.perf_counter() - inicio
+    # As views assíncronas consultam o banco em outras threads, com outras
+    # conexões, que o CaptureQueriesContext não vê. Para elas vale a contagem
+    # feita pelo middleware de instrumentação, enviada no Server-Timing.
+    instrumentadas = re.search(r'desc="(\d+) consultas"', resposta.get('Server-Timing', ''))
+    total = max(len(consultas), int(instrumentadas.group(1)) if instrumentadas else 0)
+    return resposta.status_code, duracao, total
+
+
+def _percentil(valores, p):
+    valores = sorted(valores)
+    return valores[max(0, min(len(valores) - 1, round(p / 100 * len(valores) + 0.5) - 1))]
+
+
+def executar(repeticoes=20, filtro=None, progresso=None):
+    # Executa os cenários e retorna um dicionário pronto para ser gravado em
+    # JSON. Cada cenário é executado uma vez para aquecer os caches, depois
+    # 'repeticoes' vezes para medir a latência, e mais uma vez com tracemalloc
+    # ativo para medir o pico de memória (separadamente, porque o tracemalloc
+    # torna o código bem mais lento).
+    from . import instrumentacao
+    amostragem, instrumentacao.AMOSTRAGEM = instrumentacao.AMOSTRAGEM, 0
+
+    resultado = {
+        'meta': {
+            'data': timezone.now().isoformat(),
+            'contatos': Contato.objects.count(),
+            'telefones': Telefone.objects.filter(contato__dono=dono_atual()).count(),
+            'emails': Email.objects.filter(contato__dono=dono_atual()).count(),
+            'grupos': Grupo.objects.count(),
+            'repeticoes': repeticoes,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'sqlite': (connections[particao()].Database.sqlite_version
+                       if connections[particao()].vendor == 'sqlite' else None),
+        },
+        'cenarios': {},
+    }
+    cliente = Client()
+    # O índice de sugestões é carregado na inicialização do servidor.
+    autocompletar.aquecer(em_segundo_plano=False)
+    try:
+        with _desfeito_no_final():
+            alvos = _alvos()
+            if alvos is None:
+                raise ValueError('A agenda precisa ter contatos em grupos; use "manage.py gerar_agenda".')
+            alvos['importacao'] = Importacao.objects.create(
+                caminho='', nome_arquivo='benchmark.csv', formato='csv', status=Importacao.CONCLUIDA).id
+            a, b = sorted((alvos['contato'], alvos['outro']))
+            alvos['par'] = ParDuplicado.objects.create(contato_a_id=a, contato_b_id=b, pontuacao=0.9,
+                                                       motivos='telefone').id
+            alvos['tarefa'] = Tarefa.objects.create(nome='pausa', status=Tarefa.CONCLUIDA).id
+            todos = cenarios(alvos)
+            resultado['meta']['sem_cenario'] = rotas_sem_cenario(todos)
+            for cenario in todos:
+                if filtro and filtro not in cenario.nome:
+                    continue
+                _requisitar(cliente, cenario)
+                tempos = []
+                for _ in range(max(1, min(repeticoes, cenario.repeticoes or repeticoes))):
+                    status, duracao, consultas = _requisitar(cliente, cenario)
+                    tempos.append(duracao * 1000)
+                tracemalloc.start()
+                try:
+                    _requisitar(cliente, cenario)
+                    pico = tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+                resultado['cenarios'][cenario.nome] = {
+                    'rota': cenario.rota,
+                    'status': status,
+                    'repeticoes': len(tempos),
+                    'p50_ms': round(_percentil(tempos, 50), 2),
+                    'p95_ms': round(_percentil(tempos, 95), 2),
+                    'max_ms': round(max(tempos), 2),
+                    'consultas': consultas,
+                    'pico_kb': round(pico / 1024),
+                }
+                if progresso:
+                    progresso(cenario.nome, resultado['cenarios'][cenario.nome])
+    finally:
+        instrumentacao.AMOSTRAGEM = amostragem
+    return resultado
+
+
+def rotas_carga():
+    # Pares (view síncrona, view assíncrona) exercitados por carga().
+    alvos = _alvos()
+    if alvos is None:
+        raise ValueError('A agenda precisa ter contatos em grupos; use "manage.py gerar_agenda".')
+    c, busca = alvos['contato'], urlencode({'busca': alvos['busca']})
+    return [
+        (reverse('contatos_list_view'), reverse('contatos_list_async')),
+        (f"{reverse('contatos_list_view')}?{busca}", f"{reverse('contatos_list_async')}?{busca}"),
+        (reverse('contatos_list_por_grupo', args=[alvos['grupo']]),
+         reverse('contatos_list_por_grupo_async', args=[alvos['grupo']])),
+        (reverse('grupos_list'), reverse('grupos_list_async')),
+        (reverse('contato_dados', args=[c]), reverse('contato_dados_async', args=[c])),
+    ]
+
+
+def _carga_wsgi(urls, clientes, total, tempos):
+    # Simula um servidor WSGI com uma thread por cliente: cada thread faz
+    # uma requisição de cada vez, até que 'total' requisições tenham sido
+    # feitas por todas elas.
+    proxima = count()
+    trava = threading.Lock()
+    erros = []
+
+    def cliente():
+        navegador = Client()
+        try:
+            while (i := next(proxima)) < total:
+                inicio = time.perf_counter()
+                try:
+                    ok = navegador.get(urls[i % len(urls)]).status_code < 400
+                except Exception:
+                    ok = False
+                with trava:
+                    tempos.append((time.perf_counter() - inicio) * 1000)
+                    if not ok:
+                        erros.append(i)
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=clientes) as executor:
+        for futuro in [executor.submit(cliente) for _ in range(clientes)]:
+            futuro.result()
+    return len(erros)
+
+
+async def _carga_asgi(urls, clientes, total, tempos):
+    # 'clientes' tarefas concorrentes no mesmo event loop, cada uma fazendo
+    # uma requisição de cada vez pelo handler ASGI do Django.
+    proxima = count()
+    erros = []
+
+    async def cliente():
+        navegador = AsyncClient()
+        while (i := next(proxima)) < total:
+            inicio = time.perf_counter()
+            try:
+                ok = (await navegador.get(urls[i % len(urls)])).status_code < 400
+            except Exception:
+                ok = False
+            tempos.append((time.perf_counter() - inicio) * 1000)
+            if not ok:
+                erros.append(i)
+
+    await asyncio.gather(*(cliente() for _ in range(clientes)))
+    return len(erros)
+
+
+def carga(urls, clientes=500, total=5000, assincrono=False):
+    # Faz 'total' requisições às 'urls', alternando entre elas, com
+    # 'clientes' clientes simultâneos, e retorna a vazão e a latência
+    # observadas. As requisições passam por todo o Django (middlewares, views
+    # e templates), mas não pela rede, então a comparação entre os dois modos
+    # reflete apenas o custo do modelo de concorrência de cada um.
+    from . import instrumentacao
+    amostragem, instrumentacao.AMOSTRAGEM = instrumentacao.AMOSTRAGEM, 0
+    tempos = []
+    inicio = time.perf_counter()
+    try:
+        if assincrono:
+            erros = asyncio.run(_carga_asgi(urls, clientes, total, tempos))
+        else:
+            erros = _carga_wsgi(urls, clientes, total, tempos)
+    finally:
+        instrumentacao.AMOSTRAGEM = amostragem
+    duracao = time.perf_counter() - inicio
+    return {
+        'modo': 'asgi' if assincrono else 'wsgi',
+        'clientes': clientes,
+        'requisicoes': len(tempos),
+        'erros': erros,
+        'duracao_s': round(duracao, 2),
+        'requisicoes_por_s': round(len(tempos) / duracao, 1),
+        'p50_ms': round(_percentil(tempos, 50), 1),
+        'p95_ms': round(_percentil(tempos, 95), 1),
+        'p99_ms': round(_percentil(tempos, 99), 1),
+    }
+
+
+def comparar(resultado, referencia=None, limites=None):
+    # Retorna uma lista de mensagens, uma para cada cenário que passou de
+    # CONSULTAS_MAXIMAS e para cada métrica de um cenário que piorou além do
+    # limite em relação a 'referencia'. Cenários que não existem na
+    # referência são ignorados nessa comparação.
+    limites = {**LIMITES, **(limites or {})}
+    regressoes = []
+    for nome, atual in resultado['cenarios'].items():
+        maximo = CONSULTAS_MAXIMAS.get(nome)
+        if maximo is not None and atual['consultas'] > maximo:
+            regressoes.append(f"{nome}: {atual['consultas']} consultas (máximo {maximo})")
+        anterior = (referencia or {}).get('cenarios', {}).get(nome)
+        if not anterior:
+            continue
+        for metrica in ('p50_ms', 'p95_ms', 'consultas', 'pico_kb'):
+            if metrica not in anterior:
+                continue
+            maximo = anterior[metrica] * limites[metrica]
+            if metrica.endswith('_ms'):
+                maximo = max(maximo, anterior[metrica] + limites['folga_ms'])
+            if atual[metrica] > maximo:
+                regressoes.append(f'{nome}: {metrica} {anterior[metrica]} -> {atual[metrica]} '
+                                  f'(limite {maximo:.1f})')
+    return regressoes
+
+
+def carregar(caminho):
+    with open(caminho, encoding='utf-8') as arquivo:
+        return json.load(arquivo)
+
+
+def gravar(resultado, caminho):
+    with open(caminho, 'w', encoding='utf-8') as arquivo:
+        json.dump(resultado, arquivo, indent=2, ensure_ascii=False)
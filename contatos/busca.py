@@ -0,0 +1,198 @@
+import re
+import unicodedata
+
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from . import situacao
+from .donos import dono_atual, particao
+from .models import CartaoContato, Contato, Telefone, Email
+
+# Nome da tabela virtual FTS5 que guarda o índice de busca. Cada linha tem
+# como rowid o id de um Contato e guarda, já normalizados, o nome do contato,
+# seus telefones, seus emails e os nomes dos seus grupos. Cada partição (ver
+# contatos/donos.py) tem o seu índice, com os contatos de todos os seus
+# donos; as consultas ao índice são restritas aos contatos do dono atual.
+TABELA = 'contatos_busca'
+
+# O tokenizador 'trigram' quebra o texto em sequências de três caracteres,
+# o que permite encontrar qualquer trecho de um nome, número ou email (como o
+# antigo 'nome__contains'), mas usando o índice ao invés de varrer a tabela.
+SQL_CRIAR_TABELA = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABELA} "
+    "USING fts5(nome, telefones, emails, grupos, tokenize='trigram')"
+)
+
+TAMANHO_LOTE = 2000
+
+
+def disponivel():
+    # O índice só existe quando o banco de dados é SQLite. Em outros bancos as
+    # funções deste módulo recorrem a buscas comuns com 'icontains'.
+    return connections[particao()].vendor == 'sqlite'
+
+
+def normalizar(texto):
+    # Remove acentos e diferenças entre maiúsculas e minúsculas, de forma que
+    # "João", "JOAO" e "joao" resultem no mesmo texto. A mesma normalização é
+    # aplicada ao indexar e ao buscar.
+    texto = texto or ''
+    if texto.isascii():
+        return texto.casefold().strip()
+    decomposto = unicodedata.normalize('NFKD', texto)
+    sem_acentos = ''.join(c for c in decomposto if not unicodedata.combining(c))
+    return sem_acentos.casefold().strip()
+
+
+def _somente_digitos(texto):
+    return re.sub(r'\D', '', texto or '')
+
+
+def _documento(contato_id, situacao):
+    # Conteúdo indexado de um contato, a partir da sua Situacao (ver
+    # contatos/situacao.py). Indexamos cada número como foi digitado e
+    # também apenas os seus dígitos, para que "9999-1234" seja encontrado ao
+    # buscar por "99991234".
+    telefones = [texto for numero, _ in situacao.telefones for texto in (numero, _somente_digitos(numero))]
+    return (
+        contato_id,
+        normalizar(situacao.nome),
+        normalizar(' '.join(telefones)),
+        normalizar(' '.join(situacao.emails)),
+        normalizar(' '.join(nome for _, nome in situacao.grupos)),
+    )
+
+
+def remover_contatos(ids):
+    ids = list(ids)
+    if not ids or not disponivel():
+        return
+    with connections[particao()].cursor() as cursor:
+        for inicio in range(0, len(ids), TAMANHO_LOTE):
+            lote = ids[inicio:inicio + TAMANHO_LOTE]
+            marcadores = ', '.join(['%s'] * len(lote))
+            cursor.execute(f"DELETE FROM {TABELA} WHERE rowid IN ({marcadores})", lote)
+
+
+def indexar_contatos(ids, situacoes=None):
+    # Atualiza as linhas do índice dos contatos em 'ids', substituindo as
+    # anteriores. Contatos que não existem mais são apenas removidos do
+    # índice. 'situacoes' é a situação já carregada dos contatos (ver
+    # contatos/situacao.py); sem ela, os contatos são lidos do banco.
+    ids = list(ids)
+    if not ids or not disponivel():
+        return
+    with connections[particao()].cursor() as cursor:
+        for parte in situacao.partes(ids):
+            atuais = situacao.carregar(parte) if situacoes is None else situacoes
+            remover_contatos([contato_id for contato_id in parte if contato_id not in atuais])
+            documentos = [_documento(contato_id, atuais[contato_id]) for contato_id in parte if contato_id in atuais]
+            if documentos:
+                cursor.executemany(
+                    f"INSERT OR REPLACE INTO {TABELA} (rowid, nome, telefones, emails, grupos) "
+                    "VALUES (%s, %s, %s, %s, %s)",
+                    documentos,
+                )
+
+
+def reconstruir_indice():
+    # Apaga o índice da agenda do dono atual (e as linhas de contatos que não
+    # existem mais) e o reconstrói a partir das tabelas do app, percorrendo os
+    # contatos em lotes pela chave primária.
+    if not disponivel():
+        return 0
+    with connections[particao()].cursor() as cursor:
+        cursor.execute(SQL_CRIAR_TABELA)
+        cursor.execute(f"DELETE FROM {TABELA} WHERE rowid NOT IN "
+                       f"(SELECT id FROM {Contato._meta.db_table} WHERE dono <> %s)", [dono_atual()])
+    total = 0
+    ultimo_id = 0
+    while True:
+        ids = list(Contato.objects.filter(id__gt=ultimo_id).order_by('id')
+                   .values_list('id', flat=True)[:TAMANHO_LOTE])
+        if not ids:
+            break
+        indexar_contatos(ids)
+        total += len(ids)
+        ultimo_id = ids[-1]
+    with connections[particao()].cursor() as cursor:
+        cursor.execute(f"INSERT INTO {TABELA} ({TABELA}) VALUES ('optimize')")
+    return total
+
+
+def _expressao(termo):
+    # Converte o texto digitado em uma expressão MATCH do FTS5. Cada palavra
+    # vira uma frase entre aspas, e todas precisam estar presentes no contato.
+    # O tokenizador trigram não consegue casar palavras com menos de três
+    # caracteres, por isso elas são ignoradas quando há outras maiores.
+    palavras = normalizar(termo).split()
+    longas = [p for p in palavras if len(p) >= 3]
+    if not longas:
+        return None
+    return ' AND '.join('"{}"'.format(p.replace('"', '""')) for p in longas)
+
+
+def filtrar_por_prefixo(queryset, termo, campo='nome_busca'):
+    # Restringe 'queryset' às linhas cujo 'campo' (uma coluna já
+    # normalizada, como CartaoContato.nome_busca e Grupo.nome_busca) começa
+    # com o termo normalizado. A condição é o intervalo [inicio, fim), que o
+    # SQLite percorre em um índice comum, ao contrário de um LIKE ou
+    # 'istartswith', que ele só otimiza em colunas NOCASE. Um termo vazio
+    # depois de normalizado não restringe nada.
+    inicio = normalizar(termo)
+    if not inicio:
+        return queryset
+    fim = inicio[:-1] + chr(ord(inicio[-1]) + 1)
+    return queryset.filter(**{f'{campo}__gte': inicio, f'{campo}__lt': fim})
+
+
+def filtrar_contatos(queryset, termo, campo=None):
+    # Restringe 'queryset' aos contatos que correspondem a 'termo' em
+    # qualquer um dos campos indexados. 'queryset' pode ser de Contato ou de
+    # um modelo cuja chave primária é o contato (como CartaoContato); com
+    # 'campo', de um modelo cujo campo 'campo' aponta para o contato (como
+    # 'contato' em Telefone e Email). O resultado mantém a ordem de
+    # 'queryset' (a lista de contatos é paginada por nome), e não a
+    # relevância de cada contato para a busca.
+    if not disponivel():
+        # Sem o índice, a busca é feita por nome, telefone e email, com
+        # subconsultas em vez de junções (que repetiriam o contato a cada
+        # telefone ou email encontrado).
+        filtro = (Q(nome__icontains=termo) |
+                  Q(id__in=Telefone.objects.filter(numero__icontains=termo).values('contato_id')) |
+                  Q(id__in=Email.objects.filter(endereco__icontains=termo).values('contato_id')))
+        if queryset.model is Contato and campo is None:
+            return queryset.filter(filtro)
+        return queryset.filter(**{f'{campo or "pk"}__in': Contato.objects.filter(filtro).values('id')})
+    expressao = _expressao(termo)
+    if expressao is None:
+        # Termos muito curtos para o MATCH do trigram (como as primeiras
+        # letras digitadas na caixa de busca) encontram os contatos cujo
+        # nome começa com o termo, sem acentos nem maiúsculas, percorrendo
+        # apenas o trecho correspondente do índice 'cartao_busca'.
+        #
+        # Na lista, os cartões são filtrados pelos nomes que esse trecho
+        # contém, já que a página é ordenada por 'nome' e o índice está em
+        # ordem de 'nome_busca'. Os nomes saem do próprio índice, que também
+        # os guarda, e a página é lida em ordem pelo índice 'cartao_lista',
+        # parando no último cartão dela. Filtrando pelo trecho diretamente,
+        # o SQLite escolhe entre ordenar todos os cartões do trecho (uma
+        # letra corresponde a milhares deles) ou percorrer o 'cartao_lista'
+        # inteiro até completar a página, o que leva segundos se poucos
+        # nomes começam com o termo.
+        #
+        # Telefones, emails e nomes de grupos não são buscados com menos de
+        # três caracteres: os seus índices não são separados por dono, e um
+        # início tão curto ('1', '+55', 'a') corresponde a boa parte da
+        # tabela inteira, que seria lida a cada tecla. Do terceiro caractere
+        # em diante, eles são encontrados pelo índice de busca, como
+        # qualquer trecho do nome.
+        if not normalizar(termo):
+            return queryset
+        cartoes = filtrar_por_prefixo(CartaoContato.objects.all(), termo)
+        if queryset.model is CartaoContato and campo is None:
+            return queryset.filter(nome__in=cartoes.values('nome'))
+        return queryset.filter(**{f'{campo or "pk"}__in': cartoes.values('contato_id')})
+    subconsulta = RawSQL(f"SELECT rowid FROM {TABELA} WHERE {TABELA} MATCH %s", [expressao])
+    return queryset.filter(**{f'{campo or "pk"}__in': subconsulta})
@@ -0,0 +1,119 @@
+import hashlib
+import json
+
+from django.conf import settings
+
+from . import avatares, situacao
+from .busca import filtrar_contatos, normalizar
+from .models import Contato, CartaoContato
+from .storage import armazenamento_avatares
+
+# Cartões da lista de contatos (ver CartaoContato em contatos/models.py).
+#
+# Os cartões são regravados por contatos/sincronizacao.py na mesma transação
+# que alterou os contatos, e reconstruídos do zero por reconstruir_derivados()
+# e pelo comando 'manage.py reconstruir_cartoes'. Com CONTATOS_USAR_CARTOES
+# False, a lista volta a ler os contatos com prefetch_related() e monta os
+# mesmos cartões a cada requisição (ver do_contato()).
+#
+# 'dados' usa chaves curtas, omitidas quando vazias:
+#   'g': nomes dos grupos, em ordem alfabética
+#   't': números de telefone, na ordem em que foram cadastrados
+#   'e': endereços de email, na ordem em que foram cadastrados
+#   'a': {'url'} do avatar original e, se as miniaturas já foram geradas,
+#        'src', 'srcset_jpg' e 'srcset_webp' (ver contatos/avatares.py)
+
+USAR_CARTOES = getattr(settings, 'CONTATOS_USAR_CARTOES', True)
+
+# Altura, em pixels, com que o cartão exibe o avatar.
+ALTURA_AVATAR = 200
+
+Associacao = Contato.grupos.through
+
+
+def _avatar(nome, miniaturas):
+    if not nome:
+        return None
+    dados = {'url': armazenamento_avatares().url(nome)}
+    if miniaturas:
+        dados.update(avatares.atributos_img(nome, ALTURA_AVATAR))
+    return {chave: valor for chave, valor in dados.items() if valor}
+
+
+def montar_dados(grupos, telefones, emails, avatar=None, miniaturas=False):
+    dados = {
+        'g': sorted(grupos),
+        't': list(telefones),
+        'e': list(emails),
+        'a': _avatar(avatar, miniaturas),
+    }
+    return {chave: valor for chave, valor in dados.items() if valor}
+
+
+def calcular_versao(nome, dados):
+    # Versão do cartão usada na chave do seu fragmento em cache (ver
+    # contatos/fragmentos.py). Por ser calculada a partir do conteúdo, ela
+    # muda sempre que o nome, os grupos, os telefones, os emails ou o avatar
+    # mudam, inclusive quando os cartões são reconstruídos.
+    conteudo = json.dumps([nome, dados], sort_keys=True, ensure_ascii=False)
+    return int.from_bytes(hashlib.blake2b(conteudo.encode(), digest_size=8).digest(), 'big', signed=True)
+
+
+def _cartao(contato_id, nome, dados):
+    return CartaoContato(contato_id=contato_id, nome=nome, nome_busca=normalizar(nome), dados=dados,
+                         versao=calcular_versao(nome, dados))
+
+
+def do_contato(contato):
+    # Cartão, sem gravá-lo, de um contato cujos grupos, telefones e emails já
+    # foram carregados com prefetch_related().
+    return _cartao(contato.id, contato.nome, montar_dados(
+        [grupo.nome for grupo in contato.grupos.all()],
+        [telefone.numero for telefone in contato.telefone_set.all()],
+        [email.endereco for email in contato.email_set.all()],
+        contato.avatar.name if contato.avatar else None,
+        contato.avatar_miniaturas,
+    ))
+
+
+def _cartoes(situacoes):
+    # Cartões dos contatos em 'situacoes' (ver contatos/situacao.py).
+    return [_cartao(contato_id, atual.nome, montar_dados(
+        [nome for _, nome in atual.grupos],
+        [numero for numero, _ in atual.telefones],
+        atual.emails,
+        atual.avatar,
+        atual.miniaturas,
+    )) for contato_id, atual in situacoes.items()]
+
+
+def atualizar(ids, situacoes=None):
+    # Regrava os cartões dos contatos em 'ids'. Os de contatos que não
+    # existem mais são apenas removidos. 'situacoes' é a situação já
+    # carregada dos contatos; sem ela, os contatos são lidos do banco.
+    for parte in situacao.partes(list(ids)):
+        CartaoContato.objects.filter(contato_id__in=parte).delete()
+        atuais = situacao.carregar(parte) if situacoes is None else situacoes
+        CartaoContato.objects.bulk_create(_cartoes({contato_id: atuais[contato_id] for contato_id in parte
+                                                    if contato_id in atuais}))
+
+
+def reconstruir():
+    # Apaga e grava novamente os cartões de todos os contatos. Retorna a
+    # quantidade de cartões gravados.
+    CartaoContato.objects.all().delete()
+    ids = list(Contato.objects.order_by('id').values_list('id', flat=True))
+    for parte in situacao.partes(ids):
+        CartaoContato.objects.bulk_create(_cartoes(situacao.carregar(parte)))
+    return len(ids)
+
+
+def consultar(grupo_id=None, busca=None):
+    # Cartões de todos os contatos, dos contatos do grupo 'grupo_id' ou dos
+    # que correspondem a 'busca', para serem paginados por 'nome'.
+    cartoes = CartaoContato.objects.all()
+    if grupo_id:
+        return cartoes.filter(contato_id__in=Associacao.objects.filter(grupo_id=grupo_id).values('contato_id'))
+    if busca:
+        return filtrar_contatos(cartoes, busca)
+    return cartoes
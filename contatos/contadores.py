@@ -0,0 +1,156 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Case, Count, Exists, F, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import situacao
+from .donos import dono_atual
+from .models import Contato, Grupo, Telefone, Email, ResumoContato
+
+# Contadores de cada grupo (total de contatos, quantos têm telefone e quantos
+# têm email), exibidos na lista de grupos.
+#
+# Os contadores são atualizados por contatos/sincronizacao.py a cada
+# alteração de contatos (ver comparar() e aplicar()), com base na diferença
+# entre a situação atual dos contatos alterados e a registrada em
+# ResumoContato: incluir um contato em
+# um grupo com 100 mil membros soma 1 ao contador, em vez de recontar os 100
+# mil. contagens_agregadas() calcula os mesmos valores diretamente das
+# tabelas; ela é usada quando GRUPOS_USAR_CONTADORES é False e pelo comando
+# 'manage.py reconciliar_grupos', que confere e corrige os contadores.
+
+USAR_CONTADORES = getattr(settings, 'GRUPOS_USAR_CONTADORES', True)
+
+CAMPOS = Grupo.CONTADORES
+
+# Ordenações aceitas pela lista de grupos (parâmetro 'ordem').
+ORDENS = {
+    'nome': ('nome',),
+    'tamanho': ('-membros', 'nome'),
+    'alteracao': ('-atualizado_em', 'nome'),
+}
+
+# Cada grupo ocupa até sete parâmetros na instrução UPDATE dos contadores
+# (ver aplicar()), o que mantém cada instrução abaixo de 999 parâmetros.
+GRUPOS_POR_UPDATE = 100
+
+Associacao = Contato.grupos.through
+
+
+def _resumo(atual):
+    # (grupos, tem_telefone, tem_email) de um contato, a partir da sua
+    # Situacao (ver contatos/situacao.py).
+    return sorted(grupo_id for grupo_id, _ in atual.grupos), bool(atual.telefones), bool(atual.emails)
+
+
+def _resumos(situacoes):
+    resumos = []
+    for contato_id, atual in situacoes.items():
+        grupos, telefone, email = _resumo(atual)
+        resumos.append(ResumoContato(contato_id=contato_id, grupos=grupos, tem_telefone=telefone, tem_email=email))
+    return resumos
+
+
+def novas_diferencas():
+    # {grupo_id: [total, com telefone, com email]}, acumulado por comparar()
+    # e gravado por aplicar().
+    return defaultdict(lambda: [0, 0, 0])
+
+
+def comparar(ids, situacoes, diferencas):
+    # Soma a 'diferencas' a diferença entre a situação atual dos contatos em
+    # 'ids' (no máximo situacao.TAMANHO_PARTE deles) e a registrada em
+    # ResumoContato, e regrava o ResumoContato de cada um.
+    anteriores = {contato_id: (grupos, telefone, email) for contato_id, grupos, telefone, email
+                  in ResumoContato.objects.filter(contato_id__in=ids)
+                  .values_list('contato_id', 'grupos', 'tem_telefone', 'tem_email')}
+    for contato_id in ids:
+        atual = situacoes.get(contato_id)
+        for resumo, sinal in ((anteriores.get(contato_id), -1), (atual and _resumo(atual), 1)):
+            if resumo is None:
+                continue
+            grupos, telefone, email = resumo
+            for grupo_id in grupos:
+                diferenca = diferencas[grupo_id]
+                diferenca[0] += sinal
+                diferenca[1] += sinal * telefone
+                diferenca[2] += sinal * email
+    ResumoContato.objects.filter(contato_id__in=ids).delete()
+    ResumoContato.objects.bulk_create(_resumos(situacoes))
+
+
+def aplicar(diferencas):
+    # Uma instrução UPDATE para cada parte de GRUPOS_POR_UPDATE grupos, com
+    # a diferença de cada um em uma expressão CASE. Grupos cujos contadores
+    # mudaram têm 'atualizado_em' renovado.
+    alterados = [(grupo_id, diferenca) for grupo_id, diferenca in diferencas.items() if any(diferenca)]
+    agora = timezone.now()
+    for inicio in range(0, len(alterados), GRUPOS_POR_UPDATE):
+        parte = alterados[inicio:inicio + GRUPOS_POR_UPDATE]
+        alteracoes = {}
+        for indice, campo in enumerate(CAMPOS):
+            casos = [When(id=grupo_id, then=Value(diferenca[indice])) for grupo_id, diferenca in parte
+                     if diferenca[indice]]
+            if casos:
+                alteracoes[campo] = F(campo) + Case(*casos, default=Value(0), output_field=IntegerField())
+        Grupo.objects.filter(id__in=[grupo_id for grupo_id, _ in parte]).update(atualizado_em=agora, **alteracoes)
+
+
+def atualizar(ids):
+    # Atualiza os contadores dos grupos de que os contatos em 'ids' fazem ou
+    # faziam parte e o ResumoContato de cada um.
+    diferencas = novas_diferencas()
+    for parte in situacao.partes(list(ids)):
+        comparar(parte, situacao.carregar(parte), diferencas)
+    aplicar(diferencas)
+
+
+def _contagem(*filtros):
+    associacoes = (Associacao.objects.filter(*filtros, grupo_id=OuterRef('pk')).order_by()
+                   .values('grupo_id').annotate(total=Count('*')).values('total'))
+    return Coalesce(Subquery(associacoes), Value(0))
+
+
+def contagens_agregadas():
+    # Expressões que calculam os contadores de cada grupo a partir das
+    # tabelas, para uso em annotate() ou update() de consultas de Grupo.
+    return {
+        'total_contatos': _contagem(),
+        'contatos_com_telefone': _contagem(Exists(Telefone.objects.filter(contato_id=OuterRef('contato_id')))),
+        'contatos_com_email': _contagem(Exists(Email.objects.filter(contato_id=OuterRef('contato_id')))),
+    }
+
+
+def grupos_com_estatisticas(ordem='nome'):
+    # Grupos anotados com 'membros', 'com_telefone' e 'com_email', em uma
+    # única consulta independentemente da quantidade de grupos.
+    if USAR_CONTADORES:
+        valores = {campo: F(campo) for campo in CAMPOS}
+    else:
+        valores = contagens_agregadas()
+    return (Grupo.objects.annotate(membros=valores['total_contatos'],
+                                   com_telefone=valores['contatos_com_telefone'],
+                                   com_email=valores['contatos_com_email'])
+            .order_by(*ORDENS.get(ordem, ORDENS['nome'])))
+
+
+def divergencias():
+    # Grupos cujos contadores diferem dos valores calculados das tabelas,
+    # como {'id', 'nome', 'total_contatos', 'total_contatos_calculado', ...}.
+    calculados = {f'{campo}_calculado': expressao for campo, expressao in contagens_agregadas().items()}
+    grupos = (Grupo.objects.annotate(**calculados).order_by('nome')
+              .values('id', 'nome', *CAMPOS, *calculados))
+    return [grupo for grupo in grupos if any(grupo[campo] != grupo[f'{campo}_calculado'] for campo in CAMPOS)]
+
+
+def reconstruir():
+    # Recalcula do zero os resumos de todos os contatos e os contadores de
+    # todos os grupos do dono atual. Os resumos de contatos que não existem
+    # mais também são apagados.
+    ResumoContato.objects.exclude(contato_id__in=Contato.todos.exclude(dono=dono_atual()).values('id')).delete()
+    ids = list(Contato.objects.order_by('id').values_list('id', flat=True))
+    for parte in situacao.partes(ids):
+        ResumoContato.objects.bulk_create(_resumos(situacao.carregar(parte)))
+    Grupo.objects.update(**contagens_agregadas())
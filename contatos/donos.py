@@ -0,0 +1,226 @@
+import contextvars
+import hashlib
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, models
+from django.http import HttpResponse
+
+# Agendas de vários donos, distribuídas entre partições.
+#
+# Cada usuário é dono de uma agenda própria: os contatos, os grupos e o que
+# deriva deles têm o campo 'dono' (o id do usuário), e o nome de um contato
+# ou de um grupo só precisa ser único dentro da agenda do seu dono. O dono
+# de cada requisição é definido por DonoMiddleware (o usuário autenticado
+# ou, para visitantes, AGENDA_DONO_PADRAO), e o manager 'objects' desses
+# modelos (ManagerDoDono) filtra as consultas por ele, então o restante do
+# app continua consultando Contato.objects sem se preocupar com o dono. O
+# manager 'todos' enxerga as agendas de todos os donos. Código executado
+# fora de uma requisição (comandos, tarefas, threads) usa como_dono().
+#
+# As agendas ficam nas partições de AGENDA_PARTICOES, cada uma um arquivo
+# SQLite com a sua conexão de escrita e as suas conexões de leitura. A
+# agenda inteira de um dono fica em uma única partição, então as escritas de
+# donos em partições diferentes não disputam a mesma trava. A partição de um
+# dono é escolhida por um hash estável do seu id (ver particao_por_hash()),
+# a menos que LocalizacaoDono registre outra, o que acontece quando a agenda
+# é movida por 'manage.py mover_dono'. O roteador em agenda1/roteadores.py
+# envia as consultas dos modelos particionados para a partição do dono
+# atual; os demais modelos (usuários, sessões, a fila de tarefas e o próprio
+# LocalizacaoDono) ficam sempre na partição 'default'.
+
+DONO_PADRAO = getattr(settings, 'AGENDA_DONO_PADRAO', 1)
+
+# {alias de escrita: [aliases de leitura]} de cada partição.
+PARTICOES = getattr(settings, 'AGENDA_PARTICOES', {DEFAULT_DB_ALIAS: []})
+
+# Segundos durante os quais cada processo reaproveita a localização de um
+# dono lida de LocalizacaoDono. 'manage.py mover_dono' espera esse tempo
+# depois de bloquear a agenda, para que nenhum processo continue gravando
+# na partição antiga.
+VALIDADE_LOCALIZACAO = getattr(settings, 'AGENDA_VALIDADE_LOCALIZACAO', 5)
+
+# Modelos do app que não são particionados.
+MODELOS_GLOBAIS = {'tarefa', 'localizacaodono'}
+
+_dono = contextvars.ContextVar('dono', default=None)
+_particao = contextvars.ContextVar('particao', default=None)
+
+# {dono: (partição, bloqueada, lida_em)}
+_localizacoes = {}
+
+
+class AgendaBloqueada(Exception):
+    pass
+
+
+def dono_atual():
+    dono = _dono.get()
+    return DONO_PADRAO if dono is None else dono
+
+
+@contextmanager
+def como_dono(dono, particao=None):
+    # Executa o bloco com 'dono' como dono atual. As threads criadas dentro
+    # do bloco não herdam o dono e precisam chamar como_dono() de novo. Com
+    # 'particao', as consultas do bloco vão para ela em vez da partição
+    # registrada para o dono, como faz 'manage.py mover_dono' ao preencher a
+    # partição de destino.
+    token, token_particao = _dono.set(dono), _particao.set(particao)
+    try:
+        yield
+    finally:
+        _particao.reset(token_particao)
+        _dono.reset(token)
+
+
+def iterar_como_dono(iterador, dono=None):
+    # Percorre 'iterador' como 'dono' (por padrão, o dono atual). Serve para
+    # o conteúdo de uma StreamingHttpResponse, que é gerado depois que
+    # DonoMiddleware já terminou; o dono é restabelecido a cada item.
+    dono = dono_atual() if dono is None else dono
+    iterador = iter(iterador)
+    while True:
+        with como_dono(dono):
+            try:
+                item = next(iterador)
+            except StopIteration:
+                return
+        yield item
+
+
+def particionado(modelo):
+    opcoes = modelo._meta
+    return opcoes.app_label == 'contatos' and opcoes.model_name not in MODELOS_GLOBAIS
+
+
+def particao_por_hash(dono, particoes=None):
+    # Partição de 'dono' por rendezvous hashing: cada partição recebe uma
+    # pontuação calculada do par (dono, partição) e a maior vence. Ao
+    # acrescentar uma partição, só mudam de lugar os donos para os quais ela
+    # passa a ter a maior pontuação (cerca de 1/N deles), e não quase todos,
+    # como aconteceria com 'hash(dono) % N'.
+    def pontuacao(particao):
+        return hashlib.blake2b(f'{dono}:{particao}'.encode(), digest_size=8).digest()
+    return max(particoes or PARTICOES, key=pontuacao)
+
+
+def _localizacao_guardada(dono):
+    # (partição, bloqueada) de 'dono' sem consultar o banco, ou None quando
+    # a localização precisa ser lida de LocalizacaoDono.
+    if len(PARTICOES) == 1:
+        return next(iter(PARTICOES)), False
+    localizacao = _localizacoes.get(dono)
+    if localizacao is None or time.monotonic() - localizacao[2] >= VALIDADE_LOCALIZACAO:
+        return None
+    return localizacao[0], localizacao[1]
+
+
+def _localizacao(dono):
+    localizacao = _localizacao_guardada(dono)
+    if localizacao is None:
+        from .models import LocalizacaoDono
+        registro = LocalizacaoDono.objects.filter(dono=dono).values_list('particao', 'bloqueada').first()
+        localizacao = registro or (particao_por_hash(dono), False)
+        _localizacoes[dono] = (*localizacao, time.monotonic())
+    return localizacao
+
+
+def particao(dono=None):
+    # Alias de escrita da partição com a agenda de 'dono' (por padrão, o dono
+    # atual), para transaction.atomic(using=...) e connections[...].
+    if dono is None:
+        return _particao.get() or _localizacao(dono_atual())[0]
+    return _localizacao(dono)[0]
+
+
+def bloqueada(dono=None):
+    return _localizacao(dono_atual() if dono is None else dono)[1]
+
+
+def esquecer_localizacoes():
+    # Descarta as localizações guardadas por este processo.
+    _localizacoes.clear()
+
+
+def donos_da_particao(alias):
+    # Donos com algum dado gravado na partição 'alias'.
+    from .models import Alteracao, Contato, Grupo, Importacao
+    donos = set()
+    for modelo in (Contato, Grupo, Importacao, Alteracao):
+        donos.update(modelo.todos.using(alias).order_by().values_list('dono', flat=True).distinct())
+    return donos
+
+
+def todos_os_donos():
+    # Donos com agenda em alguma partição, em ordem, para os comandos que
+    # percorrem todas as agendas com como_dono(). Cópias que ficaram em uma
+    # partição que não é mais a do dono (de uma mudança interrompida) são
+    # ignoradas.
+    return sorted(dono for alias in PARTICOES for dono in donos_da_particao(alias) if particao(dono) == alias)
+
+
+class ManagerDoDono(models.Manager):
+    # Manager padrão dos modelos particionados: as consultas enxergam apenas
+    # a agenda do dono atual. 'campo' é o caminho até o dono, como
+    # 'contato__dono' para um modelo sem o seu próprio campo.
+
+    def __init__(self, campo='dono'):
+        super().__init__()
+        self.campo = campo
+
+    def get_queryset(self):
+        return super().get_queryset().filter(**{self.campo: dono_atual()})
+
+
+class DonoMiddleware:
+    # Define o dono das consultas feitas durante a requisição: o usuário
+    # autenticado ou, para visitantes, AGENDA_DONO_PADRAO. Enquanto a agenda
+    # do dono está sendo movida de partição, a requisição recebe 503.
+    #
+    # Como InstrumentacaoMiddleware, funciona com WSGI e com ASGI, para que
+    # as views assíncronas não passem por uma thread. No modo assíncrono, o
+    # usuário só é carregado (em uma thread) quando a requisição tem o
+    # cookie de sessão, e a localização do dono só é lida do banco quando
+    # não está guardada pelo processo.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _dono(self, request):
+        usuario = getattr(request, 'user', None)
+        return usuario.id if usuario is not None and usuario.is_authenticated else DONO_PADRAO
+
+    def _bloqueada(self):
+        response = HttpResponse('A agenda está sendo movida; tente novamente em alguns segundos.',
+                                status=503, content_type='text/plain; charset=utf-8')
+        response['Retry-After'] = str(VALIDADE_LOCALIZACAO)
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        dono = self._dono(request)
+        if bloqueada(dono):
+            return self._bloqueada()
+        with como_dono(dono):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if settings.SESSION_COOKIE_NAME in request.COOKIES:
+            dono = await sync_to_async(self._dono)(request)
+        else:
+            dono = DONO_PADRAO
+        localizacao = _localizacao_guardada(dono)
+        if localizacao is None:
+            localizacao = await sync_to_async(_localizacao)(dono)
+        if localizacao[1]:
+            return self._bloqueada()
+        with como_dono(dono):
+            return await self.get_response(request)
@@ -0,0 +1,185 @@
+import multiprocessing
+import re
+from difflib import SequenceMatcher
+from itertools import combinations
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from .busca import normalizar
+from .donos import dono_atual, particao
+from .models import Contato, Telefone, Email, ParDuplicado
+
+# Detecção de contatos duplicados, como "Joao Silva" e "João da Silva" com o
+# mesmo telefone.
+#
+# Comparar todos os contatos entre si seria O(n²). Em vez disso, cada contato
+# é colocado em "blocos" pelas suas chaves (cada telefone normalizado, cada
+# email em minúsculas e uma chave fonética do nome), e só são comparados os
+# contatos que compartilham um bloco. Blocos com mais de LIMITE_BLOCO
+# contatos (um telefone de empresa, um nome muito comum) são ignorados, o que
+# mantém o número de comparações proporcional ao número de contatos.
+#
+# Cada par comparado recebe uma pontuação entre 0 e 1, e os pares com
+# pontuação a partir de PONTUACAO_MINIMA são gravados em ParDuplicado para
+# revisão.
+
+LIMITE_BLOCO = getattr(settings, 'DUPLICADOS_LIMITE_BLOCO', 50)
+PONTUACAO_MINIMA = getattr(settings, 'DUPLICADOS_PONTUACAO_MINIMA', 0.6)
+
+# Peso de cada critério na pontuação de um par.
+PESOS = {
+    'nome': 0.4,  # multiplicado pela semelhança entre os nomes (0 a 1)
+    'telefone': 0.35,
+    'email': 0.35,
+    'fonetica': 0.2,
+}
+
+PARTICULAS = {'da', 'das', 'de', 'di', 'do', 'dos', 'du', 'e', 'del', 'van', 'von'}
+
+# Regras aplicadas em ordem para aproximar palavras que soam iguais em
+# português ("Luiz"/"Luis", "Thiago"/"Tiago", "Ketlin"/"Quetlin").
+_REGRAS_FONETICAS = [
+    (re.compile(padrao), troca) for padrao, troca in (
+        (r'ph', 'f'), (r'lh', 'l'), (r'nh', 'n'), (r'[cs]h', 'x'), (r'th', 't'),
+        (r'c(?=[eiy])', 's'), (r'g(?=[eiy])', 'j'), (r'gu(?=[ei])', 'g'), (r'qu(?=[ei])', 'k'), (r'[cqk]', 'k'),
+        (r'z', 's'), (r'y', 'i'), (r'w', 'v'), (r'h', ''),
+    )
+]
+
+
+def _palavras(nome):
+    return [palavra for palavra in re.findall(r'[a-z0-9]+', normalizar(nome)) if palavra not in PARTICULAS]
+
+
+def _fonetica(palavra):
+    for padrao, troca in _REGRAS_FONETICAS:
+        palavra = padrao.sub(troca, palavra)
+    # Mantém a primeira letra, descarta as demais vogais e letras repetidas.
+    palavra = palavra[:1] + re.sub(r'[aeiou]', '', palavra[1:])
+    return re.sub(r'(.)\1+', r'\1', palavra)
+
+
+def chave_fonetica(nome):
+    # Chave do primeiro e do último nome, sem partículas: "João da Silva",
+    # "Joao Silva" e "JOÃO SYLVA" resultam na mesma chave.
+    palavras = _palavras(nome)
+    if not palavras:
+        return ''
+    return f'{_fonetica(palavras[0])} {_fonetica(palavras[-1])}'
+
+
+def carregar(limite_bloco=LIMITE_BLOCO):
+    # Lê os dados necessários de todos os contatos com três consultas e monta
+    # os blocos. Retorna ({id: (nome, chave, telefones, emails)}, blocos),
+    # onde cada bloco é uma tupla ordenada de ids.
+    dados, chaves = {}, {}
+    for contato_id, nome in Contato.objects.order_by().values_list('id', 'nome').iterator(chunk_size=5000):
+        chave = chave_fonetica(nome)
+        dados[contato_id] = (' '.join(_palavras(nome)), chave, set(), set())
+        if chave:
+            chaves.setdefault(f'n:{chave}', []).append(contato_id)
+    # Telefones e emails não têm o campo 'dono': são filtrados pelo dono do
+    # contato.
+    dono = dono_atual()
+    for contato_id, numero in (Telefone.objects.filter(contato__dono=dono).exclude(numero_normalizado='').order_by()
+                               .values_list('contato_id', 'numero_normalizado').iterator(chunk_size=5000)):
+        dados[contato_id][2].add(numero)
+        chaves.setdefault(f't:{numero}', []).append(contato_id)
+    for contato_id, endereco in (Email.objects.filter(contato__dono=dono).order_by()
+                                 .values_list('contato_id', 'endereco').iterator(chunk_size=5000)):
+        endereco = endereco.strip().lower()
+        dados[contato_id][3].add(endereco)
+        chaves.setdefault(f'e:{endereco}', []).append(contato_id)
+    blocos = []
+    for ids in chaves.values():
+        ids = sorted(set(ids))
+        if 1 < len(ids) <= limite_bloco:
+            blocos.append(tuple(ids))
+    return dados, blocos
+
+
+def pontuar(a, b, minima=0):
+    # Pontuação e motivos ('telefone,email,nome') de um par, a partir dos
+    # dados de cada contato retornados por carregar(). A semelhança entre os
+    # nomes, a parte mais cara do cálculo, só é calculada por completo se o
+    # par ainda puder alcançar 'minima'; caso contrário a pontuação retornada
+    # é uma estimativa, sempre abaixo de 'minima'.
+    nome_a, chave_a, telefones_a, emails_a = a
+    nome_b, chave_b, telefones_b, emails_b = b
+    pontuacao = 0.0
+    motivos = []
+    if telefones_a & telefones_b:
+        pontuacao += PESOS['telefone']
+        motivos.append('telefone')
+    if emails_a & emails_b:
+        pontuacao += PESOS['email']
+        motivos.append('email')
+    if chave_a and chave_a == chave_b:
+        pontuacao += PESOS['fonetica']
+        motivos.append('nome')
+    comparacao = SequenceMatcher(None, nome_a, nome_b)
+    semelhanca = comparacao.quick_ratio()
+    if pontuacao + PESOS['nome'] * semelhanca >= minima:
+        semelhanca = comparacao.ratio()
+    return min(pontuacao + PESOS['nome'] * semelhanca, 1.0), ','.join(motivos)
+
+
+# Dados da detecção em andamento. Os processos criados por detectar() são
+# cópias (fork) do processo principal e os recebem sem serialização.
+_dados = None
+_blocos = None
+
+
+def _pares_da_parte(argumentos):
+    # Compara os pares candidatos atribuídos ao processo 'indice' de 'total'.
+    # Cada par é atribuído a um único processo pelos seus ids, então um par
+    # presente em vários blocos é comparado uma única vez.
+    indice, total, minima = argumentos
+    comparados, encontrados = set(), {}
+    for bloco in _blocos:
+        for par in combinations(bloco, 2):
+            if total > 1 and (par[0] * 7919 + par[1]) % total != indice:
+                continue
+            if par in comparados:
+                continue
+            comparados.add(par)
+            pontuacao, motivos = pontuar(_dados[par[0]], _dados[par[1]], minima)
+            if pontuacao >= minima:
+                encontrados[par] = (round(pontuacao, 3), motivos)
+    return encontrados
+
+
+def detectar(processos=1, minima=PONTUACAO_MINIMA, limite_bloco=LIMITE_BLOCO):
+    # Encontra os pares de prováveis duplicados e os grava em ParDuplicado,
+    # substituindo os pares ainda não revisados. Com 'processos' > 1, as
+    # comparações são divididas entre processos (onde o sistema permite
+    # criá-los por fork). Retorna {(id_a, id_b): (pontuacao, motivos)}.
+    global _dados, _blocos
+    _dados, _blocos = carregar(limite_bloco)
+    try:
+        if processos > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            # As conexões com o banco não podem ser compartilhadas com os
+            # processos filhos, que de qualquer forma não as usam.
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(processos) as pool:
+                partes = pool.map(_pares_da_parte, [(i, processos, minima) for i in range(processos)])
+        else:
+            partes = [_pares_da_parte((0, 1, minima))]
+    finally:
+        _dados = _blocos = None
+    pares = {}
+    for parte in partes:
+        pares.update(parte)
+    gravar(pares)
+    return pares
+
+
+def gravar(pares):
+    with transaction.atomic(using=particao()):
+        ParDuplicado.objects.filter(descartado=False).delete()
+        descartados = set(ParDuplicado.objects.values_list('contato_a_id', 'contato_b_id'))
+        ParDuplicado.objects.bulk_create(
+            [ParDuplicado(contato_a_id=a, contato_b_id=b, pontuacao=pontuacao, motivos=motivos)
+             for (a, b), (pontuacao, motivos) in pares.items() if (a, b) not in descartados],
+            batch_size=1000)
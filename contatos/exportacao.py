@@ -0,0 +1,165 @@
+import base64
+import csv
+import os
+import zlib
+
+from django.core.files.storage import default_storage
+
+from . import avatares
+from .models import Contato, Telefone, Email
+
+FORMATOS = ('vcard', 'csv')
+
+TAMANHO_LOTE = 1000
+
+# Colunas do CSV exportado; são as mesmas reconhecidas pela importação
+# (contatos/importacao.py), de forma que o arquivo possa ser reimportado.
+COLUNAS_CSV = ('nome', 'telefones', 'emails', 'grupos')
+
+_TIPOS_IMAGEM = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG', '.gif': 'GIF', '.webp': 'WEBP'}
+
+
+def iterar_registros(contatos, tamanho_lote=TAMANHO_LOTE):
+    # Percorre os contatos de 'contatos' (um queryset) em lotes pela chave
+    # primária, carregando os telefones, emails e grupos de cada lote com uma
+    # consulta por tabela. A memória usada depende apenas do tamanho do lote,
+    # e não do total de contatos exportados. Os registros têm o mesmo formato
+    # dos lidos pela importação.
+    ultimo_id = 0
+    while True:
+        lote = list(contatos.filter(id__gt=ultimo_id).order_by('id')
+                    .values_list('id', 'nome', 'avatar')[:tamanho_lote])
+        if not lote:
+            return
+        ids = [contato_id for contato_id, _, _ in lote]
+        telefones, emails, grupos = {}, {}, {}
+        for contato_id, numero in Telefone.objects.filter(contato_id__in=ids).order_by('id').values_list('contato_id', 'numero'):
+            telefones.setdefault(contato_id, []).append(numero)
+        for contato_id, endereco in Email.objects.filter(contato_id__in=ids).order_by('id').values_list('contato_id', 'endereco'):
+            emails.setdefault(contato_id, []).append(endereco)
+        for contato_id, nome in (Contato.grupos.through.objects.filter(contato_id__in=ids)
+                                 .values_list('contato_id', 'grupo__nome')):
+            grupos.setdefault(contato_id, []).append(nome)
+        for contato_id, nome, avatar in lote:
+            yield {
+                'nome': nome,
+                'telefones': telefones.get(contato_id, []),
+                'emails': emails.get(contato_id, []),
+                'grupos': grupos.get(contato_id, []),
+                'avatar': avatar,
+            }
+        ultimo_id = lote[-1][0]
+
+
+def _imagem_avatar(nome):
+    # Retorna o tipo e o conteúdo da imagem usada para representar o avatar
+    # no arquivo exportado. Preferimos a miniatura JPEG de 200px, quando
+    # existir, para não incluir a foto original em tamanho integral.
+    miniatura = avatares.nome_miniatura(nome, 200, 'jpg')
+    if default_storage.exists(miniatura):
+        nome = miniatura
+    elif not default_storage.exists(nome):
+        return None, None
+    with default_storage.open(nome, 'rb') as arquivo:
+        conteudo = arquivo.read()
+    return _TIPOS_IMAGEM.get(os.path.splitext(nome)[1].lower(), 'JPEG'), conteudo
+
+
+def _escapar_vcard(valor):
+    return (valor.replace('\\', '\\\\').replace('\n', '\\n')
+            .replace(',', '\\,').replace(';', '\\;'))
+
+
+def _dobrar(linha):
+    # Linhas de vCard com mais de 75 caracteres são quebradas em linhas de
+    # continuação iniciadas por um espaço (RFC 6350, seção 3.2).
+    if len(linha) <= 75:
+        return linha + '\r\n'
+    partes = [linha[:75]] + [' ' + linha[i:i + 74] for i in range(75, len(linha), 74)]
+    return '\r\n'.join(partes) + '\r\n'
+
+
+def vcard(registro, incluir_avatar=False):
+    nome = _escapar_vcard(registro['nome'])
+    linhas = ['BEGIN:VCARD', 'VERSION:3.0', f'FN:{nome}', f'N:;{nome};;;']
+    linhas += [f'TEL:{_escapar_vcard(numero)}' for numero in registro['telefones']]
+    linhas += [f'EMAIL;TYPE=INTERNET:{_escapar_vcard(endereco)}' for endereco in registro['emails']]
+    if registro['grupos']:
+        linhas.append('CATEGORIES:' + ','.join(_escapar_vcard(grupo) for grupo in registro['grupos']))
+    if incluir_avatar and registro['avatar']:
+        tipo, conteudo = _imagem_avatar(registro['avatar'])
+        if conteudo:
+            linhas.append(f'PHOTO;ENCODING=b;TYPE={tipo}:' + base64.b64encode(conteudo).decode('ascii'))
+    linhas.append('END:VCARD')
+    return ''.join(_dobrar(linha) for linha in linhas)
+
+
+class _Eco:
+    # Objeto com a interface de arquivo esperada por csv.writer, que apenas
+    # devolve a linha escrita (técnica sugerida na documentação do Django
+    # para gerar CSV com StreamingHttpResponse).
+    def write(self, valor):
+        return valor
+
+
+def _pedacos_csv(registros, incluir_avatar):
+    escritor = csv.writer(_Eco())
+    colunas = COLUNAS_CSV + (('avatar',) if incluir_avatar else ())
+    yield escritor.writerow(colunas)
+    for registro in registros:
+        linha = [registro['nome'], ';'.join(registro['telefones']),
+                 ';'.join(registro['emails']), ';'.join(registro['grupos'])]
+        if incluir_avatar:
+            tipo, conteudo = _imagem_avatar(registro['avatar']) if registro['avatar'] else (None, None)
+            linha.append(f'data:image/{tipo.lower()};base64,' + base64.b64encode(conteudo).decode('ascii')
+                         if conteudo else '')
+        yield escritor.writerow(linha)
+
+
+def _pedacos_vcard(registros, incluir_avatar):
+    for registro in registros:
+        yield vcard(registro, incluir_avatar)
+
+
+def _agrupar(pedacos, tamanho=64 * 1024):
+    # Junta pedaços pequenos em blocos de aproximadamente 'tamanho' bytes,
+    # para não enviar (ou gravar) um bloco por contato.
+    buffer, total = [], 0
+    for pedaco in pedacos:
+        dados = pedaco.encode('utf-8')
+        buffer.append(dados)
+        total += len(dados)
+        if total >= tamanho:
+            yield b''.join(buffer)
+            buffer, total = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _comprimir(blocos):
+    # Compressão gzip incremental: cada bloco é comprimido assim que é
+    # gerado, sem manter o arquivo inteiro na memória.
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for bloco in blocos:
+        dados = compressor.compress(bloco)
+        if dados:
+            yield dados
+    yield compressor.flush()
+
+
+def exportar(contatos, formato='vcard', comprimir=False, incluir_avatar=False):
+    # Gera, em blocos de bytes, o conteúdo do arquivo exportado com os
+    # contatos de 'contatos'. Pode ser usado diretamente como conteúdo de um
+    # StreamingHttpResponse ou gravado em um arquivo.
+    registros = iterar_registros(contatos)
+    if formato == 'csv':
+        pedacos = _pedacos_csv(registros, incluir_avatar)
+    else:
+        pedacos = _pedacos_vcard(registros, incluir_avatar)
+    blocos = _agrupar(pedacos)
+    return _comprimir(blocos) if comprimir else blocos
+
+
+def nome_arquivo(base, formato, comprimir=False):
+    extensao = 'csv' if formato == 'csv' else 'vcf'
+    return f"{base}.{extensao}" + ('.gz' if comprimir else '')
@@ -1,5 +1,14 @@
+import re
+
 from django import forms
-from .models import Contato, Grupo, Telefone, Email
+from django.db.models import Prefetch
+from .avatares import miniaturas_existem
+from .models import Contato, Grupo, Telefone, Email, Importacao
+from . import tarefas
+
+# Nome dos campos de telefone e email de EditarContatoForm: 'tel_' ou
+# 'email_' seguido do id do objeto.
+CAMPO_OBJETO = re.compile(r'^(tel|email)_(\d+)$')
 
 class EditarContatoForm(forms.Form):
     # O método __init__() pode receber um número arbitrário de positional
@@ -10,8 +19,16 @@ class EditarContatoForm(forms.Form):
         # que estará sendo editado. O par key-value que contém a chave 'id'
         # e o valor correspondente ao id do contato são removidos do dicionário
         # kwargs através do método pop.
-        # Armazenamos o objeto representando o contato em uma variável 'contato'
-        contato = Contato.objects.get(id=kwargs.pop('id'))
+        # Armazenamos o objeto representando o contato em uma variável 'contato'.
+        # Os telefones, emails e grupos do contato são carregados junto com
+        # ele através de prefetch_related(), com uma consulta para cada tabela,
+        # para que a construção do formulário faça sempre o mesmo número de
+        # consultas, independente de quantos telefones e emails o contato tem.
+        contato = Contato.objects.prefetch_related(
+            Prefetch('telefone_set', queryset=Telefone.objects.order_by('id')),
+            Prefetch('email_set', queryset=Email.objects.order_by('id')),
+            Prefetch('grupos', queryset=Grupo.objects.only('id', 'nome').order_by('nome')),
+        ).get(id=kwargs.pop('id'))
 
         # Criamos um novo atributo na classe que armazena o objeto representando
         # o contato que será utilizado para criar o formulário
@@ -28,45 +45,66 @@ class EditarContatoForm(forms.Form):
         # inicializado com o nome atual do contato.
         self.fields['nome_contato'] = forms.CharField(max_length=50, initial=contato.nome)
 
-        # Recuperamos todos os grupos já armazenados no banco de dados da
-        # aplicação
-        grupos = Grupo.objects.all()
-
-        # Recuperamos todos os grupos associados com o contato atual. Isso será
-        # necessário para calcular os valores iniciais dos campos que
-        # representam os grupos que devem estar associados com o contato.
-        # Se aplicação possui 3 grupos, por exemplo, vamos mostrar três caixas
-        # de seleção. E se o contato está associado com o grupo 2, por exemplo,
-        # mostraremos apenas a caixa de seleção correspondente ao grupo 2
-        # inicialmente selecionada.
-        grupos_contato = contato.grupos.all()
-
-        # Criamos um campo (que será uma caixa de seleção) para grupo cadastrado
-        # no banco de dados da aplicação. O valor inicial de uma caixa de
-        # seleção dependerá do grupo sendo iterado pertencer ou não aos grupos
-        # já associados com o contato, armazenados em 'grupos_contato'
-        for grupo in grupos:
-            self.fields[f"g_{grupo.nome}"] = forms.BooleanField(required=False,
-                                                                initial=grupo in grupos_contato,
-                                                                label=f"{grupo.nome}")
+        # Os grupos do contato são escolhidos pelo id, em um único campo
+        # 'grupos'. A página de edição exibe apenas os grupos atuais do
+        # contato (já carregados pelo prefetch_related), e os demais são
+        # encontrados pelo seletor de grupos do template, que consulta a view
+        # 'buscar_grupos' à medida que o usuário digita. Assim, construir o
+        # formulário não depende de quantos grupos existem na agenda.
+        # Na validação, ModelMultipleChoiceField confere os ids enviados com
+        # uma única consulta, que só encontra grupos da agenda do dono atual.
+        # O widget MultipleHiddenInput não percorre o queryset para montar
+        # opções, ao contrário de um <select>.
+        self.grupos_do_contato = list(contato.grupos.all())
+        self.fields['grupos'] = forms.ModelMultipleChoiceField(
+            queryset=Grupo.objects.only('id', 'nome'), required=False, widget=forms.MultipleHiddenInput,
+            initial=[grupo.id for grupo in self.grupos_do_contato])
 
         # Aqui nós criamos um campo do tipo CharField (para entrada de texto)
         # para cada telefone que estiver associado com o contato. O nome do
-        # campo será 'tel_x', onde x corresponde à posição do telefone na
-        # sequência de telefones retornada por 'contato.telefone_set.all()'
+        # campo será 'tel_x', onde x é o id do telefone, para que o valor
+        # enviado seja gravado no mesmo telefone exibido, mesmo que outros
+        # telefones tenham sido incluídos ou excluídos nesse meio tempo.
         for i, tel in enumerate(contato.telefone_set.all()):
-            self.fields[f"tel_{i}"] = forms.CharField(max_length=14,
-                                                      label=f"Telefone {i+1}",
-                                                      initial=contato.telefone_set.all()[i].numero)
+            self.fields[f"tel_{tel.id}"] = forms.CharField(max_length=14,
+                                                           label=f"Telefone {i+1}",
+                                                           initial=tel.numero)
+            # O id do telefone é usado pelo template no link de exclusão.
+            self.fields[f"tel_{tel.id}"].objeto_id = tel.id
 
         # Aqui nós criamos um campo do tipo EmailField (para entrada de e-mails)
         # para cada email que estiver associado com o contato. O nome do
-        # campo será 'email_x', onde x corresponde à posição do email na
-        # sequência de email retornada por 'contato.email_set.all()'
+        # campo será 'email_x', onde x é o id do email.
         for i, email in enumerate(contato.email_set.all()):
-            self.fields[f"email_{i}"] = forms.EmailField(max_length=255,
-                                                         label=f"Email {i+1}",
-                                                         initial=contato.email_set.all()[i].endereco)
+            self.fields[f"email_{email.id}"] = forms.EmailField(max_length=255,
+                                                                label=f"Email {i+1}",
+                                                                initial=email.endereco)
+            self.fields[f"email_{email.id}"].objeto_id = email.id
+
+        # Telefones e emails incluídos depois que a página foi aberta não
+        # estão entre os dados enviados, e não são alterados.
+        if self.is_bound:
+            for nome in [nome for nome in self.fields if CAMPO_OBJETO.match(nome) and nome not in self.data]:
+                del self.fields[nome]
+
+    # Telefones e emails enviados que não pertencem mais ao contato (foram
+    # excluídos depois que a página foi aberta) invalidam o formulário, em vez
+    # de serem ignorados ou gravados em outro telefone ou email.
+    def clean(self):
+        cleaned_data = super().clean()
+        if any(CAMPO_OBJETO.match(nome) and nome not in self.fields for nome in self.data):
+            raise forms.ValidationError("Um telefone ou email do contato foi excluído enquanto ele era editado. "
+                                        "Confira os dados e salve novamente.")
+        return cleaned_data
+
+    # Grupos exibidos como marcados no seletor de grupos: os enviados, quando
+    # o formulário é exibido de novo por causa de um erro, ou os grupos
+    # atuais do contato.
+    @property
+    def grupos_exibidos(self):
+        if 'grupos' in getattr(self, 'cleaned_data', {}):
+            return self.cleaned_data['grupos']
+        return self.grupos_do_contato
 
     # Aqui nós criamos uma função que será executada automaticamente quando
     # um formulário for preenchido e enviado pelo usuário. O objetivo desta
@@ -76,18 +114,12 @@ class EditarContatoForm(forms.Form):
         # Armazenamos o valor de nome fornecido pelo usuário em 'nome_contato'
         nome_contato = self.cleaned_data.get('nome_contato')
 
-        # Armazenamos os nomes de todos os contatos em uma lista 'nomes_contatos'
-        nomes_contatos = []
-        for contato in Contato.objects.all():
-            nomes_contatos.append(contato.nome)
-
-        # Removemos o nome do contato atual da lista de nomes de contatos
-        nomes_contatos.remove(self.contato.nome)
-
-        # Se o nome fornecido já estiver na lista 'nomes_contatos' mostraremos
-        # uma mensagem de erro informando que o nome já está sendo utilizado.
-        # Se não, retornamos o próprio nome fornecido pelo usuário.
-        if nome_contato in nomes_contatos:
+        # Verificamos, com uma única consulta sobre o índice único (dono,
+        # nome), se existe outro contato da agenda (que não o contato atual) com o nome
+        # fornecido. Se existir, mostraremos uma mensagem de erro informando
+        # que o nome já está sendo utilizado. Se não, retornamos o próprio nome
+        # fornecido pelo usuário.
+        if Contato.objects.filter(nome=nome_contato).exclude(id=self.contato.id).exists():
             raise forms.ValidationError("O nome escolhido já está sendo utilizado.")
         return nome_contato
 
@@ -96,6 +128,14 @@ class NovoGrupoForm(forms.ModelForm):
         model = Grupo
         fields = ('nome', 'descricao')
 
+    # O nome é único apenas na agenda do dono (uma UniqueConstraint que o
+    # ModelForm não verifica), então a verificação é feita aqui.
+    def clean_nome(self):
+        nome = self.cleaned_data.get('nome')
+        if Grupo.objects.filter(nome=nome).exists():
+            raise forms.ValidationError("O nome escolhido já está sendo utilizado.")
+        return nome
+
 class NovoTelForm(forms.ModelForm):
     class Meta:
         model = Telefone
@@ -134,23 +174,14 @@ class EditarGrupoForm(forms.Form):
         # Primeiro, nós armazenamos o valor preenchido pelo usuário na variável
         # 'nome'.
         nome = self.cleaned_data.get('nome')
-        # Criamos uma lista, que inicia vazia, e logo vai armazenar os nomes
-        # de todos os grupos da aplicação, exceto o nome do grupo que está
-        # associado com o formulário através do atributo self.grupo, ou seja,
-        # removemos o nome do grupo que está sendo editado no momento para que
+        # Verificamos se existe algum outro grupo com esse nome. O grupo que
+        # está sendo editado (self.grupo) é excluído da verificação para que
         # seja possível que um grupo possa manter o seu nome após a edição.
-        nomes_grupos = []
-        # Utilizamos um loop para preencher a lista 'nomes_grupos' com os nomes
-        # de todos os grupos da aplicação.
-        for grupo in Grupo.objects.all():
-            nomes_grupos.append(grupo.nome)
-        # Removemos o nome do grupo que está sendo editado da lista 'nomes_grupos'
-        nomes_grupos.remove(self.grupo.nome)
-
-        # Se o nome enviado pelo usuário ao campo 'nome' estiver na lista 'nomes_grupos'
-        # nós mostramos uma mensagem de erro informando que o nome já está sendo
-        # utilizado
-        if nome in nomes_grupos:
+        # A consulta usa o índice único (dono, nome), então não precisamos
+        # carregar os nomes de todos os grupos da agenda.
+        # Se o nome já estiver em uso, nós mostramos uma mensagem de erro
+        # informando que o nome já está sendo utilizado
+        if Grupo.objects.filter(nome=nome).exclude(id=self.grupo.id).exists():
             raise forms.ValidationError("O nome escolhido já está sendo utilizado.")
         # Caso contrário nós apenas retornamos o nome enviado pelo usuário, pois
         # este é válido.
@@ -161,3 +192,33 @@ class NovoContatoForm(forms.ModelForm):
     class Meta:
         model = Contato
         fields = ('nome', 'avatar')
+
+    # Como em NovoGrupoForm, o nome é único apenas na agenda do dono.
+    def clean_nome(self):
+        nome = self.cleaned_data.get('nome')
+        if Contato.objects.filter(nome=nome).exists():
+            raise forms.ValidationError("O nome escolhido já está sendo utilizado.")
+        return nome
+
+    def save(self, commit=True):
+        contato = super().save(commit=commit)
+        # Depois que o avatar enviado é gravado, as suas miniaturas são
+        # geradas pela fila de tarefas, para que a lista de contatos não
+        # precise enviar o arquivo original; até lá, ela exibe o original.
+        # Como os avatares são armazenados pelo conteúdo, uma imagem já enviada
+        # antes reaproveita as miniaturas existentes.
+        if commit and contato.avatar:
+            nome = contato.avatar.name
+            if miniaturas_existem(nome):
+                contato.avatar_miniaturas = True
+                contato.save(update_fields=['avatar_miniaturas'])
+            else:
+                tarefas.enfileirar('miniaturas', nome, prioridade=tarefas.PRIORIDADE_ALTA, chave=f'miniaturas:{nome}')
+        return contato
+
+class ImportarContatosForm(forms.Form):
+    arquivo = forms.FileField(label='Arquivo (.vcf ou .csv)')
+    formato = forms.ChoiceField(choices=[('', 'Detectar pela extensão'), ('vcard', 'vCard'), ('csv', 'CSV')],
+                                required=False)
+    conflito = forms.ChoiceField(choices=Importacao._meta.get_field('conflito').choices,
+                                 label='Contatos já existentes')
@@ -0,0 +1,48 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import donos, instrumentacao
+
+# Cache de trechos de template que se repetem em várias páginas e quase
+# nunca mudam entre uma requisição e outra, como os cartões da lista de
+# contatos e da lista de grupos (ver a tag {% fragmento %} em
+# templatetags/fragmentos_tags.py).
+#
+# A chave de cada fragmento é formada pelo id do objeto e pela sua versão,
+# que muda sempre que o que o fragmento exibe muda. Por isso um fragmento
+# nunca precisa ser apagado: quando o objeto é alterado, a página passa a
+# procurar uma chave nova e só aquele cartão é renderizado de novo, enquanto
+# a versão anterior deixa de ser lida e é descartada pelo próprio cache.
+# Como os ids só são únicos dentro de cada partição (ver contatos/donos.py),
+# a chave também inclui a partição do dono atual.
+#
+# O cache usado é o de alias FRAGMENTOS_CACHE em CACHES (ver
+# agenda1/settings.py); com None, os fragmentos são sempre renderizados. Os
+# acertos e as faltas de cada requisição são registrados pela instrumentação
+# (cabeçalho Server-Timing e 'manage.py relatorio_desempenho').
+
+CACHE = getattr(settings, 'FRAGMENTOS_CACHE', 'fragmentos')
+
+
+def chave(nome, partes):
+    # As partes (como datas) podem conter caracteres que alguns backends não
+    # aceitam em chaves, por isso entram na chave através de um hash.
+    resumo = hashlib.md5(':'.join(str(parte) for parte in [donos.particao(), *partes]).encode()).hexdigest()
+    return f'fragmento.{nome}.{resumo}'
+
+
+def obter(nome, partes, renderizar):
+    # Retorna o fragmento 'nome' identificado por 'partes' do cache ou, se
+    # ele não estiver lá, o resultado de renderizar(), que é gravado.
+    if CACHE is None:
+        return renderizar()
+    cache = caches[CACHE]
+    chave_fragmento = chave(nome, partes)
+    html = cache.get(chave_fragmento)
+    instrumentacao.registrar_fragmento(acerto=html is not None)
+    if html is None:
+        html = renderizar()
+        cache.set(chave_fragmento, html)
+    return html
@@ -0,0 +1,337 @@
+import csv
+import io
+import os
+import re
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import connections, router, transaction
+
+from .busca import normalizar
+from .donos import particao
+from .models import Contato, Grupo, Telefone, Email, Importacao
+from .sincronizacao import contatos_alterados, grupos_alterados, sincronizacao_adiada
+from .telefones import normalizar_telefone
+
+# Formas de tratar um contato importado cujo nome já existe na agenda:
+#   'ignorar'    mantém o contato existente e descarta o importado;
+#   'mesclar'    acrescenta ao contato existente os telefones, emails e
+#                grupos importados que ele ainda não possui;
+#   'substituir' troca os telefones, emails e grupos do contato existente
+#                pelos importados.
+CONFLITOS = ('ignorar', 'mesclar', 'substituir')
+
+FORMATOS = ('vcard', 'csv')
+
+TAMANHO_LOTE = 1000
+
+# Campos de Importacao atualizados a cada lote gravado.
+CONTADORES = ['processados', 'criados', 'atualizados', 'ignorados']
+
+# Diretório dos arquivos enviados pela view 'importar_contatos', fora de
+# MEDIA_ROOT para que não possam ser baixados. Cada arquivo recebe um nome
+# aleatório e é apagado quando a importação é concluída ou quando a fila de
+# tarefas desiste dela (ver importar() e tarefas.importar_arquivo()).
+DIRETORIO = Path(getattr(settings, 'AGENDA_IMPORTACOES_DIR', settings.BASE_DIR / 'importacoes'))
+
+_MAX_NOME = Contato._meta.get_field('nome').max_length
+_MAX_GRUPO = Grupo._meta.get_field('nome').max_length
+_MAX_NUMERO = Telefone._meta.get_field('numero').max_length
+_MAX_ENDERECO = Email._meta.get_field('endereco').max_length
+
+
+def detectar_formato(nome_arquivo):
+    if nome_arquivo.lower().endswith(('.vcf', '.vcard')):
+        return 'vcard'
+    return 'csv'
+
+
+def abrir_texto(arquivo_binario):
+    # Lê o arquivo como texto UTF-8 (ignorando um BOM inicial, comum em
+    # arquivos CSV exportados por planilhas) sem carregá-lo todo na memória.
+    return io.TextIOWrapper(arquivo_binario, encoding='utf-8-sig', errors='replace', newline='')
+
+
+def guardar_arquivo(arquivo):
+    # Grava o arquivo enviado (um UploadedFile) em DIRETORIO, em partes, sem
+    # carregá-lo todo na memória, e retorna o caminho gravado.
+    os.makedirs(DIRETORIO, exist_ok=True)
+    caminho = DIRETORIO / uuid.uuid4().hex
+    with open(caminho, 'xb') as destino:
+        for parte in arquivo.chunks():
+            destino.write(parte)
+    return str(caminho)
+
+
+def descartar_arquivo(importacao):
+    # Apaga o arquivo de 'importacao' se ele foi enviado pela view (os
+    # arquivos importados por 'manage.py importar_contatos' são mantidos).
+    caminho = Path(importacao.caminho)
+    if caminho.parent == DIRETORIO:
+        caminho.unlink(missing_ok=True)
+
+
+def _linhas_vcard(texto):
+    # Junta as linhas "dobradas" do vCard: uma linha iniciada por espaço ou
+    # tabulação é a continuação da linha anterior (RFC 6350, seção 3.2).
+    anterior = None
+    for linha in texto:
+        linha = linha.rstrip('\r\n')
+        if linha[:1] in (' ', '\t') and anterior is not None:
+            anterior += linha[1:]
+            continue
+        if anterior is not None:
+            yield anterior
+        anterior = linha
+    if anterior is not None:
+        yield anterior
+
+
+def _valor_vcard(valor):
+    if '\\' not in valor:
+        return valor.strip()
+    return (valor.replace('\\n', ' ').replace('\\N', ' ')
+            .replace('\\,', ',').replace('\\;', ';').replace('\\\\', '\\').strip())
+
+
+def ler_vcard(texto):
+    # Lê registros de um arquivo vCard 3.0 ou 4.0, um contato por vez. Cada
+    # registro é um dicionário com 'nome', 'telefones', 'emails' e 'grupos'.
+    registro = None
+    for linha in _linhas_vcard(texto):
+        if ':' not in linha:
+            continue
+        chave, valor = linha.split(':', 1)
+        # Remove parâmetros ('TEL;TYPE=cell') e agrupamentos ('item1.EMAIL')
+        propriedade = chave.split(';', 1)[0].split('.')[-1].upper()
+        if propriedade == 'BEGIN' and valor.strip().upper() == 'VCARD':
+            registro = {'nome': '', 'telefones': [], 'emails': [], 'grupos': []}
+        elif registro is None:
+            continue
+        elif propriedade == 'END':
+            if not registro['nome'] and registro.get('n'):
+                registro['nome'] = registro['n']
+            registro.pop('n', None)
+            yield registro
+            registro = None
+        elif propriedade == 'FN':
+            registro['nome'] = _valor_vcard(valor)
+        elif propriedade == 'N':
+            # N:Sobrenome;Nome;Nomes adicionais;Prefixo;Sufixo
+            partes = [_valor_vcard(p) for p in re.split(r'(?<!\\);', valor)]
+            partes += [''] * (5 - len(partes))
+            registro['n'] = ' '.join(p for p in (partes[3], partes[1], partes[2], partes[0], partes[4]) if p)
+        elif propriedade == 'TEL':
+            registro['telefones'].append(_valor_vcard(valor.replace('tel:', '')))
+        elif propriedade == 'EMAIL':
+            registro['emails'].append(_valor_vcard(valor))
+        elif propriedade == 'CATEGORIES':
+            registro['grupos'].extend(_valor_vcard(g) for g in re.split(r'(?<!\\),', valor))
+
+
+def _dividir(valor):
+    return [parte.strip() for parte in re.split(r'[;|]', valor or '') if parte.strip()]
+
+
+def ler_csv(texto):
+    # Lê registros de um arquivo CSV com cabeçalho. As colunas reconhecidas
+    # são 'nome', 'telefones', 'emails' e 'grupos' (também no singular). Uma
+    # célula pode conter vários valores separados por ';' ou '|'.
+    leitor = csv.DictReader(texto)
+    for linha in leitor:
+        linha = {(chave or '').strip().lower(): valor for chave, valor in linha.items()}
+        yield {
+            'nome': (linha.get('nome') or '').strip(),
+            'telefones': _dividir(linha.get('telefones') or linha.get('telefone')),
+            'emails': _dividir(linha.get('emails') or linha.get('email')),
+            'grupos': _dividir(linha.get('grupos') or linha.get('grupo')),
+        }
+
+
+def ler_registros(texto, formato):
+    return ler_vcard(texto) if formato == 'vcard' else ler_csv(texto)
+
+
+def _limpar(registro):
+    # Descarta valores inválidos ou que não cabem nas colunas do banco.
+    nome = registro['nome'][:_MAX_NOME].strip()
+    telefones = []
+    for numero in registro['telefones']:
+        numero = numero.strip()
+        if len(numero) > _MAX_NUMERO:
+            numero = normalizar_telefone(numero)
+        if numero and len(numero) <= _MAX_NUMERO:
+            telefones.append(numero)
+    emails = []
+    for endereco in registro['emails']:
+        endereco = endereco.strip()
+        try:
+            validate_email(endereco)
+        except ValidationError:
+            continue
+        if len(endereco) <= _MAX_ENDERECO:
+            emails.append(endereco)
+    grupos = [grupo[:_MAX_GRUPO].strip() for grupo in registro['grupos'] if grupo.strip()]
+    return {'nome': nome, 'telefones': telefones, 'emails': emails, 'grupos': grupos}
+
+
+def _unir(destino, origem):
+    for campo in ('telefones', 'emails', 'grupos'):
+        destino[campo].extend(valor for valor in origem[campo] if valor not in destino[campo])
+
+
+def inserir_em_lote(modelo, campos, linhas, ignorar_conflitos=False):
+    # Equivalente a modelo.objects.bulk_create() para tabelas com muitas
+    # linhas por lote (telefones, emails e associações com grupos), mas sem
+    # instanciar um objeto de modelo para cada linha, o que domina o tempo de
+    # importação. 'linhas' contém tuplas com os valores de 'campos'.
+    if not linhas:
+        return
+    opcoes = modelo._meta
+    connection = connections[router.db_for_write(modelo)]
+    colunas = ', '.join(connection.ops.quote_name(opcoes.get_field(campo).column) for campo in campos)
+    marcadores = ', '.join(['%s'] * len(campos))
+    sql = (f"{connection.ops.insert_statement(ignore_conflicts=ignorar_conflitos)} "
+           f"{connection.ops.quote_name(opcoes.db_table)} ({colunas}) VALUES ({marcadores}) "
+           f"{connection.ops.ignore_conflicts_suffix_sql(ignore_conflicts=ignorar_conflitos)}")
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, linhas)
+
+
+def importar_lote(registros, conflito='ignorar'):
+    # Grava um lote de registros com um número fixo de consultas, usando
+    # inserções em lote. Retorna um dicionário com as quantidades de contatos
+    # criados, atualizados e ignorados.
+    resultado = {'criados': 0, 'atualizados': 0, 'ignorados': 0}
+
+    # Registros repetidos dentro do mesmo lote são unidos em um só.
+    por_nome = {}
+    for registro in map(_limpar, registros):
+        if not registro['nome']:
+            resultado['ignorados'] += 1
+        elif registro['nome'] in por_nome:
+            _unir(por_nome[registro['nome']], registro)
+        else:
+            por_nome[registro['nome']] = registro
+    if not por_nome:
+        return resultado
+
+    existentes = dict(Contato.objects.filter(nome__in=por_nome).values_list('nome', 'id'))
+    if conflito == 'ignorar':
+        resultado['ignorados'] += len(existentes)
+        for nome in existentes:
+            del por_nome[nome]
+        existentes = {}
+    elif conflito == 'substituir' and existentes:
+        ids = list(existentes.values())
+        Telefone.objects.filter(contato_id__in=ids).delete()
+        Email.objects.filter(contato_id__in=ids).delete()
+        Contato.grupos.through.objects.filter(contato_id__in=ids).delete()
+
+    novos = [nome for nome in por_nome if nome not in existentes]
+    Contato.objects.bulk_create([Contato(nome=nome) for nome in novos])
+    ids = dict(existentes)
+    if novos:
+        ids.update(Contato.objects.filter(nome__in=novos).values_list('nome', 'id'))
+    resultado['criados'] += len(novos)
+    resultado['atualizados'] += len(existentes)
+
+    # Ao mesclar, não repetimos telefones e emails que o contato já possui.
+    tels_existentes = set()
+    emails_existentes = set()
+    if conflito == 'mesclar' and existentes:
+        tels_existentes = set(Telefone.objects.filter(contato_id__in=existentes.values())
+                              .values_list('contato_id', 'numero_normalizado'))
+        emails_existentes = {(contato_id, endereco.lower()) for contato_id, endereco in
+                             Email.objects.filter(contato_id__in=existentes.values())
+                             .values_list('contato_id', 'endereco')}
+
+    nomes_grupos = {grupo for registro in por_nome.values() for grupo in registro['grupos']}
+    grupos = {}
+    if nomes_grupos:
+        anteriores = set(Grupo.objects.filter(nome__in=nomes_grupos).values_list('nome', flat=True))
+        Grupo.objects.bulk_create([Grupo(nome=nome, nome_busca=normalizar(nome)) for nome in nomes_grupos],
+                                  ignore_conflicts=True)
+        grupos = dict(Grupo.objects.filter(nome__in=nomes_grupos).values_list('nome', 'id'))
+        grupos_alterados([grupos[nome] for nome in nomes_grupos - anteriores])
+
+    telefones, emails, associacoes = [], [], []
+    for nome, registro in por_nome.items():
+        contato_id = ids[nome]
+        for numero in registro['telefones']:
+            normalizado = normalizar_telefone(numero)
+            if (contato_id, normalizado) not in tels_existentes:
+                tels_existentes.add((contato_id, normalizado))
+                telefones.append((contato_id, numero, normalizado))
+        for endereco in registro['emails']:
+            if (contato_id, endereco.lower()) not in emails_existentes:
+                emails_existentes.add((contato_id, endereco.lower()))
+                emails.append((contato_id, endereco))
+        for grupo in registro['grupos']:
+            associacoes.append((contato_id, grupos[grupo]))
+    inserir_em_lote(Telefone, ('contato', 'numero', 'numero_normalizado'), telefones)
+    inserir_em_lote(Email, ('contato', 'endereco'), emails)
+    inserir_em_lote(Contato.grupos.through, ('contato', 'grupo'), associacoes, ignorar_conflitos=True)
+
+    # bulk_create() e inserir_em_lote() não disparam signals
+    contatos_alterados(ids.values())
+    return resultado
+
+
+def importar(importacao, arquivo_texto, tamanho_lote=TAMANHO_LOTE, progresso=None):
+    # Importa os registros de 'arquivo_texto' em lotes, cada um gravado em
+    # sua própria transação. Depois de cada lote, o número de registros
+    # processados é salvo em 'importacao' (uma instância de Importacao), de
+    # forma que uma importação interrompida possa ser retomada do ponto em
+    # que parou, pulando os registros já gravados. Ao ser concluída, o
+    # arquivo enviado pela view é apagado; com uma falha, ele é mantido para
+    # que a importação possa ser retomada (ver descartar_arquivo()).
+    registros = ler_registros(arquivo_texto, importacao.formato)
+    for _ in range(importacao.processados):
+        if next(registros, None) is None:
+            break
+
+    importacao.status = Importacao.EM_ANDAMENTO
+    importacao.erro = ''
+    importacao.save()
+    try:
+        lote = []
+        while True:
+            registro = next(registros, None)
+            if registro is not None:
+                lote.append(registro)
+            if lote and (registro is None or len(lote) >= tamanho_lote):
+                with transaction.atomic(using=particao()), sincronizacao_adiada():
+                    resultado = importar_lote(lote, importacao.conflito)
+                    importacao.processados += len(lote)
+                    importacao.criados += resultado['criados']
+                    importacao.atualizados += resultado['atualizados']
+                    importacao.ignorados += resultado['ignorados']
+                    importacao.save()
+                lote = []
+                if progresso:
+                    progresso(importacao)
+            if registro is None:
+                break
+    except Exception as erro:
+        # Os contadores do lote que falhou foram desfeitos junto com ele, mas
+        # não na instância; eles são lidos de novo para que uma nova
+        # tentativa não pule esse lote.
+        importacao.refresh_from_db(fields=CONTADORES)
+        importacao.status = Importacao.FALHOU
+        importacao.erro = str(erro)
+        importacao.save()
+        raise
+    importacao.status = Importacao.CONCLUIDA
+    importacao.save()
+    descartar_arquivo(importacao)
+    return importacao
+
+
+def retomavel(importacao):
+    # Uma importação que não foi concluída pode ser retomada enquanto o seu
+    # arquivo existir.
+    return importacao.status != Importacao.CONCLUIDA and os.path.exists(importacao.caminho)
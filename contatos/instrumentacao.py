@@ -0,0 +1,250 @@
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends import django as backend_django
+
+logger = logging.getLogger(__name__)
+
+# Arquivo onde as medições amostradas são gravadas, uma por linha (JSON).
+# É lido pelo comando 'manage.py relatorio_desempenho'.
+ARQUIVO = Path(getattr(settings, 'INSTRUMENTACAO_ARQUIVO', settings.BASE_DIR / 'logs' / 'desempenho.log'))
+
+# Quando ARQUIVO passa de TAMANHO_MAXIMO bytes, ele é renomeado para
+# 'ARQUIVO.1' (o '.1' anterior passa a '.2', e assim por diante) e um novo
+# arquivo é iniciado. São mantidos ARQUIVOS_ANTIGOS arquivos renomeados; os
+# mais velhos são apagados. Com TAMANHO_MAXIMO igual a None, o arquivo
+# cresce sem limite.
+TAMANHO_MAXIMO = getattr(settings, 'INSTRUMENTACAO_TAMANHO_MAXIMO', 10 * 1024 * 1024)
+ARQUIVOS_ANTIGOS = getattr(settings, 'INSTRUMENTACAO_ARQUIVOS_ANTIGOS', 3)
+
+# Fração das requisições gravadas em ARQUIVO (entre 0 e 1). O cabeçalho
+# Server-Timing é enviado em todas as requisições.
+AMOSTRAGEM = getattr(settings, 'INSTRUMENTACAO_AMOSTRAGEM', 1.0)
+
+# Número de vezes que uma mesma consulta (com parâmetros diferentes) pode
+# ser executada em uma requisição antes de ser apontada como um provável
+# padrão N+1.
+LIMITE_REPETICOES = getattr(settings, 'INSTRUMENTACAO_LIMITE_REPETICOES', 5)
+
+# Medição da requisição em andamento. Uma ContextVar (e não uma variável
+# local da thread) porque, nas views assíncronas, as consultas de uma mesma
+# requisição são feitas em várias threads (ver contatos/views.py), e
+# sync_to_async() repassa o contexto para elas.
+_medicao = ContextVar('medicao', default=None)
+
+# Instruções de controle de transação (como o BEGIN IMMEDIATE de
+# agenda1/sqlite/base.py e os savepoints de atomic() aninhados). O tempo
+# delas é somado ao tempo do banco, mas elas não são contadas como consultas
+# nem apontadas como repetidas.
+_CONTROLE_DE_TRANSACAO = re.compile(r'\s*(BEGIN|COMMIT|END|ROLLBACK|SAVEPOINT|RELEASE)\b', re.IGNORECASE)
+
+_trava_arquivo = threading.Lock()
+
+
+class Medicao:
+    # Dados coletados durante uma requisição.
+    def __init__(self):
+        self.consultas = 0
+        self.tempo_banco = 0.0
+        self.tempo_template = 0.0
+        self.sql = Counter()
+        self.sql_com_parametros = Counter()
+        self.fragmentos = Counter()
+        self._trava = threading.Lock()
+
+    def registrar_consulta(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duracao = time.perf_counter() - inicio
+            controle = _CONTROLE_DE_TRANSACAO.match(sql)
+            with self._trava:
+                self.tempo_banco += duracao
+                if not controle:
+                    self.consultas += 1
+                    self.sql[sql] += 1
+                    if not many:
+                        self.sql_com_parametros[(sql, repr(params))] += 1
+
+    def repetidas(self):
+        # Consultas executadas mais de LIMITE_REPETICOES vezes, como a busca
+        # dos telefones de cada contato dentro do loop de um template.
+        return {sql: total for sql, total in self.sql.items() if total > LIMITE_REPETICOES}
+
+    def duplicadas(self):
+        # Consultas idênticas (mesmo SQL e mesmos parâmetros) repetidas.
+        return sum(total - 1 for total in self.sql_com_parametros.values() if total > 1)
+
+
+def registrar_fragmento(acerto):
+    # Chamada por contatos/fragmentos.py a cada fragmento de template
+    # procurado no cache.
+    medicao = _medicao.get()
+    if medicao is not None:
+        with medicao._trava:
+            medicao.fragmentos['acertos' if acerto else 'faltas'] += 1
+
+
+def _registrar_consulta(execute, sql, params, many, context):
+    medicao = _medicao.get()
+    if medicao is None:
+        return execute(sql, params, many, context)
+    return medicao.registrar_consulta(execute, sql, params, many, context)
+
+
+def _instrumentar_conexao(connection, **kwargs):
+    # O wrapper fica instalado permanentemente em cada conexão, inclusive nas
+    # abertas pelas threads usadas nas views assíncronas, e só registra as
+    # consultas feitas durante uma requisição instrumentada.
+    if _registrar_consulta not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_registrar_consulta)
+
+
+connection_created.connect(_instrumentar_conexao)
+
+
+def _instrumentar_templates():
+    # Envolve o render() dos templates do backend do Django para somar o
+    # tempo de renderização à medição da requisição em andamento. Templates
+    # incluídos com {% include %} ou {% extends %} fazem parte do render() do
+    # template principal e não são contados duas vezes.
+    original = backend_django.Template.render
+    if getattr(original, '_instrumentado', False):
+        return
+
+    def render(self, context=None, request=None):
+        medicao = _medicao.get()
+        if medicao is None:
+            return original(self, context, request)
+        inicio = time.perf_counter()
+        try:
+            return original(self, context, request)
+        finally:
+            medicao.tempo_template += time.perf_counter() - inicio
+
+    render._instrumentado = True
+    backend_django.Template.render = render
+
+
+def arquivos(arquivo=ARQUIVO):
+    # 'arquivo' e as suas cópias renomeadas pela rotação, da mais antiga para
+    # a mais recente.
+    return [Path(f'{arquivo}.{numero}') for numero in range(ARQUIVOS_ANTIGOS, 0, -1)] + [Path(arquivo)]
+
+
+def _rotacionar():
+    antigos = arquivos()
+    if antigos[0] != ARQUIVO:
+        antigos[0].unlink(missing_ok=True)
+    for destino, origem in zip(antigos, antigos[1:]):
+        if origem.exists():
+            os.replace(origem, destino)
+    # Sem ARQUIVOS_ANTIGOS, o único arquivo é apagado.
+    ARQUIVO.unlink(missing_ok=True)
+
+
+def _gravar(registro):
+    linha = json.dumps(registro, ensure_ascii=False) + '\n'
+    with _trava_arquivo:
+        try:
+            if TAMANHO_MAXIMO and ARQUIVO.stat().st_size >= TAMANHO_MAXIMO:
+                _rotacionar()
+        except FileNotFoundError:
+            ARQUIVO.parent.mkdir(parents=True, exist_ok=True)
+        with open(ARQUIVO, 'a', encoding='utf-8') as arquivo:
+            arquivo.write(linha)
+
+
+class InstrumentacaoMiddleware:
+    # Mede, para cada requisição, o tempo total, o tempo de renderização de
+    # templates e a quantidade e a duração das consultas ao banco de dados.
+    # O resultado é enviado no cabeçalho Server-Timing (visível nas
+    # ferramentas de desenvolvedor do navegador) e, para uma amostra das
+    # requisições, gravado em ARQUIVO. Funciona tanto com WSGI quanto com
+    # ASGI, sem obrigar as views assíncronas a passarem por uma thread.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        _instrumentar_templates()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        for alias in connections:
+            _instrumentar_conexao(connections[alias])
+        medicao = Medicao()
+        marcador = _medicao.set(medicao)
+        inicio = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _medicao.reset(marcador)
+        self._finalizar(request, response, medicao, time.perf_counter() - inicio)
+        return response
+
+    async def __acall__(self, request):
+        medicao = Medicao()
+        marcador = _medicao.set(medicao)
+        inicio = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _medicao.reset(marcador)
+        self._finalizar(request, response, medicao, time.perf_counter() - inicio)
+        return response
+
+    def _finalizar(self, request, response, medicao, total):
+        match = request.resolver_match
+        view = (match.view_name or match._func_path) if match else 'sem_rota'
+        repetidas = medicao.repetidas()
+        if repetidas:
+            for sql, vezes in repetidas.items():
+                logger.warning('%s: consulta executada %s vezes (possível N+1): %s', view, vezes, sql)
+
+        metricas = [
+            f'total;dur={total * 1000:.1f}',
+            f'db;dur={medicao.tempo_banco * 1000:.1f};desc="{medicao.consultas} consultas"',
+            f'tpl;dur={medicao.tempo_template * 1000:.1f}',
+        ]
+        if repetidas:
+            metricas.append(f'n1;desc="{len(repetidas)} consultas repetidas"')
+        if medicao.fragmentos:
+            metricas.append(f'frag;desc="{medicao.fragmentos["acertos"]} acertos, '
+                            f'{medicao.fragmentos["faltas"]} faltas"')
+        response['Server-Timing'] = ', '.join(metricas)
+
+        if AMOSTRAGEM and random.random() < AMOSTRAGEM:
+            try:
+                _gravar({
+                    'ts': round(time.time(), 3),
+                    'view': view,
+                    'metodo': request.method,
+                    'status': response.status_code,
+                    'total_ms': round(total * 1000, 2),
+                    'db_ms': round(medicao.tempo_banco * 1000, 2),
+                    'template_ms': round(medicao.tempo_template * 1000, 2),
+                    'consultas': medicao.consultas,
+                    'duplicadas': medicao.duplicadas(),
+                    'repetidas': sorted(repetidas.values(), reverse=True),
+                    'fragmentos_acertos': medicao.fragmentos['acertos'],
+                    'fragmentos_faltas': medicao.fragmentos['faltas'],
+                })
+            except OSError:
+                logger.exception('Não foi possível gravar a medição em %s', ARQUIVO)
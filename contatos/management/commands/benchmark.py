@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from contatos import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Mede latência, número de consultas e pico de memória de todas as rotas do app, '
+            'confere o número máximo de consultas das alterações e compara o resultado com '
+            'uma referência gravada anteriormente.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeticoes', type=int, default=20)
+        parser.add_argument('--cenario', help='Executa apenas os cenários cujo nome contém este texto.')
+        parser.add_argument('-o', '--saida', help='Grava o resultado neste arquivo JSON.')
+        parser.add_argument('--referencia', help='Arquivo JSON de um resultado anterior, usado na comparação.')
+        parser.add_argument('--limite', action='append', default=[], metavar='METRICA=FATOR',
+                            help='Altera um limite de regressão (ex.: --limite p95_ms=2).')
+
+    def handle(self, *args, **options):
+        limites = {}
+        for limite in options['limite']:
+            metrica, _, fator = limite.partition('=')
+            if metrica not in benchmark.LIMITES:
+                raise CommandError(f'Métrica desconhecida: {metrica}')
+            limites[metrica] = float(fator)
+        referencia = benchmark.carregar(options['referencia']) if options['referencia'] else None
+
+        def progresso(nome, medicao):
+            self.stdout.write(f"{nome:<24} {medicao['status']:>4} {medicao['p50_ms']:>9.1f} "
+                              f"{medicao['p95_ms']:>9.1f} {medicao['consultas']:>9} {medicao['pico_kb']:>9}")
+
+        # O cliente de teste do Django usa o host 'testserver', que só é
+        # aceito depois de setup_test_environment().
+        setup_test_environment()
+        try:
+            self.stdout.write(f"{'cenário':<24} {'http':>4} {'p50 (ms)':>9} {'p95 (ms)':>9} "
+                              f"{'consultas':>9} {'pico (KB)':>9}")
+            try:
+                resultado = benchmark.executar(options['repeticoes'], options['cenario'], progresso)
+            except ValueError as erro:
+                raise CommandError(str(erro))
+        finally:
+            teardown_test_environment()
+
+        meta = resultado['meta']
+        self.stdout.write(f"{meta['contatos']} contatos, {meta['telefones']} telefones, "
+                          f"{meta['emails']} emails, {meta['grupos']} grupos.")
+        if meta['sem_cenario']:
+            self.stderr.write('Rotas sem cenário: ' + ', '.join(meta['sem_cenario']))
+        if options['saida']:
+            benchmark.gravar(resultado, options['saida'])
+        regressoes = benchmark.comparar(resultado, referencia, limites)
+        if regressoes:
+            for regressao in regressoes:
+                self.stderr.write(regressao)
+            raise CommandError(f'{len(regressoes)} métricas pioraram.')
+        if referencia:
+            self.stdout.write(self.style.SUCCESS('Nenhuma regressão em relação à referência.'))
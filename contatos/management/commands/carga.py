@@ -0,0 +1,49 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from contatos import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Teste de carga das views de leitura (lista, busca, grupos e dados de um contato), '
+            'comparando as views síncronas (WSGI) com as assíncronas (ASGI).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clientes', type=int, default=500, help='Clientes simultâneos (padrão: 500).')
+        parser.add_argument('--requisicoes', type=int, default=5000, help='Total de requisições em cada modo.')
+        parser.add_argument('--modo', choices=('wsgi', 'asgi', 'ambos'), default='ambos')
+        parser.add_argument('-o', '--saida', help='Grava o resultado neste arquivo JSON.')
+
+    def handle(self, *args, **options):
+        try:
+            urls = benchmark.rotas_carga()
+        except ValueError as erro:
+            raise CommandError(str(erro))
+        modos = ('wsgi', 'asgi') if options['modo'] == 'ambos' else (options['modo'],)
+
+        resultados = []
+        setup_test_environment()
+        try:
+            for modo in modos:
+                assincrono = modo == 'asgi'
+                resultado = benchmark.carga([par[assincrono] for par in urls], options['clientes'],
+                                            options['requisicoes'], assincrono)
+                resultados.append(resultado)
+                self.stdout.write(f"{modo}: {resultado['requisicoes_por_s']} req/s, "
+                                  f"p50 {resultado['p50_ms']} ms, p95 {resultado['p95_ms']} ms, "
+                                  f"p99 {resultado['p99_ms']} ms, {resultado['erros']} erros "
+                                  f"({resultado['requisicoes']} requisições em {resultado['duracao_s']} s)")
+        finally:
+            teardown_test_environment()
+
+        if len(resultados) == 2 and resultados[0]['requisicoes_por_s']:
+            razao = resultados[1]['requisicoes_por_s'] / resultados[0]['requisicoes_por_s']
+            self.stdout.write(f'ASGI/WSGI: {razao:.2f}x')
+            if razao < 1:
+                self.stdout.write(self.style.WARNING(
+                    'As views assíncronas tiveram vazão menor que as síncronas nesta medição.'))
+        if options['saida']:
+            with open(options['saida'], 'w', encoding='utf-8') as arquivo:
+                json.dump(resultados, arquivo, indent=2)
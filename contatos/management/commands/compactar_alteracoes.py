@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from contatos import alteracoes, donos
+
+
+class Command(BaseCommand):
+    help = ('Apaga do registro de alterações as exclusões antigas. Aplicativos sincronizados '
+            'pela última vez antes delas precisarão baixar a agenda inteira de novo.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=alteracoes.RETENCAO_DIAS,
+                            help='Mantém as exclusões dos últimos N dias (padrão: ALTERACOES_RETENCAO_DIAS).')
+
+    def handle(self, *args, **options):
+        for dono in donos.todos_os_donos():
+            with donos.como_dono(dono):
+                apagadas = alteracoes.compactar(options['dias'])
+                self.stdout.write(self.style.SUCCESS(
+                    f'Dono {dono}: {apagadas} exclusão(ões) apagada(s); '
+                    f'horizonte atual: {alteracoes.horizonte_atual()}.'))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from contatos import donos, operacoes
+from contatos.models import Grupo
+
+
+class Command(BaseCommand):
+    help = ('Exclui, inclui em um grupo, retira de um grupo ou move entre grupos vários contatos de uma vez, '
+            'escolhidos por id, por uma busca e/ou por um grupo.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('acao', choices=operacoes.ACOES)
+        parser.add_argument('--ids', help='Ids dos contatos, separados por vírgula.')
+        parser.add_argument('--busca', help='Seleciona os contatos encontrados por esta busca.')
+        parser.add_argument('--de-grupo', type=int, metavar='ID', help='Seleciona os contatos deste grupo.')
+        parser.add_argument('--grupo', type=int, metavar='ID',
+                            help='Grupo de destino (ou, em "remover", o grupo de onde os contatos saem).')
+        parser.add_argument('--origem', type=int, metavar='ID',
+                            help='Em "mover", o grupo de onde os contatos saem (padrão: todos).')
+        parser.add_argument('--simular', action='store_true',
+                            help='Apenas mostra quantos contatos seriam afetados.')
+        parser.add_argument('--dono', type=int, default=donos.DONO_PADRAO,
+                            help='Id do dono da agenda (padrão: AGENDA_DONO_PADRAO).')
+
+    def handle(self, *args, **options):
+        with donos.como_dono(options['dono']):
+            self.executar(**options)
+
+    def executar(self, **options):
+        try:
+            ids = [int(i) for i in options['ids'].split(',') if i.strip()] if options['ids'] else None
+            selecionados = operacoes.selecionar_contatos(ids, options['busca'], options['de_grupo'])
+        except ValueError as erro:
+            raise CommandError(str(erro))
+        if options['simular']:
+            self.stdout.write(f'{len(selecionados)} contatos selecionados.')
+            return
+        try:
+            afetados = operacoes.executar(options['acao'], selecionados, options['grupo'], options['origem'])
+        except (ValueError, Grupo.DoesNotExist) as erro:
+            raise CommandError(str(erro))
+        self.stdout.write(self.style.SUCCESS(
+            f"{options['acao']}: {len(selecionados)} contatos selecionados, {afetados} afetados."))
@@ -0,0 +1,33 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contatos import donos, duplicados
+
+
+class Command(BaseCommand):
+    help = ('Procura contatos duplicados (mesmo telefone, mesmo email ou nomes parecidos) e grava os '
+            'pares encontrados para revisão em /duplicados/.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processos', type=int, default=os.cpu_count() or 1,
+                            help='Número de processos usados nas comparações (padrão: número de CPUs).')
+        parser.add_argument('--pontuacao-minima', type=float, default=duplicados.PONTUACAO_MINIMA,
+                            help='Pontuação mínima (0 a 1) para um par ser gravado '
+                                 '(padrão: DUPLICADOS_PONTUACAO_MINIMA).')
+        parser.add_argument('--limite-bloco', type=int, default=duplicados.LIMITE_BLOCO,
+                            help='Chaves compartilhadas por mais contatos que isto são ignoradas '
+                                 '(padrão: DUPLICADOS_LIMITE_BLOCO).')
+
+    def handle(self, *args, **options):
+        if options['processos'] < 1:
+            raise CommandError('--processos deve ser pelo menos 1.')
+        for dono in donos.todos_os_donos():
+            inicio = time.perf_counter()
+            with donos.como_dono(dono):
+                pares = duplicados.detectar(options['processos'], options['pontuacao_minima'],
+                                            options['limite_bloco'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Dono {dono}: {len(pares)} pares de possíveis duplicados encontrados em '
+                f'{time.perf_counter() - inicio:.1f} s.'))
@@ -0,0 +1,75 @@
+import multiprocessing
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from contatos import tarefas
+
+
+def _executar_threads(indice, threads, parar, opcoes):
+    # Executa 'threads' trabalhadores no processo atual até que 'parar' seja
+    # sinalizado (ou, com --ate-esvaziar, até a fila esvaziar).
+    trabalhadores = [
+        threading.Thread(target=tarefas.trabalhar, name=f'tarefas-{indice}-{i}', args=(
+            tarefas.nome_do_trabalhador(f'{indice}-{i}'), parar, opcoes['visibilidade'], opcoes['intervalo'],
+            opcoes['ate_esvaziar']))
+        for i in range(threads)
+    ]
+    for trabalhador in trabalhadores:
+        trabalhador.start()
+    for trabalhador in trabalhadores:
+        trabalhador.join()
+
+
+def _processo(indice, threads, opcoes):
+    parar = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: parar.set())
+    signal.signal(signal.SIGINT, lambda *_: parar.set())
+    _executar_threads(indice, threads, parar, opcoes)
+
+
+class Command(BaseCommand):
+    help = ('Executa as tarefas da fila (ver contatos/tarefas.py) até ser interrompido com Ctrl+C ou SIGTERM. '
+            'Uma tarefa interrompida no meio volta a ser executada depois do prazo da sua reserva.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=2, help='Trabalhadores em cada processo (padrão: 2).')
+        parser.add_argument('--processos', type=int, default=1,
+                            help='Processos, cada um com --threads trabalhadores (padrão: 1).')
+        parser.add_argument('--visibilidade', type=float, default=tarefas.VISIBILIDADE,
+                            help='Segundos de reserva de cada tarefa (padrão: TAREFAS_VISIBILIDADE).')
+        parser.add_argument('--intervalo', type=float, default=tarefas.INTERVALO,
+                            help='Segundos entre consultas à fila vazia (padrão: TAREFAS_INTERVALO).')
+        parser.add_argument('--ate-esvaziar', action='store_true',
+                            help='Termina quando não houver mais tarefas disponíveis.')
+
+    def handle(self, *args, **options):
+        apagadas = tarefas.limpar()
+        if apagadas:
+            self.stdout.write(f'{apagadas} tarefa(s) antiga(s) apagada(s).')
+        threads = max(options['threads'], 1)
+        processos = max(options['processos'], 1)
+        self.stdout.write(f'Executando tarefas com {processos} processo(s) de {threads} thread(s).')
+
+        if processos == 1 or 'fork' not in multiprocessing.get_all_start_methods():
+            parar = threading.Event()
+            signal.signal(signal.SIGTERM, lambda *_: parar.set())
+            signal.signal(signal.SIGINT, lambda *_: parar.set())
+            _executar_threads(0, threads * processos, parar, options)
+            return
+
+        # As conexões com o banco não podem ser compartilhadas com os
+        # processos filhos, que abrem as suas próprias.
+        connections.close_all()
+        contexto = multiprocessing.get_context('fork')
+        filhos = [contexto.Process(target=_processo, args=(i, threads, options), name=f'tarefas-{i}')
+                  for i in range(processos)]
+        for filho in filhos:
+            filho.start()
+        # Ctrl+C chega a todos os processos do grupo; SIGTERM é repassado.
+        signal.signal(signal.SIGTERM, lambda *_: [filho.terminate() for filho in filhos])
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for filho in filhos:
+            filho.join()
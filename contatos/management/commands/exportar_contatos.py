@@ -0,0 +1,43 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contatos import donos, exportacao
+from contatos.models import Contato, Grupo
+
+
+class Command(BaseCommand):
+    help = 'Exporta todos os contatos, ou os contatos de um grupo, como vCard ou CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-o', '--saida',
+                            help='Arquivo de destino. Sem esta opção, o conteúdo é escrito na saída padrão.')
+        parser.add_argument('--grupo', type=int, metavar='ID', help='Exporta apenas os contatos deste grupo.')
+        parser.add_argument('--formato', choices=exportacao.FORMATOS, default='vcard')
+        parser.add_argument('--gzip', action='store_true', help='Comprime o arquivo com gzip.')
+        parser.add_argument('--avatares', action='store_true', help='Inclui as imagens dos avatares.')
+        parser.add_argument('--dono', type=int, default=donos.DONO_PADRAO,
+                            help='Id do dono da agenda (padrão: AGENDA_DONO_PADRAO).')
+
+    def handle(self, *args, **options):
+        with donos.como_dono(options['dono']):
+            self.executar(**options)
+
+    def executar(self, **options):
+        if options['grupo']:
+            try:
+                contatos = Grupo.objects.get(id=options['grupo']).contato_set.all()
+            except Grupo.DoesNotExist:
+                raise CommandError(f"Grupo {options['grupo']} não encontrado.")
+        else:
+            contatos = Contato.objects.all()
+
+        blocos = exportacao.exportar(contatos, options['formato'], options['gzip'], options['avatares'])
+        if options['saida']:
+            with open(options['saida'], 'wb') as arquivo:
+                for bloco in blocos:
+                    arquivo.write(bloco)
+        else:
+            for bloco in blocos:
+                sys.stdout.buffer.write(bloco)
+            sys.stdout.buffer.flush()
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contatos import benchmark, donos
+from contatos.models import Contato
+
+
+def quantidade(valor):
+    # Aceita '1000', '100k' ou '1m'.
+    valor = valor.strip().lower()
+    multiplicador = {'k': 1000, 'm': 1000000}.get(valor[-1:], 1)
+    if multiplicador > 1:
+        valor = valor[:-1]
+    return int(float(valor) * multiplicador)
+
+
+class Command(BaseCommand):
+    help = ('Cria uma agenda sintética para medições de desempenho, com telefones, emails '
+            'e grupos sorteados a partir de uma semente.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('contatos', type=quantidade, help='Quantidade de contatos (ex.: 1000, 100k, 1m).')
+        parser.add_argument('--semente', type=int, default=42)
+        parser.add_argument('--limpar', action='store_true',
+                            help='Apaga todos os contatos e grupos antes de gerar a agenda.')
+        parser.add_argument('--dono', type=int, default=donos.DONO_PADRAO,
+                            help='Id do dono da agenda (padrão: AGENDA_DONO_PADRAO).')
+
+    def handle(self, *args, **options):
+        with donos.como_dono(options['dono']):
+            self.executar(**options)
+
+    def executar(self, **options):
+        if options['limpar']:
+            benchmark.limpar_agenda()
+        elif Contato.objects.exists():
+            raise CommandError('A agenda já tem contatos. Use --limpar para apagá-los antes '
+                               '(use um banco de dados separado para as medições).')
+        inicio = time.monotonic()
+
+        def progresso(criados):
+            self.stdout.write(f'{criados}/{options["contatos"]} contatos')
+
+        total = benchmark.gerar_agenda(options['contatos'], options['semente'], progresso)
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} contatos gerados em {time.monotonic() - inicio:.1f}s.'))
@@ -0,0 +1,65 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from contatos import donos
+from contatos.avatares import gerar_miniaturas
+from contatos.models import Contato
+from contatos.sincronizacao import contatos_alterados
+
+
+def _processar(dono, contato_id, nome):
+    # Executado em um processo separado. Retorna o dono, o id do contato e a
+    # mensagem de erro, caso a imagem não possa ser processada.
+    try:
+        gerar_miniaturas(nome)
+    except Exception as erro:
+        return dono, contato_id, f"{nome}: {erro}"
+    return dono, contato_id, None
+
+
+class Command(BaseCommand):
+    help = 'Gera as miniaturas dos avatares de contatos, em paralelo.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processos', type=int, default=os.cpu_count(),
+                            help='Número de processos usados para gerar as miniaturas.')
+        parser.add_argument('--todos', action='store_true',
+                            help='Gera novamente as miniaturas de avatares que já possuem miniaturas.')
+
+    def handle(self, *args, **options):
+        pendentes = []
+        for dono in donos.todos_os_donos():
+            with donos.como_dono(dono):
+                contatos = Contato.objects.exclude(avatar='').exclude(avatar__isnull=True)
+                if not options['todos']:
+                    contatos = contatos.filter(avatar_miniaturas=False)
+                pendentes.extend((dono, *contato) for contato in contatos.values_list('id', 'avatar'))
+        if not pendentes:
+            self.stdout.write('Nenhum avatar pendente.')
+            return
+
+        # As conexões com o banco de dados não podem ser compartilhadas com os
+        # processos filhos, então as fechamos antes de criar o pool.
+        connections.close_all()
+        concluidos = {}
+        with ProcessPoolExecutor(max_workers=options['processos']) as pool:
+            tarefas = [pool.submit(_processar, *pendente) for pendente in pendentes]
+            for tarefa in as_completed(tarefas):
+                dono, contato_id, erro = tarefa.result()
+                if erro:
+                    self.stderr.write(erro)
+                else:
+                    concluidos.setdefault(dono, []).append(contato_id)
+
+        for dono, ids in concluidos.items():
+            with donos.como_dono(dono):
+                for inicio in range(0, len(ids), 500):
+                    parte = ids[inicio:inicio + 500]
+                    Contato.objects.filter(id__in=parte).update(avatar_miniaturas=True)
+                    # Os cartões da lista passam a exibir as miniaturas.
+                    contatos_alterados(parte)
+        self.stdout.write(self.style.SUCCESS(
+            f'Miniaturas geradas para {sum(map(len, concluidos.values()))} de {len(pendentes)} avatares.'))
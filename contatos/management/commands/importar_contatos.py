@@ -0,0 +1,69 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contatos import donos
+from contatos.importacao import CONFLITOS, FORMATOS, TAMANHO_LOTE, abrir_texto, detectar_formato, importar
+from contatos.models import Importacao
+
+
+class Command(BaseCommand):
+    help = 'Importa contatos de um arquivo vCard (3.0/4.0) ou CSV, em lotes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo', nargs='?', help='Caminho do arquivo .vcf ou .csv.')
+        parser.add_argument('--formato', choices=FORMATOS,
+                            help='Formato do arquivo. Por padrão é deduzido pela extensão.')
+        parser.add_argument('--conflito', choices=CONFLITOS, default='ignorar',
+                            help='O que fazer com contatos cujo nome já existe na agenda.')
+        parser.add_argument('--lote', type=int, default=TAMANHO_LOTE,
+                            help='Quantidade de registros gravados por transação.')
+        parser.add_argument('--retomar', type=int, metavar='ID',
+                            help='Retoma a importação interrompida com este id.')
+        parser.add_argument('--dono', type=int, default=donos.DONO_PADRAO,
+                            help='Id do dono da agenda (padrão: AGENDA_DONO_PADRAO).')
+
+    def handle(self, *args, **options):
+        with donos.como_dono(options['dono']):
+            self.executar(**options)
+
+    def executar(self, **options):
+        if options['retomar']:
+            try:
+                importacao = Importacao.objects.get(id=options['retomar'])
+            except Importacao.DoesNotExist:
+                raise CommandError(f"Importação {options['retomar']} não encontrada.")
+            if importacao.status == Importacao.CONCLUIDA:
+                raise CommandError(f'A importação {importacao.id} já foi concluída.')
+        elif options['arquivo']:
+            caminho = os.path.abspath(options['arquivo'])
+            importacao = Importacao.objects.create(
+                caminho=caminho,
+                nome_arquivo=os.path.basename(caminho),
+                formato=options['formato'] or detectar_formato(caminho),
+                conflito=options['conflito'],
+            )
+        else:
+            raise CommandError('Informe o arquivo a importar ou --retomar ID.')
+
+        self.stdout.write(f'Importação {importacao.id}: {importacao.caminho}')
+        inicio = time.monotonic()
+        processados_antes = importacao.processados
+
+        def progresso(importacao):
+            decorrido = time.monotonic() - inicio
+            taxa = (importacao.processados - processados_antes) / decorrido if decorrido else 0
+            self.stdout.write(
+                f'{importacao.processados} registros processados '
+                f'({importacao.criados} criados, {importacao.atualizados} atualizados, '
+                f'{importacao.ignorados} ignorados) - {taxa:.0f} registros/s'
+            )
+
+        try:
+            with open(importacao.caminho, 'rb') as arquivo:
+                importar(importacao, abrir_texto(arquivo), tamanho_lote=options['lote'], progresso=progresso)
+        except Exception as erro:
+            raise CommandError(
+                f'{erro}\nA importação pode ser retomada com: manage.py importar_contatos --retomar {importacao.id}')
+        self.stdout.write(self.style.SUCCESS(f'Importação {importacao.id} concluída.'))
@@ -0,0 +1,127 @@
+import os
+import re
+import time
+
+from django.core.management.base import BaseCommand
+
+from contatos import donos
+from contatos.avatares import FORMATOS, TAMANHOS
+from contatos.models import Contato
+from contatos.sincronizacao import contatos_alterados
+from contatos.storage import CARENCIA, armazenamento_avatares
+
+DIRETORIO = 'avatares'
+
+# Nome de arquivo gerado por ArmazenamentoPorConteudo: 'ab/ab12...ef.jpg'
+PADRAO_HASH = re.compile(r'^avatares/([0-9a-f]{2})/\1[0-9a-f]{62}\.\w+$')
+
+PADRAO_MINIATURA = re.compile(r'^(.*)\.(\d+)\.(\w+)$')
+
+# Arquivos temporários de envios interrompidos são removidos depois deste
+# tempo (em segundos).
+IDADE_TEMPORARIOS = 3600
+
+
+class Command(BaseCommand):
+    help = ('Remove arquivos de avatar (e suas miniaturas) que não são usados por nenhum '
+            'contato. Com --converter, move antes os avatares antigos para nomes por conteúdo.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--simular', action='store_true',
+                            help='Apenas lista os arquivos que seriam removidos.')
+        parser.add_argument('--converter', action='store_true',
+                            help='Renomeia avatares antigos pelo hash do conteúdo, unindo duplicatas.')
+
+    def handle(self, *args, **options):
+        armazenamento = armazenamento_avatares()
+        if options['converter']:
+            self.converter(armazenamento, options['simular'])
+
+        # Os avatares são compartilhados pelas agendas de todos os donos.
+        referenciados = set()
+        for particao in donos.PARTICOES:
+            referenciados.update(Contato.todos.using(particao).exclude(avatar='').exclude(avatar__isnull=True)
+                                 .values_list('avatar', flat=True).distinct().iterator())
+        bases = {os.path.splitext(nome)[0] for nome in referenciados}
+
+        # Avatares gravados ou reaproveitados durante a carência são mantidos
+        # mesmo sem referências, assim como as suas miniaturas (ver
+        # contatos/storage.py).
+        agora = time.time()
+        raiz = armazenamento.path(DIRETORIO)
+        arquivos = []
+        for diretorio, _, nomes in os.walk(raiz):
+            for arquivo in nomes:
+                caminho = os.path.join(diretorio, arquivo)
+                nome = os.path.relpath(caminho, armazenamento.location).replace(os.sep, '/')
+                arquivos.append((arquivo, caminho, nome, os.path.getmtime(caminho)))
+        recentes = {os.path.splitext(nome)[0] for arquivo, _, nome, modificado in arquivos
+                    if not arquivo.startswith('.envio-') and self.miniatura_de(nome) is None
+                    and agora - modificado < CARENCIA}
+
+        removidos = 0
+        liberado = 0
+        for arquivo, caminho, nome, modificado in arquivos:
+            miniatura = self.miniatura_de(nome)
+            if arquivo.startswith('.envio-'):
+                if agora - modificado < IDADE_TEMPORARIOS:
+                    continue
+            elif miniatura is not None:
+                if miniatura in bases or miniatura in recentes:
+                    continue
+            elif nome in referenciados or agora - modificado < CARENCIA:
+                continue
+            tamanho = os.path.getsize(caminho)
+            if not options['simular']:
+                if miniatura is None and not arquivo.startswith('.envio-'):
+                    # A carência é conferida de novo sob a trava de _save().
+                    if not armazenamento.remover_sem_uso(nome):
+                        continue
+                else:
+                    os.unlink(caminho)
+            removidos += 1
+            liberado += tamanho
+            self.stdout.write(f'Removendo {nome}')
+
+        acao = 'Seriam removidos' if options['simular'] else 'Removidos'
+        self.stdout.write(self.style.SUCCESS(
+            f'{acao} {removidos} arquivos ({liberado / 1024 / 1024:.1f} MB).'))
+
+    def miniatura_de(self, nome):
+        # Retorna o nome base do avatar a que a miniatura 'nome' pertence, ou
+        # None se 'nome' não for uma miniatura.
+        resultado = PADRAO_MINIATURA.match(nome)
+        if resultado and int(resultado.group(2)) in TAMANHOS and resultado.group(3) in FORMATOS:
+            return resultado.group(1)
+        return None
+
+    def converter(self, armazenamento, simular):
+        # Grava novamente, com nome por conteúdo, cada avatar que ainda usa o
+        # nome original do envio, e atualiza os contatos que o utilizam. Os
+        # arquivos antigos deixam de ser referenciados e são removidos em
+        # seguida pela limpeza.
+        for dono in donos.todos_os_donos():
+            with donos.como_dono(dono):
+                self.converter_agenda(armazenamento, simular)
+        if not simular:
+            self.stdout.write('Execute "manage.py gerar_miniaturas" para gerar as miniaturas dos avatares convertidos.')
+
+    def converter_agenda(self, armazenamento, simular):
+        antigos = (Contato.objects.exclude(avatar='').exclude(avatar__isnull=True)
+                   .values_list('avatar', flat=True).distinct())
+        for nome in list(antigos):
+            if PADRAO_HASH.match(nome):
+                continue
+            if not armazenamento.exists(nome):
+                self.stderr.write(f'Arquivo não encontrado: {nome}')
+                continue
+            if simular:
+                self.stdout.write(f'Converteria {nome}')
+                continue
+            with armazenamento.open(nome, 'rb') as arquivo:
+                novo = armazenamento.save(nome, arquivo)
+            contatos = Contato.objects.filter(avatar=nome)
+            ids = list(contatos.values_list('id', flat=True))
+            contatos.update(avatar=novo, avatar_miniaturas=False)
+            contatos_alterados(ids)
+            self.stdout.write(f'{nome} -> {novo}')
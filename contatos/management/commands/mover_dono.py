@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contatos import donos, particoes
+
+
+class Command(BaseCommand):
+    help = ('Move a agenda de um dono para outra partição (ver contatos/particoes.py). Com --rebalancear, move '
+            'cada dono que não está na partição escolhida pelo hash, como depois de acrescentar partições.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('dono', nargs='?', type=int, help='Id do dono.')
+        parser.add_argument('particao', nargs='?', choices=list(donos.PARTICOES), help='Partição de destino.')
+        parser.add_argument('--rebalancear', action='store_true',
+                            help='Move todos os donos que não estão na partição escolhida pelo hash.')
+        parser.add_argument('--simular', action='store_true', help='Apenas mostra os donos que seriam movidos.')
+
+    def handle(self, *args, **options):
+        if options['rebalancear']:
+            mudancas = [(dono, alias, donos.particao_por_hash(dono))
+                        for alias in donos.PARTICOES for dono in sorted(donos.donos_da_particao(alias))
+                        if donos.particao(dono) == alias and donos.particao_por_hash(dono) != alias]
+        elif options['dono'] is not None and options['particao']:
+            mudancas = [(options['dono'], donos.particao(options['dono']), options['particao'])]
+        else:
+            raise CommandError('Informe o dono e a partição de destino, ou --rebalancear.')
+
+        for dono, origem, destino in mudancas:
+            if origem == destino:
+                self.stdout.write(f'A agenda do dono {dono} já está na partição {destino}.')
+                continue
+            if options['simular']:
+                self.stdout.write(f'Dono {dono}: {origem} -> {destino}')
+                continue
+            inicio = time.monotonic()
+            try:
+                copiados = particoes.mover(dono, destino)
+            except particoes.MudancaImpossivel as erro:
+                raise CommandError(str(erro))
+            self.stdout.write(self.style.SUCCESS(
+                f'Dono {dono}: {copiados} contatos movidos de {origem} para {destino} '
+                f'em {time.monotonic() - inicio:.1f} s.'))
+        if options['rebalancear'] and not mudancas:
+            self.stdout.write('Todos os donos já estão nas partições escolhidas pelo hash.')
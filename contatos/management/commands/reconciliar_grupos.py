@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from contatos import contadores, donos
+from contatos.sincronizacao import incrementar_versao
+
+
+class Command(BaseCommand):
+    help = ('Confere os contadores de contatos de cada grupo com os valores calculados '
+            'das tabelas e, com --corrigir, os recalcula.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corrigir', action='store_true',
+                            help='Recalcula os contadores de todos os grupos se houver divergências.')
+
+    def handle(self, *args, **options):
+        for dono in donos.todos_os_donos():
+            with donos.como_dono(dono):
+                self.reconciliar(dono, **options)
+
+    def reconciliar(self, dono, **options):
+        divergentes = contadores.divergencias()
+        for grupo in divergentes:
+            diferencas = ', '.join(f"{campo}: {grupo[campo]} (calculado {grupo[f'{campo}_calculado']})"
+                                   for campo in contadores.CAMPOS
+                                   if grupo[campo] != grupo[f'{campo}_calculado'])
+            self.stdout.write(f"Dono {dono}: {grupo['nome']} (id {grupo['id']}): {diferencas}")
+        if not divergentes:
+            self.stdout.write(self.style.SUCCESS(f'Dono {dono}: os contadores de todos os grupos estão corretos.'))
+            return
+        if not options['corrigir']:
+            self.stdout.write(f'Dono {dono}: {len(divergentes)} grupo(s) com divergências; '
+                              'use --corrigir para recalcular.')
+            return
+        with transaction.atomic(using=donos.particao()):
+            contadores.reconstruir()
+            incrementar_versao()
+        self.stdout.write(self.style.SUCCESS(
+            f'Dono {dono}: contadores recalculados ({len(divergentes)} grupo(s) corrigido(s)).'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from contatos import busca, donos
+
+
+class Command(BaseCommand):
+    help = 'Apaga e reconstrói o índice de busca de contatos (FTS5).'
+
+    def handle(self, *args, **options):
+        if not busca.disponivel():
+            self.stderr.write('O índice de busca só está disponível com SQLite.')
+            return
+        total = 0
+        for dono in donos.todos_os_donos():
+            with donos.como_dono(dono), transaction.atomic(using=donos.particao()):
+                total += busca.reconstruir_indice()
+        self.stdout.write(self.style.SUCCESS(f'{total} contatos indexados.'))
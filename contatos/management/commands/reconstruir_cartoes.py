@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from contatos import cartoes, donos
+from contatos.sincronizacao import incrementar_versao
+
+
+class Command(BaseCommand):
+    help = 'Apaga e grava novamente os cartões da lista de contatos (CartaoContato).'
+
+    def handle(self, *args, **options):
+        total = 0
+        for dono in donos.todos_os_donos():
+            with donos.como_dono(dono), transaction.atomic(using=donos.particao()):
+                total += cartoes.reconstruir()
+                incrementar_versao()
+        self.stdout.write(self.style.SUCCESS(f'{total} cartões gravados.'))
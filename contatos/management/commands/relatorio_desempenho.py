@@ -0,0 +1,87 @@
+import json
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contatos import instrumentacao
+
+METRICAS = ('total_ms', 'db_ms', 'template_ms', 'consultas')
+
+
+def percentil(valores, p):
+    # Percentil pelo método do valor mais próximo; 'valores' deve estar
+    # ordenado.
+    if not valores:
+        return 0
+    indice = max(0, min(len(valores) - 1, round(p / 100 * len(valores) + 0.5) - 1))
+    return valores[indice]
+
+
+class Command(BaseCommand):
+    help = ('Resume as medições gravadas pela instrumentação das requisições, '
+            'com os percentis 50, 95 e 99 de cada view.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--arquivo', default=str(instrumentacao.ARQUIVO),
+                            help='Arquivo de medições (padrão: INSTRUMENTACAO_ARQUIVO).')
+        parser.add_argument('--horas', type=float,
+                            help='Considera apenas as medições das últimas N horas.')
+        parser.add_argument('--metrica', choices=METRICAS, default='total_ms',
+                            help='Métrica usada para ordenar as views (padrão: total_ms).')
+        parser.add_argument('--json', action='store_true', help='Gera o resumo em JSON.')
+
+    def handle(self, *args, **options):
+        desde = time.time() - options['horas'] * 3600 if options['horas'] else 0
+        por_view = {}
+        # Inclui os arquivos renomeados pela rotação (ver
+        # contatos/instrumentacao.py), do mais antigo para o mais recente.
+        existentes = [caminho for caminho in instrumentacao.arquivos(options['arquivo']) if caminho.exists()]
+        if not existentes:
+            raise CommandError(f"Arquivo '{options['arquivo']}' não encontrado.")
+        for caminho in existentes:
+            with open(caminho, encoding='utf-8') as arquivo:
+                for linha in arquivo:
+                    try:
+                        medicao = json.loads(linha)
+                    except ValueError:
+                        continue
+                    if medicao.get('ts', 0) < desde:
+                        continue
+                    view = por_view.setdefault(medicao['view'], {**{m: [] for m in METRICAS + ('repetidas',)},
+                                                                 'fragmentos': Counter()})
+                    for metrica in METRICAS:
+                        view[metrica].append(medicao.get(metrica, 0))
+                    view['repetidas'].append(1 if medicao.get('repetidas') else 0)
+                    view['fragmentos'].update(
+                        acertos=medicao.get('fragmentos_acertos', 0), faltas=medicao.get('fragmentos_faltas', 0))
+
+        resumo = {}
+        for nome, valores in por_view.items():
+            fragmentos = valores['fragmentos']
+            resumo[nome] = {'requisicoes': len(valores['total_ms']),
+                            'com_n1': sum(valores['repetidas']),
+                            'fragmentos': {'acertos': fragmentos['acertos'], 'faltas': fragmentos['faltas']}}
+            for metrica in METRICAS:
+                ordenados = sorted(valores[metrica])
+                resumo[nome][metrica] = {f'p{p}': percentil(ordenados, p) for p in (50, 95, 99)}
+        ordem = sorted(resumo, key=lambda nome: resumo[nome][options['metrica']]['p95'], reverse=True)
+
+        if options['json']:
+            self.stdout.write(json.dumps({nome: resumo[nome] for nome in ordem}, indent=2, ensure_ascii=False))
+            return
+        if not ordem:
+            self.stdout.write('Nenhuma medição encontrada.')
+            return
+        self.stdout.write(f"{'view':<28} {'req':>6} {'total p50/p95/p99 (ms)':>24} "
+                          f"{'banco p95':>10} {'tpl p95':>8} {'consultas p50/p99':>18} {'N+1':>5} {'cache':>6}")
+        for nome in ordem:
+            r = resumo[nome]
+            total = '/'.join(f"{r['total_ms'][p]:.0f}" for p in ('p50', 'p95', 'p99'))
+            consultas = '/'.join(str(r['consultas'][p]) for p in ('p50', 'p99'))
+            # Fração dos fragmentos de template encontrados no cache.
+            procurados = r['fragmentos']['acertos'] + r['fragmentos']['faltas']
+            cache = f"{r['fragmentos']['acertos'] / procurados:.0%}" if procurados else '-'
+            self.stdout.write(f"{nome[:28]:<28} {r['requisicoes']:>6} {total:>24} "
+                              f"{r['db_ms']['p95']:>10.1f} {r['template_ms']['p95']:>8.1f} "
+                              f"{consultas:>18} {r['com_n1']:>5} {cache:>6}")
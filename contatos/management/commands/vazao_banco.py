@@ -0,0 +1,135 @@
+import json
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, router, transaction
+
+from contatos.models import Contato, Telefone
+
+# Perfil 'padrao': o backend SQLite como o Django o configura sem ajustes,
+# com o journal em modo DELETE, transações iniciadas com BEGIN e uma conexão
+# nova para cada operação (CONN_MAX_AGE = 0), e leituras e escritas na mesma
+# conexão. Perfil 'ajustado': as conexões configuradas em DATABASES.
+ALIAS_PADRAO = 'vazao_padrao'
+
+
+def _percentil(valores, p):
+    if not valores:
+        return 0
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(p / 100 * len(valores)))]
+
+
+class Command(BaseCommand):
+    help = ('Mede a vazão de leituras e escritas concorrentes no banco, com a configuração '
+            'padrão do SQLite e com a configuração de DATABASES.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--perfil', choices=('padrao', 'ajustado', 'ambos'), default='ambos')
+        parser.add_argument('--leitores', type=int, default=8, help='Threads que só leem (padrão: 8).')
+        parser.add_argument('--escritores', type=int, default=2, help='Threads que escrevem (padrão: 2).')
+        parser.add_argument('--segundos', type=float, default=10, help='Duração de cada medição (padrão: 10).')
+        parser.add_argument('--json', action='store_true', help='Gera o resultado em JSON.')
+
+    def handle(self, *args, **options):
+        contatos = list(Contato.objects.values_list('id', 'nome')[:2000])
+        if not contatos:
+            raise CommandError('A agenda está vazia; use "manage.py gerar_agenda".')
+        perfis = ('padrao', 'ajustado') if options['perfil'] == 'ambos' else (options['perfil'],)
+        resultados = {}
+        for perfil in perfis:
+            # O modo do journal é gravado no arquivo e só pode ser trocado
+            # sem outras conexões abertas.
+            connections.close_all()
+            if perfil == 'padrao':
+                self._registrar_alias_padrao()
+            resultados[perfil] = self._medir(perfil, contatos, options)
+            connections.close_all()
+
+        if options['json']:
+            self.stdout.write(json.dumps(resultados, indent=2))
+            return
+        self.stdout.write(f"{'perfil':<10} {'leituras/s':>11} {'escritas/s':>11} {'leitura p95 (ms)':>17} "
+                          f"{'escrita p95 (ms)':>17} {'erros':>6}")
+        for perfil, r in resultados.items():
+            self.stdout.write(f"{perfil:<10} {r['leituras_s']:>11.1f} {r['escritas_s']:>11.1f} "
+                              f"{r['leitura_p95_ms']:>17.1f} {r['escrita_p95_ms']:>17.1f} {r['erros']:>6}")
+        for perfil, r in resultados.items():
+            for erro in r['exemplos_erros']:
+                self.stdout.write(self.style.WARNING(f'{perfil}: {erro}'))
+
+    def _registrar_alias_padrao(self):
+        configuracao = connections.databases[DEFAULT_DB_ALIAS]
+        connections.databases[ALIAS_PADRAO] = {
+            'ENGINE': 'agenda1.sqlite',
+            'NAME': configuracao['NAME'],
+            'OPTIONS': {'pragmas': {'journal_mode': 'DELETE'}},
+        }
+
+    def _medir(self, perfil, contatos, options):
+        fim = time.perf_counter() + options['segundos']
+        tempos = {'leitura': [], 'escrita': []}
+        erros = []
+        trava = threading.Lock()
+
+        def ler(alias, rng):
+            _, nome = rng.choice(contatos)
+            pagina = list(Contato.objects.using(alias).filter(nome__gte=nome).order_by('nome')
+                          .values_list('id', flat=True)[:24])
+            Telefone.objects.using(alias).filter(contato_id__in=pagina).count()
+
+        def escrever(alias, rng):
+            # Lê e depois altera a mesma linha na mesma transação, como uma
+            # edição de contato. O valor gravado é o mesmo que já estava lá.
+            contato_id, _ = rng.choice(contatos)
+            with transaction.atomic(using=alias):
+                valor = Contato.objects.using(alias).filter(id=contato_id).values_list('atualizado_em', flat=True)[0]
+                Contato.objects.using(alias).filter(id=contato_id).update(atualizado_em=valor)
+
+        def trabalhador(tipo, operacao, semente):
+            rng = random.Random(semente)
+            proprios, falhas = [], []
+            try:
+                while time.perf_counter() < fim:
+                    if perfil == 'padrao':
+                        alias = ALIAS_PADRAO
+                    elif tipo == 'leitura':
+                        alias = router.db_for_read(Contato)
+                    else:
+                        alias = router.db_for_write(Contato)
+                    inicio = time.perf_counter()
+                    try:
+                        operacao(alias, rng)
+                    except OperationalError as erro:
+                        falhas.append(str(erro))
+                    else:
+                        proprios.append(time.perf_counter() - inicio)
+                    if perfil == 'padrao':
+                        connections[alias].close()
+            finally:
+                connections.close_all()
+            with trava:
+                tempos[tipo].extend(proprios)
+                erros.extend(falhas)
+
+        threads = [threading.Thread(target=trabalhador, args=('leitura', ler, i))
+                   for i in range(options['leitores'])]
+        threads += [threading.Thread(target=trabalhador, args=('escrita', escrever, 1000 + i))
+                    for i in range(options['escritores'])]
+        inicio = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duracao = time.perf_counter() - inicio
+
+        return {
+            'leituras_s': len(tempos['leitura']) / duracao,
+            'escritas_s': len(tempos['escrita']) / duracao,
+            'leitura_p95_ms': _percentil(tempos['leitura'], 95) * 1000,
+            'escrita_p95_ms': _percentil(tempos['escrita'], 95) * 1000,
+            'erros': len(erros),
+            'exemplos_erros': sorted(set(erros))[:3],
+        }
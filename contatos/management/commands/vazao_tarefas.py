@@ -0,0 +1,154 @@
+import json
+import multiprocessing
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+
+from contatos import tarefas
+from contatos.models import Tarefa
+
+
+def _percentil(valores, p):
+    if not valores:
+        return 0
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(p / 100 * len(valores)))]
+
+
+def _trabalhadores(indice, threads, parar, intervalo):
+    # Executa 'threads' trabalhadores até que 'parar' seja sinalizado.
+    grupo = [threading.Thread(target=tarefas.trabalhar,
+                              args=(tarefas.nome_do_trabalhador(f'vazao-{indice}-{i}'), parar,
+                                    tarefas.VISIBILIDADE, intervalo))
+             for i in range(threads)]
+    for trabalhador in grupo:
+        trabalhador.start()
+    for trabalhador in grupo:
+        trabalhador.join()
+
+
+class Command(BaseCommand):
+    help = ('Mede a vazão e a latência da fila de tarefas (ver contatos/tarefas.py) com vários trabalhadores '
+            'simultâneos, enquanto outras threads enfileiram tarefas sem efeitos.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tarefas', type=int, default=2000, help='Tarefas em cada medição (padrão: 2000).')
+        parser.add_argument('--trabalhadores', default='1,2,4,8',
+                            help='Quantidades de trabalhadores a medir, separadas por vírgula (padrão: 1,2,4,8).')
+        parser.add_argument('--processos', type=int, default=1,
+                            help='Divide os trabalhadores entre N processos (padrão: 1).')
+        parser.add_argument('--produtores', type=int, default=2, help='Threads que enfileiram (padrão: 2).')
+        parser.add_argument('--ritmo', type=float, default=0,
+                            help='Tarefas enfileiradas por segundo por todos os produtores juntos; 0 enfileira '
+                                 'o mais rápido possível e mede a vazão máxima (padrão: 0).')
+        parser.add_argument('--pausa', type=float, default=0,
+                            help='Duração de cada tarefa, em milissegundos (padrão: 0).')
+        parser.add_argument('--intervalo', type=float, default=0.05,
+                            help='Segundos entre consultas à fila vazia (padrão: 0.05).')
+        parser.add_argument('--json', action='store_true', help='Gera o resultado em JSON.')
+
+    def handle(self, *args, **options):
+        try:
+            quantidades = [int(n) for n in options['trabalhadores'].split(',')]
+        except ValueError:
+            raise CommandError('Informe as quantidades de trabalhadores como números separados por vírgula.')
+        if options['processos'] > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            raise CommandError('Este sistema não permite criar processos por fork; use --processos 1.')
+        if Tarefa.objects.filter(status__in=Tarefa.ATIVAS).exclude(nome='pausa').exists():
+            raise CommandError('Há tarefas da agenda na fila; execute-as antes de medir a vazão.')
+
+        resultados = {}
+        try:
+            for quantidade in quantidades:
+                Tarefa.objects.filter(nome='pausa').delete()
+                resultados[quantidade] = self._medir(quantidade, options)
+        finally:
+            Tarefa.objects.filter(nome='pausa').delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps(resultados, indent=2))
+            return
+        self.stdout.write(f"{'trabalhadores':>13} {'tarefas/s':>10} {'latência p50 (ms)':>18} "
+                          f"{'latência p95 (ms)':>18} {'enfileirar p95 (ms)':>20} {'repetidas':>10} {'erros':>6}")
+        for quantidade, r in resultados.items():
+            self.stdout.write(f"{quantidade:>13} {r['tarefas_s']:>10.1f} {r['latencia_p50_ms']:>18.1f} "
+                              f"{r['latencia_p95_ms']:>18.1f} {r['enfileirar_p95_ms']:>20.1f} "
+                              f"{r['repetidas']:>10} {r['erros']:>6}")
+
+    def _medir(self, quantidade, options):
+        total, produtores = options['tarefas'], max(options['produtores'], 1)
+        processos = max(min(options['processos'], quantidade), 1)
+        tempos_enfileirar, erros = [], []
+        trava = threading.Lock()
+
+        def produtor(indice):
+            proprios, falhas = [], []
+            comeco = time.perf_counter()
+            try:
+                for i in range(indice, total, produtores):
+                    if options['ritmo']:
+                        time.sleep(max(0, comeco + i / options['ritmo'] - time.perf_counter()))
+                    inicio = time.perf_counter()
+                    try:
+                        tarefas.enfileirar('pausa', options['pausa'])
+                    except OperationalError as erro:
+                        falhas.append(str(erro))
+                    else:
+                        proprios.append(time.perf_counter() - inicio)
+            finally:
+                connections.close_all()
+            with trava:
+                tempos_enfileirar.extend(proprios)
+                erros.extend(falhas)
+
+        # Os trabalhadores começam antes dos produtores, para que a latência
+        # medida seja a de uma fila em funcionamento e não a de uma fila
+        # acumulada.
+        connections.close_all()
+        if processos > 1:
+            contexto = multiprocessing.get_context('fork')
+            parar = contexto.Event()
+            divisao = [quantidade // processos + (i < quantidade % processos) for i in range(processos)]
+            consumidores = [contexto.Process(target=_trabalhadores, args=(i, n, parar, options['intervalo']))
+                            for i, n in enumerate(divisao)]
+        else:
+            parar = threading.Event()
+            consumidores = [threading.Thread(target=_trabalhadores,
+                                             args=(0, quantidade, parar, options['intervalo']))]
+        for consumidor in consumidores:
+            consumidor.start()
+        try:
+            threads = [threading.Thread(target=produtor, args=(i,)) for i in range(produtores)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            enfileiradas = len(tempos_enfileirar)
+            while Tarefa.objects.filter(nome='pausa', status__in=Tarefa.ATIVAS).exists():
+                time.sleep(0.05)
+        finally:
+            parar.set()
+            for consumidor in consumidores:
+                consumidor.join()
+
+        linhas = list(Tarefa.objects.filter(nome='pausa')
+                      .values_list('criada_em', 'iniciada_em', 'concluida_em', 'tentativas'))
+        if not linhas:
+            raise CommandError(f'Nenhuma tarefa foi enfileirada: {erros[:1]}')
+        inicio = min(criada for criada, *_ in linhas)
+        fim = max(concluida for *_, concluida, _ in linhas)
+        latencias = [(concluida - criada).total_seconds() for criada, _, concluida, _ in linhas]
+        return {
+            'tarefas': enfileiradas,
+            'processos': processos,
+            'tarefas_s': len(linhas) / max((fim - inicio).total_seconds(), 1e-6),
+            'latencia_p50_ms': _percentil(latencias, 50) * 1000,
+            'latencia_p95_ms': _percentil(latencias, 95) * 1000,
+            'espera_p95_ms': _percentil([(iniciada - criada).total_seconds() for criada, iniciada, *_ in linhas],
+                                        95) * 1000,
+            'enfileirar_p95_ms': _percentil(tempos_enfileirar, 95) * 1000,
+            'repetidas': sum(1 for *_, tentativas in linhas if tentativas > 1),
+            'erros': len(erros),
+        }
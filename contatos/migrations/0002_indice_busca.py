@@ -0,0 +1,57 @@
+import unicodedata
+
+from django.db import migrations
+
+
+def normalizar(texto):
+    decomposto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in decomposto if not unicodedata.combining(c)).casefold().strip()
+
+
+def criar_indice(apps, schema_editor):
+    # O índice de busca usa uma tabela virtual FTS5, que só existe no SQLite.
+    banco = schema_editor.connection.alias
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS contatos_busca "
+        "USING fts5(nome, telefones, emails, grupos, tokenize='trigram')"
+    )
+    # Preenchemos o índice com os contatos que já existem no banco.
+    Contato = apps.get_model('contatos', 'Contato')
+    Telefone = apps.get_model('contatos', 'Telefone')
+    Email = apps.get_model('contatos', 'Email')
+    telefones = {}
+    for contato_id, numero in Telefone.objects.using(banco).values_list('contato_id', 'numero'):
+        digitos = ''.join(c for c in numero if c.isdigit())
+        telefones.setdefault(contato_id, []).extend([numero, digitos])
+    emails = {}
+    for contato_id, endereco in Email.objects.using(banco).values_list('contato_id', 'endereco'):
+        emails.setdefault(contato_id, []).append(endereco)
+    with schema_editor.connection.cursor() as cursor:
+        for contato in Contato.objects.using(banco).prefetch_related('grupos'):
+            cursor.execute(
+                "INSERT INTO contatos_busca (rowid, nome, telefones, emails, grupos) VALUES (%s, %s, %s, %s, %s)",
+                [contato.id,
+                 normalizar(contato.nome),
+                 normalizar(' '.join(telefones.get(contato.id, []))),
+                 normalizar(' '.join(emails.get(contato.id, []))),
+                 normalizar(' '.join(g.nome for g in contato.grupos.all()))],
+            )
+
+
+def remover_indice(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS contatos_busca")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contatos', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_indice, remover_indice),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contatos', '0002_indice_busca'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='telefone',
+            name='numero_normalizado',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=16),
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+from contatos.telefones import normalizar_telefone
+
+
+def preencher_numero_normalizado(apps, schema_editor):
+    # Calcula a forma normalizada dos telefones cadastrados antes da criação
+    # da coluna 'numero_normalizado', em lotes para limitar o uso de memória.
+    banco = schema_editor.connection.alias
+    Telefone = apps.get_model('contatos', 'Telefone')
+    lote = []
+    for telefone in Telefone.objects.using(banco).only('id', 'numero').iterator(chunk_size=2000):
+        telefone.numero_normalizado = normalizar_telefone(telefone.numero)
+        lote.append(telefone)
+        if len(lote) >= 2000:
+            Telefone.objects.using(banco).bulk_update(lote, ['numero_normalizado'])
+            lote = []
+    if lote:
+        Telefone.objects.using(banco).bulk_update(lote, ['numero_normalizado'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contatos', '0003_telefone_numero_normalizado'),
+    ]
+
+    operations = [
+        migrations.RunPython(preencher_numero_normalizado, migrations.RunPython.noop),
+    ]
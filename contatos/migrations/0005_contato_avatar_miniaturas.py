@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contatos', '0004_preencher_numero_normalizado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contato',
+            name='avatar_miniaturas',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
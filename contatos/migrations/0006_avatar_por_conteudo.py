@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:56
+
+import contatos.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contatos', '0005_contato_avatar_miniaturas'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='contato',
+            name='avatar',
+            field=models.ImageField(blank=True, db_index=True, null=True, storage=contatos.storage.armazenamento_avatares, upload_to='avatares/'),
+        ),
+    ]
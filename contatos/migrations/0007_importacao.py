@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contatos', '0006_avatar_por_conteudo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Importacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('caminho', models.CharField(max_length=500)),
+                ('nome_arquivo', models.CharField(max_length=255)),
+                ('formato', models.CharField(choices=[('vcard', 'vCard'), ('csv', 'CSV')], max_length=5)),
+                ('conflito', models.CharField(choices=[('ignorar', 'Ignorar contatos existentes'), ('mesclar', 'Mesclar com contatos existentes'), ('substituir', 'Substituir contatos existentes')], default='ignorar', max_length=10)),
+                ('status', models.CharField(choices=[('pendente', 'Pendente'), ('andamento', 'Em andamento'), ('concluida', 'Concluída'), ('falhou', 'Falhou')], default='pendente', max_length=10)),
+                ('processados', models.PositiveIntegerField(default=0)),
+                ('criados', models.PositiveIntegerField(default=0)),
+                ('atualizados', models.PositiveIntegerField(default=0)),
+                ('ignorados', models.PositiveIntegerField(default=0)),
+                ('erro', models.TextField(blank=True)),
+                ('criada_em', models.DateTimeField(auto_now_add=True)),
+                ('atualizada_em', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
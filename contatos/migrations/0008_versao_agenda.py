@@ -0,0 +1,39 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def criar_versao(apps, schema_editor):
+    banco = schema_editor.connection.alias
+    VersaoAgenda = apps.get_model('contatos', 'VersaoAgenda')
+    VersaoAgenda.objects.using(banco).get_or_create(id=1, defaults={'versao': 1})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contatos', '0007_importacao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersaoAgenda',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('versao', models.BigIntegerField(default=0)),
+                ('alterada_em', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='contato',
+            name='atualizado_em',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='grupo',
+            name='atualizado_em',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(criar_versao, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Exists, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def preencher_contadores(apps, schema_editor):
+    # Mesmo cálculo de contatos.contadores.reconstruir(), com os modelos
+    # históricos.
+    banco = schema_editor.connection.alias
+    Contato = apps.get_model('contatos', 'Contato')
+    Grupo = apps.get_model('contatos', 'Grupo')
+    Telefone = apps.get_model('contatos', 'Telefone')
+    Email = apps.get_model('contatos', 'Email')
+    ResumoContato = apps.get_model('contatos', 'ResumoContato')
+    Associacao = Contato.grupos.through
+
+    ids = list(Contato.objects.using(banco).order_by('id').values_list('id', flat=True))
+    for inicio in range(0, len(ids), 500):
+        parte = ids[inicio:inicio + 500]
+        grupos = {contato_id: [] for contato_id in parte}
+        for contato_id, grupo_id in Associacao.objects.using(banco).filter(contato_id__in=parte).values_list('contato_id', 'grupo_id'):
+            grupos[contato_id].append(grupo_id)
+        com_telefone = set(Telefone.objects.using(banco).filter(contato_id__in=parte).values_list('contato_id', flat=True))
+        com_email = set(Email.objects.using(banco).filter(contato_id__in=parte).values_list('contato_id', flat=True))
+        ResumoContato.objects.using(banco).bulk_create([
+            ResumoContato(contato_id=contato_id, grupos=sorted(ids_grupos),
+                          tem_telefone=contato_id in com_telefone, tem_email=contato_id in com_email)
+            for contato_id, ids_grupos in grupos.items()])
+
+    def contagem(*filtros):
+        associacoes = (Associacao.objects.using(banco).filter(*filtros, grupo_id=OuterRef('pk')).order_by()
+                       .values('grupo_id').annotate(total=Count('*')).values('total'))
+        return Coalesce(Subquery(associacoes), Value(0))
+
+    Grupo.objects.using(banco).update(
+        total_contatos=contagem(),
+        contatos_com_telefone=contagem(Exists(Telefone.objects.using(banco).filter(contato_id=OuterRef('contato_id')))),
+        contatos_com_email=contagem(Exists(Email.objects.using(banco).filter(contato_id=OuterRef('contato_id')))),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contatos', '0008_versao_agenda'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoContato',
+            fields=[
+                ('contato', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='+', serialize=False, to='contatos.contato')),
+                ('grupos', models.JSONField(default=list)),
+                ('tem_telefone', models.BooleanField(default=False)),
+                ('tem_email', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='grupo',
+            name='contatos_com_email',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='grupo',
+            name='contatos_com_telefone',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='grupo',
+            name='total_contatos',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(preencher_contadores, migrations.RunPython.noop),
+    ]
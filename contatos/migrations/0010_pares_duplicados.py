@@ -0,0 +1,34 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contatos', '0009_contadores_grupos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParDuplicado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pontuacao', models.FloatField()),
+                ('motivos', models.CharField(max_length=100)),
+                ('descartado', models.BooleanField(default=False)),
+                ('detectado_em', models.DateTimeField(auto_now_add=True)),
+                ('contato_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contatos.contato')),
+                ('contato_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contatos.contato')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='parduplicado',
+            index=models.Index(fields=['descartado', '-pontuacao'], name='par_duplicado_revisao'),
+        ),
+        migrations.AddConstraint(
+            model_name='parduplicado',
+            constraint=models.UniqueConstraint(fields=('contato_a', 'contato_b'), name='par_duplicado_unico'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:38
+
+import contatos.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+from contatos.cartoes import montar_dados
+
+
+def preencher_cartoes(apps, schema_editor):
+    # Mesmo cálculo de contatos.cartoes.reconstruir(), com os modelos
+    # históricos.
+    banco = schema_editor.connection.alias
+    Contato = apps.get_model('contatos', 'Contato')
+    Telefone = apps.get_model('contatos', 'Telefone')
+    Email = apps.get_model('contatos', 'Email')
+    CartaoContato = apps.get_model('contatos', 'CartaoContato')
+    Associacao = Contato.grupos.through
+
+    ids = list(Contato.objects.using(banco).order_by('id').values_list('id', flat=True))
+    for inicio in range(0, len(ids), 500):
+        parte = ids[inicio:inicio + 500]
+        relacoes = {contato_id: ([], [], []) for contato_id in parte}
+        for contato_id, nome in Associacao.objects.using(banco).filter(contato_id__in=parte).values_list('contato_id', 'grupo__nome'):
+            relacoes[contato_id][0].append(nome)
+        for contato_id, numero in Telefone.objects.using(banco).filter(contato_id__in=parte).order_by('id').values_list('contato_id', 'numero'):
+            relacoes[contato_id][1].append(numero)
+        for contato_id, endereco in Email.objects.using(banco).filter(contato_id__in=parte).order_by('id').values_list('contato_id', 'endereco'):
+            relacoes[contato_id][2].append(endereco)
+        CartaoContato.objects.using(banco).bulk_create([
+            CartaoContato(contato_id=contato_id, nome=nome, dados=montar_dados(*relacoes[contato_id], avatar, miniaturas))
+            for contato_id, nome, avatar, miniaturas
+            in Contato.objects.using(banco).filter(id__in=parte).values_list('id', 'nome', 'avatar', 'avatar_miniaturas')])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contatos', '0010_pares_duplicados'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartaoContato',
+            fields=[
+                ('contato', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='+', serialize=False, to='contatos.contato')),
+                ('nome', models.CharField(db_index=True, max_length=50)),
+                ('dados', models.JSONField(default=dict, encoder=contatos.models.JSONCompacto)),
+            ],
+        ),
+        migrations.RunPython(preencher_cartoes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:43
+
+from django.db import migrations, models
+
+from contatos.cartoes import calcular_versao
+
+
+def preencher_versoes(apps, schema_editor):
+    banco = schema_editor.connection.alias
+    CartaoContato = apps.get_model('contatos', 'CartaoContato')
+    ultimo = 0
+    while True:
+        cartoes = list(CartaoContato.objects.using(banco).filter(contato_id__gt=ultimo).order_by('contato_id')[:2000])
+        if not cartoes:
+            break
+        for cartao in cartoes:
+            cartao.versao = calcular_versao(cartao.nome, cartao.dados)
+        CartaoContato.objects.using(banco).bulk_update(cartoes, ['versao'], batch_size=500)
+        ultimo = cartoes[-1].contato_id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contatos', '0011_cartoes_contatos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartaocontato',
+            name='versao',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(preencher_versoes, migrations.RunPython.noop),
+    ]
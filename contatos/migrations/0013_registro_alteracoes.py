@@ -0,0 +1,49 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:46
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def registrar_existentes(apps, schema_editor):
+    # Mesmo resultado de contatos.alteracoes.reconstruir(), com os modelos
+    # históricos: uma alteração para cada grupo e cada contato existente.
+    banco = schema_editor.connection.alias
+    Alteracao = apps.get_model('contatos', 'Alteracao')
+    for tipo, nome_modelo in (('grupo', 'Grupo'), ('contato', 'Contato')):
+        ids = list(apps.get_model('contatos', nome_modelo).objects.using(banco).order_by('id').values_list('id', flat=True))
+        for inicio in range(0, len(ids), 500):
+            Alteracao.objects.using(banco).bulk_create([Alteracao(tipo=tipo, objeto_id=objeto_id)
+                                                        for objeto_id in ids[inicio:inicio + 500]])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contatos', '0012_versao_cartoes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Alteracao',
+            fields=[
+                ('sequencia', models.BigAutoField(primary_key=True, serialize=False)),
+                ('tipo', models.CharField(choices=[('contato', 'Contato'), ('grupo', 'Grupo')], max_length=10)),
+                ('objeto_id', models.BigIntegerField()),
+                ('excluido', models.BooleanField(default=False)),
+                ('registrada_em', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CompactacaoAlteracoes',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('horizonte', models.BigIntegerField(default=0)),
+                ('compactada_em', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='alteracao',
+            constraint=models.UniqueConstraint(fields=('tipo', 'objeto_id'), name='alteracao_por_objeto'),
+        ),
+        migrations.RunPython(registrar_existentes, migrations.RunPython.noop),
+    ]
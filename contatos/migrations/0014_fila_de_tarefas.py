@@ -0,0 +1,43 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:54
+
+import contatos.models
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contatos', '0013_registro_alteracoes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tarefa',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=50)),
+                ('argumentos', models.JSONField(default=list, encoder=contatos.models.JSONCompacto)),
+                ('prioridade', models.SmallIntegerField(default=0)),
+                ('chave', models.CharField(blank=True, db_index=True, max_length=200, null=True)),
+                ('status', models.CharField(choices=[('pendente', 'Pendente'), ('executando', 'Executando'), ('concluida', 'Concluída'), ('falhou', 'Falhou')], default='pendente', max_length=10)),
+                ('disponivel_em', models.DateTimeField(default=django.utils.timezone.now)),
+                ('tentativas', models.PositiveSmallIntegerField(default=0)),
+                ('max_tentativas', models.PositiveSmallIntegerField(default=5)),
+                ('trabalhador', models.CharField(blank=True, max_length=100)),
+                ('resultado', models.JSONField(blank=True, encoder=contatos.models.JSONCompacto, null=True)),
+                ('erro', models.TextField(blank=True)),
+                ('criada_em', models.DateTimeField(default=django.utils.timezone.now)),
+                ('iniciada_em', models.DateTimeField(blank=True, null=True)),
+                ('concluida_em', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='tarefa',
+            index=models.Index(fields=['status', '-prioridade', 'disponivel_em'], name='tarefa_fila'),
+        ),
+        migrations.AddConstraint(
+            model_name='tarefa',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ('pendente', 'executando'))), fields=('chave',), name='tarefa_chave_ativa'),
+        ),
+    ]
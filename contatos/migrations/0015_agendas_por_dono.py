@@ -0,0 +1,158 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:15
+
+import contatos.donos
+from django.db import migrations, models
+
+TABELAS_POR_DONO = ['contatos_alteracao', 'contatos_cartaocontato', 'contatos_contato', 'contatos_grupo',
+                    'contatos_parduplicado']
+
+
+def _indices_por_dono(cursor):
+    # (tabela, índice, quantidade de colunas) dos índices que começam pela
+    # coluna 'dono'.
+    for tabela in TABELAS_POR_DONO:
+        cursor.execute(f"SELECT name FROM pragma_index_list('{tabela}')")
+        for (indice,) in cursor.fetchall():
+            cursor.execute(f"SELECT name FROM pragma_index_info('{indice}') ORDER BY seqno")
+            colunas = [coluna for (coluna,) in cursor.fetchall()]
+            if colunas and colunas[0] == 'dono':
+                yield tabela, indice, len(colunas)
+
+
+def fixar_estatisticas(apps, schema_editor):
+    # Sem estatísticas, o SQLite supõe que 'dono = ?' seleciona só 10 linhas
+    # e usa os índices que começam pelo dono até em consultas por id, como
+    # "dono = 1 AND id IN (...)", percorrendo a agenda inteira. Gravamos em
+    # sqlite_stat1 estatísticas fixas dizendo que um dono tem muitas linhas:
+    # esses índices continuam sendo usados para listar a agenda em ordem e
+    # para verificar nomes, e as consultas por id voltam a usar a chave
+    # primária. Um ANALYZE posterior substitui esses valores pelos reais.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('ANALYZE sqlite_schema')
+        for tabela, indice, colunas in list(_indices_por_dono(cursor)):
+            cursor.execute('SELECT 1 FROM sqlite_stat1 WHERE idx = %s', [indice])
+            if cursor.fetchone() is None:
+                cursor.execute('INSERT INTO sqlite_stat1 (tbl, idx, stat) VALUES (%s, %s, %s)',
+                               [tabela, indice, ' '.join(['1000000', '100000'] + ['1'] * (colunas - 1))])
+
+
+def remover_estatisticas(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_schema WHERE name = 'sqlite_stat1'")
+        if cursor.fetchone() is not None:
+            cursor.execute(f"DELETE FROM sqlite_stat1 WHERE tbl IN ({', '.join(['%s'] * len(TABELAS_POR_DONO))})",
+                           TABELAS_POR_DONO)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contatos', '0014_fila_de_tarefas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocalizacaoDono',
+            fields=[
+                ('dono', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('particao', models.CharField(max_length=100)),
+                ('bloqueada', models.BooleanField(default=False)),
+                ('alterada_em', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RemoveConstraint(
+            model_name='tarefa',
+            name='tarefa_chave_ativa',
+        ),
+        migrations.RemoveIndex(
+            model_name='parduplicado',
+            name='par_duplicado_revisao',
+        ),
+        migrations.AddField(
+            model_name='alteracao',
+            name='dono',
+            field=models.PositiveIntegerField(default=contatos.donos.dono_atual, editable=False),
+        ),
+        migrations.AddField(
+            model_name='cartaocontato',
+            name='dono',
+            field=models.PositiveIntegerField(default=contatos.donos.dono_atual, editable=False),
+        ),
+        migrations.AddField(
+            model_name='contato',
+            name='dono',
+            field=models.PositiveIntegerField(default=contatos.donos.dono_atual, editable=False),
+        ),
+        migrations.AddField(
+            model_name='grupo',
+            name='dono',
+            field=models.PositiveIntegerField(default=contatos.donos.dono_atual, editable=False),
+        ),
+        migrations.AddField(
+            model_name='importacao',
+            name='dono',
+            field=models.PositiveIntegerField(default=contatos.donos.dono_atual, editable=False),
+        ),
+        migrations.AddField(
+            model_name='parduplicado',
+            name='dono',
+            field=models.PositiveIntegerField(default=contatos.donos.dono_atual, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tarefa',
+            name='dono',
+            field=models.PositiveIntegerField(default=contatos.donos.dono_atual),
+        ),
+        migrations.AlterField(
+            model_name='cartaocontato',
+            name='nome',
+            field=models.CharField(max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='contato',
+            name='nome',
+            field=models.CharField(max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='grupo',
+            name='nome',
+            field=models.CharField(max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='tarefa',
+            name='chave',
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='alteracao',
+            index=models.Index(fields=['dono', 'sequencia'], name='alteracao_por_dono'),
+        ),
+        migrations.AddIndex(
+            model_name='cartaocontato',
+            index=models.Index(fields=['dono', 'nome'], name='cartao_lista'),
+        ),
+        migrations.AddIndex(
+            model_name='parduplicado',
+            index=models.Index(fields=['dono', 'descartado', '-pontuacao'], name='par_duplicado_revisao'),
+        ),
+        migrations.AddIndex(
+            model_name='tarefa',
+            index=models.Index(fields=['dono', 'chave'], name='tarefa_chave'),
+        ),
+        migrations.AddConstraint(
+            model_name='contato',
+            constraint=models.UniqueConstraint(fields=('dono', 'nome'), name='contato_nome_por_dono'),
+        ),
+        migrations.AddConstraint(
+            model_name='grupo',
+            constraint=models.UniqueConstraint(fields=('dono', 'nome'), name='grupo_nome_por_dono'),
+        ),
+        migrations.AddConstraint(
+            model_name='tarefa',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ('pendente', 'executando'))), fields=('dono', 'chave'), name='tarefa_chave_ativa'),
+        ),
+        migrations.RunPython(fixar_estatisticas, remover_estatisticas),
+    ]
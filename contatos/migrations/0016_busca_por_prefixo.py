@@ -0,0 +1,61 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:15
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+def normalizar(texto):
+    # Cópia de contatos.busca.normalizar() no momento desta migração, como em
+    # 0002_indice_busca, para que alterações no módulo não a alterem.
+    decomposto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in decomposto if not unicodedata.combining(c)).casefold().strip()
+
+
+def preencher_nomes(apps, schema_editor):
+    banco = schema_editor.connection.alias
+    CartaoContato = apps.get_model('contatos', 'CartaoContato')
+    ultimo = 0
+    while True:
+        cartoes = list(CartaoContato.objects.using(banco).filter(contato_id__gt=ultimo).order_by('contato_id')[:2000])
+        if not cartoes:
+            break
+        for cartao in cartoes:
+            cartao.nome_busca = normalizar(cartao.nome)
+        CartaoContato.objects.using(banco).bulk_update(cartoes, ['nome_busca'], batch_size=500)
+        ultimo = cartoes[-1].contato_id
+
+
+def fixar_estatisticas(apps, schema_editor):
+    # Como em 0015_agendas_por_dono: sem estatísticas, o SQLite usaria o
+    # novo índice, que começa pelo dono, até em consultas por id.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_schema WHERE name = 'sqlite_stat1'")
+        if cursor.fetchone() is None:
+            return
+        cursor.execute("DELETE FROM sqlite_stat1 WHERE idx = 'cartao_busca'")
+        cursor.execute("INSERT INTO sqlite_stat1 (tbl, idx, stat) "
+                       "VALUES ('contatos_cartaocontato', 'cartao_busca', '1000000 100000 1')")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contatos', '0015_agendas_por_dono'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartaocontato',
+            name='nome_busca',
+            field=models.CharField(default='', max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='cartaocontato',
+            index=models.Index(fields=['dono', 'nome_busca'], name='cartao_busca'),
+        ),
+        migrations.RunPython(preencher_nomes, migrations.RunPython.noop),
+        migrations.RunPython(fixar_estatisticas, migrations.RunPython.noop),
+    ]
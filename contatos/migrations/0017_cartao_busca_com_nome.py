@@ -0,0 +1,36 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:20
+
+from django.db import migrations, models
+
+
+def fixar_estatisticas(apps, schema_editor):
+    # As mesmas estatísticas de 0016_busca_por_prefixo, agora com a coluna
+    # 'nome' no índice.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_schema WHERE name = 'sqlite_stat1'")
+        if cursor.fetchone() is None:
+            return
+        cursor.execute("DELETE FROM sqlite_stat1 WHERE idx = 'cartao_busca'")
+        cursor.execute("INSERT INTO sqlite_stat1 (tbl, idx, stat) "
+                       "VALUES ('contatos_cartaocontato', 'cartao_busca', '1000000 100000 1 1')")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contatos', '0016_busca_por_prefixo'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='cartaocontato',
+            name='cartao_busca',
+        ),
+        migrations.AddIndex(
+            model_name='cartaocontato',
+            index=models.Index(fields=['dono', 'nome_busca', 'nome'], name='cartao_busca'),
+        ),
+        migrations.RunPython(fixar_estatisticas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 3.2.25 on 2026-10-18 16:40
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+def normalizar(texto):
+    # Cópia de contatos.busca.normalizar() no momento desta migração, como em
+    # 0002_indice_busca, para que alterações no módulo não a alterem.
+    decomposto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in decomposto if not unicodedata.combining(c)).casefold().strip()
+
+
+def preencher_nomes(apps, schema_editor):
+    banco = schema_editor.connection.alias
+    Grupo = apps.get_model('contatos', 'Grupo')
+    ultimo = 0
+    while True:
+        grupos = list(Grupo.objects.using(banco).filter(id__gt=ultimo).order_by('id').only('id', 'nome')[:2000])
+        if not grupos:
+            break
+        for grupo in grupos:
+            grupo.nome_busca = normalizar(grupo.nome)
+        Grupo.objects.using(banco).bulk_update(grupos, ['nome_busca'], batch_size=500)
+        ultimo = grupos[-1].id
+
+
+def fixar_estatisticas(apps, schema_editor):
+    # Como em 0015_agendas_por_dono: sem estatísticas, o SQLite usaria o
+    # novo índice, que começa pelo dono, até em consultas por id.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_schema WHERE name = 'sqlite_stat1'")
+        if cursor.fetchone() is None:
+            return
+        cursor.execute("DELETE FROM sqlite_stat1 WHERE idx = 'grupo_busca'")
+        cursor.execute("INSERT INTO sqlite_stat1 (tbl, idx, stat) "
+                       "VALUES ('contatos_grupo', 'grupo_busca', '1000000 100000 1 1')")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contatos', '0017_cartao_busca_com_nome'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='grupo',
+            name='nome_busca',
+            field=models.CharField(default='', editable=False, max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='grupo',
+            index=models.Index(fields=['dono', 'nome_busca', 'nome'], name='grupo_busca'),
+        ),
+        migrations.RunPython(preencher_nomes, migrations.RunPython.noop),
+        migrations.RunPython(fixar_estatisticas, migrations.RunPython.noop),
+    ]
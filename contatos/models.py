@@ -1,22 +1,333 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
+
+from .donos import ManagerDoDono, dono_atual
+from .storage import armazenamento_avatares
+from .telefones import normalizar_telefone
+
+class JSONCompacto(DjangoJSONEncoder):
+    # JSON sem espaços entre os itens e com os acentos gravados como UTF-8
+    # em vez de sequências '\uXXXX'.
+    def __init__(self, *args, **kwargs):
+        kwargs.update(separators=(',', ':'), ensure_ascii=False)
+        super().__init__(*args, **kwargs)
 
 # Create your models here.
+#
+# Os modelos da agenda pertencem a um dono e ficam na partição dele (ver
+# contatos/donos.py). 'dono' é o id do usuário, sem chave estrangeira, porque
+# os usuários ficam na partição 'default' e a agenda pode estar em outra.
 class Grupo(models.Model):
-    nome = models.CharField(max_length=50, unique=True)
+    dono = models.PositiveIntegerField(default=dono_atual, editable=False)
+    nome = models.CharField(max_length=50)
+    # Nome normalizado (ver contatos/busca.py), calculado automaticamente ao
+    # salvar, para que o seletor de grupos encontre os grupos cujo nome
+    # começa com o texto digitado percorrendo apenas um trecho do índice.
+    nome_busca = models.CharField(max_length=50, default='', editable=False)
     descricao = models.CharField(max_length=280, null=True, blank=True)
+    atualizado_em = models.DateTimeField(auto_now=True)
+    # Contadores mantidos por contatos/contadores.py a cada alteração dos
+    # contatos, para que a lista de grupos não precise agregar as tabelas de
+    # associações, telefones e emails.
+    total_contatos = models.PositiveIntegerField(default=0, editable=False)
+    contatos_com_telefone = models.PositiveIntegerField(default=0, editable=False)
+    contatos_com_email = models.PositiveIntegerField(default=0, editable=False)
+    CONTADORES = ('total_contatos', 'contatos_com_telefone', 'contatos_com_email')
+
+    objects = ManagerDoDono()
+    todos = models.Manager()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['dono', 'nome'], name='grupo_nome_por_dono')]
+        indexes = [models.Index(fields=['dono', 'nome_busca', 'nome'], name='grupo_busca')]
+
+    def save(self, *args, **kwargs):
+        from .busca import normalizar
+        self.nome_busca = normalizar(self.nome)
+        if kwargs.get('update_fields') is not None and 'nome' in kwargs['update_fields']:
+            kwargs['update_fields'] = [*kwargs['update_fields'], 'nome_busca']
+        # Os contadores só são gravados por contatos/contadores.py, somando a
+        # diferença ao valor do banco. Ao salvar um grupo já existente, eles
+        # ficam de fora do UPDATE, para que os valores lidos junto com o
+        # grupo não apaguem as alterações feitas desde então.
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [campo.name for campo in self._meta.concrete_fields
+                                       if not campo.primary_key and campo.name not in self.CONTADORES]
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.nome
 
 class Contato(models.Model):
-    nome = models.CharField(max_length=50, unique=True)
-    avatar = models.ImageField(upload_to='avatares/', null=True, blank=True)
+    dono = models.PositiveIntegerField(default=dono_atual, editable=False)
+    nome = models.CharField(max_length=50)
+    # Os avatares são armazenados pelo hash do seu conteúdo (ver
+    # contatos/storage.py), e a coluna é indexada para permitir contar
+    # rapidamente quantos contatos usam cada arquivo.
+    avatar = models.ImageField(upload_to='avatares/', storage=armazenamento_avatares,
+                               null=True, blank=True, db_index=True)
+    # Indica se as miniaturas do avatar (ver contatos/avatares.py) já foram
+    # geradas. Enquanto não forem, os templates exibem o arquivo original.
+    avatar_miniaturas = models.BooleanField(default=False, editable=False)
     grupos = models.ManyToManyField(Grupo)
+    # Atualizado sempre que o contato, seus telefones, emails ou grupos são
+    # alterados (ver contatos/sincronizacao.py).
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    objects = ManagerDoDono()
+    todos = models.Manager()
 
     class Meta:
         ordering = ['nome']
+        # A restrição cria o índice (dono, nome), que serve tanto à busca
+        # por nome quanto à lista de cada agenda em ordem alfabética.
+        constraints = [models.UniqueConstraint(fields=['dono', 'nome'], name='contato_nome_por_dono')]
+
+    def __str__(self):
+        return self.nome
 
 class Telefone(models.Model):
     numero = models.CharField(max_length=14)
+    # Forma canônica (E.164) de 'numero', calculada automaticamente ao salvar.
+    # É indexada para permitir descobrir o dono de um número com uma consulta.
+    numero_normalizado = models.CharField(max_length=16, db_index=True, editable=False, default='')
     contato = models.ForeignKey(Contato, on_delete=models.CASCADE)
 
+    def save(self, *args, **kwargs):
+        self.numero_normalizado = normalizar_telefone(self.numero)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.numero
+
 class Email(models.Model):
     endereco = models.EmailField(max_length=255)
     contato = models.ForeignKey(Contato, on_delete=models.CASCADE)
+
+    def __str__(self):
+        return self.endereco
+
+class ResumoContato(models.Model):
+    # Última situação de cada contato considerada nos contadores dos grupos
+    # (seus grupos e se tem telefone e email). Comparando-a com a situação
+    # atual, contatos/contadores.py calcula quanto cada contador mudou, sem
+    # recontar os membros dos grupos. A linha de um contato excluído é
+    # removida na sincronização seguinte, por isso não há chave estrangeira.
+    contato = models.OneToOneField(Contato, primary_key=True, on_delete=models.DO_NOTHING,
+                                   db_constraint=False, related_name='+')
+    grupos = models.JSONField(default=list)
+    tem_telefone = models.BooleanField(default=False)
+    tem_email = models.BooleanField(default=False)
+
+class CartaoContato(models.Model):
+    # Modelo de leitura da lista de contatos: uma linha por contato com tudo
+    # o que o seu cartão exibe (grupos, telefones, emails e as URLs do
+    # avatar) já reunido em 'dados', gravada por contatos/cartoes.py a cada
+    # sincronização. Uma página da lista é lida desta tabela com uma única
+    # varredura do índice de 'nome', sem juntar as demais tabelas.
+    contato = models.OneToOneField(Contato, primary_key=True, on_delete=models.DO_NOTHING,
+                                   db_constraint=False, related_name='+')
+    dono = models.PositiveIntegerField(default=dono_atual, editable=False)
+    nome = models.CharField(max_length=50)
+    # O nome sem acentos e em minúsculas (ver contatos.busca.normalizar()),
+    # para a busca por termos curtos, que procura os nomes que começam com o
+    # termo no índice 'cartao_busca', que também guarda o nome (ver
+    # contatos.busca.filtrar_contatos()).
+    nome_busca = models.CharField(max_length=100, default='')
+    dados = models.JSONField(default=dict, encoder=JSONCompacto)
+    # Muda sempre que o conteúdo do cartão muda (ver
+    # contatos.cartoes.calcular_versao()).
+    versao = models.BigIntegerField(default=0)
+
+    objects = ManagerDoDono()
+    todos = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['dono', 'nome'], name='cartao_lista'),
+            models.Index(fields=['dono', 'nome_busca', 'nome'], name='cartao_busca'),
+        ]
+
+    @property
+    def id(self):
+        return self.contato_id
+
+    @property
+    def grupos(self):
+        return self.dados.get('g', ())
+
+    @property
+    def telefones(self):
+        return self.dados.get('t', ())
+
+    @property
+    def emails(self):
+        return self.dados.get('e', ())
+
+    @property
+    def avatar(self):
+        return self.dados.get('a')
+
+class VersaoAgenda(models.Model):
+    # Uma linha para cada dono (com id igual ao dono) que guarda um contador
+    # incrementado a cada alteração da sua agenda. É usada para responder
+    # requisições condicionais (ETag / Last-Modified) sem consultar os
+    # contatos.
+    versao = models.BigIntegerField(default=0)
+    alterada_em = models.DateTimeField(default=timezone.now)
+
+class Importacao(models.Model):
+    # Registro de uma importação de contatos (ver contatos/importacao.py).
+    # 'processados' indica quantos registros do arquivo já foram gravados,
+    # permitindo retomar uma importação interrompida.
+    PENDENTE = 'pendente'
+    EM_ANDAMENTO = 'andamento'
+    CONCLUIDA = 'concluida'
+    FALHOU = 'falhou'
+    STATUS = [
+        (PENDENTE, 'Pendente'),
+        (EM_ANDAMENTO, 'Em andamento'),
+        (CONCLUIDA, 'Concluída'),
+        (FALHOU, 'Falhou'),
+    ]
+
+    dono = models.PositiveIntegerField(default=dono_atual, editable=False)
+    caminho = models.CharField(max_length=500)
+    nome_arquivo = models.CharField(max_length=255)
+    formato = models.CharField(max_length=5, choices=[('vcard', 'vCard'), ('csv', 'CSV')])
+    conflito = models.CharField(max_length=10, default='ignorar',
+                                choices=[('ignorar', 'Ignorar contatos existentes'),
+                                         ('mesclar', 'Mesclar com contatos existentes'),
+                                         ('substituir', 'Substituir contatos existentes')])
+    status = models.CharField(max_length=10, choices=STATUS, default=PENDENTE)
+    processados = models.PositiveIntegerField(default=0)
+    criados = models.PositiveIntegerField(default=0)
+    atualizados = models.PositiveIntegerField(default=0)
+    ignorados = models.PositiveIntegerField(default=0)
+    erro = models.TextField(blank=True)
+    criada_em = models.DateTimeField(auto_now_add=True)
+    atualizada_em = models.DateTimeField(auto_now=True)
+
+    objects = ManagerDoDono()
+    todos = models.Manager()
+
+class ParDuplicado(models.Model):
+    # Par de contatos que provavelmente são a mesma pessoa, encontrado por
+    # contatos/duplicados.py e revisado na view 'duplicados'. 'contato_a' tem
+    # sempre o menor id. Pares descartados na revisão são mantidos para não
+    # serem sugeridos novamente.
+    dono = models.PositiveIntegerField(default=dono_atual, editable=False)
+    contato_a = models.ForeignKey(Contato, on_delete=models.CASCADE, related_name='+')
+    contato_b = models.ForeignKey(Contato, on_delete=models.CASCADE, related_name='+')
+    pontuacao = models.FloatField()
+    motivos = models.CharField(max_length=100)
+    descartado = models.BooleanField(default=False)
+    detectado_em = models.DateTimeField(auto_now_add=True)
+
+    objects = ManagerDoDono()
+    todos = models.Manager()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['contato_a', 'contato_b'], name='par_duplicado_unico')]
+        indexes = [models.Index(fields=['dono', 'descartado', '-pontuacao'], name='par_duplicado_revisao')]
+
+class Alteracao(models.Model):
+    # Registro de alterações da agenda, lido pela view 'sincronizar' para que
+    # os aplicativos atualizem a sua cópia local sem baixar tudo de novo (ver
+    # contatos/alteracoes.py). Cada objeto tem no máximo uma linha, a da sua
+    # alteração mais recente: ao ser alterado de novo, a linha anterior é
+    # apagada e uma nova é criada com a próxima sequência. Alterações em
+    # telefones, emails e grupos de um contato são registradas como
+    # alterações do contato, e exclusões deixam uma linha com 'excluido'.
+    CONTATO = 'contato'
+    GRUPO = 'grupo'
+    TIPOS = [(CONTATO, 'Contato'), (GRUPO, 'Grupo')]
+
+    # No SQLite a chave primária automática é criada com AUTOINCREMENT, então
+    # a sequência nunca se repete, mesmo depois que as últimas linhas são
+    # apagadas.
+    sequencia = models.BigAutoField(primary_key=True)
+    dono = models.PositiveIntegerField(default=dono_atual, editable=False)
+    tipo = models.CharField(max_length=10, choices=TIPOS)
+    objeto_id = models.BigIntegerField()
+    excluido = models.BooleanField(default=False)
+    registrada_em = models.DateTimeField(default=timezone.now)
+
+    objects = ManagerDoDono()
+    todos = models.Manager()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['tipo', 'objeto_id'], name='alteracao_por_objeto')]
+        # Um aplicativo em dia é respondido com uma varredura deste índice a
+        # partir da sua sequência, sem passar pelas alterações de outros donos.
+        indexes = [models.Index(fields=['dono', 'sequencia'], name='alteracao_por_dono')]
+
+class CompactacaoAlteracoes(models.Model):
+    # Uma linha para cada dono (com id igual ao dono). Exclusões da agenda
+    # com sequência até 'horizonte' podem ter sido apagadas do registro de
+    # alterações pela compactação, então um aplicativo sincronizado até antes
+    # dela precisa baixar a agenda inteira de novo.
+    horizonte = models.BigIntegerField(default=0)
+    compactada_em = models.DateTimeField(default=timezone.now)
+
+class Tarefa(models.Model):
+    # Fila de tarefas executadas fora das requisições pelo comando
+    # 'manage.py executar_tarefas' (ver contatos/tarefas.py). A fila é uma
+    # só para todos os donos e fica na partição 'default'; cada tarefa é
+    # executada como o dono que a enfileirou.
+    PENDENTE = 'pendente'
+    EXECUTANDO = 'executando'
+    CONCLUIDA = 'concluida'
+    FALHOU = 'falhou'
+    STATUS = [
+        (PENDENTE, 'Pendente'),
+        (EXECUTANDO, 'Executando'),
+        (CONCLUIDA, 'Concluída'),
+        (FALHOU, 'Falhou'),
+    ]
+    # Tarefas que ainda serão executadas. Uma tarefa 'executando' cujo
+    # 'disponivel_em' já passou foi abandonada pelo trabalhador e volta a
+    # ficar pendente.
+    ATIVAS = (PENDENTE, EXECUTANDO)
+
+    dono = models.PositiveIntegerField(default=dono_atual)
+    nome = models.CharField(max_length=50)
+    argumentos = models.JSONField(default=list, encoder=JSONCompacto)
+    # Tarefas com prioridade maior são executadas primeiro.
+    prioridade = models.SmallIntegerField(default=0)
+    # Enquanto houver uma tarefa ativa do mesmo dono com a mesma chave,
+    # enfileirar outra retorna a tarefa existente em vez de criar uma nova.
+    chave = models.CharField(max_length=200, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS, default=PENDENTE)
+    # Momento a partir do qual a tarefa pode ser executada: o agendamento de
+    # uma tarefa pendente (ou da sua próxima tentativa) ou, durante a
+    # execução, o fim do prazo do trabalhador que a reservou.
+    disponivel_em = models.DateTimeField(default=timezone.now)
+    tentativas = models.PositiveSmallIntegerField(default=0)
+    max_tentativas = models.PositiveSmallIntegerField(default=5)
+    trabalhador = models.CharField(max_length=100, blank=True)
+    resultado = models.JSONField(null=True, blank=True, encoder=JSONCompacto)
+    erro = models.TextField(blank=True)
+    criada_em = models.DateTimeField(default=timezone.now)
+    iniciada_em = models.DateTimeField(null=True, blank=True)
+    concluida_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['dono', 'chave'], name='tarefa_chave_ativa',
+                                               condition=models.Q(status__in=('pendente', 'executando')))]
+        # A próxima tarefa é a primeira pendente já disponível na ordem deste
+        # índice, sem ordenar a fila nem percorrer as tarefas concluídas, que
+        # são a maior parte da tabela.
+        indexes = [models.Index(fields=['status', '-prioridade', 'disponivel_em'], name='tarefa_fila'),
+                   models.Index(fields=['dono', 'chave'], name='tarefa_chave')]
+
+class LocalizacaoDono(models.Model):
+    # Partição em que está a agenda de um dono, quando não é a escolhida pelo
+    # hash do dono (ver contatos/donos.py), gravada por 'manage.py
+    # mover_dono'. Enquanto a agenda está sendo copiada para outra partição,
+    # 'bloqueada' faz as requisições do dono receberem 503.
+    dono = models.PositiveIntegerField(primary_key=True)
+    particao = models.CharField(max_length=100)
+    bloqueada = models.BooleanField(default=False)
+    alterada_em = models.DateTimeField(auto_now=True)
@@ -0,0 +1,220 @@
+from django.db import router, transaction
+from django.db.models import Q
+
+from .busca import filtrar_contatos
+from .donos import particao
+from .importacao import inserir_em_lote
+from .models import Contato, Grupo, Telefone, Email, ParDuplicado
+from .sincronizacao import contatos_alterados, sincronizacao_adiada
+from .storage import liberar_avatar_apos_commit
+
+# Operações sobre muitos contatos de uma vez (excluir, incluir em um grupo,
+# retirar de um grupo e mover entre grupos), usadas pela view
+# contatos_em_lote_view e pelo comando 'manage.py contatos_em_lote', e a
+# união de contatos duplicados, usada por par_duplicado_view.
+#
+# Cada operação executa algumas instruções SQL por parte de TAMANHO_PARTE
+# contatos, todas dentro de uma única transação, em vez de carregar e salvar
+# (ou excluir) cada contato, telefone e email individualmente. Como as
+# instruções não disparam signals, as estruturas derivadas são atualizadas
+# com uma única chamada a contatos_alterados() ao final.
+
+ACOES = ('excluir', 'adicionar', 'remover', 'mover')
+
+# Quantidade de ids em cada cláusula IN, abaixo do limite de parâmetros por
+# consulta de versões antigas do SQLite (999).
+TAMANHO_PARTE = 500
+
+Associacao = Contato.grupos.through
+
+
+def _partes(ids):
+    for inicio in range(0, len(ids), TAMANHO_PARTE):
+        yield ids[inicio:inicio + TAMANHO_PARTE]
+
+
+def _apagar(queryset):
+    # DELETE direto no banco. Diferente de QuerySet.delete(), não carrega as
+    # linhas na memória para disparar os signals de post_delete (que Contato,
+    # Telefone e Email têm) nem para seguir as chaves estrangeiras, então as
+    # tabelas dependentes precisam ser apagadas antes.
+    return queryset._raw_delete(router.db_for_write(queryset.model))
+
+
+def selecionar_contatos(ids=None, busca=None, grupo_id=None):
+    # Retorna os ids dos contatos existentes que atendem a todos os critérios
+    # informados: uma lista de ids, um termo de busca e/ou um grupo. Ao menos
+    # um critério é obrigatório, para que uma operação não atinja a agenda
+    # inteira por engano.
+    if ids is None and not busca and not grupo_id:
+        raise ValueError('Informe os contatos (ids), uma busca ou um grupo.')
+    contatos = Contato.objects.order_by()
+    if grupo_id:
+        contatos = contatos.filter(grupos__id=grupo_id)
+    if busca:
+        contatos = filtrar_contatos(contatos, busca)
+    if ids is None:
+        return list(contatos.values_list('id', flat=True).distinct())
+    selecionados = []
+    for parte in _partes(list(dict.fromkeys(ids))):
+        selecionados.extend(contatos.filter(id__in=parte).values_list('id', flat=True).distinct())
+    return selecionados
+
+
+def excluir_contatos(ids):
+    # Exclui os contatos, com seus telefones, emails e associações com
+    # grupos. Os arquivos de avatar que deixarem de ser usados são apagados
+    # depois que a transação for confirmada. Retorna o número de contatos
+    # excluídos.
+    ids = list(dict.fromkeys(ids))
+    excluidos = 0
+    with transaction.atomic(using=particao()), sincronizacao_adiada():
+        avatares = set()
+        for parte in _partes(ids):
+            avatares.update(Contato.objects.filter(id__in=parte).exclude(avatar__isnull=True)
+                            .exclude(avatar='').values_list('avatar', flat=True).distinct())
+            _apagar(Associacao.objects.filter(contato_id__in=parte))
+            _apagar(Telefone.objects.filter(contato_id__in=parte))
+            _apagar(Email.objects.filter(contato_id__in=parte))
+            _apagar(ParDuplicado.objects.filter(Q(contato_a_id__in=parte) | Q(contato_b_id__in=parte)))
+            excluidos += _apagar(Contato.objects.filter(id__in=parte))
+        contatos_alterados(ids)
+        for nome in avatares:
+            liberar_avatar_apos_commit(nome)
+    return excluidos
+
+
+def adicionar_ao_grupo(ids, grupo_id):
+    # Inclui os contatos no grupo; os que já fazem parte dele são ignorados.
+    ids = list(dict.fromkeys(ids))
+    with transaction.atomic(using=particao()), sincronizacao_adiada():
+        if not Grupo.objects.filter(id=grupo_id).exists():
+            raise Grupo.DoesNotExist(f'Grupo {grupo_id} não encontrado.')
+        for parte in _partes(ids):
+            inserir_em_lote(Associacao, ('contato', 'grupo'), [(contato_id, grupo_id) for contato_id in parte],
+                            ignorar_conflitos=True)
+        contatos_alterados(ids)
+    return len(ids)
+
+
+def remover_do_grupo(ids, grupo_id=None):
+    # Retira os contatos do grupo, ou de todos os grupos se 'grupo_id' for
+    # None. Retorna o número de associações removidas.
+    ids = list(dict.fromkeys(ids))
+    removidas = 0
+    with transaction.atomic(using=particao()), sincronizacao_adiada():
+        for parte in _partes(ids):
+            associacoes = Associacao.objects.filter(contato_id__in=parte)
+            if grupo_id:
+                associacoes = associacoes.filter(grupo_id=grupo_id)
+            removidas += _apagar(associacoes)
+        contatos_alterados(ids)
+    return removidas
+
+
+def mover_para_grupo(ids, grupo_id, origem_id=None):
+    # Retira os contatos do grupo 'origem_id' (ou de todos os grupos, se não
+    # for informado) e os inclui no grupo 'grupo_id'.
+    with transaction.atomic(using=particao()), sincronizacao_adiada():
+        remover_do_grupo(ids, origem_id)
+        return adicionar_ao_grupo(ids, grupo_id)
+
+
+def executar(acao, ids, grupo_id=None, origem_id=None):
+    # Ponto de entrada comum da view e do comando.
+    if acao not in ACOES:
+        raise ValueError(f'Ação desconhecida: {acao}')
+    if acao == 'excluir':
+        return excluir_contatos(ids)
+    if not grupo_id and acao != 'remover':
+        raise ValueError('Informe o grupo.')
+    if acao == 'adicionar':
+        return adicionar_ao_grupo(ids, grupo_id)
+    if acao == 'remover':
+        return remover_do_grupo(ids, grupo_id)
+    return mover_para_grupo(ids, grupo_id, origem_id)
+
+
+def mesclar_contatos(sobrevivente_id, ids):
+    # Une ao contato 'sobrevivente_id' os contatos em 'ids' (duplicados dele)
+    # e exclui estes últimos, tudo em uma transação. O sobrevivente recebe os
+    # telefones e emails que ainda não tem, os grupos dos demais e, se não
+    # tiver avatar, o primeiro avatar encontrado. Retorna o número de
+    # contatos unidos a ele.
+    ids = [contato_id for contato_id in dict.fromkeys(ids) if contato_id != sobrevivente_id]
+    with transaction.atomic(using=particao()), sincronizacao_adiada():
+        sobrevivente = Contato.objects.filter(id=sobrevivente_id).values('avatar').first()
+        duplicados = list(Contato.objects.filter(id__in=ids).order_by('id')
+                          .values('id', 'avatar', 'avatar_miniaturas'))
+        if sobrevivente is None or len(duplicados) != len(ids):
+            raise Contato.DoesNotExist('Contato não encontrado.')
+
+        numeros = set(Telefone.objects.filter(contato_id=sobrevivente_id).values_list('numero_normalizado', flat=True))
+        mover, repetidos = [], []
+        for telefone_id, numero in (Telefone.objects.filter(contato_id__in=ids).order_by('id')
+                                    .values_list('id', 'numero_normalizado')):
+            if numero and numero in numeros:
+                repetidos.append(telefone_id)
+            else:
+                numeros.add(numero)
+                mover.append(telefone_id)
+        Telefone.objects.filter(id__in=mover).update(contato_id=sobrevivente_id)
+        _apagar(Telefone.objects.filter(id__in=repetidos))
+
+        enderecos = {endereco.lower() for endereco in
+                     Email.objects.filter(contato_id=sobrevivente_id).values_list('endereco', flat=True)}
+        mover, repetidos = [], []
+        for email_id, endereco in Email.objects.filter(contato_id__in=ids).order_by('id').values_list('id', 'endereco'):
+            if endereco.lower() in enderecos:
+                repetidos.append(email_id)
+            else:
+                enderecos.add(endereco.lower())
+                mover.append(email_id)
+        Email.objects.filter(id__in=mover).update(contato_id=sobrevivente_id)
+        _apagar(Email.objects.filter(id__in=repetidos))
+
+        grupos = set(Associacao.objects.filter(contato_id__in=ids).values_list('grupo_id', flat=True))
+        inserir_em_lote(Associacao, ('contato', 'grupo'), [(sobrevivente_id, grupo_id) for grupo_id in grupos],
+                        ignorar_conflitos=True)
+        _apagar(Associacao.objects.filter(contato_id__in=ids))
+
+        avatar = sobrevivente['avatar']
+        if not avatar:
+            com_avatar = next((duplicado for duplicado in duplicados if duplicado['avatar']), None)
+            if com_avatar:
+                avatar = com_avatar['avatar']
+                Contato.objects.filter(id=sobrevivente_id).update(
+                    avatar=avatar, avatar_miniaturas=com_avatar['avatar_miniaturas'])
+
+        _apagar(ParDuplicado.objects.filter(Q(contato_a_id__in=ids) | Q(contato_b_id__in=ids)))
+        _apagar(Contato.objects.filter(id__in=ids))
+        contatos_alterados([sobrevivente_id, *ids])
+        for duplicado in duplicados:
+            if duplicado['avatar'] and duplicado['avatar'] != avatar:
+                liberar_avatar_apos_commit(duplicado['avatar'])
+    return len(ids)
+
+
+def _excluir_do_contato(modelo, ids, contato_id=None):
+    ids = list(dict.fromkeys(ids))
+    excluidos = 0
+    with transaction.atomic(using=particao()), sincronizacao_adiada():
+        contatos = set()
+        for parte in _partes(ids):
+            linhas = modelo.objects.filter(id__in=parte)
+            if contato_id is not None:
+                linhas = linhas.filter(contato_id=contato_id)
+            contatos.update(linhas.values_list('contato_id', flat=True))
+            excluidos += _apagar(linhas)
+        contatos_alterados(contatos)
+    return excluidos
+
+
+def excluir_telefones(ids, contato_id=None):
+    # Exclui os telefones pelos seus ids. Com 'contato_id', apenas os
+    # telefones daquele contato são considerados.
+    return _excluir_do_contato(Telefone, ids, contato_id)
+
+
+def excluir_emails(ids, contato_id=None):
+    return _excluir_do_contato(Email, ids, contato_id)
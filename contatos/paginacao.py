@@ -0,0 +1,82 @@
+from urllib.parse import urlencode
+
+from django.conf import settings
+
+# Quantidade de contatos exibidos por página quando o usuário não escolhe
+# outra, e o limite máximo aceito através do parâmetro 'por_pagina'.
+POR_PAGINA_PADRAO = getattr(settings, 'CONTATOS_POR_PAGINA', 24)
+POR_PAGINA_MAXIMO = getattr(settings, 'CONTATOS_POR_PAGINA_MAXIMO', 120)
+
+
+def ler_por_pagina(valor):
+    # Converte o valor recebido na querystring para um inteiro entre 1 e
+    # POR_PAGINA_MAXIMO. Valores inválidos resultam no tamanho padrão.
+    try:
+        por_pagina = int(valor)
+    except (TypeError, ValueError):
+        return POR_PAGINA_PADRAO
+    return max(1, min(por_pagina, POR_PAGINA_MAXIMO))
+
+
+class PaginaKeyset:
+    # Representa uma página de resultados obtida através de paginação por
+    # cursor (keyset). Ao invés de usar OFFSET, que obriga o banco de dados a
+    # percorrer todas as linhas anteriores e "pula" ou repete registros quando
+    # contatos são inseridos entre uma página e outra, guardamos o valor da
+    # coluna de ordenação do primeiro e do último item da página.
+    def __init__(self, itens, por_pagina, cursor_anterior=None, cursor_proximo=None):
+        self.itens = itens
+        self.por_pagina = por_pagina
+        self.cursor_anterior = cursor_anterior
+        self.cursor_proximo = cursor_proximo
+
+    def __iter__(self):
+        return iter(self.itens)
+
+    def __len__(self):
+        return len(self.itens)
+
+    @property
+    def tem_anterior(self):
+        return self.cursor_anterior is not None
+
+    @property
+    def tem_proxima(self):
+        return self.cursor_proximo is not None
+
+    def querystring(self, direcao, **extras):
+        # Monta a querystring usada nos links de navegação, preservando os
+        # parâmetros extras (como a busca atual) que tenham algum valor.
+        params = {chave: valor for chave, valor in extras.items() if valor}
+        if self.por_pagina != POR_PAGINA_PADRAO:
+            params['por_pagina'] = self.por_pagina
+        if direcao == 'anterior':
+            params['antes'] = self.cursor_anterior
+        else:
+            params['depois'] = self.cursor_proximo
+        return urlencode(params)
+
+
+def paginar_por_nome(queryset, depois=None, antes=None, por_pagina=POR_PAGINA_PADRAO):
+    # Pagina 'queryset' pela coluna 'nome', que é única e indexada em Contato,
+    # de forma que cada página custa uma única varredura de intervalo no
+    # índice, independente de quantas páginas vêm antes dela.
+    # 'depois' avança para os itens posteriores ao nome informado e 'antes'
+    # volta para os itens anteriores. Buscamos um item a mais do que o tamanho
+    # da página apenas para saber se existe uma página seguinte.
+    if antes is not None:
+        linhas = list(queryset.filter(nome__lt=antes).order_by('-nome')[:por_pagina + 1])
+        ha_mais = len(linhas) > por_pagina
+        itens = linhas[:por_pagina][::-1]
+        cursor_anterior = itens[0].nome if ha_mais else None
+        # Se viemos de uma página posterior, ela continua existindo.
+        cursor_proximo = itens[-1].nome if itens else None
+    else:
+        if depois is not None:
+            queryset = queryset.filter(nome__gt=depois)
+        linhas = list(queryset.order_by('nome')[:por_pagina + 1])
+        ha_mais = len(linhas) > por_pagina
+        itens = linhas[:por_pagina]
+        cursor_anterior = itens[0].nome if depois is not None and itens else None
+        cursor_proximo = itens[-1].nome if ha_mais else None
+    return PaginaKeyset(itens, por_pagina, cursor_anterior, cursor_proximo)
@@ -0,0 +1,189 @@
+import time
+
+from django.db import connections, transaction
+from django.db.models import Max
+
+from . import busca, donos
+from .importacao import inserir_em_lote
+from .models import (Alteracao, CartaoContato, CompactacaoAlteracoes, Contato, Email, Grupo, Importacao,
+                     LocalizacaoDono, ParDuplicado, ResumoContato, Tarefa, Telefone, VersaoAgenda)
+from .sincronizacao import reconstruir_derivados
+
+# Mudança da agenda de um dono para outra partição (ver contatos/donos.py),
+# feita por 'manage.py mover_dono':
+#
+#   1. a agenda é bloqueada em LocalizacaoDono: as requisições do dono
+#      recebem 503 e as suas tarefas são adiadas. A cópia espera
+#      AGENDA_VALIDADE_LOCALIZACAO segundos, para que nenhum processo
+#      continue usando a localização antiga;
+#   2. os grupos, contatos, telefones, emails, associações, importações e
+#      pares de duplicados são copiados para a partição de destino, em uma
+#      única transação, e as estruturas derivadas são reconstruídas lá;
+#   3. a nova partição é registrada, a agenda é desbloqueada e a cópia da
+#      partição de origem é apagada.
+#
+# Os ids são únicos apenas dentro de cada partição, então os objetos copiados
+# recebem ids novos. Os tokens de sincronização emitidos antes da mudança
+# expiram (os aplicativos baixam a agenda inteira de novo), e endereços com o
+# id antigo de um contato ou de uma importação deixam de funcionar.
+#
+# Se a mudança for interrompida antes do passo 3, a agenda continua na
+# partição de origem, bloqueada, e basta executar o comando de novo: o que
+# ficou no destino é apagado antes da nova cópia. Depois do passo 3, o que
+# sobrar na origem é ignorado (ver donos.todos_os_donos()) e apagado por
+# uma próxima mudança para aquela partição.
+
+TAMANHO_PARTE = 500
+
+Associacao = Contato.grupos.through
+
+
+class MudancaImpossivel(Exception):
+    pass
+
+
+def _partes(linhas):
+    for inicio in range(0, len(linhas), TAMANHO_PARTE):
+        yield linhas[inicio:inicio + TAMANHO_PARTE]
+
+
+def _campos(modelo):
+    return [campo.attname for campo in modelo._meta.concrete_fields if not campo.primary_key]
+
+
+def _inserir(modelo, campos, linhas):
+    # Grava as linhas na partição atual com os valores exatamente como foram
+    # lidos, sem os pre_save() de auto_now e auto_now_add que bulk_create()
+    # aplicaria às datas.
+    conexao = connections[donos.particao()]
+    campos_modelo = [modelo._meta.get_field(campo) for campo in campos]
+    inserir_em_lote(modelo, campos, [tuple(campo.get_db_prep_save(valor, conexao)
+                                           for campo, valor in zip(campos_modelo, linha))
+                                     for linha in linhas])
+
+
+def _copiar_por_nome(modelo, dono, origem):
+    # Copia os grupos ou os contatos do dono para a partição atual e retorna
+    # {id na origem: id no destino}. Os novos ids são encontrados pelo nome,
+    # que é único na agenda do dono.
+    campos = _campos(modelo)
+    ids = {}
+    ultimo_id = 0
+    while True:
+        linhas = list(modelo.todos.using(origem).filter(dono=dono, id__gt=ultimo_id).order_by('id')
+                      .values_list('id', *campos)[:TAMANHO_PARTE])
+        if not linhas:
+            return ids
+        _inserir(modelo, campos, [linha[1:] for linha in linhas])
+        indice_nome = campos.index('nome') + 1
+        novos = dict(modelo.objects.filter(nome__in=[linha[indice_nome] for linha in linhas])
+                     .values_list('nome', 'id'))
+        ids.update((linha[0], novos[linha[indice_nome]]) for linha in linhas)
+        ultimo_id = linhas[-1][0]
+
+
+def _copiar(dono, origem):
+    # Copia a agenda do dono da partição 'origem' para a partição atual.
+    grupos = _copiar_por_nome(Grupo, dono, origem)
+    contatos = _copiar_por_nome(Contato, dono, origem)
+    for parte in _partes(list(contatos)):
+        _inserir(Telefone, ('contato_id', 'numero', 'numero_normalizado'),
+                 [(contatos[contato_id], numero, normalizado) for contato_id, numero, normalizado
+                  in Telefone.objects.using(origem).filter(contato_id__in=parte).order_by('id')
+                  .values_list('contato_id', 'numero', 'numero_normalizado')])
+        _inserir(Email, ('contato_id', 'endereco'),
+                 [(contatos[contato_id], endereco) for contato_id, endereco
+                  in Email.objects.using(origem).filter(contato_id__in=parte).order_by('id')
+                  .values_list('contato_id', 'endereco')])
+        _inserir(Associacao, ('contato_id', 'grupo_id'),
+                 [(contatos[contato_id], grupos[grupo_id]) for contato_id, grupo_id
+                  in Associacao.objects.using(origem).filter(contato_id__in=parte)
+                  .values_list('contato_id', 'grupo_id')])
+
+    campos = _campos(Importacao)
+    _inserir(Importacao, campos, Importacao.todos.using(origem).filter(dono=dono).order_by('id')
+             .values_list(*campos))
+
+    campos = _campos(ParDuplicado)
+    pares = []
+    for par in ParDuplicado.todos.using(origem).filter(dono=dono).order_by('id').values(*campos):
+        # 'contato_a' tem sempre o menor id.
+        par['contato_a_id'], par['contato_b_id'] = sorted((contatos[par['contato_a_id']],
+                                                           contatos[par['contato_b_id']]))
+        pares.append([par[campo] for campo in campos])
+    _inserir(ParDuplicado, campos, pares)
+
+    # A versão continua a contagem da origem (e é incrementada pela
+    # reconstrução), para que nenhum ETag anterior à mudança seja aceito.
+    versao = VersaoAgenda.objects.using(origem).filter(id=dono).values_list('versao', flat=True).first() or 0
+    VersaoAgenda.objects.create(id=dono, versao=versao)
+
+    # As sequências do registro de alterações do destino passam a ser
+    # maiores que todas as da origem. Assim a reconstrução do registro avança
+    # o horizonte além de qualquer token emitido na origem, que expira.
+    ultima = Alteracao.todos.using(origem).aggregate(ultima=Max('sequencia'))['ultima'] or 0
+    conexao = connections[donos.particao()]
+    if conexao.vendor == 'sqlite':
+        tabela = Alteracao._meta.db_table
+        with conexao.cursor() as cursor:
+            cursor.execute('UPDATE sqlite_sequence SET seq = MAX(seq, %s) WHERE name = %s', [ultima, tabela])
+            if not cursor.rowcount:
+                cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [tabela, ultima])
+    reconstruir_derivados()
+    return len(contatos)
+
+
+def apagar_agenda(dono, alias):
+    # Apaga da partição 'alias' tudo o que é do dono, diretamente nas
+    # tabelas.
+    contatos = Contato.todos.using(alias).filter(dono=dono).order_by().values('id')
+    conexao = connections[alias]
+    if conexao.vendor == 'sqlite':
+        with conexao.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {busca.TABELA} WHERE rowid IN '
+                           f'(SELECT id FROM {Contato._meta.db_table} WHERE dono = %s)', [dono])
+    for queryset in (Associacao.objects.filter(contato_id__in=contatos),
+                     Telefone.objects.filter(contato_id__in=contatos),
+                     Email.objects.filter(contato_id__in=contatos),
+                     ResumoContato.objects.filter(contato_id__in=contatos),
+                     ParDuplicado.todos.filter(dono=dono), CartaoContato.todos.filter(dono=dono),
+                     Alteracao.todos.filter(dono=dono), Importacao.todos.filter(dono=dono),
+                     Contato.todos.filter(dono=dono), Grupo.todos.filter(dono=dono),
+                     VersaoAgenda.objects.filter(id=dono), CompactacaoAlteracoes.objects.filter(id=dono)):
+        queryset.using(alias)._raw_delete(alias)
+
+
+def _registrar(dono, alias, bloqueada):
+    # Registra a partição do dono, ou apaga o registro quando ela é a
+    # escolhida pelo hash e a agenda não está bloqueada.
+    if alias == donos.particao_por_hash(dono) and not bloqueada:
+        LocalizacaoDono.objects.filter(dono=dono).delete()
+    else:
+        LocalizacaoDono.objects.update_or_create(dono=dono, defaults={'particao': alias, 'bloqueada': bloqueada})
+    donos.esquecer_localizacoes()
+
+
+def mover(dono, destino, espera=donos.VALIDADE_LOCALIZACAO):
+    # Move a agenda do dono para a partição 'destino' e retorna a quantidade
+    # de contatos copiados. A agenda fica bloqueada durante a cópia.
+    if destino not in donos.PARTICOES:
+        raise MudancaImpossivel(f'Partição desconhecida: {destino!r}.')
+    origem = donos.particao(dono)
+    if origem == destino:
+        return 0
+    _registrar(dono, origem, bloqueada=True)
+    try:
+        time.sleep(espera)
+        # As tarefas guardam ids de objetos da agenda, que mudam na cópia.
+        if Tarefa.objects.filter(dono=dono, status__in=Tarefa.ATIVAS).exists():
+            raise MudancaImpossivel(f'O dono {dono} tem tarefas na fila; execute-as antes de mover a agenda.')
+        with donos.como_dono(dono, particao=destino), transaction.atomic(using=destino):
+            apagar_agenda(dono, destino)
+            copiados = _copiar(dono, origem)
+    except BaseException:
+        _registrar(dono, origem, bloqueada=False)
+        raise
+    _registrar(dono, destino, bloqueada=False)
+    with transaction.atomic(using=origem):
+        apagar_agenda(dono, origem)
+    return copiados
@@ -0,0 +1,104 @@
+from django.db.models.signals import post_init, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import Contato, Grupo, Telefone, Email
+from .sincronizacao import contatos_alterados, grupos_alterados, agenda_alterada
+from .storage import liberar_avatar_apos_commit
+
+# Este módulo mantém as estruturas derivadas dos modelos do app (como o
+# índice de busca e os arquivos de avatar) sincronizadas com as alterações
+# feitas nos contatos, telefones, emails e grupos, através de
+# contatos/sincronizacao.py. Ele é importado em ContatosConfig.ready().
+
+
+@receiver(post_init, sender=Contato)
+def contato_carregado(sender, instance, **kwargs):
+    # Guardamos o avatar com que o contato foi carregado para saber, ao
+    # salvar, se o arquivo anterior deixou de ser usado. Lemos o valor de
+    # __dict__ para não disparar uma consulta quando o campo for adiado.
+    instance._avatar_original = instance.__dict__.get('avatar')
+
+
+@receiver(post_save, sender=Contato)
+def contato_salvo(sender, instance, **kwargs):
+    contatos_alterados([instance.id])
+    anterior = getattr(instance, '_avatar_original', None)
+    atual = instance.avatar.name if instance.avatar else None
+    if anterior and anterior != atual:
+        liberar_avatar_apos_commit(str(anterior))
+    instance._avatar_original = atual
+
+
+@receiver(post_delete, sender=Contato)
+def contato_excluido(sender, instance, **kwargs):
+    contatos_alterados([instance.id])
+    if instance.avatar:
+        liberar_avatar_apos_commit(instance.avatar.name)
+
+
+@receiver(post_save, sender=Telefone)
+@receiver(post_delete, sender=Telefone)
+@receiver(post_save, sender=Email)
+@receiver(post_delete, sender=Email)
+def telefone_ou_email_alterado(sender, instance, **kwargs):
+    contatos_alterados([instance.contato_id])
+
+
+@receiver(post_init, sender=Grupo)
+def grupo_carregado(sender, instance, **kwargs):
+    # Guardamos o nome com que o grupo foi carregado (None se o campo foi
+    # adiado) para saber, ao salvar, se ele mudou.
+    instance._nome_original = instance.__dict__.get('nome')
+
+
+@receiver(post_save, sender=Grupo)
+def grupo_salvo(sender, instance, created, **kwargs):
+    # Um grupo recém-criado ainda não tem contatos. Já a alteração do nome de
+    # um grupo existente precisa ser refletida no índice, nos cartões e no
+    # registro de alterações de todos os seus contatos; as demais alterações
+    # (como a descrição) não mudam nada nos contatos.
+    grupos_alterados([instance.id])
+    nome_alterado = not created and instance._nome_original != instance.nome
+    instance._nome_original = instance.nome
+    ids = list(instance.contato_set.values_list('id', flat=True)) if nome_alterado else []
+    if ids:
+        contatos_alterados(ids)
+    else:
+        agenda_alterada()
+
+
+@receiver(m2m_changed, sender=Contato.grupos.through)
+def grupos_do_contato_alterados(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear', 'pre_clear'):
+        return
+    if not reverse:
+        # contato.grupos.add(...), remove(...) ou clear()
+        if action != 'pre_clear':
+            contatos_alterados([instance.id])
+    elif action == 'pre_clear':
+        # grupo.contato_set.clear(): guardamos os contatos antes que a
+        # associação seja removida, para reindexá-los em seguida.
+        instance._contatos_antes_de_limpar = list(instance.contato_set.values_list('id', flat=True))
+    elif action == 'post_clear':
+        contatos_alterados(getattr(instance, '_contatos_antes_de_limpar', []))
+    else:
+        # grupo.contato_set.add(...) ou remove(...)
+        contatos_alterados(pk_set or [])
+
+
+@receiver(pre_delete, sender=Grupo)
+def grupo_sera_excluido(sender, instance, **kwargs):
+    instance._contatos_do_grupo = list(instance.contato_set.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Grupo)
+def grupo_excluido(sender, instance, **kwargs):
+    # Ao excluir um grupo, o Django remove as associações com os contatos sem
+    # disparar m2m_changed. Os contatos afetados foram guardados em
+    # pre_delete para que possam ser reindexados sem o nome do grupo.
+    grupos_alterados([instance.id])
+    ids = getattr(instance, '_contatos_do_grupo', [])
+    if ids:
+        contatos_alterados(ids)
+    else:
+        agenda_alterada()
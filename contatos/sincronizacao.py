@@ -0,0 +1,131 @@
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import alteracoes, autocompletar, busca, cartoes, contadores, situacao
+from .donos import dono_atual, particao
+from .models import Alteracao, Contato, VersaoAgenda
+
+# Este módulo concentra a atualização das estruturas derivadas dos contatos
+# (como o índice de busca, os contadores dos grupos, os cartões da lista, o
+# índice de sugestões, o registro de alterações e a versão da agenda). Os
+# receivers em contatos/signals.py informam aqui os contatos e grupos
+# alterados, e operações que alteram muitas linhas de uma vez (bulk_update,
+# update, delete em lote) chamam contatos_alterados() diretamente, já que
+# essas operações não disparam signals.
+
+_estado = threading.local()
+
+
+def versao_agenda():
+    # Retorna o número da versão atual da agenda do dono e o momento da
+    # última alteração, com uma única consulta pela chave primária.
+    versao = VersaoAgenda.objects.filter(id=dono_atual()).values_list('versao', 'alterada_em').first()
+    return versao or (0, None)
+
+
+def incrementar_versao():
+    # A versão da agenda é um contador de cada dono, incrementado a cada
+    # alteração de contatos, telefones, emails ou grupos. Ela permite saber
+    # se alguma coisa mudou desde uma requisição anterior lendo uma única
+    # linha.
+    dono = dono_atual()
+    if not VersaoAgenda.objects.filter(id=dono).update(versao=F('versao') + 1, alterada_em=timezone.now()):
+        VersaoAgenda.objects.get_or_create(id=dono, defaults={'versao': 1})
+    autocompletar.versao_incrementada()
+
+
+def sincronizar_contatos(ids):
+    # Atualiza imediatamente as estruturas derivadas dos contatos em 'ids'.
+    # Contatos que não existem mais são removidos delas. A situação dos
+    # contatos é lida uma única vez para cada parte de até 2000 contatos e
+    # repassada a todas as estruturas, que só gravam; os contadores dos
+    # grupos são gravados uma única vez no final.
+    #
+    # Tudo é gravado em uma única transação: dentro de uma transação já
+    # aberta (como a das views), sem um savepoint; fora dela, em uma nova,
+    # para que as leituras nunca vejam as estruturas pela metade.
+    ids = sorted(set(ids))
+    if not ids:
+        return
+    with transaction.atomic(using=particao(), savepoint=False):
+        diferencas = contadores.novas_diferencas()
+        agora = timezone.now()
+        for parte in situacao.partes(ids):
+            situacoes = situacao.carregar(parte)
+            busca.indexar_contatos(parte, situacoes)
+            contadores.comparar(parte, situacoes, diferencas)
+            cartoes.atualizar(parte, situacoes)
+            alteracoes.registrar(Alteracao.CONTATO, parte, existentes=situacoes)
+            autocompletar.contatos_alterados(parte, situacoes)
+            # Alterações em telefones, emails e grupos também contam como
+            # alterações do contato, já que mudam a forma como ele é exibido.
+            if situacoes:
+                Contato.objects.filter(id__in=list(situacoes)).update(atualizado_em=agora)
+        contadores.aplicar(diferencas)
+        incrementar_versao()
+
+
+def reconstruir_derivados():
+    # Reconstrói do zero todas as estruturas derivadas, para uso depois de
+    # cargas que gravam diretamente nas tabelas (como o gerador de agendas em
+    # contatos/benchmark.py).
+    busca.reconstruir_indice()
+    contadores.reconstruir()
+    cartoes.reconstruir()
+    alteracoes.reconstruir()
+    autocompletar.invalidar()
+    incrementar_versao()
+
+
+def contatos_alterados(ids):
+    # Registra que os contatos em 'ids' foram alterados. Dentro de um bloco
+    # 'sincronizacao_adiada()' a atualização é acumulada e feita uma única
+    # vez no final; fora dele, é feita na hora.
+    pendentes = getattr(_estado, 'pendentes', None)
+    if pendentes is not None:
+        pendentes.update(ids)
+        _estado.alterada = True
+    else:
+        sincronizar_contatos(ids)
+
+
+def grupos_alterados(ids):
+    # Registra a criação, alteração ou exclusão dos grupos em 'ids' para a
+    # sincronização dos aplicativos. Os contatos afetados são informados
+    # separadamente, por contatos_alterados().
+    alteracoes.registrar(Alteracao.GRUPO, ids)
+
+
+def agenda_alterada():
+    # Registra uma alteração que não afeta nenhum contato em particular (como
+    # a criação de um grupo ou a mudança da sua descrição).
+    if getattr(_estado, 'pendentes', None) is not None:
+        _estado.alterada = True
+    else:
+        incrementar_versao()
+
+
+@contextmanager
+def sincronizacao_adiada():
+    # Agrupa todas as alterações feitas dentro do bloco em uma única
+    # sincronização, evitando que cada save(), add() ou remove() reconstrua
+    # separadamente as mesmas estruturas. Blocos aninhados são incorporados
+    # ao bloco mais externo.
+    if getattr(_estado, 'pendentes', None) is not None:
+        yield
+        return
+    _estado.pendentes = set()
+    _estado.alterada = False
+    try:
+        yield
+        pendentes, alterada = _estado.pendentes, _estado.alterada
+    finally:
+        _estado.pendentes = None
+    if pendentes:
+        sincronizar_contatos(pendentes)
+    elif alterada:
+        incrementar_versao()
@@ -0,0 +1,46 @@
+from collections import namedtuple
+
+from .models import Contato, Telefone, Email
+
+# Situação atual de um conjunto de contatos, lida uma única vez por
+# contatos/sincronizacao.py e repassada a cada estrutura derivada (índice de
+# busca, contadores dos grupos, cartões, registro de alterações e índice de
+# sugestões), em vez de cada uma ler de novo as mesmas tabelas.
+#
+#   'grupos'     pares (id, nome) dos grupos do contato;
+#   'telefones'  pares (numero, numero_normalizado), na ordem em que foram
+#                cadastrados;
+#   'emails'     endereços, na ordem em que foram cadastrados.
+
+Situacao = namedtuple('Situacao', 'nome avatar miniaturas grupos telefones emails')
+
+Associacao = Contato.grupos.through
+
+# Contatos lidos por vez, o mesmo tamanho dos lotes do índice de busca.
+TAMANHO_PARTE = 2000
+
+
+def partes(ids):
+    for inicio in range(0, len(ids), TAMANHO_PARTE):
+        yield ids[inicio:inicio + TAMANHO_PARTE]
+
+
+def carregar(ids):
+    # {contato_id: Situacao} dos contatos que existem entre 'ids' (no máximo
+    # TAMANHO_PARTE deles), com quatro consultas, ou uma só se nenhum deles
+    # existir mais.
+    situacoes = {contato_id: Situacao(nome, avatar, miniaturas, [], [], [])
+                 for contato_id, nome, avatar, miniaturas in Contato.objects.filter(id__in=ids).order_by()
+                 .values_list('id', 'nome', 'avatar', 'avatar_miniaturas')}
+    if not situacoes:
+        return situacoes
+    for contato_id, grupo_id, nome in (Associacao.objects.filter(contato_id__in=ids)
+                                       .values_list('contato_id', 'grupo_id', 'grupo__nome')):
+        situacoes[contato_id].grupos.append((grupo_id, nome))
+    for contato_id, numero, normalizado in (Telefone.objects.filter(contato_id__in=ids).order_by('id')
+                                            .values_list('contato_id', 'numero', 'numero_normalizado')):
+        situacoes[contato_id].telefones.append((numero, normalizado))
+    for contato_id, endereco in (Email.objects.filter(contato_id__in=ids).order_by('id')
+                                 .values_list('contato_id', 'endereco')):
+        situacoes[contato_id].emails.append(endereco)
+    return situacoes
@@ -0,0 +1,131 @@
+import hashlib
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import locks
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+
+from . import avatares, donos
+
+# Um arquivo sem referências só é removido se não tiver sido gravado nem
+# reaproveitado por um envio nos últimos AVATAR_CARENCIA segundos: o contato
+# que reaproveitou o arquivo pode ainda não ter sido gravado no banco, e a
+# contagem de referências não o encontraria.
+CARENCIA = getattr(settings, 'AVATAR_CARENCIA', 3600)
+
+
+class ArmazenamentoPorConteudo(FileSystemStorage):
+    # Armazena cada arquivo com um nome derivado do hash SHA-256 do seu
+    # conteúdo ('avatares/3f/3fa4...9c.jpg'). Dois envios do mesmo arquivo
+    # resultam no mesmo nome, então cada conteúdo é gravado uma única vez, não
+    # importa quantos contatos o utilizem.
+    #
+    # O hash é calculado enquanto o arquivo é copiado, pedaço por pedaço, para
+    # um arquivo temporário no próprio diretório de destino. Depois, o
+    # temporário é renomeado para o nome definitivo, ou descartado se aquele
+    # conteúdo já estiver armazenado; nesse caso, o arquivo existente tem a
+    # data de modificação renovada, o que o protege de remover_sem_uso()
+    # durante a carência.
+
+    @contextmanager
+    def trava(self):
+        # Trava entre processos (um arquivo travado com flock) que torna
+        # exclusivas a decisão de reaproveitar um arquivo em _save() e a de
+        # removê-lo em remover_sem_uso().
+        os.makedirs(self.location, exist_ok=True)
+        with open(os.path.join(self.location, '.trava-avatares'), 'ab') as arquivo:
+            locks.lock(arquivo, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(arquivo)
+
+    def remover_sem_uso(self, nome):
+        # Remove o arquivo 'nome', cujas referências já foram contadas, se ele
+        # não tiver sido gravado ou reaproveitado nos últimos CARENCIA
+        # segundos. Retorna True se o arquivo foi removido.
+        caminho = self.path(nome)
+        with self.trava():
+            try:
+                if time.time() - os.path.getmtime(caminho) < CARENCIA:
+                    return False
+            except FileNotFoundError:
+                return False
+            os.unlink(caminho)
+        return True
+
+    def _save(self, name, content):
+        diretorio = os.path.dirname(name)
+        extensao = os.path.splitext(name)[1].lower()
+        caminho_diretorio = self.path(diretorio)
+        os.makedirs(caminho_diretorio, exist_ok=True)
+
+        sha256 = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        with tempfile.NamedTemporaryFile(dir=caminho_diretorio, prefix='.envio-', delete=False) as temporario:
+            try:
+                for pedaco in content.chunks():
+                    sha256.update(pedaco)
+                    temporario.write(pedaco)
+            except BaseException:
+                os.unlink(temporario.name)
+                raise
+
+        resumo = sha256.hexdigest()
+        nome = os.path.join(diretorio, resumo[:2], resumo + extensao).replace('\\', '/')
+        destino = self.path(nome)
+        with self.trava():
+            if os.path.exists(destino):
+                os.unlink(temporario.name)
+                os.utime(destino)
+            else:
+                os.makedirs(os.path.dirname(destino), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(temporario.name, self.file_permissions_mode)
+                os.replace(temporario.name, destino)
+        return nome
+
+    def get_available_name(self, name, max_length=None):
+        # O nome final só é conhecido depois de ler o conteúdo em _save(), e
+        # um nome já existente significa apenas que o conteúdo já está salvo.
+        return name
+
+
+_armazenamento = ArmazenamentoPorConteudo()
+
+
+def armazenamento_avatares():
+    # Usado como 'storage' de Contato.avatar. Por ser uma função, o Django
+    # guarda apenas a sua referência nas migrações.
+    return _armazenamento
+
+
+def referencias(nome):
+    # Número de contatos que usam o arquivo 'nome' como avatar, nas agendas
+    # de todos os donos, já que o mesmo conteúdo é armazenado uma única vez.
+    # A coluna Contato.avatar é indexada, então a contagem não percorre a
+    # tabela.
+    from .models import Contato
+    return sum(Contato.todos.using(particao).filter(avatar=nome).count() for particao in donos.PARTICOES)
+
+
+def liberar_avatar(nome):
+    # Remove o arquivo 'nome' e as suas miniaturas quando nenhum contato faz
+    # mais referência a ele. Deve ser chamado depois que a exclusão ou a troca
+    # do avatar tiver sido gravada no banco de dados. Um arquivo enviado
+    # recentemente é mantido (ver CARENCIA) e removido depois por 'manage.py
+    # limpar_avatares'.
+    if not nome or referencias(nome) or not _armazenamento.remover_sem_uso(nome):
+        return False
+    avatares.excluir_miniaturas(nome)
+    return True
+
+
+def liberar_avatar_apos_commit(nome):
+    if nome:
+        transaction.on_commit(lambda: liberar_avatar(nome), using=donos.particao())
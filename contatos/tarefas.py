@@ -0,0 +1,325 @@
+import contextvars
+import logging
+import os
+import random
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .avatares import gerar_miniaturas, miniaturas_existem
+from .donos import AgendaBloqueada, bloqueada, como_dono, dono_atual, particao
+from .importacao import abrir_texto, descartar_arquivo, importar
+from .models import Contato, Importacao, Tarefa
+from .sincronizacao import contatos_alterados
+
+logger = logging.getLogger(__name__)
+
+# Fila de tarefas gravada no próprio banco, para o que não precisa (ou não
+# deve) ser feito durante uma requisição, como gerar as miniaturas de um
+# avatar enviado ou importar um arquivo de contatos.
+#
+# As views chamam enfileirar() e respondem logo em seguida; a tarefa é
+# gravada na mesma transação que a view, então só é vista pelos trabalhadores
+# se a transação for confirmada. O comando 'manage.py executar_tarefas'
+# executa as tarefas em threads e/ou processos, e a view 'tarefa' informa a
+# situação de cada uma.
+#
+# Um trabalhador reserva a próxima tarefa (a de maior prioridade entre as
+# disponíveis) com um UPDATE que só tem efeito se ela ainda estiver
+# pendente, então dois trabalhadores nunca reservam a mesma tarefa (ver
+# reservar()). A reserva vale por TAREFAS_VISIBILIDADE segundos: se o
+# trabalhador for encerrado antes de terminar, a tarefa volta a ficar
+# disponível depois desse prazo e é executada de novo. Por isso as tarefas
+# devem poder ser repetidas sem efeitos duplicados. Uma tarefa que falha é tentada outra vez
+# depois de uma espera que dobra a cada tentativa, até 'max_tentativas'.
+#
+# Com TAREFAS_SINCRONAS, as tarefas são executadas pelo próprio processo
+# logo após a confirmação da transação, sem precisar de trabalhadores.
+#
+# A fila é uma só para as agendas de todos os donos e fica na partição
+# 'default' (ver contatos/donos.py). Cada tarefa guarda o dono que a
+# enfileirou e é executada como ele; enquanto a agenda do dono está sendo
+# movida de partição, a tarefa falha e é tentada de novo mais tarde. Quando
+# a agenda do dono está em outra partição, a tarefa não é gravada na mesma
+# transação que os dados da view.
+
+VISIBILIDADE = getattr(settings, 'TAREFAS_VISIBILIDADE', 300)
+MAX_TENTATIVAS = getattr(settings, 'TAREFAS_MAX_TENTATIVAS', 5)
+INTERVALO = getattr(settings, 'TAREFAS_INTERVALO', 1.0)
+RETENCAO_DIAS = getattr(settings, 'TAREFAS_RETENCAO_DIAS', 7)
+SINCRONAS = getattr(settings, 'TAREFAS_SINCRONAS', False)
+
+# Espera, em segundos, antes da segunda tentativa e limite das esperas
+# seguintes. Cada espera é sorteada entre a metade e o valor calculado, para
+# que tarefas que falharam juntas não sejam tentadas de novo todas juntas.
+ESPERA_BASE = 5
+ESPERA_MAXIMA = 60 * 60
+
+PRIORIDADE_ALTA = 10
+PRIORIDADE_NORMAL = 0
+PRIORIDADE_BAIXA = -10
+
+# Quantidade de tarefas lidas a cada reserva, entre as quais o trabalhador
+# escolhe uma (ver reservar()).
+CANDIDATAS = 8
+
+TAREFAS = {}
+
+_devolvidas_em = 0.0
+
+# Tarefa sendo executada por executar() na thread atual.
+_tarefa_atual = contextvars.ContextVar('tarefa_atual', default=None)
+
+
+def tarefa(nome):
+    # Registra a função decorada como a tarefa 'nome'. Os argumentos e o
+    # valor retornado precisam poder ser gravados como JSON.
+    def registrar(funcao):
+        TAREFAS[nome] = funcao
+        return funcao
+    return registrar
+
+
+def enfileirar(nome, *argumentos, prioridade=PRIORIDADE_NORMAL, chave=None, atraso=0, max_tentativas=MAX_TENTATIVAS):
+    # Cria a tarefa 'nome', a ser executada como o dono atual com
+    # 'argumentos' a partir de 'atraso' segundos. Se já houver uma tarefa
+    # ativa do mesmo dono com a mesma 'chave', ela é retornada no lugar de uma nova; se ainda estiver pendente, passa
+    # a valer a maior prioridade e o agendamento mais próximo entre as duas.
+    if nome not in TAREFAS:
+        raise ValueError(f'Tarefa desconhecida: {nome!r}')
+    disponivel_em = timezone.now() + timedelta(seconds=atraso)
+    with transaction.atomic():
+        existente = (Tarefa.objects.filter(dono=dono_atual(), chave=chave, status__in=Tarefa.ATIVAS).first()
+                     if chave else None)
+        if existente is not None:
+            if existente.status == Tarefa.PENDENTE:
+                existente.prioridade = max(existente.prioridade, prioridade)
+                existente.disponivel_em = min(existente.disponivel_em, disponivel_em)
+                existente.save(update_fields=['prioridade', 'disponivel_em'])
+            return existente
+        nova = Tarefa.objects.create(nome=nome, argumentos=list(argumentos), prioridade=prioridade, chave=chave,
+                                     disponivel_em=disponivel_em, max_tentativas=max_tentativas)
+    if SINCRONAS and not atraso:
+        transaction.on_commit(lambda: executar_proxima(nome_do_trabalhador('sincrono'), tarefa_id=nova.id))
+    return nova
+
+
+def situacao(tarefa_id):
+    # Situação da tarefa para a view 'tarefa', ou None se ela não existir ou
+    # for de outro dono.
+    tarefa = Tarefa.objects.filter(id=tarefa_id, dono=dono_atual()).first()
+    if tarefa is None:
+        return None
+    return {
+        'id': tarefa.id,
+        'nome': tarefa.nome,
+        'status': tarefa.status,
+        'tentativas': tarefa.tentativas,
+        'max_tentativas': tarefa.max_tentativas,
+        'resultado': tarefa.resultado,
+        'erro': tarefa.erro.strip().splitlines()[-1] if tarefa.erro else '',
+        'criada_em': tarefa.criada_em,
+        'iniciada_em': tarefa.iniciada_em,
+        'concluida_em': tarefa.concluida_em,
+    }
+
+
+def ultima_tentativa():
+    # Indica se uma falha da tarefa em execução seria a última, ou seja, se
+    # ela não será tentada de novo. Fora de uma tarefa, sempre é.
+    tarefa = _tarefa_atual.get()
+    return tarefa is None or tarefa.tentativas >= tarefa.max_tentativas
+
+
+def nome_do_trabalhador(sufixo=''):
+    return f'{socket.gethostname()}:{os.getpid()}:{sufixo}'[:100]
+
+
+def espera(tentativas):
+    # Espera antes da próxima tentativa de uma tarefa que já falhou
+    # 'tentativas' vezes.
+    limite = min(ESPERA_BASE * 2 ** (tentativas - 1), ESPERA_MAXIMA)
+    return random.uniform(limite / 2, limite)
+
+
+def _devolver_abandonadas(agora):
+    # Devolve à fila as tarefas cuja reserva acabou sem que o trabalhador as
+    # terminasse (ele pode ter sido encerrado no meio delas), ou as marca
+    # como falhas se aquela era a última tentativa. Verificado no máximo uma
+    # vez por segundo em cada processo.
+    global _devolvidas_em
+    if time.monotonic() - _devolvidas_em < 1:
+        return
+    _devolvidas_em = time.monotonic()
+    abandonadas = Tarefa.objects.filter(status=Tarefa.EXECUTANDO, disponivel_em__lte=agora)
+    if not abandonadas.exists():
+        return
+    with transaction.atomic():
+        abandonadas.filter(tentativas__gte=F('max_tentativas')).update(
+            status=Tarefa.FALHOU, concluida_em=agora, erro='A tarefa não terminou no prazo da reserva.')
+        abandonadas.update(status=Tarefa.PENDENTE)
+
+
+def finalizar(tarefa, campos):
+    # Grava o fim da execução, desde que a reserva ainda seja deste
+    # trabalhador: se o prazo acabou e outro trabalhador reservou a tarefa,
+    # o resultado desta execução é descartado.
+    atualizadas = Tarefa.objects.filter(id=tarefa.id, status=Tarefa.EXECUTANDO, trabalhador=tarefa.trabalhador,
+                                        tentativas=tarefa.tentativas).update(**campos)
+    if not atualizadas:
+        logger.warning('A reserva da tarefa %s (%s) expirou antes do fim da execução', tarefa.id, tarefa.nome)
+
+
+def reservar(trabalhador, visibilidade=VISIBILIDADE, tarefa_id=None, anterior=None):
+    # Reserva a próxima tarefa disponível (ou a tarefa 'tarefa_id', se ela
+    # estiver disponível) para 'trabalhador' e a retorna, ou retorna None se
+    # não houver nenhuma. 'anterior' é o par (tarefa, campos) retornado por
+    # executar() para a última tarefa do trabalhador, cujo fim é gravado na
+    # mesma transação que reserva a próxima.
+    #
+    # No SQLite, uma escrita espera o fim da anterior, então a transação só
+    # contém as duas atualizações. As candidatas são lidas antes, pela
+    # conexão de leitura, percorrendo o índice 'tarefa_fila'. Cada
+    # trabalhador tenta as de maior prioridade em uma ordem aleatória, para
+    # que trabalhadores simultâneos não disputem sempre a mesma tarefa; a
+    # atualização só reserva a tarefa se ela ainda estiver pendente.
+    while True:
+        agora = timezone.now()
+        _devolver_abandonadas(agora)
+        pendentes = Tarefa.objects.filter(status=Tarefa.PENDENTE, disponivel_em__lte=agora)
+        if tarefa_id is not None:
+            pendentes = pendentes.filter(id=tarefa_id)
+        candidatas = list(pendentes.order_by('-prioridade', 'disponivel_em')[:CANDIDATAS])
+        if not candidatas:
+            if anterior is not None:
+                finalizar(*anterior)
+            return None
+        candidatas = [tarefa for tarefa in candidatas if tarefa.prioridade == candidatas[0].prioridade]
+        random.shuffle(candidatas)
+        with transaction.atomic():
+            if anterior is not None:
+                finalizar(*anterior)
+                anterior = None
+            for tarefa in candidatas:
+                reserva = {'status': Tarefa.EXECUTANDO, 'tentativas': tarefa.tentativas + 1,
+                           'trabalhador': trabalhador, 'iniciada_em': agora,
+                           'disponivel_em': agora + timedelta(seconds=visibilidade)}
+                if Tarefa.objects.filter(id=tarefa.id, status=Tarefa.PENDENTE,
+                                         tentativas=tarefa.tentativas).update(**reserva):
+                    for campo, valor in reserva.items():
+                        setattr(tarefa, campo, valor)
+                    return tarefa
+
+
+def executar(tarefa):
+    # Executa uma tarefa já reservada e retorna os campos que registram o
+    # resultado ou o erro, a serem gravados por finalizar().
+    funcao = TAREFAS.get(tarefa.nome)
+    token = _tarefa_atual.set(tarefa)
+    try:
+        if funcao is None:
+            raise LookupError(f'Tarefa desconhecida: {tarefa.nome!r}')
+        with como_dono(tarefa.dono):
+            if bloqueada():
+                raise AgendaBloqueada(f'A agenda do dono {tarefa.dono} está sendo movida de partição.')
+            resultado = funcao(*tarefa.argumentos)
+    except Exception:
+        erro = traceback.format_exc()
+        if funcao is not None and tarefa.tentativas < tarefa.max_tentativas:
+            logger.warning('Tarefa %s (%s) falhou na tentativa %s', tarefa.id, tarefa.nome, tarefa.tentativas)
+            return {'status': Tarefa.PENDENTE, 'erro': erro,
+                    'disponivel_em': timezone.now() + timedelta(seconds=espera(tarefa.tentativas))}
+        logger.error('Tarefa %s (%s) falhou', tarefa.id, tarefa.nome)
+        return {'status': Tarefa.FALHOU, 'erro': erro, 'concluida_em': timezone.now()}
+    finally:
+        _tarefa_atual.reset(token)
+    return {'status': Tarefa.CONCLUIDA, 'resultado': resultado, 'erro': '', 'concluida_em': timezone.now()}
+
+
+def executar_proxima(trabalhador, visibilidade=VISIBILIDADE, tarefa_id=None):
+    # Reserva e executa a próxima tarefa. Retorna False se não havia nenhuma.
+    tarefa = reservar(trabalhador, visibilidade, tarefa_id)
+    if tarefa is None:
+        return False
+    finalizar(tarefa, executar(tarefa))
+    return True
+
+
+def trabalhar(trabalhador, parar, visibilidade=VISIBILIDADE, intervalo=INTERVALO, ate_esvaziar=False):
+    # Executa tarefas até que o evento 'parar' seja sinalizado ou, com
+    # 'ate_esvaziar', até que não haja mais tarefas disponíveis. Sem tarefas,
+    # consulta a fila de novo a cada 'intervalo' segundos.
+    anterior = None
+    try:
+        while not parar.is_set():
+            tarefa = reservar(trabalhador, visibilidade, anterior=anterior)
+            anterior = None
+            if tarefa is not None:
+                anterior = (tarefa, executar(tarefa))
+            elif ate_esvaziar:
+                break
+            else:
+                parar.wait(intervalo)
+    finally:
+        if anterior is not None:
+            finalizar(*anterior)
+        # Cada thread usa as suas próprias conexões.
+        connections.close_all()
+
+
+def limpar(dias=RETENCAO_DIAS):
+    # Apaga as tarefas concluídas ou que falharam há mais de 'dias' dias.
+    # Retorna o número de tarefas apagadas.
+    limite = timezone.now() - timedelta(days=dias)
+    apagadas, _ = Tarefa.objects.filter(status__in=(Tarefa.CONCLUIDA, Tarefa.FALHOU),
+                                        concluida_em__lt=limite).delete()
+    return apagadas
+
+
+# Tarefas da agenda
+
+@tarefa('miniaturas')
+def miniaturas_do_avatar(nome):
+    # Gera as miniaturas do avatar 'nome' e as mostra nos cartões dos
+    # contatos que o usam.
+    if not miniaturas_existem(nome):
+        gerar_miniaturas(nome)
+    with transaction.atomic(using=particao()):
+        ids = list(Contato.objects.filter(avatar=nome, avatar_miniaturas=False).values_list('id', flat=True))
+        Contato.objects.filter(id__in=ids).update(avatar_miniaturas=True)
+        contatos_alterados(ids)
+    return {'contatos': len(ids)}
+
+
+@tarefa('importar')
+def importar_arquivo(importacao_id):
+    # Importa (ou retoma a importação de) um arquivo enviado pela view
+    # 'importar_contatos'. Se a importação falhar, ou se o trabalhador for
+    # encerrado no meio dela, a nova tentativa da fila continua do último
+    # lote gravado. O arquivo só é apagado quando a importação é concluída
+    # ou quando falha na última tentativa; até lá, ela também pode ser
+    # retomada pela view 'retomar_importacao'.
+    importacao = Importacao.objects.get(id=importacao_id)
+    if importacao.status != Importacao.CONCLUIDA:
+        with open(importacao.caminho, 'rb') as arquivo:
+            try:
+                importar(importacao, abrir_texto(arquivo))
+            except Exception:
+                if ultima_tentativa():
+                    descartar_arquivo(importacao)
+                raise
+    return {'status': importacao.status, 'processados': importacao.processados, 'criados': importacao.criados,
+            'atualizados': importacao.atualizados, 'ignorados': importacao.ignorados}
+
+
+@tarefa('pausa')
+def pausa(milissegundos=0):
+    # Tarefa sem efeitos, usada por 'manage.py vazao_tarefas' para medir a
+    # fila.
+    time.sleep(milissegundos / 1000)
@@ -0,0 +1,42 @@
+import re
+
+from django.conf import settings
+
+# DDI do Brasil, usado para completar números informados apenas com DDD.
+DDI_BRASIL = '55'
+
+# DDD usado para completar números informados sem DDD (8 ou 9 dígitos).
+# Quando não configurado, esses números são armazenados apenas com os seus
+# dígitos, sem o prefixo '+'.
+DDD_PADRAO = getattr(settings, 'TELEFONE_DDD_PADRAO', None)
+
+
+def normalizar_telefone(numero):
+    # Converte um número de telefone digitado em qualquer formato comum no
+    # Brasil para a sua forma canônica E.164 ('+5511999991234'), que é a
+    # forma armazenada em Telefone.numero_normalizado. Exemplos aceitos:
+    #   '(11) 99999-1234', '11 9999-1234', '011 99999-1234',
+    #   '0 21 11 99999-1234' (com código de operadora), '+55 11 99999-1234',
+    #   '0055 11 99999-1234' e '99999-1234' (sem DDD).
+    numero = (numero or '').strip()
+    internacional = numero.startswith('+')
+    digitos = re.sub(r'\D', '', numero)
+    if not digitos:
+        return ''
+    if internacional:
+        return '+' + digitos
+    if digitos.startswith('00'):
+        # Discagem internacional a partir do Brasil (00 + DDI)
+        return '+' + digitos[2:]
+    if digitos.startswith('0'):
+        digitos = digitos[1:]
+        # Discagem com código de operadora: 0 + operadora (2) + DDD (2) + número
+        if len(digitos) in (12, 13):
+            digitos = digitos[2:]
+    if len(digitos) in (10, 11):
+        return '+' + DDI_BRASIL + digitos
+    if len(digitos) in (12, 13) and digitos.startswith(DDI_BRASIL):
+        return '+' + digitos
+    if len(digitos) in (8, 9) and DDD_PADRAO:
+        return '+' + DDI_BRASIL + DDD_PADRAO + digitos
+    return digitos
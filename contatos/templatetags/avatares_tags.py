@@ -0,0 +1,24 @@
+from django import template
+
+from .. import avatares, cartoes
+
+register = template.Library()
+
+
+@register.inclusion_tag('contatos/avatar.html')
+def avatar(contato, altura=200):
+    # Exibe o avatar do contato usando as miniaturas geradas, quando
+    # disponíveis, através de 'srcset'. O navegador escolhe a menor miniatura
+    # suficiente para a altura exibida e a densidade da tela.
+    contexto = {'contato': contato, 'altura': altura, 'miniaturas': False}
+    if contato.avatar and contato.avatar_miniaturas:
+        contexto.update(avatares.atributos_img(contato.avatar.name, altura), miniaturas=True)
+    return contexto
+
+
+@register.inclusion_tag('contatos/avatar.html')
+def avatar_do_cartao(cartao):
+    # Mesmo resultado de 'avatar' para um CartaoContato, cujas URLs já foram
+    # calculadas quando o cartão foi gravado (ver contatos/cartoes.py).
+    return {'contato': cartao, 'altura': cartoes.ALTURA_AVATAR, 'miniaturas': 'src' in cartao.avatar,
+            **cartao.avatar}
@@ -0,0 +1,35 @@
+from django import template
+
+from .. import fragmentos
+
+register = template.Library()
+
+
+class FragmentoNode(template.Node):
+
+    def __init__(self, nodelist, nome, partes):
+        self.nodelist = nodelist
+        self.nome = nome
+        self.partes = partes
+
+    def render(self, context):
+        partes = [parte.resolve(context) for parte in self.partes]
+        return fragmentos.obter(self.nome.resolve(context), partes, lambda: self.nodelist.render(context))
+
+
+@register.tag
+def fragmento(parser, token):
+    # Guarda em cache o conteúdo do bloco (ver contatos/fragmentos.py):
+    #
+    #   {% fragmento 'cartao' contato.id contato.versao %} ... {% endfragmento %}
+    #
+    # O primeiro argumento é o nome do fragmento e os demais formam a sua
+    # chave: o id do objeto exibido e tudo o que muda quando ele muda.
+    nodelist = parser.parse(('endfragmento',))
+    parser.delete_first_token()
+    argumentos = token.split_contents()
+    if len(argumentos) < 3:
+        raise template.TemplateSyntaxError(
+            f"'{argumentos[0]}' recebe o nome do fragmento e ao menos uma parte da chave.")
+    nome, *partes = (parser.compile_filter(argumento) for argumento in argumentos[1:])
+    return FragmentoNode(nodelist, nome, partes)
@@ -0,0 +1,15 @@
+from contatos.models import Contato, Email, Telefone
+
+
+def criar_contato(nome, telefones=(), emails=(), grupos=()):
+    # Cria um contato do dono atual pelos mesmos caminhos das views, de forma
+    # que os signals mantenham as estruturas derivadas (índice de busca,
+    # cartões, contadores e registro de alterações).
+    contato = Contato.objects.create(nome=nome)
+    for numero in telefones:
+        Telefone.objects.create(contato=contato, numero=numero)
+    for endereco in emails:
+        Email.objects.create(contato=contato, endereco=endereco)
+    if grupos:
+        contato.grupos.add(*grupos)
+    return contato
@@ -0,0 +1,96 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+
+from contatos import busca, contadores, donos, operacoes
+from contatos.models import Alteracao, CartaoContato, Contato, Grupo, Telefone
+
+from . import criar_contato
+
+
+class AcoesDoAdminTests(TestCase):
+    # As exclusões e as ações em lote do admin passam por
+    # contatos/operacoes.py, que mantém as estruturas derivadas.
+
+    def setUp(self):
+        # O administrador é o dono padrão, para usar a agenda dos contatos
+        # criados pelos testes.
+        self.client.force_login(User.objects.create_superuser('admin', password='senha-de-teste',
+                                                              id=donos.DONO_PADRAO))
+        self.amigos = Grupo.objects.create(nome='Amigos')
+        self.trabalho = Grupo.objects.create(nome='Trabalho')
+        self.ana = criar_contato('Ana', telefones=['11 91111-1111'], grupos=[self.amigos])
+        self.bruno = criar_contato('Bruno', emails=['bruno@exemplo.com'], grupos=[self.amigos, self.trabalho])
+        self.carla = criar_contato('Carla')
+        with donos.como_dono(2):
+            self.grupo_de_outro = Grupo.objects.create(nome='Outro')
+
+    def acao(self, acao, contatos, **dados):
+        return self.client.post(reverse('admin:contatos_contato_changelist'),
+                                {'action': acao, '_selected_action': [contato.id for contato in contatos], **dados},
+                                follow=True)
+
+    def assertDerivadosConsistentes(self):
+        self.assertEqual(contadores.divergencias(), [])
+        self.assertEqual(set(CartaoContato.objects.values_list('contato_id', flat=True)),
+                         set(Contato.objects.values_list('id', flat=True)))
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT rowid FROM {busca.TABELA}')
+            self.assertEqual({rowid for rowid, in cursor.fetchall()},
+                             set(Contato.todos.values_list('id', flat=True)))
+
+    def test_acoes_com_grupo(self):
+        with mock.patch.object(operacoes, 'executar', wraps=operacoes.executar) as executar:
+            resposta = self.acao('adicionar_ao_grupo', [self.ana, self.carla], grupo=self.trabalho.id)
+        executar.assert_called_once_with('adicionar', mock.ANY, self.trabalho.id)
+        self.assertContains(resposta, '2 contatos incluídos no grupo.')
+        self.assertEqual(set(self.trabalho.contato_set.all()), {self.ana, self.bruno, self.carla})
+        self.assertEqual(CartaoContato.objects.get(contato_id=self.carla.id).grupos, ['Trabalho'])
+        self.assertDerivadosConsistentes()
+
+        self.acao('mover_para_grupo', [self.bruno], grupo=self.amigos.id)
+        self.assertEqual(list(self.bruno.grupos.all()), [self.amigos])
+        # Sem grupo, a remoção retira os contatos de todos os grupos.
+        resposta = self.acao('remover_do_grupo', [self.ana, self.bruno])
+        self.assertContains(resposta, '3 associações removidas.')
+        self.assertFalse(self.amigos.contato_set.exists())
+        self.assertDerivadosConsistentes()
+
+    def test_grupo_invalido(self):
+        for dados in ({}, {'grupo': self.grupo_de_outro.id}, {'grupo': 9999}):
+            with self.subTest(**dados):
+                resposta = self.acao('adicionar_ao_grupo', [self.carla], **dados)
+                self.assertEqual([mensagem.level_tag for mensagem in resposta.context['messages']], ['error'])
+                self.assertFalse(self.carla.grupos.exists())
+        self.assertFalse(self.grupo_de_outro.contato_set.exists())
+
+    def test_excluir_selecionados(self):
+        with mock.patch.object(operacoes, 'excluir_contatos', wraps=operacoes.excluir_contatos) as excluir:
+            confirmacao = self.acao('delete_selected', [self.ana, self.bruno])
+            self.assertContains(confirmacao, 'Ana')
+            self.acao('delete_selected', [self.ana, self.bruno], post='yes')
+        excluir.assert_called_once()
+        self.assertEqual(list(Contato.objects.all()), [self.carla])
+        self.assertFalse(Telefone.objects.filter(contato_id=self.ana.id).exists())
+        self.assertEqual(set(Alteracao.objects.filter(tipo=Alteracao.CONTATO, excluido=True)
+                             .values_list('objeto_id', flat=True)), {self.ana.id, self.bruno.id})
+        self.amigos.refresh_from_db()
+        self.assertEqual(self.amigos.total_contatos, 0)
+        self.assertDerivadosConsistentes()
+
+    def test_busca_de_grupos(self):
+        Grupo.objects.create(nome='Família')
+        resposta = self.client.get(reverse('admin:contatos_grupo_changelist'), {'q': 'fami'})
+        self.assertEqual([grupo.nome for grupo in resposta.context['cl'].result_list], ['Família'])
+
+    def test_excluir_telefone(self):
+        telefone = self.ana.telefone_set.get()
+        self.client.post(reverse('admin:contatos_telefone_delete', args=[telefone.id]), {'post': 'yes'})
+        self.assertFalse(Telefone.objects.filter(id=telefone.id).exists())
+        self.assertEqual(CartaoContato.objects.get(contato_id=self.ana.id).telefones, ())
+        self.amigos.refresh_from_db()
+        self.assertEqual(self.amigos.contatos_com_telefone, 0)
+        self.assertDerivadosConsistentes()
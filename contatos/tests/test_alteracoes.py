@@ -0,0 +1,105 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from contatos import alteracoes
+from contatos.models import Alteracao, Contato, Email, Telefone
+
+from . import criar_contato
+
+
+class AlteracoesTests(TestCase):
+
+    def test_sincronizacao_incremental(self):
+        self.assertEqual(alteracoes.token_atual(), '0.0')
+        ana = criar_contato('Ana', telefones=['11 91111-1111'])
+        bruno = criar_contato('Bruno')
+
+        inicial = alteracoes.desde('0')
+        self.assertEqual([(a['tipo'], a['id']) for a in inicial['alteracoes']],
+                         [(Alteracao.CONTATO, ana.id), (Alteracao.CONTATO, bruno.id)])
+        self.assertEqual(inicial['alteracoes'][0]['dados']['telefones'][0]['numero'], '11 91111-1111')
+        self.assertFalse(inicial['mais'])
+        self.assertEqual(inicial['token'], alteracoes.token_atual())
+
+        # Um aplicativo em dia não recebe nada.
+        self.assertEqual(alteracoes.desde(inicial['token'])['alteracoes'], [])
+
+        Email.objects.create(contato=ana, endereco='ana@exemplo.com')
+        bruno_id = bruno.id
+        bruno.delete()
+        resposta = alteracoes.desde(inicial['token'])
+        self.assertEqual([(a['id'], a['excluido']) for a in resposta['alteracoes']],
+                         [(ana.id, False), (bruno_id, True)])
+        self.assertEqual(resposta['alteracoes'][0]['dados']['emails'][0]['endereco'], 'ana@exemplo.com')
+
+    def test_cada_objeto_tem_uma_unica_linha(self):
+        ana = criar_contato('Ana')
+        for numero in ('11 91111-1111', '11 92222-2222'):
+            Telefone.objects.create(contato=ana, numero=numero)
+        self.assertEqual(Alteracao.objects.filter(objeto_id=ana.id).count(), 1)
+
+    def test_lotes(self):
+        for nome in ('Ana', 'Bruno', 'Carla'):
+            criar_contato(nome)
+        primeiro = alteracoes.desde('0', limite=2)
+        self.assertTrue(primeiro['mais'])
+        segundo = alteracoes.desde(primeiro['token'], limite=2)
+        self.assertFalse(segundo['mais'])
+        self.assertEqual([a['id'] for a in primeiro['alteracoes'] + segundo['alteracoes']],
+                         list(Contato.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_compactacao_expira_tokens_antigos(self):
+        ana = criar_contato('Ana')
+        criar_contato('Bruno')
+        antigo = alteracoes.token_atual()
+        ana.delete()
+        Alteracao.objects.filter(excluido=True).update(registrada_em=timezone.now() - timedelta(days=2))
+
+        self.assertEqual(alteracoes.compactar(dias=1), 1)
+        self.assertFalse(Alteracao.objects.filter(excluido=True).exists())
+        self.assertEqual(alteracoes.compactar(dias=1), 0)
+
+        criar_contato('Carla')
+        with self.assertRaises(alteracoes.TokenExpirado):
+            alteracoes.desde(antigo)
+        # Um token emitido depois da compactação continua valendo, assim como
+        # recomeçar do zero.
+        self.assertEqual(len(alteracoes.desde('0')['alteracoes']), 2)
+
+    def test_compactacao_sem_linhas_depois_do_token(self):
+        criar_contato('Ana')
+        bruno = criar_contato('Bruno')
+        antigo = alteracoes.token_atual()
+        bruno.delete()
+        Alteracao.objects.filter(excluido=True).update(registrada_em=timezone.now() - timedelta(days=2))
+        self.assertEqual(alteracoes.compactar(dias=1), 1)
+
+        # Não sobrou nenhuma linha depois do token, mas a exclusão de Bruno
+        # foi perdida: o token expirou.
+        self.assertFalse(Alteracao.objects.filter(sequencia__gt=alteracoes.ler_token(antigo)[1]).exists())
+        with self.assertRaises(alteracoes.TokenExpirado):
+            alteracoes.desde(antigo)
+        # Um aplicativo em dia depois da compactação recebe o novo horizonte.
+        atual = alteracoes.desde('0')['token']
+        self.assertEqual(alteracoes.desde(atual), {'token': atual, 'mais': False, 'alteracoes': []})
+
+    def test_compactacao_mantem_exclusoes_recentes(self):
+        criar_contato('Ana').delete()
+        self.assertEqual(alteracoes.compactar(dias=1), 0)
+        self.assertTrue(Alteracao.objects.filter(excluido=True).exists())
+
+    def test_token_invalido(self):
+        for token in ('abc', '1', '1.-2'):
+            with self.assertRaises(alteracoes.TokenInvalido):
+                alteracoes.desde(token)
+
+    def test_view(self):
+        criar_contato('Ana')
+        resposta = self.client.get(reverse('sincronizar'), {'since': 'abc'})
+        self.assertEqual(resposta.status_code, 400)
+        resposta = self.client.get(reverse('sincronizar'))
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(len(resposta.json()['alteracoes']), 1)
@@ -0,0 +1,178 @@
+from unittest import mock
+
+from django.db import transaction
+from django.test import TestCase
+from django.urls import reverse
+
+from contatos import alteracoes, autocompletar, donos
+from contatos.models import Contato, Telefone
+
+from . import criar_contato
+
+
+class IndiceTests(TestCase):
+    # As alterações só chegam ao índice em memória quando a transação é
+    # confirmada; captureOnCommitCallbacks(execute=True) faz esse papel
+    # dentro da transação do teste.
+
+    def setUp(self):
+        autocompletar._indices.clear()
+        autocompletar._verificado_em.clear()
+        # Sem verificações da versão da agenda, que recarregariam o índice
+        # em segundo plano.
+        verificar = mock.patch.object(autocompletar, '_verificar')
+        verificar.start()
+        self.addCleanup(verificar.stop)
+        self.addCleanup(autocompletar._indices.clear)
+        self.ana = criar_contato('Ana Souza', telefones=['(11) 91111-1111'], emails=['ana@exemplo.com'])
+        self.jose = criar_contato('José Ângelo')
+        with donos.como_dono(2):
+            self.ana_de_outro = criar_contato('Ana Lima')
+            autocompletar.aquecer(em_segundo_plano=False)
+        autocompletar.aquecer(em_segundo_plano=False)
+
+    def ids(self, termo, limite=autocompletar.LIMITE_PADRAO):
+        return [resultado['id'] for resultado in autocompletar.buscar(termo, limite)]
+
+    def test_indices_separados_por_dono(self):
+        self.assertEqual(self.ids('ana'), [self.ana.id])
+        with donos.como_dono(2):
+            self.assertEqual(self.ids('ana'), [self.ana_de_outro.id])
+            self.assertEqual(self.ids('jose'), [])
+            with self.captureOnCommitCallbacks(execute=True):
+                criar_contato('Anabela')
+        # O contato novo do outro dono não aparece na agenda do dono padrão.
+        self.assertEqual(self.ids('ana'), [self.ana.id])
+
+    def test_acentos_e_maiusculas(self):
+        for termo in ('jose', 'JOSÉ', 'ang', 'José Âng', 'angelo jo'):
+            with self.subTest(termo=termo):
+                self.assertEqual(self.ids(termo), [self.jose.id])
+        self.assertEqual(self.ids('jose souza'), [])
+
+    def test_telefone_e_email(self):
+        resultado, = autocompletar.buscar('1191111')
+        self.assertEqual((resultado['id'], resultado['campo']), (self.ana.id, 'telefone'))
+        resultado, = autocompletar.buscar('ana@')
+        self.assertEqual((resultado['id'], resultado['campo'], resultado['valor']),
+                         (self.ana.id, 'email', 'ana@exemplo.com'))
+
+    def test_renomear_remove_as_chaves_antigas(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.jose.nome = 'Joaquim Prado'
+            self.jose.save()
+        self.assertEqual(self.ids('ang'), [])
+        self.assertEqual(self.ids('jose'), [])
+        resultado, = autocompletar.buscar('prad')
+        self.assertEqual((resultado['id'], resultado['nome']), (self.jose.id, 'Joaquim Prado'))
+
+    def test_exclusoes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Telefone.objects.filter(contato=self.ana).delete()
+        self.assertEqual(self.ids('1191111'), [])
+        self.assertEqual(self.ids('ana'), [self.ana.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ana.delete()
+        self.assertEqual(self.ids('ana'), [])
+        self.assertEqual(self.ids('ana@'), [])
+        indice = autocompletar._indices[donos.dono_atual()]
+        self.assertNotIn(self.ana.id, indice.ids)
+        self.assertNotIn(self.ana.id, indice.contatos)
+
+    def test_transacao_desfeita_nao_altera_o_indice(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    Contato.objects.filter(id=self.jose.id).update(nome='Outro')
+                    criar_contato('Anita')
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(self.ids('ani'), [])
+        self.assertEqual(self.ids('jose'), [self.jose.id])
+
+    def test_limite(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for numero in range(autocompletar.LIMITE_MAXIMO + 5):
+                criar_contato(f'Maria {numero}')
+        self.assertEqual(len(self.ids('maria')), autocompletar.LIMITE_PADRAO)
+        self.assertEqual(len(self.ids('maria', 3)), 3)
+        # Um contato aparece uma única vez, mesmo com várias chaves.
+        ids = self.ids('m', autocompletar.LIMITE_MAXIMO)
+        self.assertEqual(len(ids), len(set(ids)))
+
+        url = reverse('autocompletar')
+        resultados = self.client.get(url, {'q': 'maria', 'limite': 1000}).json()['resultados']
+        self.assertEqual(len(resultados), autocompletar.LIMITE_MAXIMO)
+        resultados = self.client.get(url, {'q': 'maria', 'limite': 'x'}).json()['resultados']
+        self.assertEqual(len(resultados), autocompletar.LIMITE_PADRAO)
+        self.assertEqual(self.client.get(url, {'q': ' '}).json()['resultados'], [])
+
+
+class VerificacaoTests(TestCase):
+    # Alterações feitas por outros processos chegam ao banco, mas não ao
+    # índice deste processo: captureOnCommitCallbacks() sem execute=True
+    # descarta as atualizações do índice em memória.
+
+    def setUp(self):
+        autocompletar._indices.clear()
+        autocompletar._verificado_em.clear()
+        self.addCleanup(autocompletar._indices.clear)
+        self.addCleanup(autocompletar._verificado_em.clear)
+        self.ana = criar_contato('Ana Souza')
+        self.jose = criar_contato('José Ângelo')
+        autocompletar.aquecer(em_segundo_plano=False)
+
+    def ids(self, termo):
+        # Cada busca confere a versão da agenda.
+        autocompletar._verificado_em.clear()
+        return [resultado['id'] for resultado in autocompletar.buscar(termo)]
+
+    def test_aplica_as_alteracoes_de_outro_processo(self):
+        with self.captureOnCommitCallbacks():
+            self.jose.nome = 'Joaquim Prado'
+            self.jose.save()
+            self.ana.delete()
+            anita = criar_contato('Anita')
+        with mock.patch.object(autocompletar, 'aquecer') as aquecer:
+            self.assertEqual(self.ids('prad'), [self.jose.id])
+            self.assertEqual(self.ids('jose'), [])
+            self.assertEqual(self.ids('an'), [anita.id])
+        aquecer.assert_not_called()
+        indice = autocompletar._indices[donos.dono_atual()]
+        self.assertEqual(indice.versao, autocompletar._versao_atual())
+        self.assertEqual(indice.sequencia, autocompletar._sequencia_atual())
+
+    def test_reconstroi_quando_o_registro_nao_basta(self):
+        with self.captureOnCommitCallbacks():
+            criar_contato('Anita')
+        with mock.patch.object(autocompletar, 'MAXIMO_ATUALIZADOS', 0), \
+                mock.patch.object(autocompletar, 'aquecer') as aquecer:
+            self.assertEqual(self.ids('anit'), [])
+        aquecer.assert_called_once_with(dono=donos.dono_atual())
+
+        # As exclusões anteriores ao horizonte podem ter sido apagadas.
+        with self.captureOnCommitCallbacks():
+            self.ana.delete()
+        alteracoes.compactar(dias=-1)
+        with mock.patch.object(autocompletar, 'aquecer') as aquecer:
+            self.ids('an')
+        aquecer.assert_called_once_with(dono=donos.dono_atual())
+
+    def test_alteracoes_de_outro_dono(self):
+        with donos.como_dono(2), self.captureOnCommitCallbacks():
+            criar_contato('Anabela')
+        with mock.patch.object(autocompletar, '_atualizar') as atualizar, \
+                mock.patch.object(autocompletar, 'aquecer') as aquecer:
+            self.assertEqual(self.ids('ana'), [self.ana.id])
+        atualizar.assert_not_called()
+        aquecer.assert_not_called()
+
+    def test_maximo_de_donos(self):
+        with mock.patch.object(autocompletar, 'MAXIMO_DONOS', 2):
+            autocompletar.aquecer(em_segundo_plano=False, dono=2)
+            # A busca na agenda do dono padrão o torna o mais recente.
+            self.ids('ana')
+            autocompletar.aquecer(em_segundo_plano=False, dono=3)
+        self.assertEqual(list(autocompletar._indices), [donos.DONO_PADRAO, 3])
+        self.assertEqual(self.ids('ana'), [self.ana.id])
@@ -0,0 +1,161 @@
+import io
+import shutil
+import tempfile
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from contatos import avatares
+from contatos.models import CartaoContato, Contato
+from contatos.storage import armazenamento_avatares
+
+VERMELHO, AZUL = (255, 0, 0), (0, 0, 255)
+
+
+def imagem(largura, altura, formato='JPEG', orientacao=None):
+    # Imagem com a metade esquerda vermelha e a direita azul, opcionalmente
+    # com a orientação EXIF informada.
+    conteudo = Image.new('RGB', (largura, altura), AZUL)
+    conteudo.paste(VERMELHO, (0, 0, largura // 2, altura))
+    exif = Image.Exif()
+    if orientacao:
+        exif[0x0112] = orientacao
+    arquivo = io.BytesIO()
+    conteudo.save(arquivo, formato, exif=exif.tobytes())
+    return arquivo.getvalue()
+
+
+def cor(pixel):
+    return VERMELHO if pixel[0] > pixel[2] else AZUL
+
+
+class MiniaturasTests(TestCase):
+
+    def setUp(self):
+        diretorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, diretorio)
+        configuracao = override_settings(MEDIA_ROOT=diretorio)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+    def salvar(self, conteudo, nome='avatares/ana.jpg'):
+        return armazenamento_avatares().save(nome, ContentFile(conteudo))
+
+    def abrir(self, nome):
+        with default_storage.open(nome, 'rb') as arquivo:
+            miniatura = Image.open(arquivo)
+            miniatura.load()
+        return miniatura
+
+    def test_tamanhos_e_formatos(self):
+        nome = self.salvar(imagem(300, 120, 'PNG'), 'avatares/ana.png')
+        avatares.gerar_miniaturas(nome)
+        base = nome[:-len('.png')]
+        self.assertEqual(avatares.nomes_miniaturas(nome),
+                         [f'{base}.{tamanho}.{formato}' for tamanho in avatares.TAMANHOS
+                          for formato in avatares.FORMATOS])
+        for tamanho in avatares.TAMANHOS:
+            for formato, formato_pil in (('jpg', 'JPEG'), ('webp', 'WEBP')):
+                if formato not in avatares.FORMATOS:
+                    continue
+                with self.subTest(tamanho=tamanho, formato=formato):
+                    miniatura = self.abrir(avatares.nome_miniatura(nome, tamanho, formato))
+                    self.assertEqual((miniatura.format, miniatura.size), (formato_pil, (tamanho, tamanho)))
+        self.assertTrue(avatares.miniaturas_existem(nome))
+
+        # Gerar de novo substitui as miniaturas, sem criar outros arquivos.
+        avatares.gerar_miniaturas(nome)
+        _, arquivos = default_storage.listdir(nome.rsplit('/', 1)[0])
+        self.assertEqual(len(arquivos), 1 + len(avatares.nomes_miniaturas(nome)))
+        avatares.excluir_miniaturas(nome)
+        self.assertFalse(any(default_storage.exists(miniatura) for miniatura in avatares.nomes_miniaturas(nome)))
+
+    def test_recorte_no_centro(self):
+        # Uma imagem larga perde as laterais: o centro tem as duas cores.
+        nome = self.salvar(imagem(400, 100))
+        avatares.gerar_miniaturas(nome)
+        miniatura = self.abrir(avatares.nome_miniatura(nome, 64, 'jpg'))
+        self.assertEqual(miniatura.size, (64, 64))
+        self.assertEqual([cor(miniatura.getpixel((x, 32))) for x in (2, 61)], [VERMELHO, AZUL])
+
+    def test_orientacao_exif(self):
+        # Com a orientação 6, a foto é exibida girada 90° no sentido horário:
+        # a metade esquerda (vermelha) fica em cima.
+        nome = self.salvar(imagem(200, 100, orientacao=6))
+        avatares.gerar_miniaturas(nome)
+        miniatura = self.abrir(avatares.nome_miniatura(nome, 64, 'jpg'))
+        self.assertEqual([cor(miniatura.getpixel(ponto)) for ponto in ((2, 2), (61, 2), (2, 61), (61, 61))],
+                         [VERMELHO, VERMELHO, AZUL, AZUL])
+
+    def test_srcset(self):
+        nome = self.salvar(imagem(100, 100))
+        base = '/media/' + nome[:-len('.jpg')]
+        atributos = avatares.atributos_img(nome, 200)
+        self.assertEqual(atributos['src'], f'{base}.200.jpg')
+        self.assertEqual(atributos['srcset_jpg'], f'{base}.64.jpg 64w, {base}.200.jpg 200w, {base}.400.jpg 400w')
+        # Acima do maior tamanho, a maior miniatura.
+        self.assertEqual(avatares.atributos_img(nome, 1000)['src'], f'{base}.400.jpg')
+
+        contato = Contato.objects.create(nome='Ana', avatar=nome, avatar_miniaturas=True)
+        html = Template('{% load avatares_tags %}{% avatar contato 64 %}').render(Context({'contato': contato}))
+        self.assertInHTML(f'<img style="height:64px; object-fit:cover" src="{base}.64.jpg" '
+                          f'srcset="{atributos["srcset_jpg"]}" sizes="64px" loading="lazy" '
+                          f'class="card-img-top img-thumbnail" alt="Ana">', html)
+        if 'webp' in avatares.FORMATOS:
+            self.assertIn(f'srcset="{base}.64.webp 64w, {base}.200.webp 200w, {base}.400.webp 400w"', html)
+
+        # O cartão da lista de contatos guarda os mesmos atributos.
+        resposta = self.client.get(reverse('contatos_list_view'))
+        self.assertContains(resposta, f'src="{base}.200.jpg" srcset="{atributos["srcset_jpg"]}" sizes="200px"')
+
+    def test_sem_miniaturas_exibe_o_original(self):
+        nome = self.salvar(imagem(100, 100))
+        contato = Contato.objects.create(nome='Ana', avatar=nome)
+        html = Template('{% load avatares_tags %}{% avatar contato %}').render(Context({'contato': contato}))
+        self.assertIn(f'src="/media/{nome}"', html)
+        self.assertNotIn('srcset', html)
+
+
+class GerarMiniaturasCommandTests(TestCase):
+
+    def setUp(self):
+        diretorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, diretorio)
+        configuracao = override_settings(MEDIA_ROOT=diretorio)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+    def test_gera_as_miniaturas_pendentes(self):
+        armazenamento = armazenamento_avatares()
+        ana = Contato.objects.create(nome='Ana', avatar=armazenamento.save('avatares/ana.jpg', ContentFile(imagem(80, 60))))
+        bruno = Contato.objects.create(nome='Bruno', avatar=armazenamento.save('avatares/bruno.jpg',
+                                                                               ContentFile(b'nao e uma imagem')))
+        Contato.objects.create(nome='Carla')
+        saida, erros = io.StringIO(), io.StringIO()
+        call_command('gerar_miniaturas', processos=2, stdout=saida, stderr=erros)
+
+        self.assertIn('Miniaturas geradas para 1 de 2 avatares.', saida.getvalue())
+        self.assertIn(bruno.avatar.name, erros.getvalue())
+        self.assertTrue(avatares.miniaturas_existem(ana.avatar.name))
+        self.assertEqual(list(Contato.objects.filter(avatar_miniaturas=True)), [ana])
+        # O cartão passa a exibir as miniaturas.
+        self.assertEqual(CartaoContato.objects.get(contato_id=ana.id).avatar['src'],
+                         '/media/' + avatares.nome_miniatura(ana.avatar.name, 200, 'jpg'))
+        self.assertNotIn('src', CartaoContato.objects.get(contato_id=bruno.id).avatar)
+
+        # A imagem inválida continua pendente; com --todos, a de Ana também.
+        saida = io.StringIO()
+        call_command('gerar_miniaturas', processos=1, stdout=saida, stderr=io.StringIO())
+        self.assertIn('Miniaturas geradas para 0 de 1 avatares.', saida.getvalue())
+        saida = io.StringIO()
+        call_command('gerar_miniaturas', processos=1, todos=True, stdout=saida, stderr=io.StringIO())
+        self.assertIn('Miniaturas geradas para 1 de 2 avatares.', saida.getvalue())
+        Contato.objects.filter(id=bruno.id).delete()
+        saida = io.StringIO()
+        call_command('gerar_miniaturas', stdout=saida)
+        self.assertIn('Nenhum avatar pendente.', saida.getvalue())
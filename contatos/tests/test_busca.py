@@ -0,0 +1,123 @@
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+
+from contatos import busca, cartoes, donos
+from contatos.models import Alteracao, Contato, Grupo, Telefone
+
+from . import criar_contato
+
+
+class BuscaTests(TestCase):
+
+    def setUp(self):
+        self.familia = Grupo.objects.create(nome='Família')
+        self.joao = criar_contato('João da Silva', telefones=['11 99999-1234'],
+                                  emails=['joao@exemplo.com'], grupos=[self.familia])
+        self.maria = criar_contato('Maria Souza', telefones=['21 98888-0000'], emails=['maria_s@exemplo.com'])
+
+    def ids(self, termo, queryset=None):
+        return set(busca.filtrar_contatos(queryset or Contato.objects.all(), termo).values_list('pk', flat=True))
+
+    def test_indice_ignora_acentos_e_maiusculas(self):
+        self.assertEqual(self.ids('JOAO'), {self.joao.id})
+        self.assertEqual(self.ids('joão silva'), {self.joao.id})
+        self.assertEqual(self.ids('souza'), {self.maria.id})
+
+    def test_telefone_sem_formatacao_e_grupo(self):
+        self.assertEqual(self.ids('999991234'), {self.joao.id})
+        self.assertEqual(self.ids('familia'), {self.joao.id})
+
+    def test_termo_curto_busca_o_inicio_do_nome(self):
+        # Termos com menos de três caracteres não usam o MATCH do trigram.
+        self.assertIsNone(busca._expressao('jo'))
+        self.assertEqual(self.ids('jo'), {self.joao.id})
+        self.assertEqual(self.ids('JÔ'), {self.joao.id})
+        self.assertEqual(self.ids('m'), {self.maria.id})
+        self.assertEqual(self.ids('ri'), set())
+        self.assertEqual(self.ids('%'), set())
+        # Telefones, emails e grupos só são buscados a partir do terceiro
+        # caractere.
+        self.assertEqual(self.ids('98'), set())
+        self.assertEqual(self.ids('988'), {self.maria.id})
+        self.assertEqual(self.ids('ex'), set())
+        self.assertEqual(self.ids('exe'), {self.joao.id, self.maria.id})
+        self.assertEqual(self.ids('fa'), set())
+        self.assertEqual(self.ids('fam'), {self.joao.id})
+        telefones = busca.filtrar_contatos(Telefone.objects.all(), 'ma', campo='contato')
+        self.assertEqual([telefone.numero for telefone in telefones], ['21 98888-0000'])
+
+    def test_termo_curto_usa_o_indice_do_nome(self):
+        consulta = cartoes.consultar(busca='jo').order_by('nome')
+        sql, parametros = consulta.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', parametros)
+            plano = ' '.join(str(linha[-1]) for linha in cursor.fetchall())
+        # Os nomes do trecho saem do índice 'cartao_busca', e a página é
+        # lida em ordem pelo 'cartao_lista', sem ordenar os cartões.
+        self.assertIn('COVERING INDEX cartao_busca (dono=? AND nome_busca>? AND nome_busca<?)', plano)
+        self.assertIn('cartao_lista (dono=? AND nome=?)', plano)
+        self.assertNotIn('TEMP B-TREE', plano)
+        self.assertNotIn('SCAN', plano.replace('SCAN CONSTANT ROW', ''))
+        self.assertEqual([cartao.nome for cartao in consulta], ['João da Silva'])
+
+    def test_filtra_cartoes_e_modelos_relacionados(self):
+        self.assertEqual(set(cartoes.consultar(busca='silva').values_list('pk', flat=True)), {self.joao.id})
+        telefones = busca.filtrar_contatos(Telefone.objects.all(), 'maria', campo='contato')
+        self.assertEqual([telefone.numero for telefone in telefones], ['21 98888-0000'])
+
+    def test_indice_acompanha_alteracoes(self):
+        self.joao.nome = 'Joana'
+        self.joao.save()
+        self.assertEqual(self.ids('silva'), set())
+        self.assertEqual(self.ids('joana'), {self.joao.id})
+        self.joao.delete()
+        self.assertEqual(self.ids('joana'), set())
+
+    def test_busca_sem_indice(self):
+        with mock.patch.object(busca, 'disponivel', return_value=False):
+            self.assertEqual(self.ids('silva'), {self.joao.id})
+            self.assertEqual(self.ids('8888'), {self.maria.id})
+            self.assertEqual(self.ids('exemplo'), {self.joao.id, self.maria.id})
+
+    def test_busca_restrita_ao_dono(self):
+        with donos.como_dono(2):
+            criar_contato('João Pereira')
+            self.assertEqual(Contato.objects.filter(nome='João Pereira').count(), 1)
+        self.assertEqual(self.ids('joao'), {self.joao.id})
+
+
+class GrupoAlteradoTests(TestCase):
+    # Só o nome do grupo aparece no índice de busca, nos cartões e nos dados
+    # sincronizados dos seus contatos.
+
+    def setUp(self):
+        self.grupo = Grupo.objects.create(nome='Trabalho')
+        self.membros = [criar_contato(f'Colega {numero}', grupos=[self.grupo]) for numero in range(20)]
+        self.sequencias = set(Alteracao.objects.filter(tipo=Alteracao.CONTATO).values_list('sequencia', flat=True))
+
+    def test_descricao_nao_sincroniza_os_contatos(self):
+        grupo = Grupo.objects.get(id=self.grupo.id)
+        grupo.descricao = 'Pessoas do escritório'
+        # O UPDATE do grupo, o registro de alterações do grupo e a versão da
+        # agenda, sem consultar os membros.
+        with self.assertNumQueries(5):
+            grupo.save()
+        self.assertEqual(set(Alteracao.objects.filter(tipo=Alteracao.CONTATO).values_list('sequencia', flat=True)),
+                         self.sequencias)
+        self.assertTrue(Alteracao.objects.filter(tipo=Alteracao.GRUPO, objeto_id=grupo.id).exists())
+
+    def test_nome_sincroniza_os_contatos(self):
+        grupo = Grupo.objects.get(id=self.grupo.id)
+        grupo.nome = 'Escritório'
+        grupo.save()
+        self.assertEqual(set(busca.filtrar_contatos(Contato.objects.all(), 'escritorio').values_list('id', flat=True)),
+                         {contato.id for contato in self.membros})
+        self.assertEqual(cartoes.consultar().get(contato_id=self.membros[0].id).grupos, ['Escritório'])
+        self.assertFalse(Alteracao.objects.filter(sequencia__in=self.sequencias).exists())
+        # Salvar de novo, sem alterar o nome, não sincroniza os contatos outra vez.
+        sequencias = set(Alteracao.objects.filter(tipo=Alteracao.CONTATO).values_list('sequencia', flat=True))
+        grupo.save()
+        self.assertEqual(set(Alteracao.objects.filter(tipo=Alteracao.CONTATO).values_list('sequencia', flat=True)),
+                         sequencias)
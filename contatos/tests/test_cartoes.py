@@ -0,0 +1,45 @@
+from unittest import mock
+
+from django.db import connections
+from django.test import TransactionTestCase
+from django.urls import reverse
+
+from contatos import cartoes
+from contatos.models import CartaoContato, Contato, Telefone
+from contatos.sincronizacao import versao_agenda
+
+
+class CartoesTransacaoTests(TransactionTestCase):
+    # Fora de TestCase, para que as views não rodem dentro da transação do
+    # próprio teste.
+    databases = {'default', 'leitura'}
+
+    def setUp(self):
+        self.contato = Contato.objects.create(nome='Ana')
+
+    def tearDown(self):
+        # Exclui os contatos pelo ORM, para que os signals limpem também o
+        # índice de busca, que não é apagado entre os testes.
+        Contato.objects.all().delete()
+
+    def test_gravacao_e_cartao_na_mesma_transacao(self):
+        transacoes = []
+        atualizar = cartoes.atualizar
+
+        def registrar(*args, **kwargs):
+            transacoes.append(connections['default'].in_atomic_block)
+            return atualizar(*args, **kwargs)
+
+        with mock.patch.object(cartoes, 'atualizar', side_effect=registrar):
+            self.client.post(reverse('novo_tel', args=[self.contato.id]), {'numero': '11 91111-1111'})
+        self.assertEqual(transacoes, [True])
+        self.assertEqual(CartaoContato.objects.get(contato_id=self.contato.id).telefones, ['11 91111-1111'])
+
+    def test_falha_na_sincronizacao_desfaz_a_gravacao(self):
+        versao = versao_agenda()
+        with mock.patch.object(cartoes, 'atualizar', side_effect=RuntimeError('falhou')):
+            with self.assertRaises(RuntimeError):
+                self.client.post(reverse('novo_tel', args=[self.contato.id]), {'numero': '11 91111-1111'})
+        self.assertFalse(Telefone.objects.exists())
+        self.assertEqual(CartaoContato.objects.get(contato_id=self.contato.id).telefones, ())
+        self.assertEqual(versao_agenda(), versao)
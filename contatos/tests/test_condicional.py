@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from contatos.models import Contato
+
+from . import criar_contato
+
+
+class ListasCondicionaisTests(TestCase):
+
+    def setUp(self):
+        criar_contato('Ana')
+        # A primeira página cria o cookie CSRF do visitante.
+        self.client.get(reverse('contatos_list_view'))
+
+    def get(self, nome, etag):
+        return self.client.get(reverse(nome), HTTP_IF_NONE_MATCH=etag)
+
+    def test_304_com_o_mesmo_etag(self):
+        for nome in ('contatos_list_view', 'grupos_list'):
+            with self.subTest(nome):
+                resposta = self.client.get(reverse(nome))
+                self.assertEqual(resposta.status_code, 200)
+                self.assertIn('Cookie', resposta['Vary'])
+                self.assertEqual(self.get(nome, resposta['ETag']).status_code, 304)
+
+    def test_alteracao_da_agenda_muda_o_etag(self):
+        etag = self.client.get(reverse('contatos_list_view'))['ETag']
+        criar_contato('Bruno')
+        self.assertContains(self.get('contatos_list_view', etag), 'Bruno')
+
+    def test_outro_token_csrf_muda_o_etag(self):
+        etag = self.client.get(reverse('contatos_list_view'))['ETag']
+        self.client.cookies[settings.CSRF_COOKIE_NAME] = 'b' * 32
+        resposta = self.get('contatos_list_view', etag)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertNotEqual(resposta['ETag'], etag)
+
+    def test_sem_cookie_csrf_a_requisicao_nao_e_condicional(self):
+        etag = self.client.get(reverse('contatos_list_view'))['ETag']
+        self.client.cookies.clear()
+        resposta = self.get('contatos_list_view', etag)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertFalse(resposta.has_header('ETag'))
+        self.assertFalse(resposta.has_header('Last-Modified'))
+
+
+class ListasAssincronasCondicionaisTests(TransactionTestCase):
+    # As views assíncronas consultam o banco em outras threads, que não
+    # enxergam a transação de um TestCase.
+    databases = {'default', 'leitura'}
+
+    def setUp(self):
+        criar_contato('Ana')
+
+    def tearDown(self):
+        # Pelo ORM, para que os signals limpem também o índice de busca.
+        Contato.objects.all().delete()
+
+    def test_304_com_o_mesmo_etag_e_token(self):
+        for nome in ('contatos_list_async', 'grupos_list_async'):
+            with self.subTest(nome):
+                self.client.cookies.clear()
+                resposta = self.client.get(reverse(nome))
+                # Sem o cookie CSRF, a resposta não tem ETag.
+                self.assertFalse(resposta.has_header('ETag'))
+                resposta = self.client.get(reverse(nome))
+                self.assertIn('Cookie', resposta['Vary'])
+                etag = resposta['ETag']
+                self.assertEqual(self.client.get(reverse(nome), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+                self.client.cookies[settings.CSRF_COOKIE_NAME] = 'b' * 32
+                self.assertEqual(self.client.get(reverse(nome), HTTP_IF_NONE_MATCH=etag).status_code, 200)
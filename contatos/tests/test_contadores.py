@@ -0,0 +1,61 @@
+import io
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from contatos import contadores
+from contatos.models import Email, Grupo
+
+from . import criar_contato
+
+
+class ContadoresTests(TestCase):
+
+    def setUp(self):
+        self.grupo = Grupo.objects.create(nome='Amigos')
+        self.ana = criar_contato('Ana', telefones=['11 91111-1111'], grupos=[self.grupo])
+        self.bruno = criar_contato('Bruno', emails=['bruno@exemplo.com'], grupos=[self.grupo])
+
+    def contadores(self):
+        self.grupo.refresh_from_db()
+        return tuple(getattr(self.grupo, campo) for campo in Grupo.CONTADORES)
+
+    def test_contadores_acompanham_alteracoes(self):
+        self.assertEqual(self.contadores(), (2, 1, 1))
+        Email.objects.create(contato=self.ana, endereco='ana@exemplo.com')
+        self.assertEqual(self.contadores(), (2, 1, 2))
+        self.bruno.grupos.remove(self.grupo)
+        self.assertEqual(self.contadores(), (1, 1, 1))
+        self.ana.delete()
+        self.assertEqual(self.contadores(), (0, 0, 0))
+        self.assertEqual(contadores.divergencias(), [])
+
+    def test_salvar_grupo_nao_sobrescreve_os_contadores(self):
+        grupo = Grupo.objects.get(id=self.grupo.id)
+        criar_contato('Carla', grupos=[self.grupo])
+        grupo.nome = 'Amigos próximos'
+        grupo.save()
+        self.assertEqual(self.contadores(), (3, 1, 1))
+        self.assertEqual(self.grupo.nome, 'Amigos próximos')
+
+    def test_reconciliacao(self):
+        Grupo.objects.filter(id=self.grupo.id).update(total_contatos=10, contatos_com_email=0)
+        divergentes = contadores.divergencias()
+        self.assertEqual([grupo['id'] for grupo in divergentes], [self.grupo.id])
+        self.assertEqual(divergentes[0]['total_contatos_calculado'], 2)
+
+        saida = io.StringIO()
+        call_command('reconciliar_grupos', stdout=saida)
+        self.assertIn('use --corrigir', saida.getvalue())
+        self.assertEqual(self.contadores(), (10, 1, 0))
+
+        call_command('reconciliar_grupos', '--corrigir', stdout=io.StringIO())
+        self.assertEqual(self.contadores(), (2, 1, 1))
+        self.assertEqual(contadores.divergencias(), [])
+
+    def test_estatisticas_sem_contadores(self):
+        Grupo.objects.filter(id=self.grupo.id).update(total_contatos=10)
+        with mock.patch.object(contadores, 'USAR_CONTADORES', False):
+            self.assertEqual(contadores.grupos_com_estatisticas().get(id=self.grupo.id).membros, 2)
+        self.assertEqual(contadores.grupos_com_estatisticas().get(id=self.grupo.id).membros, 10)
@@ -0,0 +1,79 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from agenda1.roteadores import RoteadorLeituraEscrita
+from contatos import donos
+from contatos.models import Contato, Grupo, LocalizacaoDono, Tarefa
+
+
+class DonosTests(TestCase):
+
+    def tearDown(self):
+        donos.esquecer_localizacoes()
+
+    def test_manager_filtra_pelo_dono_atual(self):
+        Contato.objects.create(nome='Ana')
+        with donos.como_dono(2):
+            # O nome só é único dentro da agenda de cada dono.
+            Contato.objects.create(nome='Ana')
+            self.assertEqual(Contato.objects.get().dono, 2)
+        self.assertEqual(Contato.objects.get().dono, donos.DONO_PADRAO)
+        self.assertEqual(Contato.todos.count(), 2)
+
+    def test_particao_por_hash_e_estavel(self):
+        duas = {'default': [], 'particao1': []}
+        tres = {**duas, 'particao2': []}
+        movidos = [dono for dono in range(1, 301)
+                   if donos.particao_por_hash(dono, duas) != donos.particao_por_hash(dono, tres)]
+        # Só mudam de lugar os donos que passam para a nova partição.
+        self.assertTrue(all(donos.particao_por_hash(dono, tres) == 'particao2' for dono in movidos))
+        self.assertTrue(0 < len(movidos) < 200)
+        self.assertEqual(donos.particao_por_hash(42, duas), donos.particao_por_hash(42, duas))
+
+    def test_localizacao_registrada_tem_precedencia(self):
+        particoes = {'default': ['leitura'], 'outra': []}
+        LocalizacaoDono.objects.create(dono=7, particao='outra', bloqueada=True)
+        with mock.patch.object(donos, 'PARTICOES', particoes), override_settings(AGENDA_PARTICOES=particoes):
+            roteador = RoteadorLeituraEscrita()
+            self.assertEqual(donos.particao(7), 'outra')
+            self.assertTrue(donos.bloqueada(7))
+            with donos.como_dono(7):
+                self.assertEqual(roteador.db_for_write(Contato), 'outra')
+                # A fila de tarefas fica sempre na partição 'default'.
+                self.assertEqual(roteador.db_for_write(Tarefa), 'default')
+            with donos.como_dono(7, particao='default'):
+                self.assertEqual(roteador.db_for_write(Contato), 'default')
+
+    def test_leituras_da_transacao_usam_a_conexao_de_escrita(self):
+        roteador = RoteadorLeituraEscrita()
+        # Os testes rodam dentro de uma transação da conexão de escrita.
+        self.assertEqual(roteador.db_for_read(Contato), 'default')
+        contato, grupo = Contato.objects.create(nome='Ana'), Grupo.objects.create(nome='Amigos')
+        self.assertTrue(roteador.allow_relation(contato, grupo))
+
+    def test_requisicao_usa_a_agenda_do_usuario(self):
+        Contato.objects.create(nome='Contato do visitante')
+        # O usuário com o id AGENDA_DONO_PADRAO compartilha a agenda dos
+        # visitantes, então o teste usa outro.
+        User.objects.create_user('primeiro', password='senha-de-teste', id=donos.DONO_PADRAO)
+        usuario = User.objects.create_user('usuario', password='senha-de-teste')
+        with donos.como_dono(usuario.id):
+            Contato.objects.create(nome='Contato do usuário')
+
+        resposta = self.client.get(reverse('contatos_list_view'))
+        self.assertContains(resposta, 'Contato do visitante')
+        self.assertNotContains(resposta, 'Contato do usuário')
+
+        self.client.force_login(usuario)
+        resposta = self.client.get(reverse('contatos_list_view'))
+        self.assertContains(resposta, 'Contato do usuário')
+        self.assertNotContains(resposta, 'Contato do visitante')
+
+    def test_agenda_bloqueada_responde_503(self):
+        particoes = {'default': ['leitura'], 'outra': []}
+        LocalizacaoDono.objects.create(dono=donos.DONO_PADRAO, particao='default', bloqueada=True)
+        with mock.patch.object(donos, 'PARTICOES', particoes):
+            self.assertEqual(self.client.get(reverse('contatos_list_view')).status_code, 503)
@@ -0,0 +1,46 @@
+from django.test import TestCase
+
+from contatos import busca, contadores
+from contatos.models import CartaoContato, Contato, Grupo
+from contatos.operacoes import mesclar_contatos
+
+from . import criar_contato
+
+
+class MesclarContatosTests(TestCase):
+
+    def setUp(self):
+        self.trabalho = Grupo.objects.create(nome='Trabalho')
+        self.amigos = Grupo.objects.create(nome='Amigos')
+        self.ana = criar_contato('Ana Lima', telefones=['(11) 91111-1111'], emails=['ana@exemplo.com'],
+                                 grupos=[self.trabalho])
+        self.duplicado = criar_contato('Ana L.', telefones=['11 91111-1111', '11 92222-2222'],
+                                       emails=['ANA@exemplo.com', 'ana.lima@exemplo.com'],
+                                       grupos=[self.trabalho, self.amigos])
+
+    def test_une_os_dados_sem_repetir(self):
+        self.assertEqual(mesclar_contatos(self.ana.id, [self.duplicado.id, self.ana.id]), 1)
+
+        self.assertFalse(Contato.objects.filter(id=self.duplicado.id).exists())
+        self.assertEqual(sorted(self.ana.telefone_set.values_list('numero', flat=True)),
+                         ['(11) 91111-1111', '11 92222-2222'])
+        self.assertEqual(sorted(self.ana.email_set.values_list('endereco', flat=True)),
+                         ['ana.lima@exemplo.com', 'ana@exemplo.com'])
+        self.assertEqual(set(self.ana.grupos.all()), {self.trabalho, self.amigos})
+
+    def test_estruturas_derivadas(self):
+        mesclar_contatos(self.ana.id, [self.duplicado.id])
+        self.assertEqual(contadores.divergencias(), [])
+        self.trabalho.refresh_from_db()
+        self.assertEqual(self.trabalho.total_contatos, 1)
+        self.assertFalse(CartaoContato.objects.filter(contato_id=self.duplicado.id).exists())
+        self.assertEqual(len(CartaoContato.objects.get(contato_id=self.ana.id).telefones), 2)
+        self.assertEqual(set(busca.filtrar_contatos(Contato.objects.all(), '92222').values_list('id', flat=True)),
+                         {self.ana.id})
+
+    def test_contato_inexistente(self):
+        with self.assertRaises(Contato.DoesNotExist):
+            mesclar_contatos(self.ana.id, [self.duplicado.id, self.duplicado.id + 100])
+        # Nada foi alterado.
+        self.assertTrue(Contato.objects.filter(id=self.duplicado.id).exists())
+        self.assertEqual(self.duplicado.telefone_set.count(), 2)
@@ -0,0 +1,255 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from contatos import busca, contadores, donos
+from contatos.forms import EditarContatoForm
+from contatos.models import CartaoContato, Contato, Email, Grupo, Telefone
+
+from . import criar_contato
+
+
+def dados_do_formulario(contato, **alterados):
+    # Os dados que a página de edição enviaria sem nenhuma alteração, com os
+    # valores em 'alterados' substituídos.
+    dados = {'nome_contato': contato.nome, 'grupos': [grupo.id for grupo in contato.grupos.all()]}
+    dados.update({f'tel_{tel.id}': tel.numero for tel in contato.telefone_set.all()})
+    dados.update({f'email_{email.id}': email.endereco for email in contato.email_set.all()})
+    dados.update(alterados)
+    return dados
+
+
+class EditarContatoViewTests(TestCase):
+
+    def setUp(self):
+        self.amigos = Grupo.objects.create(nome='Amigos')
+        self.trabalho = Grupo.objects.create(nome='Trabalho')
+        self.contato = criar_contato('Ana', telefones=['11 91111-1111', '11 92222-2222'],
+                                     emails=['ana@exemplo.com'], grupos=[self.amigos])
+        self.url = reverse('editar_contato', args=[self.contato.id])
+
+    def editar(self, **alterados):
+        return self.client.post(self.url, dados_do_formulario(self.contato, **alterados))
+
+    def test_edita_nome_telefones_emails_e_grupos(self):
+        primeiro, segundo = self.contato.telefone_set.order_by('id')
+        email = self.contato.email_set.get()
+        resposta = self.editar(nome_contato='Ana Souza', grupos=[self.trabalho.id],
+                               **{f'tel_{segundo.id}': '11 93333-3333', f'email_{email.id}': 'souza@exemplo.com'})
+        self.assertRedirects(resposta, reverse('contatos_list_view'))
+        self.contato.refresh_from_db()
+        self.assertEqual(self.contato.nome, 'Ana Souza')
+        # Cada valor é gravado no telefone ou email do mesmo id.
+        self.assertEqual(list(self.contato.telefone_set.order_by('id').values_list('id', 'numero')),
+                         [(primeiro.id, '11 91111-1111'), (segundo.id, '11 93333-3333')])
+        segundo.refresh_from_db()
+        self.assertEqual(segundo.numero_normalizado, '+5511933333333')
+        self.assertEqual(Email.objects.get(id=email.id).endereco, 'souza@exemplo.com')
+        self.assertEqual(list(self.contato.grupos.all()), [self.trabalho])
+
+        cartao = CartaoContato.objects.get(contato_id=self.contato.id)
+        self.assertEqual((cartao.nome, cartao.telefones, cartao.emails),
+                         ('Ana Souza', ['11 91111-1111', '11 93333-3333'], ['souza@exemplo.com']))
+        self.assertEqual(contadores.divergencias(), [])
+        for termo in ('93333', 'souza@', 'trabalho'):
+            self.assertTrue(busca.filtrar_contatos(Contato.objects.all(), termo).filter(id=self.contato.id).exists())
+        self.assertFalse(busca.filtrar_contatos(Contato.objects.all(), '92222').exists())
+
+    def test_incluir_e_excluir_telefones_e_emails(self):
+        self.client.post(reverse('novo_tel', args=[self.contato.id]), {'numero': '11 94444-4444'})
+        self.client.post(reverse('novo_email', args=[self.contato.id]), {'endereco': 'outro@exemplo.com'})
+        primeiro = self.contato.telefone_set.order_by('id').first()
+        self.client.post(reverse('excluir_telefone', args=[self.contato.id, primeiro.id]))
+        email = self.contato.email_set.get(endereco='ana@exemplo.com')
+        self.client.post(reverse('excluir_email', args=[self.contato.id, email.id]))
+
+        # A página de edição exibe os telefones e emails atuais.
+        form = self.client.get(self.url).context['form']
+        self.assertEqual({nome: campo.initial for nome, campo in form.fields.items() if nome != 'grupos'},
+                         {'nome_contato': 'Ana', **{f'tel_{tel.id}': tel.numero for tel in self.contato.telefone_set.all()},
+                          **{f'email_{e.id}': e.endereco for e in self.contato.email_set.all()}})
+        self.assertEqual(sorted(self.contato.telefone_set.values_list('numero', flat=True)),
+                         ['11 92222-2222', '11 94444-4444'])
+
+        novo = self.contato.telefone_set.get(numero='11 94444-4444')
+        self.editar(**{f'tel_{novo.id}': '11 95555-5555'})
+        self.assertEqual(sorted(self.contato.telefone_set.values_list('numero', flat=True)),
+                         ['11 92222-2222', '11 95555-5555'])
+        cartao = CartaoContato.objects.get(contato_id=self.contato.id)
+        self.assertEqual((cartao.telefones, cartao.emails), (['11 92222-2222', '11 95555-5555'], ['outro@exemplo.com']))
+
+    def test_telefone_incluido_durante_a_edicao_nao_e_alterado(self):
+        dados = dados_do_formulario(self.contato, nome_contato='Ana Souza')
+        novo = Telefone.objects.create(contato=self.contato, numero='11 94444-4444')
+        self.client.post(self.url, dados)
+        novo.refresh_from_db()
+        self.assertEqual(novo.numero, '11 94444-4444')
+        self.assertEqual(Contato.objects.get(id=self.contato.id).nome, 'Ana Souza')
+
+    def test_telefone_excluido_durante_a_edicao(self):
+        primeiro, segundo = self.contato.telefone_set.order_by('id')
+        dados = dados_do_formulario(self.contato, nome_contato='Ana Souza', **{f'tel_{segundo.id}': '11 93333-3333'})
+        primeiro.delete()
+        resposta = self.client.post(self.url, dados)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertIn('excluído enquanto ele era editado', resposta.context['form'].non_field_errors()[0])
+        # Nada foi gravado, e o telefone excluído não foi recriado.
+        self.contato.refresh_from_db()
+        self.assertEqual(self.contato.nome, 'Ana')
+        self.assertEqual(list(self.contato.telefone_set.values_list('numero', flat=True)), ['11 92222-2222'])
+
+    def test_telefone_de_outro_contato(self):
+        outro = criar_contato('Bruno', telefones=['11 96666-6666'])
+        telefone = outro.telefone_set.get()
+        resposta = self.editar(**{f'tel_{telefone.id}': '11 97777-7777'})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertTrue(resposta.context['form'].non_field_errors())
+        telefone.refresh_from_db()
+        self.assertEqual(telefone.numero, '11 96666-6666')
+
+    def test_nome_em_uso(self):
+        criar_contato('Bruno')
+        resposta = self.editar(nome_contato='Bruno')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertIn('nome_contato', resposta.context['form'].errors)
+        # O próprio nome do contato pode ser mantido.
+        self.assertRedirects(self.editar(), reverse('contatos_list_view'))
+
+
+class EditarContatoConsultasTests(TestCase):
+    # O número de consultas da página de edição não depende de quantos
+    # telefones, emails e grupos o contato tem, nem de quantos grupos existem
+    # na agenda.
+
+    def setUp(self):
+        grupos = [Grupo.objects.create(nome=f'Grupo {numero}') for numero in range(20)]
+        self.pequeno = criar_contato('Ana', telefones=['11 91111-1111'], emails=['ana@exemplo.com'],
+                                     grupos=grupos[:1])
+        self.grande = criar_contato('Bruno', telefones=[f'11 9{numero:04}-0000' for numero in range(10)],
+                                    emails=[f'bruno{numero}@exemplo.com' for numero in range(10)],
+                                    grupos=grupos[:10])
+        self.outros_grupos = grupos[10:]
+
+    def consultas(self, funcao):
+        with CaptureQueriesContext(connection) as consultas:
+            funcao()
+        return len(consultas)
+
+    def test_construcao_do_formulario(self):
+        # O contato e uma consulta para cada prefetch_related (telefones,
+        # emails e grupos).
+        for contato in (self.pequeno, self.grande):
+            with self.subTest(contato=contato.nome), self.assertNumQueries(4):
+                form = EditarContatoForm(id=contato.id)
+                [str(campo) for campo in form]
+        self.assertEqual(len(form.fields), 1 + 1 + 10 + 10)
+
+    def test_validacao(self):
+        # Além da construção, uma consulta para o nome e outra para os
+        # grupos enviados.
+        for contato in (self.pequeno, self.grande):
+            dados = dados_do_formulario(contato, grupos=[grupo.id for grupo in self.outros_grupos])
+            with self.subTest(contato=contato.nome), self.assertNumQueries(6):
+                self.assertTrue(EditarContatoForm(dados, id=contato.id).is_valid())
+
+    def test_pagina_de_edicao(self):
+        self.client.get(reverse('editar_contato', args=[self.pequeno.id]))
+        self.assertEqual(self.consultas(lambda: self.client.get(reverse('editar_contato', args=[self.pequeno.id]))),
+                         self.consultas(lambda: self.client.get(reverse('editar_contato', args=[self.grande.id]))))
+
+    def test_gravacao(self):
+        # Todos os telefones e emails alterados e todos os grupos trocados.
+        def editar(contato):
+            dados = dados_do_formulario(contato, grupos=[grupo.id for grupo in self.outros_grupos])
+            for nome, valor in list(dados.items()):
+                if nome.startswith('tel_'):
+                    dados[nome] = valor.replace('-0000', '-9999').replace('-1111', '-9999')
+                elif nome.startswith('email_'):
+                    dados[nome] = 'novo.' + valor
+            url = reverse('editar_contato', args=[contato.id])
+            return lambda: self.assertRedirects(self.client.post(url, dados), reverse('contatos_list_view'),
+                                                fetch_redirect_response=False)
+
+        self.assertEqual(self.consultas(editar(self.pequeno)), self.consultas(editar(self.grande)))
+        self.assertEqual(sorted(self.grande.telefone_set.values_list('numero', flat=True)),
+                         [f'11 9{numero:04}-9999' for numero in range(10)])
+        self.assertEqual(set(self.grande.grupos.all()), set(self.outros_grupos))
+        self.assertEqual(contadores.divergencias(), [])
+
+
+class SeletorDeGruposTests(TestCase):
+    # O seletor de grupos da página de edição só encontra, e o formulário só
+    # aceita, grupos da agenda do dono atual.
+
+    def setUp(self):
+        self.grupos = [Grupo.objects.create(nome=nome) for nome in ('Amigos', 'Ana e Bia', 'Família', 'Trabalho')]
+        self.contato = criar_contato('Ana', grupos=self.grupos[:1])
+        # O usuário com o id AGENDA_DONO_PADRAO compartilha a agenda dos
+        # visitantes, então o outro dono é um segundo usuário.
+        User.objects.create_user('primeiro', password='senha-de-teste', id=donos.DONO_PADRAO)
+        self.outro = User.objects.create_user('outro', password='senha-de-teste')
+        with donos.como_dono(self.outro.id):
+            self.grupo_de_outro = Grupo.objects.create(nome='Amizades')
+
+    def buscar(self, **parametros):
+        return self.client.get(reverse('buscar_grupos'), parametros).json()
+
+    def test_busca_pelo_inicio_do_nome(self):
+        resposta = self.buscar(q='a')
+        self.assertEqual(resposta['resultados'], [{'id': grupo.id, 'nome': grupo.nome} for grupo in self.grupos[:2]])
+        self.assertIsNone(resposta['depois'])
+        self.assertEqual([grupo['nome'] for grupo in self.buscar(q='AMI')['resultados']], ['Amigos'])
+        self.assertEqual(self.buscar(q='mig')['resultados'], [])
+        self.client.force_login(self.outro)
+        self.assertEqual(self.buscar(q='a')['resultados'], [{'id': self.grupo_de_outro.id, 'nome': 'Amizades'}])
+
+    def test_busca_sem_acentos_e_depois_de_renomear(self):
+        self.assertEqual([grupo['nome'] for grupo in self.buscar(q='FAMI')['resultados']], ['Família'])
+        grupo = self.grupos[2]
+        grupo.nome = 'Parentes'
+        grupo.save(update_fields=['nome'])
+        self.assertEqual(self.buscar(q='fam')['resultados'], [])
+        self.assertEqual(self.buscar(q='par')['resultados'], [{'id': grupo.id, 'nome': 'Parentes'}])
+        # Um texto sem letras depois de normalizado não filtra os grupos.
+        self.assertEqual(len(self.buscar(q='\u0301')['resultados']), len(self.grupos))
+
+    def test_busca_usa_o_indice_do_nome(self):
+        # A mesma consulta de buscar_grupos_view().
+        nomes = busca.filtrar_por_prefixo(Grupo.objects.all(), 'ami').values('nome')
+        consulta = Grupo.objects.only('id', 'nome').filter(nome__in=nomes).order_by('nome')[:25]
+        sql, parametros = consulta.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', parametros)
+            plano = ' '.join(str(linha[-1]) for linha in cursor.fetchall())
+        self.assertIn('COVERING INDEX grupo_busca (dono=? AND nome_busca>? AND nome_busca<?)', plano)
+        self.assertNotIn('TEMP B-TREE', plano)
+        self.assertNotIn('SCAN', plano.replace('SCAN CONSTANT ROW', ''))
+        self.assertEqual([grupo.nome for grupo in consulta], ['Amigos'])
+
+    def test_paginas(self):
+        nomes, depois = [], None
+        while True:
+            resposta = self.buscar(por_pagina=3, **({'depois': depois} if depois else {}))
+            nomes += [grupo['nome'] for grupo in resposta['resultados']]
+            depois = resposta['depois']
+            if depois is None:
+                break
+        self.assertEqual(nomes, ['Amigos', 'Ana e Bia', 'Família', 'Trabalho'])
+
+    def test_formulario_aceita_apenas_grupos_do_dono(self):
+        url = reverse('editar_contato', args=[self.contato.id])
+        for ids in ([self.grupo_de_outro.id], [self.grupos[1].id, 9999], ['x']):
+            with self.subTest(ids=ids):
+                form = EditarContatoForm({'nome_contato': 'Ana', 'grupos': ids}, id=self.contato.id)
+                self.assertFalse(form.is_valid())
+                self.assertIn('grupos', form.errors)
+                resposta = self.client.post(url, {'nome_contato': 'Ana', 'grupos': ids})
+                self.assertEqual(resposta.status_code, 200)
+                self.assertEqual(list(self.contato.grupos.all()), self.grupos[:1])
+        self.assertFalse(self.grupo_de_outro.contato_set.exists())
+
+        self.client.post(url, {'nome_contato': 'Ana', 'grupos': [grupo.id for grupo in self.grupos[1:]]})
+        self.assertEqual(list(self.contato.grupos.order_by('nome')), self.grupos[1:])
+        self.assertEqual(contadores.divergencias(), [])
@@ -0,0 +1,79 @@
+import gzip
+import io
+
+from django.test import TestCase
+from django.urls import reverse
+
+from contatos import exportacao, importacao
+from contatos.models import Contato, Grupo
+
+from . import criar_contato
+
+
+class ExportacaoTests(TestCase):
+    # Os arquivos exportados são lidos de volta pela importação, de forma que
+    # uma agenda exportada e reimportada fica igual à original.
+
+    def setUp(self):
+        self.familia = Grupo.objects.create(nome='Família, parentes')
+        self.trabalho = Grupo.objects.create(nome='Trabalho')
+        criar_contato('Ana Souza', telefones=['11 91111-1111', '(11) 3333-4444'],
+                      emails=['ana@exemplo.com', 'ana.souza@exemplo.com'], grupos=[self.familia, self.trabalho])
+        criar_contato('Bruno; "Bê" Lima', emails=['bruno@exemplo.com'], grupos=[self.trabalho])
+        # Um email longo, que ocupa linhas de continuação no vCard.
+        criar_contato('João da Silva Júnior', telefones=['21 92222-2222'],
+                      emails=['joao.' + 'da.silva.' * 10 + 'junior@exemplo.com.br'])
+        criar_contato('Carla\\Barra')
+
+    def registros(self, contatos=None, **kwargs):
+        registros = exportacao.iterar_registros(contatos or Contato.objects.all(), **kwargs)
+        return [(r['nome'], sorted(r['telefones']), sorted(r['emails']), sorted(r['grupos'])) for r in registros]
+
+    def exportar(self, formato, **parametros):
+        resposta = self.client.get(reverse('exportar_contatos'), {'formato': formato, **parametros})
+        self.assertTrue(resposta.streaming)
+        conteudo = b''.join(resposta.streaming_content)
+        if parametros.get('gzip') == '1':
+            conteudo = gzip.decompress(conteudo)
+        return conteudo
+
+    def ler(self, conteudo, formato):
+        texto = importacao.abrir_texto(io.BytesIO(conteudo))
+        return [(r['nome'], sorted(r['telefones']), sorted(r['emails']), sorted(r['grupos']))
+                for r in importacao.ler_registros(texto, formato)]
+
+    def test_lotes(self):
+        self.assertEqual(self.registros(tamanho_lote=1), self.registros())
+        self.assertEqual(len(self.registros()), 4)
+
+    def test_arquivos_sao_lidos_pela_importacao(self):
+        originais = sorted(self.registros())
+        for formato in exportacao.FORMATOS:
+            for parametros in ({}, {'gzip': '1'}):
+                with self.subTest(formato=formato, **parametros):
+                    self.assertEqual(sorted(self.ler(self.exportar(formato, **parametros), formato)), originais)
+
+    def test_linhas_do_vcard(self):
+        conteudo = self.exportar('vcard').decode('utf-8')
+        linhas = conteudo.split('\r\n')
+        self.assertTrue(all(len(linha) <= 75 for linha in linhas))
+        self.assertTrue(any(linha.startswith(' ') for linha in linhas))
+        self.assertIn('CATEGORIES:Família\\, parentes,Trabalho', conteudo)
+
+    def test_reimportar_a_agenda(self):
+        for formato in exportacao.FORMATOS:
+            with self.subTest(formato=formato):
+                originais = sorted(self.registros())
+                conteudo = self.exportar(formato)
+                Contato.objects.all().delete()
+                Grupo.objects.all().delete()
+                registros = list(importacao.ler_registros(importacao.abrir_texto(io.BytesIO(conteudo)), formato))
+                self.assertEqual(importacao.importar_lote(registros)['criados'], 4)
+                self.assertEqual(sorted(self.registros()), originais)
+
+    def test_exportar_grupo(self):
+        resposta = self.client.get(reverse('exportar_grupo', args=[self.familia.id]), {'formato': 'csv'})
+        self.assertEqual(resposta['Content-Disposition'],
+                         f'attachment; filename="contatos-grupo-{self.familia.id}.csv"')
+        registros = self.ler(b''.join(resposta.streaming_content), 'csv')
+        self.assertEqual([registro[0] for registro in registros], ['Ana Souza'])
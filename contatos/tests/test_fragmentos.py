@@ -0,0 +1,84 @@
+from unittest import mock
+
+from django.core.cache import caches
+from django.template import Context, Template, TemplateSyntaxError
+from django.test import TestCase
+from django.urls import reverse
+
+from contatos import fragmentos
+from contatos.models import CartaoContato, Grupo
+
+from . import criar_contato
+
+
+class FragmentosTests(TestCase):
+
+    def setUp(self):
+        caches[fragmentos.CACHE].clear()
+        self.addCleanup(caches[fragmentos.CACHE].clear)
+
+    def renderizar(self, versao, texto):
+        template = Template("{% load fragmentos_tags %}{% fragmento 'teste' 1 versao %}{{ texto }}{% endfragmento %}")
+        return template.render(Context({'versao': versao, 'texto': texto}))
+
+    def test_versao_identifica_o_fragmento(self):
+        self.assertEqual(self.renderizar(1, 'primeiro'), 'primeiro')
+        # Com a mesma versão, o fragmento vem do cache.
+        self.assertEqual(self.renderizar(1, 'segundo'), 'primeiro')
+        self.assertEqual(self.renderizar(2, 'segundo'), 'segundo')
+        # A versão anterior continua lá até ser descartada pelo cache, mas
+        # não é mais procurada.
+        self.assertEqual(self.renderizar(1, 'terceiro'), 'primeiro')
+
+    def test_chave_inclui_a_particao(self):
+        renderizar = mock.Mock(side_effect=['default', 'outra'])
+        self.assertEqual(fragmentos.obter('teste', [1, 1], renderizar), 'default')
+        with mock.patch.object(fragmentos.donos, 'particao', return_value='outra'):
+            self.assertEqual(fragmentos.obter('teste', [1, 1], renderizar), 'outra')
+        self.assertEqual(fragmentos.obter('teste', [1, 1], renderizar), 'default')
+        self.assertEqual(renderizar.call_count, 2)
+        self.assertRegex(fragmentos.chave('teste', ['2024-01-01 10:00:00+00:00']), r'^fragmento\.teste\.[0-9a-f]{32}$')
+
+    def test_sem_cache(self):
+        with mock.patch.object(fragmentos, 'CACHE', None):
+            self.assertEqual(self.renderizar(1, 'primeiro'), 'primeiro')
+            self.assertEqual(self.renderizar(1, 'segundo'), 'segundo')
+
+    def test_argumentos_da_tag(self):
+        with self.assertRaises(TemplateSyntaxError):
+            Template("{% load fragmentos_tags %}{% fragmento 'teste' %}{% endfragmento %}")
+
+
+class FragmentosDasListasTests(TestCase):
+    # Alterar um contato ou grupo muda a versão do seu cartão, e as listas
+    # passam a exibir o cartão novo sem que o cache seja apagado.
+
+    def setUp(self):
+        caches[fragmentos.CACHE].clear()
+        self.addCleanup(caches[fragmentos.CACHE].clear)
+        self.grupo = Grupo.objects.create(nome='Amigos')
+        self.contato = criar_contato('Ana', telefones=['11 91111-1111'], grupos=[self.grupo])
+
+    def test_cartao_do_contato(self):
+        url = reverse('contatos_list_view')
+        self.assertContains(self.client.get(url), '11 91111-1111')
+        versao = CartaoContato.objects.get(contato_id=self.contato.id).versao
+
+        telefone = self.contato.telefone_set.get()
+        telefone.numero = '11 92222-2222'
+        telefone.save()
+        self.assertNotEqual(CartaoContato.objects.get(contato_id=self.contato.id).versao, versao)
+        resposta = self.client.get(url)
+        self.assertContains(resposta, '11 92222-2222')
+        self.assertNotContains(resposta, '11 91111-1111')
+
+    def test_cartao_do_grupo(self):
+        url = reverse('grupos_list')
+        self.assertContains(self.client.get(url), '1 contato<br>')
+        # Os contadores fazem parte da chave do fragmento.
+        criar_contato('Bruno', grupos=[self.grupo])
+        self.assertContains(self.client.get(url), '2 contatos<br>')
+        # E a data de alteração, que muda com a descrição.
+        self.grupo.descricao = 'Amigos da escola'
+        self.grupo.save()
+        self.assertContains(self.client.get(url), 'Amigos da escola')
@@ -0,0 +1,135 @@
+import io
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from django.db import OperationalError
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from contatos import busca, importacao, tarefas
+from contatos.models import Contato, Grupo, Importacao, Tarefa, Telefone
+
+
+class ImportacaoTests(TestCase):
+    CSV = ('nome,telefones,emails,grupos\n'
+           'Ana,11 91111-1111,ana@exemplo.com,Amigos\n'
+           'Bruno,11 92222-2222,,Amigos\n'
+           'Carla,,carla@exemplo.com,\n'
+           'Davi,11 94444-4444,,Trabalho\n')
+
+    def setUp(self):
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        self.diretorio = Path(diretorio.name)
+        patcher = mock.patch.object(importacao, 'DIRETORIO', self.diretorio)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def nova_importacao(self):
+        caminho = self.diretorio / 'envio'
+        caminho.write_text(self.CSV, encoding='utf-8')
+        return Importacao.objects.create(caminho=str(caminho), nome_arquivo='contatos.csv', formato='csv')
+
+    def test_importa_em_lotes(self):
+        registro = self.nova_importacao()
+        lotes = []
+        importacao.importar(registro, io.StringIO(self.CSV), tamanho_lote=3,
+                            progresso=lambda atual: lotes.append(atual.processados))
+        self.assertEqual(lotes, [3, 4])
+        self.assertEqual((registro.status, registro.criados), (Importacao.CONCLUIDA, 4))
+        self.assertEqual(Grupo.objects.get(nome='Amigos').total_contatos, 2)
+        self.assertEqual(set(busca.filtrar_contatos(Contato.objects.all(), 'carla').values_list('nome', flat=True)),
+                         {'Carla'})
+        self.assertFalse(Path(registro.caminho).exists())
+
+    def test_retoma_do_ultimo_lote_gravado(self):
+        registro = self.nova_importacao()
+        # Simula um trabalhador encerrado depois do primeiro lote.
+        registro.status = Importacao.EM_ANDAMENTO
+        registro.processados = 2
+        registro.save()
+        Contato.objects.create(nome='Ana')
+        Contato.objects.create(nome='Bruno')
+
+        importacao.importar(registro, io.StringIO(self.CSV), tamanho_lote=2)
+        self.assertEqual((registro.status, registro.processados, registro.criados), (Importacao.CONCLUIDA, 4, 2))
+        self.assertEqual(sorted(Contato.objects.values_list('nome', flat=True)), ['Ana', 'Bruno', 'Carla', 'Davi'])
+        # Os registros já processados não são lidos de novo.
+        self.assertFalse(Telefone.objects.filter(numero='11 91111-1111').exists())
+
+    def test_falha_mantem_o_arquivo_para_retomar(self):
+        registro = self.nova_importacao()
+        importar_lote = importacao.importar_lote
+        lotes = iter([None, RuntimeError('falhou')])
+
+        def falhar_no_segundo(*args):
+            erro = next(lotes)
+            if erro:
+                raise erro
+            return importar_lote(*args)
+
+        with mock.patch.object(importacao, 'importar_lote', side_effect=falhar_no_segundo):
+            with self.assertRaises(RuntimeError):
+                importacao.importar(registro, io.StringIO(self.CSV), tamanho_lote=2)
+        self.assertEqual((registro.status, registro.processados, registro.erro), (Importacao.FALHOU, 2, 'falhou'))
+        registro.refresh_from_db()
+        self.assertEqual((registro.status, registro.processados), (Importacao.FALHOU, 2))
+        self.assertTrue(Path(registro.caminho).exists())
+        self.assertTrue(importacao.retomavel(registro))
+
+        # A nova tentativa continua do lote que falhou.
+        importacao.importar(registro, io.StringIO(self.CSV), tamanho_lote=2)
+        self.assertEqual((registro.status, registro.processados, registro.criados), (Importacao.CONCLUIDA, 4, 4))
+        self.assertFalse(Path(registro.caminho).exists())
+
+    def test_contadores_do_lote_desfeito(self):
+        registro = self.nova_importacao()
+        # O primeiro lote falha ao salvar a importação, depois de somar os
+        # seus registros aos contadores da instância.
+        with mock.patch.object(Importacao, 'save', side_effect=[None, RuntimeError('falhou'), None]):
+            with self.assertRaises(RuntimeError):
+                importacao.importar(registro, io.StringIO(self.CSV), tamanho_lote=2)
+        self.assertEqual(registro.processados, 0)
+
+    def test_arquivo_fora_do_diretorio_e_mantido(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as arquivo:
+            arquivo.write(self.CSV)
+        self.addCleanup(Path(arquivo.name).unlink, missing_ok=True)
+        registro = Importacao.objects.create(caminho=arquivo.name, nome_arquivo='contatos.csv', formato='csv')
+        importacao.importar(registro, io.StringIO(self.CSV))
+        self.assertTrue(Path(arquivo.name).exists())
+
+    def test_tarefa_retoma_importacao_que_falhou(self):
+        registro = self.nova_importacao()
+        registro.status = Importacao.FALHOU
+        registro.processados = 2
+        registro.save()
+        self.assertEqual(tarefas.importar_arquivo(registro.id)['status'], Importacao.CONCLUIDA)
+        self.assertEqual(sorted(Contato.objects.values_list('nome', flat=True)), ['Carla', 'Davi'])
+
+    def test_fila_tenta_de_novo_e_apaga_o_arquivo_na_ultima_tentativa(self):
+        registro = self.nova_importacao()
+        tarefa = tarefas.enfileirar('importar', registro.id, max_tentativas=2)
+        with mock.patch.object(importacao, 'importar_lote', side_effect=OperationalError('database is locked')):
+            tarefas.executar_proxima('trabalhador')
+            tarefa.refresh_from_db()
+            self.assertEqual(tarefa.status, Tarefa.PENDENTE)
+            self.assertTrue(Path(registro.caminho).exists())
+
+            Tarefa.objects.filter(id=tarefa.id).update(disponivel_em=timezone.now())
+            tarefas.executar_proxima('trabalhador')
+        tarefa.refresh_from_db()
+        registro.refresh_from_db()
+        self.assertEqual((tarefa.status, registro.status), (Tarefa.FALHOU, Importacao.FALHOU))
+        self.assertFalse(Path(registro.caminho).exists())
+        self.assertFalse(importacao.retomavel(registro))
+
+    def test_view_retoma_importacao_que_falhou(self):
+        registro = self.nova_importacao()
+        registro.status = Importacao.FALHOU
+        registro.save()
+        with mock.patch.object(tarefas, 'enfileirar') as enfileirar:
+            self.client.post(reverse('retomar_importacao', args=[registro.id]))
+        enfileirar.assert_called_once_with('importar', registro.id, chave=f'importacao:{registro.id}')
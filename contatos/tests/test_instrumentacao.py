@@ -0,0 +1,40 @@
+from asgiref.sync import iscoroutinefunction
+from django.test import SimpleTestCase
+
+from contatos import instrumentacao
+
+
+def _executar(sql, params, many, context):
+    return sql
+
+
+class MedicaoTests(SimpleTestCase):
+
+    def test_controle_de_transacao_nao_conta_como_consulta(self):
+        medicao = instrumentacao.Medicao()
+        for _ in range(instrumentacao.LIMITE_REPETICOES + 1):
+            for sql in ('BEGIN IMMEDIATE', 'SAVEPOINT "s1"', 'RELEASE SAVEPOINT "s1"',
+                        'ROLLBACK TO SAVEPOINT "s1"', 'COMMIT'):
+                self.assertEqual(medicao.registrar_consulta(_executar, sql, None, False, {}), sql)
+        medicao.registrar_consulta(_executar, 'SELECT 1', (), False, {})
+        self.assertEqual(medicao.consultas, 1)
+        self.assertEqual(medicao.repetidas(), {})
+        self.assertEqual(medicao.duplicadas(), 0)
+        self.assertGreater(medicao.tempo_banco, 0)
+
+    def test_consultas_repetidas(self):
+        medicao = instrumentacao.Medicao()
+        sql = 'SELECT * FROM contatos_telefone WHERE contato_id = %s'
+        for contato_id in range(instrumentacao.LIMITE_REPETICOES + 1):
+            medicao.registrar_consulta(_executar, sql, (contato_id,), False, {})
+        self.assertEqual(medicao.repetidas(), {sql: instrumentacao.LIMITE_REPETICOES + 1})
+
+
+class InstrumentacaoMiddlewareTests(SimpleTestCase):
+
+    def test_assincrono_com_get_response_assincrono(self):
+        async def get_response(request):
+            return None
+
+        self.assertTrue(iscoroutinefunction(instrumentacao.InstrumentacaoMiddleware(get_response)))
+        self.assertFalse(iscoroutinefunction(instrumentacao.InstrumentacaoMiddleware(lambda request: None)))
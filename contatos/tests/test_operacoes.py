@@ -0,0 +1,138 @@
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+
+from contatos import busca, cartoes, contadores, donos
+from contatos.models import Alteracao, CartaoContato, Contato, Email, Grupo, Telefone
+
+from . import criar_contato
+
+
+class OperacoesEmLoteTests(TestCase):
+    # As operações em lote apagam e inserem diretamente no banco, sem signals
+    # nem as exclusões em cascata do ORM; os testes conferem que as
+    # estruturas derivadas continuam de acordo com as tabelas.
+
+    def setUp(self):
+        self.amigos = Grupo.objects.create(nome='Amigos')
+        self.trabalho = Grupo.objects.create(nome='Trabalho')
+        self.ana = criar_contato('Ana', telefones=['11 91111-1111'], emails=['ana@exemplo.com'],
+                                 grupos=[self.amigos])
+        self.bruno = criar_contato('Bruno', telefones=['11 92222-2222', '11 92222-3333'],
+                                   grupos=[self.amigos, self.trabalho])
+        self.carla = criar_contato('Carla', emails=['carla@exemplo.com'])
+        with donos.como_dono(2):
+            self.grupo_de_outro = Grupo.objects.create(nome='Amigos')
+            self.de_outro = criar_contato('Davi', telefones=['11 94444-4444'], grupos=[self.grupo_de_outro])
+
+    def lote(self, **dados):
+        return self.client.post(reverse('contatos_em_lote'), dados)
+
+    def assertDerivadosConsistentes(self):
+        for dono in (donos.DONO_PADRAO, 2):
+            with self.subTest(dono=dono), donos.como_dono(dono):
+                self.assertEqual(contadores.divergencias(), [])
+                contatos = Contato.objects.prefetch_related('grupos', 'telefone_set', 'email_set')
+                esperados = {contato.id: cartoes.do_contato(contato) for contato in contatos}
+                gravados = {cartao.contato_id: cartao for cartao in CartaoContato.objects.all()}
+                self.assertEqual(set(gravados), set(esperados))
+                for contato_id, cartao in esperados.items():
+                    self.assertEqual((gravados[contato_id].nome, gravados[contato_id].dados),
+                                     (cartao.nome, cartao.dados))
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT rowid FROM {busca.TABELA}')
+            self.assertEqual({rowid for rowid, in cursor.fetchall()},
+                             set(Contato.todos.values_list('id', flat=True)))
+
+    def assertExcluidos(self, *contatos):
+        for contato in contatos:
+            self.assertFalse(Contato.todos.filter(id=contato.id).exists())
+            self.assertTrue(Alteracao.objects.filter(tipo=Alteracao.CONTATO, objeto_id=contato.id,
+                                                     excluido=True).exists())
+
+    def test_excluir(self):
+        resposta = self.lote(acao='excluir', ids=f'{self.ana.id},{self.bruno.id},{self.de_outro.id},9999')
+        self.assertEqual(resposta.json(), {'acao': 'excluir', 'contatos': 2, 'afetados': 2})
+        self.assertExcluidos(self.ana, self.bruno)
+        self.assertFalse(Telefone.objects.filter(contato_id__in=[self.ana.id, self.bruno.id]).exists())
+        self.assertFalse(Email.objects.filter(contato_id=self.ana.id).exists())
+        # O contato de outro dono não foi afetado.
+        self.assertTrue(Contato.todos.filter(id=self.de_outro.id).exists())
+        self.assertEqual(Telefone.objects.filter(contato_id=self.de_outro.id).count(), 1)
+        self.amigos.refresh_from_db()
+        self.assertEqual(self.amigos.total_contatos, 0)
+        self.assertDerivadosConsistentes()
+
+    def test_excluir_por_busca_e_grupo(self):
+        resposta = self.lote(acao='excluir', busca='bruno', de_grupo=self.amigos.id)
+        self.assertEqual(resposta.json()['afetados'], 1)
+        self.assertExcluidos(self.bruno)
+        self.assertDerivadosConsistentes()
+
+    def test_adicionar(self):
+        resposta = self.lote(acao='adicionar', ids=[self.ana.id, self.carla.id, self.de_outro.id],
+                             grupo=self.trabalho.id)
+        self.assertEqual(resposta.json()['contatos'], 2)
+        self.assertEqual(set(self.trabalho.contato_set.values_list('id', flat=True)),
+                         {self.ana.id, self.bruno.id, self.carla.id})
+        self.assertFalse(self.grupo_de_outro.contato_set.filter(id=self.carla.id).exists())
+        self.assertEqual(set(busca.filtrar_contatos(Contato.objects.all(), 'trabalho').values_list('id', flat=True)),
+                         {self.ana.id, self.bruno.id, self.carla.id})
+        self.assertDerivadosConsistentes()
+
+    def test_grupo_de_outro_dono(self):
+        resposta = self.lote(acao='adicionar', ids=self.carla.id, grupo=self.grupo_de_outro.id)
+        self.assertEqual(resposta.status_code, 400)
+        self.assertFalse(self.carla.grupos.exists())
+        self.assertDerivadosConsistentes()
+
+    def test_remover_e_mover(self):
+        self.lote(acao='remover', ids=[self.ana.id, self.bruno.id], grupo=self.amigos.id)
+        self.assertFalse(self.amigos.contato_set.exists())
+        self.assertDerivadosConsistentes()
+
+        self.lote(acao='mover', ids=[self.bruno.id], origem=self.trabalho.id, grupo=self.amigos.id)
+        self.assertEqual(list(self.bruno.grupos.all()), [self.amigos])
+        # Sem 'origem', o contato sai de todos os grupos.
+        self.ana.grupos.add(self.trabalho)
+        self.lote(acao='mover', ids=[self.ana.id], grupo=self.amigos.id)
+        self.assertEqual(list(self.ana.grupos.all()), [self.amigos])
+        self.assertDerivadosConsistentes()
+
+    def test_parametros_invalidos(self):
+        self.assertEqual(self.lote(acao='excluir').status_code, 400)
+        self.assertEqual(self.lote(acao='sumir', ids=self.ana.id).status_code, 400)
+        self.assertEqual(self.lote(acao='adicionar', ids=self.ana.id).status_code, 400)
+        self.assertEqual(self.lote(acao='excluir', ids='a,b').status_code, 400)
+        self.assertEqual(self.client.get(reverse('contatos_em_lote')).status_code, 405)
+        self.assertTrue(Contato.objects.filter(id=self.ana.id).exists())
+
+    def test_excluir_telefones(self):
+        ids = list(self.bruno.telefone_set.values_list('id', flat=True))
+        # Telefones de outro contato e de outro dono são ignorados.
+        outros = [self.ana.telefone_set.get().id, self.de_outro.telefone_set.get().id]
+        self.client.post(reverse('excluir_telefones', args=[self.bruno.id]), {'ids': ids + outros})
+        self.assertFalse(self.bruno.telefone_set.exists())
+        self.assertEqual(Telefone.objects.filter(id__in=outros).count(), 2)
+        self.assertEqual(CartaoContato.objects.get(contato_id=self.bruno.id).telefones, ())
+        self.assertEqual(set(busca.filtrar_contatos(Contato.objects.all(), '92222').values_list('id', flat=True)),
+                         set())
+        self.assertTrue(Alteracao.objects.filter(tipo=Alteracao.CONTATO, objeto_id=self.bruno.id).exists())
+        self.assertDerivadosConsistentes()
+
+    def test_excluir_email_pelo_id(self):
+        email = self.ana.email_set.get()
+        url = reverse('excluir_email', args=[self.carla.id, email.id])
+        self.client.post(url)
+        self.assertTrue(Email.objects.filter(id=email.id).exists())
+        self.client.post(reverse('excluir_email', args=[self.ana.id, email.id]))
+        self.assertFalse(Email.objects.filter(id=email.id).exists())
+        self.amigos.refresh_from_db()
+        self.assertEqual(self.amigos.contatos_com_email, 0)
+        self.assertDerivadosConsistentes()
+
+    def test_contato_de_outro_dono(self):
+        telefone = self.de_outro.telefone_set.get()
+        resposta = self.client.post(reverse('excluir_telefone', args=[self.de_outro.id, telefone.id]))
+        self.assertEqual(resposta.status_code, 404)
+        self.assertTrue(Telefone.objects.filter(id=telefone.id).exists())
@@ -0,0 +1,114 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from contatos import cartoes
+from contatos.models import Contato, Grupo
+from contatos.paginacao import POR_PAGINA_MAXIMO, POR_PAGINA_PADRAO, ler_por_pagina, paginar_por_nome
+from contatos.views import _pagina_da_lista
+
+from . import criar_contato
+
+
+class PaginacaoTests(TestCase):
+
+    def setUp(self):
+        for nome in ('Ana', 'Bruno', 'Carla', 'Davi', 'Elisa'):
+            Contato.objects.create(nome=nome)
+
+    def nomes(self, pagina):
+        return [contato.nome for contato in pagina]
+
+    def test_avanca_e_volta_pelos_cursores(self):
+        primeira = paginar_por_nome(Contato.objects.all(), por_pagina=2)
+        self.assertEqual(self.nomes(primeira), ['Ana', 'Bruno'])
+        self.assertFalse(primeira.tem_anterior)
+        self.assertEqual(primeira.cursor_proximo, 'Bruno')
+
+        segunda = paginar_por_nome(Contato.objects.all(), depois=primeira.cursor_proximo, por_pagina=2)
+        self.assertEqual(self.nomes(segunda), ['Carla', 'Davi'])
+        self.assertEqual(segunda.cursor_anterior, 'Carla')
+
+        ultima = paginar_por_nome(Contato.objects.all(), depois=segunda.cursor_proximo, por_pagina=2)
+        self.assertEqual(self.nomes(ultima), ['Elisa'])
+        self.assertFalse(ultima.tem_proxima)
+
+        anterior = paginar_por_nome(Contato.objects.all(), antes=segunda.cursor_anterior, por_pagina=2)
+        self.assertEqual(self.nomes(anterior), ['Ana', 'Bruno'])
+        self.assertFalse(anterior.tem_anterior)
+        self.assertEqual(anterior.cursor_proximo, 'Bruno')
+
+    def test_insercao_entre_paginas_nao_repete_contatos(self):
+        # Com OFFSET, um contato incluído antes da página atual faria o
+        # último contato da página anterior aparecer de novo.
+        primeira = paginar_por_nome(Contato.objects.all(), por_pagina=2)
+        Contato.objects.create(nome='Aline')
+        segunda = paginar_por_nome(Contato.objects.all(), depois=primeira.cursor_proximo, por_pagina=2)
+        self.assertEqual(self.nomes(segunda), ['Carla', 'Davi'])
+
+    def test_querystring_preserva_a_busca(self):
+        pagina = paginar_por_nome(Contato.objects.all(), por_pagina=2)
+        self.assertEqual(pagina.querystring('proxima', busca='an'), 'busca=an&por_pagina=2&depois=Bruno')
+
+    def test_ler_por_pagina(self):
+        self.assertEqual(ler_por_pagina('10'), 10)
+        self.assertEqual(ler_por_pagina('0'), 1)
+        self.assertEqual(ler_por_pagina(str(POR_PAGINA_MAXIMO + 1)), POR_PAGINA_MAXIMO)
+        self.assertEqual(ler_por_pagina('abc'), POR_PAGINA_PADRAO)
+        self.assertEqual(ler_por_pagina(None), POR_PAGINA_PADRAO)
+
+
+class ConsultasDaListaTests(TestCase):
+    # Uma página da lista custa o mesmo número de consultas, não importa
+    # quantos contatos ela exibe nem quantos telefones, emails e grupos cada
+    # um tem.
+
+    def setUp(self):
+        cache.clear()
+        self.grupo = Grupo.objects.create(nome='Amigos')
+
+    def criar_contatos(self, quantidade, inicio=0):
+        for numero in range(inicio, inicio + quantidade):
+            criar_contato(f'Contato {numero:03}', telefones=[f'11 9{numero:04}-0000', f'11 9{numero:04}-1111'],
+                          emails=[f'c{numero}@exemplo.com'], grupos=[self.grupo])
+
+    def pagina(self, consultas, **parametros):
+        with self.assertNumQueries(consultas):
+            pagina, _ = _pagina_da_lista(parametros, None, None)
+            # O template percorre os telefones, emails e grupos de cada cartão.
+            for cartao in pagina:
+                list(cartao.telefones), list(cartao.emails), list(cartao.grupos)
+        return pagina
+
+    def test_pagina_com_cartoes(self):
+        self.criar_contatos(2)
+        self.pagina(1)
+        self.criar_contatos(30, inicio=2)
+        self.assertEqual(len(self.pagina(1)), POR_PAGINA_PADRAO)
+        self.assertEqual(len(self.pagina(1, por_pagina='30', depois='Contato 001')), 30)
+
+    def test_pagina_com_prefetch(self):
+        with mock.patch.object(cartoes, 'USAR_CARTOES', False):
+            self.criar_contatos(2)
+            self.pagina(4)
+            self.criar_contatos(30, inicio=2)
+            self.assertEqual(len(self.pagina(4)), POR_PAGINA_PADRAO)
+            self.assertEqual(len(self.pagina(4, por_pagina='30', depois='Contato 001')), 30)
+
+    def test_view(self):
+        self.criar_contatos(2)
+        url = reverse('contatos_list_view')
+        # A primeira página cria o cookie CSRF, sem o qual a lista não lê a
+        # versão da agenda para o ETag.
+        self.client.get(url)
+        cache.clear()
+        with self.assertNumQueries(2):
+            self.client.get(url)
+        self.criar_contatos(30, inicio=2)
+        cache.clear()
+        with self.assertNumQueries(2):
+            resposta = self.client.get(url)
+        self.assertContains(resposta, 'Contato 023')
+        self.assertNotContains(resposta, 'Contato 024')
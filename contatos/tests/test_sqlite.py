@@ -0,0 +1,41 @@
+from unittest import mock
+
+from django.db import OperationalError, connections
+from django.test import TestCase
+
+from agenda1.roteadores import RoteadorLeituraEscrita
+from contatos.models import Contato, Tarefa
+
+
+class BancoSqliteTests(TestCase):
+    databases = {'default', 'leitura'}
+
+    def pragma(self, alias, nome):
+        with connections[alias].cursor() as cursor:
+            cursor.execute(f'PRAGMA {nome}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_aplicados_a_cada_conexao(self):
+        self.assertEqual(self.pragma('default', 'synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma('default', 'cache_size'), -64 * 1024)
+        self.assertEqual(self.pragma('default', 'temp_store'), 2)  # MEMORY
+        self.assertEqual(connections['default'].inicio_transacao, 'BEGIN IMMEDIATE')
+
+    def test_conexao_de_leitura_nao_grava(self):
+        self.assertEqual(self.pragma('leitura', 'query_only'), 1)
+        with self.assertRaises(OperationalError):
+            with connections['leitura'].cursor() as cursor:
+                cursor.execute("INSERT INTO contatos_contato (dono, nome, avatar_miniaturas, atualizado_em) "
+                               "VALUES (1, 'Ana', 0, '2024-01-01')")
+
+    def test_roteamento_de_leituras_e_escritas(self):
+        roteador = RoteadorLeituraEscrita()
+        self.assertEqual(roteador.db_for_write(Contato), 'default')
+        # Fora de uma transação, as leituras vão para a conexão de leitura.
+        with mock.patch.object(connections['default'], 'in_atomic_block', False):
+            self.assertEqual(roteador.db_for_read(Contato), 'leitura')
+            self.assertEqual(roteador.db_for_read(Tarefa), 'leitura')
+        # Dentro dela, vão para a conexão de escrita, que enxerga o que a
+        # transação já gravou.
+        self.assertEqual(roteador.db_for_read(Contato), 'default')
+        self.assertFalse(roteador.allow_migrate('leitura', 'contatos'))
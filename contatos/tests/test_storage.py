@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.test import TestCase
+
+from contatos import storage
+from contatos.models import Contato
+
+
+class ArmazenamentoPorConteudoTests(TestCase):
+
+    def setUp(self):
+        diretorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, diretorio)
+        self.armazenamento = storage.ArmazenamentoPorConteudo(location=diretorio)
+
+    def salvar(self, nome, conteudo):
+        return self.armazenamento.save(nome, ContentFile(conteudo))
+
+    def envelhecer(self, nome):
+        antigo = time.time() - 2 * storage.CARENCIA
+        os.utime(self.armazenamento.path(nome), (antigo, antigo))
+
+    def arquivos(self):
+        return sorted(os.path.relpath(os.path.join(raiz, nome), self.armazenamento.location)
+                      for raiz, _, nomes in os.walk(self.armazenamento.location)
+                      for nome in nomes if nome != '.trava-avatares')
+
+    def test_mesmo_conteudo_e_gravado_uma_vez(self):
+        primeiro = self.salvar('avatares/ana.JPG', b'imagem')
+        segundo = self.salvar('avatares/bruno.jpg', b'imagem')
+        outro = self.salvar('avatares/carla.jpg', b'outra imagem')
+        self.assertEqual(primeiro, segundo)
+        self.assertRegex(primeiro, r'^avatares/([0-9a-f]{2})/\1[0-9a-f]{62}\.jpg$')
+        self.assertNotEqual(primeiro, outro)
+        # Nenhum temporário '.envio-' fica para trás.
+        self.assertEqual(self.arquivos(), sorted([primeiro, outro]))
+        with self.armazenamento.open(primeiro) as arquivo:
+            self.assertEqual(arquivo.read(), b'imagem')
+
+    def test_remover_sem_uso_respeita_a_carencia(self):
+        nome = self.salvar('avatares/ana.jpg', b'imagem')
+        self.assertFalse(self.armazenamento.remover_sem_uso(nome))
+        self.envelhecer(nome)
+        # Reaproveitar o arquivo renova a carência.
+        self.salvar('avatares/bruno.jpg', b'imagem')
+        self.assertFalse(self.armazenamento.remover_sem_uso(nome))
+        self.envelhecer(nome)
+        self.assertTrue(self.armazenamento.remover_sem_uso(nome))
+        self.assertFalse(self.armazenamento.exists(nome))
+        self.assertFalse(self.armazenamento.remover_sem_uso(nome))
+
+    def salvar_em_outra_thread(self, nome, conteudo):
+        resultado = []
+        thread = threading.Thread(target=lambda: resultado.append(self.salvar(nome, conteudo)))
+        thread.start()
+        # O envio espera pela trava, mantida pela coleta.
+        thread.join(0.2)
+        self.assertTrue(thread.is_alive())
+        return thread, resultado
+
+    def test_reaproveitamento_durante_a_coleta(self):
+        nome = self.salvar('avatares/ana.jpg', b'imagem')
+        self.envelhecer(nome)
+        with self.armazenamento.trava():
+            # A coleta decidiu remover o arquivo antes que o envio do mesmo
+            # conteúdo o encontrasse: o envio grava o arquivo de novo.
+            thread, resultado = self.salvar_em_outra_thread('avatares/bruno.jpg', b'imagem')
+            os.unlink(self.armazenamento.path(nome))
+        thread.join()
+        self.assertEqual(resultado, [nome])
+        self.assertTrue(self.armazenamento.exists(nome))
+        # E, gravado agora, o arquivo não é removido pela próxima coleta.
+        self.assertFalse(self.armazenamento.remover_sem_uso(nome))
+
+    def test_coleta_depois_do_reaproveitamento(self):
+        nome = self.salvar('avatares/ana.jpg', b'imagem')
+        self.envelhecer(nome)
+        with self.armazenamento.trava():
+            thread, resultado = self.salvar_em_outra_thread('avatares/bruno.jpg', b'imagem')
+        thread.join()
+        self.assertEqual(resultado, [nome])
+        self.assertFalse(self.armazenamento.remover_sem_uso(nome))
+        self.assertTrue(self.armazenamento.exists(nome))
+
+    def test_liberar_avatar_conta_as_referencias(self):
+        nome = self.salvar('avatares/ana.jpg', b'imagem')
+        self.envelhecer(nome)
+        contato = Contato.objects.create(nome='Ana', avatar=nome)
+        with mock.patch.object(storage, '_armazenamento', self.armazenamento), \
+                mock.patch.object(storage.avatares, 'excluir_miniaturas') as excluir_miniaturas:
+            self.assertEqual(storage.referencias(nome), 1)
+            self.assertFalse(storage.liberar_avatar(nome))
+            self.assertTrue(self.armazenamento.exists(nome))
+            contato.delete()
+            self.assertTrue(storage.liberar_avatar(nome))
+        self.assertFalse(self.armazenamento.exists(nome))
+        excluir_miniaturas.assert_called_once_with(nome)
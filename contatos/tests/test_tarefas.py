@@ -0,0 +1,96 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from contatos import donos, tarefas
+from contatos.models import Contato, Tarefa
+
+
+# Tarefas registradas apenas para os testes da fila.
+
+@tarefas.tarefa('teste_somar')
+def _somar(a, b):
+    return a + b
+
+
+@tarefas.tarefa('teste_falhar')
+def _falhar():
+    raise RuntimeError('falha de teste')
+
+
+class TarefasTests(TestCase):
+
+    def test_reservar_e_executar(self):
+        nova = tarefas.enfileirar('teste_somar', 2, 3)
+        tarefa = tarefas.reservar('trabalhador')
+        self.assertEqual(tarefa.id, nova.id)
+        self.assertEqual((tarefa.status, tarefa.tentativas), (Tarefa.EXECUTANDO, 1))
+        # Uma tarefa reservada não é entregue a outro trabalhador.
+        self.assertIsNone(tarefas.reservar('outro'))
+
+        tarefas.finalizar(tarefa, tarefas.executar(tarefa))
+        tarefa.refresh_from_db()
+        self.assertEqual((tarefa.status, tarefa.resultado), (Tarefa.CONCLUIDA, 5))
+        self.assertEqual(tarefas.situacao(tarefa.id)['status'], Tarefa.CONCLUIDA)
+
+    def test_prioridade(self):
+        tarefas.enfileirar('teste_somar', 1, 1)
+        urgente = tarefas.enfileirar('teste_somar', 2, 2, prioridade=tarefas.PRIORIDADE_ALTA)
+        self.assertEqual(tarefas.reservar('trabalhador').id, urgente.id)
+
+    def test_chave_evita_duplicatas(self):
+        primeira = tarefas.enfileirar('teste_somar', 1, 1, chave='soma')
+        segunda = tarefas.enfileirar('teste_somar', 1, 1, chave='soma', prioridade=tarefas.PRIORIDADE_ALTA)
+        self.assertEqual(primeira.id, segunda.id)
+        self.assertEqual(Tarefa.objects.get(id=primeira.id).prioridade, tarefas.PRIORIDADE_ALTA)
+
+    def test_nova_tentativa_depois_de_falhar(self):
+        nova = tarefas.enfileirar('teste_falhar', max_tentativas=2)
+        tarefa = tarefas.reservar('trabalhador')
+        tarefas.finalizar(tarefa, tarefas.executar(tarefa))
+        tarefa.refresh_from_db()
+        self.assertEqual(tarefa.status, Tarefa.PENDENTE)
+        self.assertIn('falha de teste', tarefa.erro)
+        self.assertGreater(tarefa.disponivel_em, timezone.now())
+        # A nova tentativa só fica disponível depois da espera.
+        self.assertIsNone(tarefas.reservar('trabalhador'))
+
+        Tarefa.objects.filter(id=nova.id).update(disponivel_em=timezone.now())
+        tarefa = tarefas.reservar('trabalhador')
+        self.assertEqual(tarefa.tentativas, 2)
+        tarefas.finalizar(tarefa, tarefas.executar(tarefa))
+        tarefa.refresh_from_db()
+        self.assertEqual(tarefa.status, Tarefa.FALHOU)
+        self.assertIsNotNone(tarefa.concluida_em)
+
+    def test_espera_dobra_a_cada_tentativa(self):
+        for tentativas in (1, 2, 3):
+            limite = tarefas.ESPERA_BASE * 2 ** (tentativas - 1)
+            self.assertTrue(limite / 2 <= tarefas.espera(tentativas) <= limite)
+        self.assertLessEqual(tarefas.espera(100), tarefas.ESPERA_MAXIMA)
+
+    def test_reserva_expirada_volta_para_a_fila(self):
+        nova = tarefas.enfileirar('teste_somar', 1, 2)
+        abandonada = tarefas.reservar('trabalhador', visibilidade=60)
+        Tarefa.objects.filter(id=nova.id).update(disponivel_em=timezone.now() - timedelta(seconds=1))
+        tarefas._devolvidas_em = 0
+        tarefa = tarefas.reservar('outro')
+        self.assertEqual((tarefa.id, tarefa.tentativas), (nova.id, 2))
+        # O resultado do primeiro trabalhador é descartado.
+        tarefas.finalizar(abandonada, tarefas.executar(abandonada))
+        self.assertEqual(Tarefa.objects.get(id=nova.id).status, Tarefa.EXECUTANDO)
+
+    def test_executa_como_o_dono_que_enfileirou(self):
+        with donos.como_dono(2):
+            Contato.objects.create(nome='Contato do dono 2')
+            tarefas.enfileirar('miniaturas', 'avatares/inexistente.jpg')
+        tarefa = tarefas.reservar('trabalhador')
+        self.assertEqual(tarefa.dono, 2)
+        self.assertEqual(tarefas.situacao(tarefa.id), None)
+        with donos.como_dono(2):
+            self.assertEqual(tarefas.situacao(tarefa.id)['nome'], 'miniaturas')
+
+    def test_tarefa_desconhecida(self):
+        with self.assertRaises(ValueError):
+            tarefas.enfileirar('nao_existe')
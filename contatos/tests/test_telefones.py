@@ -0,0 +1,85 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from contatos import donos, telefones
+from contatos.models import Telefone
+from contatos.telefones import normalizar_telefone
+
+from . import criar_contato
+
+
+class NormalizarTelefoneTests(SimpleTestCase):
+
+    def test_com_ddd(self):
+        for numero in ('(11) 99999-1234', '11 99999-1234', '11999991234', '011 99999-1234',
+                       '0 21 11 99999-1234', ' 11.99999.1234 '):
+            with self.subTest(numero):
+                self.assertEqual(normalizar_telefone(numero), '+5511999991234')
+        # Fixo, com 8 dígitos depois do DDD.
+        self.assertEqual(normalizar_telefone('(21) 3333-4444'), '+552133334444')
+        self.assertEqual(normalizar_telefone('0 15 21 3333-4444'), '+552133334444')
+
+    def test_com_ddi(self):
+        for numero in ('+55 11 99999-1234', '0055 11 99999-1234', '55 11 99999-1234', '+55 (11) 99999-1234'):
+            with self.subTest(numero):
+                self.assertEqual(normalizar_telefone(numero), '+5511999991234')
+        # Números de outros países são mantidos com o seu DDI.
+        self.assertEqual(normalizar_telefone('+1 (415) 555-2671'), '+14155552671')
+        self.assertEqual(normalizar_telefone('00 351 912 345 678'), '+351912345678')
+
+    def test_sem_ddd(self):
+        self.assertEqual(normalizar_telefone('99999-1234'), '999991234')
+        self.assertEqual(normalizar_telefone('3333-4444'), '33334444')
+        with mock.patch.object(telefones, 'DDD_PADRAO', '21'):
+            self.assertEqual(normalizar_telefone('99999-1234'), '+5521999991234')
+            self.assertEqual(normalizar_telefone('3333-4444'), '+552133334444')
+
+    def test_sem_digitos(self):
+        for numero in ('', None, '   ', '(  ) -', 'sem número'):
+            with self.subTest(numero):
+                self.assertEqual(normalizar_telefone(numero), '')
+
+
+class DonoDoTelefoneTests(TestCase):
+
+    def setUp(self):
+        self.ana = criar_contato('Ana', telefones=['(11) 99999-1234', '11 99999-1234'])
+        self.bruno = criar_contato('Bruno', telefones=['+55 11 99999-1234'])
+        criar_contato('Carla', telefones=['21 99999-1234'])
+
+    def buscar(self, numero):
+        return self.client.get(reverse('dono_do_telefone'), {'numero': numero})
+
+    def test_numero_normalizado_ao_salvar(self):
+        self.assertEqual(set(Telefone.objects.filter(contato=self.ana).values_list('numero_normalizado', flat=True)),
+                         {'+5511999991234'})
+
+    def test_encontra_os_contatos_em_qualquer_formato(self):
+        for numero in ('11999991234', '+55 (11) 99999-1234', '0055 11 99999 1234'):
+            with self.subTest(numero):
+                resposta = self.buscar(numero)
+                self.assertEqual(resposta.status_code, 200)
+                dados = resposta.json()
+                self.assertEqual(dados['normalizado'], '+5511999991234')
+                # Cada contato aparece uma vez, mesmo com o número repetido.
+                self.assertEqual(sorted(contato['id'] for contato in dados['contatos']),
+                                 [self.ana.id, self.bruno.id])
+
+    def test_numero_desconhecido(self):
+        self.assertEqual(self.buscar('11 98888-0000').json()['contatos'], [])
+
+    def test_numero_ausente(self):
+        self.assertEqual(self.client.get(reverse('dono_do_telefone')).status_code, 400)
+        self.assertEqual(self.buscar('abc').status_code, 400)
+
+    def test_restrito_a_agenda_do_dono(self):
+        with donos.como_dono(2):
+            criar_contato('Davi', telefones=['11 99999-1234'])
+        ids = [contato['id'] for contato in self.buscar('11 99999-1234').json()['contatos']]
+        self.assertEqual(sorted(ids), [self.ana.id, self.bruno.id])
+
+    def test_uma_consulta(self):
+        with self.assertNumQueries(1):
+            self.buscar('11 99999-1234')
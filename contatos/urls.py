@@ -9,10 +9,30 @@ urlpatterns = [
     path('<int:contato_id>/novo-tel/', views.novo_tel_view, name='novo_tel'),
     path('<int:contato_id>/novo-email/', views.novo_email_view, name='novo_email'),
     path('<int:contato_id>/excluir/', views.excluir_contato_view, name='excluir_contato'),
-    path('<int:contato_id>/tel/<label>/excluir/', views.excluir_telefone_view, name='excluir_telefone'),
-    path('<int:contato_id>/email/<label>/excluir/', views.excluir_email_view, name='excluir_email'),
+    path('<int:contato_id>/tel/<int:telefone_id>/excluir/', views.excluir_telefones_view, name='excluir_telefone'),
+    path('<int:contato_id>/email/<int:email_id>/excluir/', views.excluir_emails_view, name='excluir_email'),
+    path('<int:contato_id>/telefones/excluir/', views.excluir_telefones_view, name='excluir_telefones'),
+    path('<int:contato_id>/emails/excluir/', views.excluir_emails_view, name='excluir_emails'),
+    path('lote/', views.contatos_em_lote_view, name='contatos_em_lote'),
     path('grupos/', views.grupos_list_view, name='grupos_list'),
     path('grupos/<int:grupo_id>/editar/', views.editar_grupo, name='editar_grupo'),
     path('grupos/<int:grupo_id>/excluir/', views.excluir_grupo, name='excluir_grupo'),
+    path('grupos/buscar/', views.buscar_grupos_view, name='buscar_grupos'),
     path('novo-contato/', views.novo_contato_view, name='novo_contato'),
+    path('exportar/', views.exportar_contatos_view, name='exportar_contatos'),
+    path('grupos/<int:grupo_id>/exportar/', views.exportar_contatos_view, name='exportar_grupo'),
+    path('importar/', views.importar_contatos_view, name='importar_contatos'),
+    path('importar/<int:importacao_id>/', views.importacao_detalhe_view, name='importacao_detalhe'),
+    path('importar/<int:importacao_id>/retomar/', views.retomar_importacao_view, name='retomar_importacao'),
+    path('telefones/dono/', views.dono_do_telefone_view, name='dono_do_telefone'),
+    path('autocompletar/', views.autocompletar_view, name='autocompletar'),
+    path('sync/', views.sincronizar_view, name='sincronizar'),
+    path('tarefas/<int:tarefa_id>/', views.tarefa_view, name='tarefa'),
+    path('duplicados/', views.duplicados_view, name='duplicados'),
+    path('duplicados/<int:par_id>/', views.par_duplicado_view, name='par_duplicado'),
+    path('<int:contato_id>/dados/', views.contato_dados_view, name='contato_dados'),
+    path('async/', views.contatos_list_async, name='contatos_list_async'),
+    path('async/grupos/<int:grupo_id>/contatos/', views.contatos_list_async, name='contatos_list_por_grupo_async'),
+    path('async/grupos/', views.grupos_list_async, name='grupos_list_async'),
+    path('async/<int:contato_id>/dados/', views.contato_dados_async, name='contato_dados_async'),
 ]
@@ -1,19 +1,170 @@
+import asyncio
+import os
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import close_old_connections, transaction
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
-from .models import Contato, Grupo, Telefone, Email
-from .forms import EditarContatoForm, NovoGrupoForm, NovoTelForm, NovoEmailForm, EditarGrupoForm, NovoContatoForm
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.crypto import salted_hmac
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_cookie
+from django.views.static import serve
+from .models import Contato, Grupo, Telefone, Email, Importacao, ParDuplicado
+from .forms import CAMPO_OBJETO, EditarContatoForm, NovoGrupoForm, NovoTelForm, NovoEmailForm, EditarGrupoForm, NovoContatoForm, ImportarContatosForm
+from .importacao import detectar_formato, guardar_arquivo, retomavel
+from . import alteracoes, autocompletar, cartoes, contadores, exportacao, operacoes, tarefas
+from .busca import filtrar_contatos, filtrar_por_prefixo
+from .donos import dono_atual, iterar_como_dono, particao
+from .paginacao import paginar_por_nome, ler_por_pagina
+from .sincronizacao import sincronizacao_adiada, contatos_alterados, versao_agenda
+from .telefones import normalizar_telefone
+
+def _versao(request):
+    # A versão da agenda é lida uma única vez por requisição.
+    if not hasattr(request, '_versao_agenda'):
+        request._versao_agenda = versao_agenda()
+    return request._versao_agenda
+
+def _estado_da_sessao(request):
+    # As páginas das listas incluem o token CSRF do visitante (nos
+    # formulários, como a caixa de busca de 'base.html'), que muda ao entrar
+    # e sair da conta. O ETag inclui um hash do segredo CSRF e da sessão para
+    # que uma página guardada com outro token não seja reaproveitada com 304
+    # (o POST seguinte seria recusado com 403). Sem o cookie CSRF, o token
+    # ainda será criado pela própria página, e a requisição não é
+    # condicional.
+    segredo = request.META.get('CSRF_COOKIE')
+    if not segredo:
+        return None
+    sessao = getattr(request, 'session', None)
+    chave = sessao.session_key if sessao is not None else None
+    return salted_hmac('contatos.views.etag', f'{segredo}:{chave or ""}').hexdigest()[:16]
+
+def _etag_da_versao(versao, estado):
+    # As versões são contadas por dono, então o ETag também identifica o dono.
+    return f'"agenda-{dono_atual()}-{versao[0]}-{estado}"'
+
+def etag_agenda(request, *args, **kwargs):
+    estado = _estado_da_sessao(request)
+    return _etag_da_versao(_versao(request), estado) if estado else None
 
+# As listas de contatos e de grupos só mudam quando a agenda (ou a sessão do
+# visitante) muda. Com o decorator condition(), uma requisição GET com
+# If-None-Match correspondente ao ETag atual é respondida com 304 Not
+# Modified, sem consultar os contatos nem renderizar o template. As listas
+# não usam Last-Modified, já que If-Modified-Since não distingue as sessões.
+@vary_on_cookie
+@condition(etag_func=etag_agenda)
 def contatos_list_view(request, grupo_id=None):
     grupo = None
-    busca = None
+    # A busca chega por POST através da caixa de busca em 'base.html', e por
+    # GET através dos links de navegação entre as páginas de resultado.
+    busca = request.POST.get('busca') or request.GET.get('busca')
     if grupo_id:
         grupo = get_object_or_404(Grupo, id=grupo_id)
-        contatos = grupo.contato_set.all()
-    elif request.POST.get('busca'):
-        busca = request.POST.get('busca')
-        contatos = Contato.objects.filter(nome__contains=busca)
+    pagina, busca = _pagina_da_lista(request.GET, grupo_id, busca)
+    return render(request, 'contatos/contatos_list.html', _contexto_da_lista(pagina, grupo, busca))
+
+def _pagina_da_lista(parametros, grupo_id, busca):
+    # Consulta a página de contatos exibida por contatos_list_view (e pela
+    # sua versão assíncrona). Retorna a página, com um CartaoContato para
+    # cada contato, e o termo de busca efetivamente aplicado.
+    busca = None if grupo_id else busca or None
+    por_pagina = ler_por_pagina(parametros.get('por_pagina'))
+    if cartoes.USAR_CARTOES:
+        # Os cartões já trazem os grupos, telefones, emails e o avatar de
+        # cada contato, então a página inteira é lida com uma consulta.
+        return paginar_por_nome(cartoes.consultar(grupo_id, busca), depois=parametros.get('depois'),
+                                antes=parametros.get('antes'), por_pagina=por_pagina), busca
+
+    if grupo_id:
+        contatos = Contato.objects.filter(grupos__id=grupo_id)
+    elif busca:
+        contatos = filtrar_contatos(Contato.objects.all(), busca)
     else:
         contatos = Contato.objects.all()
-    return render(request, 'contatos/contatos_list.html', {'contatos':contatos, 'grupo':grupo, 'busca':busca})
+
+    # Carregamos os grupos, telefones e emails de todos os contatos da página
+    # de uma só vez, para que o template não precise fazer uma consulta para
+    # cada cartão. Assim, uma página custa sempre o mesmo número de consultas.
+    contatos = contatos.prefetch_related('grupos', 'telefone_set', 'email_set')
+    pagina = paginar_por_nome(contatos,
+                              depois=parametros.get('depois'),
+                              antes=parametros.get('antes'),
+                              por_pagina=por_pagina)
+    pagina.itens = [cartoes.do_contato(contato) for contato in pagina.itens]
+    return pagina, busca
+
+def _contexto_da_lista(pagina, grupo, busca):
+    return {
+        'contatos': pagina,
+        'pagina': pagina,
+        'url_anterior': pagina.querystring('anterior', busca=busca) if pagina.tem_anterior else None,
+        'url_proxima': pagina.querystring('proxima', busca=busca) if pagina.tem_proxima else None,
+        'grupo': grupo,
+        'busca': busca,
+    }
+
+def salvar_edicao_contato(contato_id, cd):
+    # Aplica os dados do formulário EditarContatoForm ('cd') ao contato,
+    # alterando apenas o que mudou. O número de consultas não depende da
+    # quantidade de telefones, emails ou grupos do contato.
+
+    # Bloqueamos a linha do contato até o fim da transação (em bancos que
+    # suportam SELECT ... FOR UPDATE) para serializar edições simultâneas.
+    contato = Contato.objects.select_for_update().get(id=contato_id)
+
+    # Separamos os valores do formulário pelo prefixo do nome do campo
+    # ('tel_<id>' ou 'email_<id>'), indexados pelo id do telefone ou email.
+    cd_objetos = {'tel': {}, 'email': {}}
+    for nome, valor in cd.items():
+        campo = CAMPO_OBJETO.match(nome)
+        if campo:
+            cd_objetos[campo.group(1)][int(campo.group(2))] = valor
+    cd_tels, cd_emails = cd_objetos['tel'], cd_objetos['email']
+
+    if contato.nome != cd['nome_contato']:
+        contato.nome = cd['nome_contato']
+        contato.save(update_fields=['nome'])
+
+    # Atualizamos, com um único UPDATE para cada tabela, apenas as linhas
+    # enviadas no formulário cujo valor foi alterado. Um telefone ou email
+    # excluído depois da validação do formulário não é recriado.
+    tels_alterados = []
+    for tel in contato.telefone_set.filter(id__in=cd_tels) if cd_tels else ():
+        numero = cd_tels[tel.id]
+        if tel.numero != numero:
+            tel.numero = numero
+            tel.numero_normalizado = normalizar_telefone(numero)
+            tels_alterados.append(tel)
+    if tels_alterados:
+        Telefone.objects.bulk_update(tels_alterados, ['numero', 'numero_normalizado'])
+
+    emails_alterados = []
+    for email in contato.email_set.filter(id__in=cd_emails) if cd_emails else ():
+        endereco = cd_emails[email.id]
+        if email.endereco != endereco:
+            email.endereco = endereco
+            emails_alterados.append(email)
+    if emails_alterados:
+        Email.objects.bulk_update(emails_alterados, ['endereco'])
+
+    # grupos.set() compara os grupos atuais com os selecionados e executa
+    # apenas as inclusões e remoções necessárias. Os grupos selecionados já
+    # foram carregados pela validação do campo 'grupos'.
+    contato.grupos.set(cd['grupos'])
+
+    # bulk_update() não dispara signals, então informamos diretamente que o
+    # contato foi alterado.
+    if tels_alterados or emails_alterados:
+        contatos_alterados([contato.id])
+    return contato
 
 # A view deve receber o id de um contato como argumento.
 def editar_contato(request, contato_id):
@@ -31,113 +182,11 @@ def editar_contato(request, contato_id):
 
         # Testamos se o form foi corretamente preenchido
         if form.is_valid():
-
-            # Armazenamos os dados enviados pelo formulário na variável 'cd'.
-            # 'cd' será um dicionário onde cada par é formado pela key
-            # ao nome do campo correspondente, e o valor é o valor preenchido
-            # pelo usuário no formulário.
-            cd = form.cleaned_data
-
-            # Atualizamos o nome do contato com o valor recebido pelo campo
-            # 'nome_contato' do formulário
-            contato.nome = cd['nome_contato']
-            contato.save()
-
-            # Criamos três listas vazias, cada uma será responsável por
-            # armazenar valores fornecidos pelo usuário através do formulário.
-
-            # 'cd_grupos' vai armazenar todos os grupos cujas caixas de seleção
-            # foram selecionadas pelo usuário ao preencher o formulário.
-            cd_grupos = []
-
-            # 'cd_tels' vai armazenar os números de telefone fornecidos pelo
-            # usuário através do formulário.
-            cd_tels = []
-
-            # 'cd_emails' vai armazenar os endereços de email fornecidos pelo
-            # usuário através do formulário.
-            cd_emails = []
-
-            # Fazemos um loop com todos os pares key-value do dicionário cd.
-            for nome, valor in cd.items():
-                # Se a key do par sendo iterado começar com 'tel_', adicionamos
-                # o valor associado com essa key à lista 'cd_tels'
-                if nome.startswith('tel_'):
-                    cd_tels.append(valor)
-                # Se a key do par sendo iterado começar com 'email_', adicionamos
-                # o valor associado com essa key à lista 'cd_emails'
-                elif nome.startswith('email_'):
-                    cd_emails.append(valor)
-                # Se a key associada com o par sendo iterado começar com 'g_',
-                # nós testamos se o valor associado com essa key é True.
-                # Será True se a caixa de selação desse grupo estiver
-                # selecionada quando o usuário enviar o formulário.
-                elif nome.startswith('g_'):
-                    if valor:
-                        # Recuperamos, do banco de dados da aplicação,  o objeto
-                        # que representa o grupo, e associamos a variável
-                        # 'grupo' com esse objeto.
-                        grupo =  Grupo.objects.get(nome=nome.replace('g_', ''))
-                        # Por último, acrescentamos esse objeto à lista 'cd_grupos'
-                        cd_grupos.append(grupo)
-
-            # Criamos uma variável que armazena todos os telefones associados
-            # com o contato.
-            contato_tels = contato.telefone_set.all()
-
-            # Criamos uma variável que armazena todos os emails associados
-            # com o contato.
-            contato_emails = contato.email_set.all()
-
-            # Criamos uma variável que armazena todos os grupos associados
-            # com o contato.
-            contato_grupos = contato.grupos.all()
-
-            # Fazemos um loop com a lista 'contato_tels', que armazena os
-            # telefones associados com o contato. Então, atualizamos o atributo
-            # 'numero', de cada telefone, com um número da lista 'cd_tels', que
-            # contém os números de telefone fornecidos pelo usuário através
-            # do formulário
-            for i, tel in enumerate(contato_tels):
-                tel.numero = cd_tels[i]
-                tel.save()
-
-            # Fazemos um loop com a lista 'contato_emails', que armazena os
-            # emails associados com o contato. Então, atualizamos o atributo
-            # 'endereço', de cada email, com o endereço de email da lista
-            # 'cd_emails', que contém os endereços fornecidos pelo usuário
-            # através do formulário.
-            for i, email in enumerate(contato_emails):
-                email.endereco = cd_emails[i]
-                email.save()
-
-            # Fazemos um loop com a lista 'contato_grupos', que armazena todos
-            # os grupos que estão inicialmente associados com o contato.
-            # O objetivo deste loop é remover o que não deveria estar lá.
-            for grupo in contato_grupos:
-                # Se o grupo sendo iterado é um elemento da lista 'cd_grupos',
-                # que armazena os grupos cujas caixas de seleção foram selecionadas
-                # no formulário, não fazemos nada.
-                if grupo in cd_grupos:
-                    pass
-                # Mas, se o grupo sendo iterado não fizer parte da lista
-                # 'cd_grupos', removemos a associação desse grupo com o contato.
-                else:
-                    contato.grupos.remove(grupo)
-
-            # Fazemos um loop com a lista 'cd_grupos', que armazena todos os grupos
-            # cujas caixas de seleção foram selecionadas no formulário.
-            # O objetivo deste loop é incluir o que deveria estar lá.
-            for grupo in cd_grupos:
-                # Se o grupo sendo iterado já fizer parte da lista de grupos
-                # associados com o contato, não fazemos nada.
-                if grupo in contato.grupos.all():
-                    pass
-                # Mas, se o grupo (que deveria estar associado com o contato),
-                # não fizer parte dos grupos que estão associados com o contato,
-                # fazemos essa inclusão.
-                else:
-                    contato.grupos.add(grupo)
+            # Gravamos todas as alterações em uma única transação, para que
+            # dois salvamentos simultâneos do mesmo contato não deixem o
+            # contato com parte dos dados de cada um.
+            with transaction.atomic(using=particao()), sincronizacao_adiada():
+                salvar_edicao_contato(contato_id, form.cleaned_data)
             # Por fim, redirecionamos o usuário de volta à lista de contatos.
             return redirect('contatos_list_view')
     # Caso o método do request não seja POST, significa que o usuário ainda não
@@ -149,11 +198,20 @@ def editar_contato(request, contato_id):
     # do formulário e do contato.
     return render(request, 'contatos/editar_contato.html', {'form':form, 'contato':contato})
 
+# As views abaixo gravam pelos signals de contatos/signals.py. Como em
+# editar_contato, cada gravação e a atualização das estruturas derivadas
+# (cartões, índice de busca, contadores, registro de alterações e versão da
+# agenda) são feitas em uma única transação, para que uma leitura nunca
+# encontre o contato sem o seu cartão, nem a versão da agenda incrementada
+# antes dos dados novos, e para que uma falha no meio não deixe as
+# estruturas derivadas diferentes das tabelas.
+
 def novo_grupo_view(request):
     if request.method == 'POST':
         form = NovoGrupoForm(data=request.POST)
         if form.is_valid():
-            form.save()
+            with transaction.atomic(using=particao()), sincronizacao_adiada():
+                form.save()
             return redirect('contatos_list_view')
     else:
         form = NovoGrupoForm()
@@ -166,7 +224,8 @@ def novo_tel_view(request, contato_id):
         if form.is_valid():
             novo_tel = form.save(commit=False)
             novo_tel.contato = contato
-            novo_tel.save()
+            with transaction.atomic(using=particao()), sincronizacao_adiada():
+                novo_tel.save()
             return redirect('editar_contato', contato_id=contato.id)
     else:
         form = NovoTelForm()
@@ -179,7 +238,8 @@ def novo_email_view(request, contato_id):
         if form.is_valid():
             novo_email = form.save(commit=False)
             novo_email.contato = contato
-            novo_email.save()
+            with transaction.atomic(using=particao()), sincronizacao_adiada():
+                novo_email.save()
             return redirect('editar_contato', contato_id=contato.id)
     else:
         form = NovoEmailForm()
@@ -187,29 +247,97 @@ def novo_email_view(request, contato_id):
 
 def excluir_contato_view(request, contato_id):
     contato = get_object_or_404(Contato, id=contato_id)
-    contato.delete()
+    operacoes.excluir_contatos([contato.id])
     return redirect('contatos_list_view')
 
-def excluir_telefone_view(request, contato_id, label):
+def _ler_ids(valores):
+    # Aceita ids repetidos ('ids=1&ids=2') ou separados por vírgula ('ids=1,2').
+    try:
+        return [int(parte) for valor in valores for parte in valor.split(',') if parte.strip()]
+    except ValueError:
+        raise ValueError('Os ids devem ser números inteiros.')
+
+def excluir_telefones_view(request, contato_id, telefone_id=None):
+    # Exclui um telefone (pelo id na URL) ou vários de uma vez (pelos ids
+    # enviados por POST), desde que sejam do contato informado.
     contato = get_object_or_404(Contato, id=contato_id)
-    telefone_seq = int(label.replace('Telefone ', '')) - 1
-    telefones_contato = Telefone.objects.filter(contato=contato)
-    telefone = telefones_contato[telefone_seq]
-    telefone.delete()
+    try:
+        ids = [telefone_id] if telefone_id else _ler_ids(request.POST.getlist('ids'))
+    except ValueError as erro:
+        return JsonResponse({'erro': str(erro)}, status=400)
+    operacoes.excluir_telefones(ids, contato_id=contato.id)
     return redirect('editar_contato', contato_id=contato.id)
 
-def excluir_email_view(request, contato_id, label):
+def excluir_emails_view(request, contato_id, email_id=None):
     contato = get_object_or_404(Contato, id=contato_id)
-    email_seq = int(label.replace('Email ', '')) - 1
-    print(f"Email {email_seq}")
-    emails_contato = Email.objects.filter(contato=contato)
-    email = emails_contato[email_seq]
-    email.delete()
+    try:
+        ids = [email_id] if email_id else _ler_ids(request.POST.getlist('ids'))
+    except ValueError as erro:
+        return JsonResponse({'erro': str(erro)}, status=400)
+    operacoes.excluir_emails(ids, contato_id=contato.id)
     return redirect('editar_contato', contato_id=contato.id)
 
+def contatos_em_lote_view(request):
+    # Executa uma operação sobre vários contatos de uma vez. Parâmetros (POST):
+    #   acao     excluir, adicionar (a um grupo), remover (de um grupo) ou
+    #            mover (de um grupo, ou de todos, para outro);
+    #   ids      os contatos, repetido ou separado por vírgulas; ou então
+    #   busca / de_grupo   seleciona os contatos por uma busca e/ou grupo;
+    #   grupo    o grupo de destino (ou, em 'remover', o grupo de origem);
+    #   origem   em 'mover', o grupo de onde os contatos saem;
+    #   proxima  endereço para onde redirecionar ao final. Sem ele, a
+    #            resposta é um JSON com o resultado.
+    if request.method != 'POST':
+        return JsonResponse({'erro': 'Use o método POST.'}, status=405)
+    dados = request.POST
+    try:
+        ids = _ler_ids(dados.getlist('ids')) if dados.getlist('ids') else None
+        grupo_id = int(dados['grupo']) if dados.get('grupo') else None
+        origem_id = int(dados['origem']) if dados.get('origem') else None
+        de_grupo = int(dados['de_grupo']) if dados.get('de_grupo') else None
+        selecionados = operacoes.selecionar_contatos(ids, dados.get('busca'), de_grupo)
+        afetados = operacoes.executar(dados.get('acao'), selecionados, grupo_id, origem_id)
+    except (ValueError, Grupo.DoesNotExist) as erro:
+        return JsonResponse({'erro': str(erro)}, status=400)
+    proxima = dados.get('proxima')
+    if proxima and url_has_allowed_host_and_scheme(proxima, allowed_hosts={request.get_host()}):
+        return redirect(proxima)
+    return JsonResponse({'acao': dados.get('acao'), 'contatos': len(selecionados), 'afetados': afetados})
+
+@vary_on_cookie
+@condition(etag_func=etag_agenda)
 def grupos_list_view(request):
-    grupos = Grupo.objects.all()
-    return render(request, 'contatos/grupos_list.html', {'grupos':grupos})
+    ordem = request.GET.get('ordem', 'nome')
+    grupos = contadores.grupos_com_estatisticas(ordem)
+    return render(request, 'contatos/grupos_list.html', {'grupos':grupos, 'ordem':ordem})
+
+# Consultas que compõem os dados de um contato. São independentes entre si,
+# o que permite à versão assíncrona de contato_dados_view executá-las ao
+# mesmo tempo.
+def _contato(contato_id):
+    return Contato.objects.filter(id=contato_id).values('id', 'nome', 'avatar', 'atualizado_em').first()
+
+def _telefones(contato_id):
+    return list(Telefone.objects.filter(contato_id=contato_id).order_by('id')
+                .values('id', 'numero', 'numero_normalizado'))
+
+def _emails(contato_id):
+    return list(Email.objects.filter(contato_id=contato_id).order_by('id').values('id', 'endereco'))
+
+def _grupos_do_contato(contato_id):
+    return list(Grupo.objects.filter(contato__id=contato_id).order_by('nome').values('id', 'nome'))
+
+def _dados_do_contato(contato, telefones, emails, grupos):
+    if contato is None:
+        raise Http404('Contato não encontrado.')
+    avatar = contato.pop('avatar')
+    contato['avatar'] = Contato._meta.get_field('avatar').storage.url(avatar) if avatar else None
+    return {**contato, 'telefones': telefones, 'emails': emails, 'grupos': grupos}
+
+def contato_dados_view(request, contato_id):
+    # Dados de um contato (com telefones, emails e grupos) em JSON.
+    return JsonResponse(_dados_do_contato(_contato(contato_id), _telefones(contato_id),
+                                          _emails(contato_id), _grupos_do_contato(contato_id)))
 
 def editar_grupo(request, grupo_id):
     grupo = get_object_or_404(Grupo, id=grupo_id)
@@ -219,7 +347,8 @@ def editar_grupo(request, grupo_id):
             cd = form.cleaned_data
             grupo.nome = cd['nome']
             grupo.descricao = cd['descricao']
-            grupo.save()
+            with transaction.atomic(using=particao()), sincronizacao_adiada():
+                grupo.save()
             return redirect('grupos_list')
     else:
         form = EditarGrupoForm(initial={'nome':grupo.nome, 'descricao':grupo.descricao}, id=grupo.id)
@@ -227,15 +356,290 @@ def editar_grupo(request, grupo_id):
 
 def excluir_grupo(request, grupo_id):
     grupo = get_object_or_404(Grupo, id=grupo_id)
-    grupo.delete()
+    with transaction.atomic(using=particao()), sincronizacao_adiada():
+        grupo.delete()
     return redirect('grupos_list')
 
 def novo_contato_view(request):
     if request.method == 'POST':
         form = NovoContatoForm(request.POST, request.FILES,)
         if form.is_valid():
-            novo_contato = form.save()
+            with transaction.atomic(using=particao()), sincronizacao_adiada():
+                novo_contato = form.save()
             return redirect('editar_contato', contato_id=novo_contato.id)
     else:
         form = NovoContatoForm()
     return render(request, 'contatos/novo_contato.html', {'form':form})
+
+def dono_do_telefone_view(request):
+    # Identificação de chamadas: recebe um número em qualquer formato através
+    # do parâmetro 'numero' e retorna os contatos que possuem esse telefone.
+    # A busca é feita com uma única consulta sobre o índice da coluna
+    # Telefone.numero_normalizado.
+    numero = request.GET.get('numero', '')
+    normalizado = normalizar_telefone(numero)
+    if not normalizado:
+        return JsonResponse({'erro': 'Informe um número de telefone no parâmetro "numero".'}, status=400)
+    contatos = list(Contato.objects.filter(telefone__numero_normalizado=normalizado)
+                    .values('id', 'nome').distinct())
+    return JsonResponse({'numero': numero, 'normalizado': normalizado, 'contatos': contatos})
+
+def buscar_grupos_view(request):
+    # Grupos para o seletor de grupos da edição de contatos, em ordem
+    # alfabética e em páginas de 'por_pagina' grupos. Parâmetros (GET):
+    #   q        início do nome do grupo (sem diferenciar maiúsculas nem
+    #            acentos);
+    #   depois   o cursor 'depois' da página anterior.
+    # Cada página é uma varredura do índice (dono, nome) a partir do cursor,
+    # sem contar nem carregar os demais grupos da agenda. Com 'q', ela se
+    # limita aos nomes lidos do trecho correspondente do índice (dono,
+    # nome_busca, nome) (ver busca.filtrar_por_prefixo()), como na busca
+    # por termos curtos da lista de contatos.
+    termo = request.GET.get('q', '').strip()
+    grupos = Grupo.objects.only('id', 'nome')
+    if termo:
+        grupos = grupos.filter(nome__in=filtrar_por_prefixo(Grupo.objects.all(), termo).values('nome'))
+    pagina = paginar_por_nome(grupos, depois=request.GET.get('depois') or None,
+                              por_pagina=ler_por_pagina(request.GET.get('por_pagina')))
+    return JsonResponse({'termo': termo,
+                         'resultados': [{'id': grupo.id, 'nome': grupo.nome} for grupo in pagina],
+                         'depois': pagina.cursor_proximo})
+
+def autocompletar_view(request):
+    # Sugestões para a caixa de busca, chamada a cada tecla digitada. As
+    # sugestões vêm do índice em memória de contatos/autocompletar.py, sem
+    # consultas ao banco.
+    termo = request.GET.get('q', '').strip()
+    try:
+        limite = min(max(int(request.GET.get('limite', autocompletar.LIMITE_PADRAO)), 1),
+                     autocompletar.LIMITE_MAXIMO)
+    except ValueError:
+        limite = autocompletar.LIMITE_PADRAO
+    resultados = autocompletar.buscar(termo, limite) if termo else []
+    return JsonResponse({'termo': termo, 'resultados': resultados})
+
+def sincronizar_view(request):
+    # Alterações da agenda desde o token recebido em 'since', para que os
+    # aplicativos atualizem a sua cópia local (ver contatos/alteracoes.py).
+    # Sem 'since', a sincronização começa do zero e devolve a agenda
+    # inteira, em lotes de até 'limite' alterações.
+    try:
+        limite = min(max(int(request.GET.get('limite', alteracoes.LOTE_PADRAO)), 1), alteracoes.LOTE_MAXIMO)
+    except ValueError:
+        limite = alteracoes.LOTE_PADRAO
+    try:
+        resultado = alteracoes.desde(request.GET.get('since', ''), limite)
+    except alteracoes.TokenInvalido as erro:
+        return JsonResponse({'erro': str(erro)}, status=400)
+    except alteracoes.TokenExpirado:
+        return JsonResponse({'erro': 'O token expirou; sincronize novamente sem "since".', 'reiniciar': True},
+                            status=410)
+    return JsonResponse(resultado)
+
+def tarefa_view(request, tarefa_id):
+    # Situação de uma tarefa da fila, para que a página que a criou acompanhe
+    # a sua execução.
+    resultado = tarefas.situacao(tarefa_id)
+    if resultado is None:
+        raise Http404('Tarefa não encontrada.')
+    return JsonResponse(resultado)
+
+def duplicados_view(request):
+    # Pares de prováveis duplicados ainda não revisados, dos mais para os
+    # menos prováveis. Os pares são encontrados por
+    # 'manage.py detectar_duplicados' (ver contatos/duplicados.py).
+    pares = (ParDuplicado.objects.filter(descartado=False).select_related('contato_a', 'contato_b')
+             .order_by('-pontuacao', 'id'))
+    pagina = Paginator(pares, 50).get_page(request.GET.get('pagina'))
+    return render(request, 'contatos/duplicados.html', {'pagina':pagina})
+
+def par_duplicado_view(request, par_id):
+    # Mostra os dois contatos do par lado a lado. Com POST, une os dois no
+    # contato escolhido como sobrevivente ou, com acao=descartar, registra
+    # que não são a mesma pessoa.
+    par = get_object_or_404(ParDuplicado.objects.select_related('contato_a', 'contato_b'),
+                            id=par_id, descartado=False)
+    if request.method == 'POST':
+        if request.POST.get('acao') == 'descartar':
+            ParDuplicado.objects.filter(id=par.id).update(descartado=True)
+            return redirect('duplicados')
+        if request.POST.get('sobrevivente') == str(par.contato_b_id):
+            sobrevivente, duplicado = par.contato_b, par.contato_a
+        else:
+            sobrevivente, duplicado = par.contato_a, par.contato_b
+        operacoes.mesclar_contatos(sobrevivente.id, [duplicado.id])
+        return redirect('editar_contato', contato_id=sobrevivente.id)
+    contatos = [{'contato': contato, 'telefones': _telefones(contato.id), 'emails': _emails(contato.id),
+                 'grupos': _grupos_do_contato(contato.id)} for contato in (par.contato_a, par.contato_b)]
+    return render(request, 'contatos/par_duplicado.html', {'par':par, 'contatos':contatos})
+
+def _executar_importacao(importacao):
+    # A importação é feita pela fila de tarefas (ver contatos/tarefas.py),
+    # fora da requisição. Se ela falhar, os lotes já gravados são mantidos e
+    # a nova tentativa continua de onde parou.
+    tarefas.enfileirar('importar', importacao.id, chave=f'importacao:{importacao.id}')
+
+def importar_contatos_view(request):
+    if request.method == 'POST':
+        form = ImportarContatosForm(request.POST, request.FILES)
+        if form.is_valid():
+            cd = form.cleaned_data
+            arquivo = cd['arquivo']
+            # O arquivo enviado é gravado em disco, fora de MEDIA_ROOT, para
+            # ser lido durante a importação e, se ela for interrompida,
+            # novamente ao retomá-la.
+            importacao = Importacao.objects.create(
+                caminho=guardar_arquivo(arquivo),
+                nome_arquivo=arquivo.name,
+                formato=cd['formato'] or detectar_formato(arquivo.name),
+                conflito=cd['conflito'],
+            )
+            _executar_importacao(importacao)
+            return redirect('importacao_detalhe', importacao_id=importacao.id)
+    else:
+        form = ImportarContatosForm()
+    return render(request, 'contatos/importar_contatos.html', {'form':form})
+
+def importacao_detalhe_view(request, importacao_id):
+    importacao = get_object_or_404(Importacao, id=importacao_id)
+    return render(request, 'contatos/importacao_detalhe.html',
+                  {'importacao':importacao, 'retomavel':retomavel(importacao)})
+
+def retomar_importacao_view(request, importacao_id):
+    importacao = get_object_or_404(Importacao, id=importacao_id)
+    # Uma importação interrompida ou que falhou pode ser retomada enquanto o
+    # arquivo enviado existir: ele é apagado ao concluir ou quando a fila de
+    # tarefas desiste da importação.
+    if request.method == 'POST' and retomavel(importacao):
+        _executar_importacao(importacao)
+    return redirect('importacao_detalhe', importacao_id=importacao.id)
+
+def exportar_contatos_view(request, grupo_id=None):
+    # Exporta todos os contatos, ou apenas os contatos de um grupo, como
+    # vCard (padrão) ou CSV. O arquivo é gerado aos poucos enquanto é enviado,
+    # então a memória usada não depende da quantidade de contatos.
+    # Parâmetros: formato=vcard|csv, gzip=1 e avatares=1.
+    formato = request.GET.get('formato', 'vcard')
+    if formato not in exportacao.FORMATOS:
+        formato = 'vcard'
+    comprimir = request.GET.get('gzip') == '1'
+    incluir_avatar = request.GET.get('avatares') == '1'
+    if grupo_id:
+        grupo = get_object_or_404(Grupo, id=grupo_id)
+        contatos = grupo.contato_set.all()
+        base = f"contatos-grupo-{grupo.id}"
+    else:
+        contatos = Contato.objects.all()
+        base = 'contatos'
+
+    if comprimir:
+        tipo = 'application/gzip'
+    elif formato == 'csv':
+        tipo = 'text/csv; charset=utf-8'
+    else:
+        tipo = 'text/vcard; charset=utf-8'
+    response = StreamingHttpResponse(iterar_como_dono(exportacao.exportar(contatos, formato, comprimir,
+                                                                          incluir_avatar)),
+                                     content_type=tipo)
+    response['Content-Disposition'] = f'attachment; filename="{exportacao.nome_arquivo(base, formato, comprimir)}"'
+    return response
+
+# Avatares armazenados pelo hash do conteúdo (ver contatos/storage.py), e as
+# suas miniaturas, nunca mudam: um conteúdo diferente recebe outro nome.
+PADRAO_MEDIA_IMUTAVEL = re.compile(r'^avatares/[0-9a-f]{2}/([0-9a-f]{64})((?:\.\d+)?\.\w+)$')
+
+def media_view(request, path):
+    # Substitui a rota static() para os arquivos de MEDIA_ROOT. O ETag e o
+    # Last-Modified são calculados a partir de os.stat(), sem ler o arquivo,
+    # e requisições condicionais que correspondem a eles recebem 304.
+    try:
+        estado = os.stat(safe_join(settings.MEDIA_ROOT, path))
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404('Arquivo não encontrado.')
+    imutavel = PADRAO_MEDIA_IMUTAVEL.match(path)
+    if imutavel:
+        etag = f'"{imutavel.group(1)[:32]}{imutavel.group(2)}"'
+        cache = 'public, max-age=31536000, immutable'
+    else:
+        etag = f'"{estado.st_mtime_ns:x}-{estado.st_size:x}"'
+        cache = 'public, max-age=0, must-revalidate'
+    response = get_conditional_response(request, etag=etag, last_modified=int(estado.st_mtime))
+    if response is None:
+        response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    response['ETag'] = etag
+    response['Cache-Control'] = cache
+    return response
+
+# Views assíncronas
+#
+# Versões assíncronas das views de leitura mais acessadas, para implantações
+# ASGI (agenda1/asgi.py). Elas usam os mesmos templates e as mesmas consultas
+# das views síncronas, mas não ocupam uma thread durante toda a requisição, e
+# consultas independentes de uma mesma requisição são feitas ao mesmo tempo.
+#
+# Elas não são mais rápidas que as síncronas: as consultas ao SQLite e a
+# renderização dos templates usam a CPU e disputam o GIL, e cada passagem
+# por sync_to_async() acrescenta uma troca de thread. Em 'manage.py carga',
+# numa máquina com uma CPU, a vazão com ASGI ficou em 0,75x da obtida com
+# WSGI com 20 clientes e em 0,59x com 200 clientes; só a cauda da latência
+# (p99) foi menor. As rotas síncronas continuam sendo as usadas pelas
+# páginas, e WSGI continua sendo a implantação recomendada.
+
+def _em_paralelo(funcao):
+    # O Django 3.2 ainda não tem uma interface assíncrona para o ORM, então
+    # as consultas são executadas com sync_to_async(). Com
+    # thread_sensitive=False elas rodam no pool de threads do event loop (e
+    # não na thread única usada por padrão), cada thread com a sua própria
+    # conexão com o banco. Ao final, como o Django faz ao terminar cada
+    # requisição, a conexão é fechada se tiver passado de CONN_MAX_AGE.
+    def executar(*args, **kwargs):
+        try:
+            return funcao(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(executar, thread_sensitive=False)
+
+async def _resposta_condicional(request):
+    # Equivalente ao decorator condition() usado nas listas síncronas, que
+    # não suporta views assíncronas no Django 3.2.
+    estado = _estado_da_sessao(request)
+    if not estado:
+        return None, None
+    etag = _etag_da_versao(await _em_paralelo(versao_agenda)(), estado)
+    return etag, get_conditional_response(request, etag=etag)
+
+def _com_validadores(response, etag):
+    if response.status_code == 200 and etag:
+        response['ETag'] = etag
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+async def contatos_list_async(request, grupo_id=None):
+    etag, response = await _resposta_condicional(request)
+    if response is not None:
+        return _com_validadores(response, etag)
+    busca = request.POST.get('busca') or request.GET.get('busca')
+    consultas = [_em_paralelo(_pagina_da_lista)(request.GET, grupo_id, busca)]
+    if grupo_id:
+        consultas.append(_em_paralelo(Grupo.objects.filter(id=grupo_id).first)())
+    (pagina, busca), *grupo = await asyncio.gather(*consultas)
+    grupo = grupo[0] if grupo else None
+    if grupo_id and grupo is None:
+        raise Http404('Grupo não encontrado.')
+    response = await _em_paralelo(render)(request, 'contatos/contatos_list.html',
+                                          _contexto_da_lista(pagina, grupo, busca))
+    return _com_validadores(response, etag)
+
+async def grupos_list_async(request):
+    etag, response = await _resposta_condicional(request)
+    if response is not None:
+        return _com_validadores(response, etag)
+    ordem = request.GET.get('ordem', 'nome')
+    grupos = await _em_paralelo(list)(contadores.grupos_com_estatisticas(ordem))
+    response = await _em_paralelo(render)(request, 'contatos/grupos_list.html', {'grupos':grupos, 'ordem':ordem})
+    return _com_validadores(response, etag)
+
+async def contato_dados_async(request, contato_id):
+    partes = await asyncio.gather(*(_em_paralelo(consulta)(contato_id)
+                                    for consulta in (_contato, _telefones, _emails, _grupos_do_contato)))
+    return JsonResponse(_dados_do_contato(*partes))